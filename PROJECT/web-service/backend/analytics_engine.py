@@ -0,0 +1,357 @@
+"""
+Векторизованная аналитика транзакций PayGo
+Один потоковый запрос за период, агрегация массивами NumPy и кеш по периоду
+"""
+
+import asyncio
+import calendar
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+AMOUNT_PERCENTILES = (50, 90, 95, 99)
+# Гистограмма сумм для перцентилей: корзины растут в AMOUNT_BUCKET_GROWTH раз
+# от AMOUNT_BUCKET_MIN до AMOUNT_BUCKET_MAX, погрешность перцентиля - до 0.25%
+AMOUNT_BUCKET_MIN = 0.01
+AMOUNT_BUCKET_MAX = 1e7
+AMOUNT_BUCKET_GROWTH = 1.005
+AMOUNT_BUCKETS = int(np.ceil(np.log(AMOUNT_BUCKET_MAX / AMOUNT_BUCKET_MIN) / np.log(AMOUNT_BUCKET_GROWTH))) + 1
+
+def _epoch_seconds(column, dialect_name: str):
+    """Время в секундах Unix в диалекте базы (timestamp без зоны считается UTC)"""
+    if dialect_name == "postgresql":
+        return func.extract("epoch", column)
+    return cast(func.strftime("%s", column), Integer)
+
+def _to_epoch(value: datetime) -> float:
+    return calendar.timegm(value.timetuple()) + value.microsecond / 1e6
+
+class PeriodAccumulator:
+    """Агрегаты периода, накапливаемые по пачкам строк.
+
+    Дневные, недельные и часовые ряды, разбивки по методам оплаты и терминалам
+    считаются np.bincount по каждой пачке, поэтому память не растет с числом
+    строк. Перцентили сумм берутся из логарифмической гистограммы фиксированного
+    размера (AMOUNT_BUCKETS корзин), а не из сохраненных сумм.
+    """
+
+    def __init__(self, start: datetime, days: int):
+        self.start = start
+        self.days = days
+        self._start_ts = _to_epoch(start)
+        self.daily_count = np.zeros(days, dtype=np.int64)
+        self.daily_amount = np.zeros(days, dtype=np.float64)
+        self.hourly_count = np.zeros(24, dtype=np.int64)
+        self.hourly_amount = np.zeros(24, dtype=np.float64)
+        self.method_names: Dict[str, int] = {}
+        self.method_count = np.zeros(0, dtype=np.int64)
+        self.method_amount = np.zeros(0, dtype=np.float64)
+        self.terminal_count = np.zeros(0, dtype=np.int64)
+        self.terminal_amount = np.zeros(0, dtype=np.float64)
+        self.amount_histogram = np.zeros(AMOUNT_BUCKETS, dtype=np.int64)
+        self.amount_min = np.inf
+        self.amount_max = -np.inf
+        self.rows = 0
+
+    @staticmethod
+    def _add_bins(counts: np.ndarray, amounts: np.ndarray, index: np.ndarray,
+                  weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        size = max(len(counts), int(index.max()) + 1 if len(index) else 0)
+        chunk_counts = np.bincount(index, minlength=size)
+        chunk_amounts = np.bincount(index, weights=weights, minlength=size)
+        if size > len(counts):
+            counts = np.concatenate([counts, np.zeros(size - len(counts), dtype=counts.dtype)])
+            amounts = np.concatenate([amounts, np.zeros(size - len(amounts), dtype=amounts.dtype)])
+        return counts + chunk_counts, amounts + chunk_amounts
+
+    def method_codes(self, methods) -> np.ndarray:
+        """Коды методов оплаты (строки заменяются номерами категорий)"""
+        names = self.method_names
+        return np.fromiter(
+            (names.setdefault(method, len(names)) for method in methods), dtype=np.int64, count=len(methods)
+        )
+
+    def add(self, timestamps: np.ndarray, amounts: np.ndarray, method_codes: np.ndarray, terminal_ids: np.ndarray):
+        """Пачка строк: секунды Unix, суммы, коды методов и id терминалов"""
+        offsets = timestamps - self._start_ts
+        inside = (offsets >= 0) & (offsets < self.days * SECONDS_PER_DAY)
+        if not inside.all():
+            timestamps, offsets, amounts = timestamps[inside], offsets[inside], amounts[inside]
+            method_codes, terminal_ids = method_codes[inside], terminal_ids[inside]
+        if not len(offsets):
+            return
+        day_index = (offsets // SECONDS_PER_DAY).astype(np.int64)
+        hour_index = (timestamps % SECONDS_PER_DAY // 3600).astype(np.int64)
+
+        self.daily_count += np.bincount(day_index, minlength=self.days)
+        self.daily_amount += np.bincount(day_index, weights=amounts, minlength=self.days)
+        self.hourly_count += np.bincount(hour_index, minlength=24)
+        self.hourly_amount += np.bincount(hour_index, weights=amounts, minlength=24)
+        self.method_count, self.method_amount = self._add_bins(
+            self.method_count, self.method_amount, method_codes, amounts
+        )
+        self.terminal_count, self.terminal_amount = self._add_bins(
+            self.terminal_count, self.terminal_amount, terminal_ids.astype(np.int64), amounts
+        )
+        buckets = np.log(np.maximum(amounts, AMOUNT_BUCKET_MIN) / AMOUNT_BUCKET_MIN) / np.log(AMOUNT_BUCKET_GROWTH)
+        self.amount_histogram += np.bincount(
+            np.clip(buckets.astype(np.int64), 0, AMOUNT_BUCKETS - 1), minlength=AMOUNT_BUCKETS
+        )
+        self.amount_min = min(self.amount_min, float(amounts.min()))
+        self.amount_max = max(self.amount_max, float(amounts.max()))
+        self.rows += len(amounts)
+
+    def daily(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "date": (self.start + timedelta(days=day)).date().isoformat(),
+                "transactions": int(self.daily_count[day]),
+                "amount": float(self.daily_amount[day])
+            }
+            for day in range(self.days)
+        ]
+
+    def weekly(self) -> List[Dict[str, Any]]:
+        weeks = (self.days + 6) // 7
+        week_index = np.arange(self.days) // 7
+        counts = np.bincount(week_index, weights=self.daily_count, minlength=weeks)
+        amounts = np.bincount(week_index, weights=self.daily_amount, minlength=weeks)
+        return [
+            {
+                "week_start": (self.start + timedelta(days=week * 7)).date().isoformat(),
+                "transactions": int(counts[week]),
+                "amount": float(amounts[week])
+            }
+            for week in range(weeks)
+        ]
+
+    def hourly(self) -> List[Dict[str, Any]]:
+        return [
+            {"hour": hour, "transactions": int(self.hourly_count[hour]), "amount": float(self.hourly_amount[hour])}
+            for hour in range(24)
+        ]
+
+    def percentiles(self) -> Dict[str, float]:
+        if not self.rows:
+            return {f"p{q}": 0.0 for q in AMOUNT_PERCENTILES}
+        cumulative = np.cumsum(self.amount_histogram)
+        ranks = np.maximum(np.ceil(np.array(AMOUNT_PERCENTILES) / 100 * self.rows), 1)
+        buckets = np.searchsorted(cumulative, ranks)
+        # Середина корзины в логарифмической шкале, в пределах наблюдавшихся сумм
+        values = np.clip(AMOUNT_BUCKET_MIN * AMOUNT_BUCKET_GROWTH ** (buckets + 0.5), self.amount_min, self.amount_max)
+        return {f"p{q}": round(float(value), 2) for q, value in zip(AMOUNT_PERCENTILES, values)}
+
+    def payment_methods(self) -> List[Dict[str, Any]]:
+        return [
+            {"method": method, "transactions": int(self.method_count[code]), "amount": float(self.method_amount[code])}
+            for method, code in self.method_names.items()
+            if self.method_count[code] > 0
+        ]
+
+    def top_terminals(self, limit: int = 10) -> List[Tuple[int, int, float]]:
+        """(id терминала, число, сумма) по убыванию суммы"""
+        active = np.flatnonzero(self.terminal_count)
+        order = active[np.argsort(-self.terminal_amount[active], kind="stable")][:limit]
+        return [(int(terminal), int(self.terminal_count[terminal]), float(self.terminal_amount[terminal])) for terminal in order]
+
+class AnalyticsEngine:
+    """Аналитика для /admin/analytics: один запрос за период вместо запроса на каждый день"""
+
+    def __init__(self, session_factory, models_provider, period_granularity: int = 300,
+                 cache_size: int = 32, chunk_size: int = 50000):
+        # session_factory() - асинхронный контекстный менеджер сессии,
+        # models_provider() - (User, Terminal, Transaction, Card)
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        # Конец периода округляется вниз до period_granularity секунд: все запросы
+        # в пределах интервала получают один и тот же результат из кеша
+        self.period_granularity = period_granularity
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self._cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        # Одновременные запросы одного периода ждут одно вычисление
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "rows_scanned": 0}
+
+    def period_end(self) -> datetime:
+        """Конец текущего периода (UTC), округленный до period_granularity"""
+        now = time.time()
+        return datetime.utcfromtimestamp(now - now % self.period_granularity)
+
+    async def _cached(self, key: Tuple, compute) -> Dict[str, Any]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return cached
+        if key in self._inflight:
+            self.stats["hits"] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.stats["misses"] += 1
+        future = asyncio.ensure_future(compute())
+        self._inflight[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def invalidate(self):
+        self._cache.clear()
+
+    async def transaction_analytics(self, days: int) -> Dict[str, Any]:
+        """Ряды по дням, неделям и часам, перцентили сумм, методы оплаты и топ терминалов"""
+        end_date = self.period_end()
+        return await self._cached(
+            ("transactions", days, end_date), lambda: self._compute_transaction_analytics(days, end_date)
+        )
+
+    async def _compute_transaction_analytics(self, days: int, end_date: datetime) -> Dict[str, Any]:
+        User, Terminal, Transaction, Card = self._models_provider()
+        start_date = end_date - timedelta(days=days)
+        accumulator = PeriodAccumulator(start_date, days)
+
+        async with self._session_factory() as session:
+            epoch = _epoch_seconds(Transaction.created_at, session.get_bind().dialect.name)
+            result = await session.stream(
+                select(epoch, Transaction.amount, Transaction.payment_method, Transaction.terminal_id)
+                .where(
+                    Transaction.created_at >= start_date,
+                    Transaction.created_at < end_date,
+                    Transaction.status == "completed"
+                )
+                .execution_options(yield_per=self.chunk_size)
+            )
+            async for rows in result.partitions(self.chunk_size):
+                timestamps, amounts, methods, terminal_ids = zip(*rows)
+                accumulator.add(
+                    np.asarray(timestamps, dtype=np.float64),
+                    np.asarray(amounts, dtype=np.float64),
+                    accumulator.method_codes(methods),
+                    np.asarray(terminal_ids, dtype=np.int64)
+                )
+
+            top = accumulator.top_terminals()
+            terminals = {}
+            if top:
+                terminal_rows = await session.execute(
+                    select(Terminal.id, Terminal.serial_number, Terminal.name, Terminal.location)
+                    .where(Terminal.id.in_([terminal for terminal, _, _ in top]))
+                )
+                terminals = {row[0]: row[1:] for row in terminal_rows}
+
+        self.stats["rows_scanned"] += accumulator.rows
+        return {
+            "period": {
+                "start_date": start_date.date().isoformat(),
+                "end_date": end_date.date().isoformat(),
+                "days": days
+            },
+            "daily_stats": accumulator.daily(),
+            "weekly_stats": accumulator.weekly(),
+            "hourly_stats": accumulator.hourly(),
+            "amount_percentiles": accumulator.percentiles(),
+            "payment_methods": accumulator.payment_methods(),
+            "top_terminals": [
+                {
+                    "terminal_id": terminals.get(terminal, (None, None, None))[0],
+                    "name": terminals.get(terminal, (None, None, None))[1],
+                    "location": terminals.get(terminal, (None, None, None))[2],
+                    "transactions": count,
+                    "amount": amount
+                }
+                for terminal, count, amount in top
+            ],
+            "computed_at": datetime.utcnow().isoformat()
+        }
+
+    async def user_analytics(self, days: int = 30) -> Dict[str, Any]:
+        """Регистрации по дням, роли, активность и статистика карт"""
+        end_date = self.period_end()
+        return await self._cached(("users", days, end_date), lambda: self._compute_user_analytics(days, end_date))
+
+    async def _compute_user_analytics(self, days: int, end_date: datetime) -> Dict[str, Any]:
+        User, Terminal, Transaction, Card = self._models_provider()
+        start_date = end_date - timedelta(days=days)
+
+        async with self._session_factory() as session:
+            epoch = _epoch_seconds(User.created_at, session.get_bind().dialect.name)
+            registrations = np.asarray(
+                (await session.execute(
+                    select(epoch).where(User.created_at >= start_date, User.created_at < end_date)
+                )).scalars().all(),
+                dtype=np.float64
+            )
+            role_stats = (await session.execute(
+                select(User.role, func.count(User.id)).group_by(User.role)
+            )).all()
+            active_users = await session.scalar(
+                select(func.count(func.distinct(Transaction.user_id))).where(
+                    Transaction.created_at >= start_date,
+                    Transaction.user_id.isnot(None)
+                )
+            ) or 0
+            # Число карт на пользователя, затем агрегаты по пользователям с картами
+            cards_per_user = select(func.count(Card.id).label("cards")).group_by(Card.user_id).subquery()
+            card_summary = (await session.execute(
+                select(
+                    func.sum(cards_per_user.c.cards),
+                    func.count(),
+                    func.avg(cards_per_user.c.cards)
+                )
+            )).first()
+            total_users = await session.scalar(select(func.count(User.id)))
+
+        day_index = ((registrations - _to_epoch(start_date)) // SECONDS_PER_DAY).astype(np.int64)
+        daily = np.bincount(day_index[(day_index >= 0) & (day_index < days)], minlength=days)
+        return {
+            "period": {
+                "start_date": start_date.date().isoformat(),
+                "end_date": end_date.date().isoformat()
+            },
+            "daily_registrations": [
+                {"date": (start_date + timedelta(days=day)).date().isoformat(), "registrations": int(daily[day])}
+                for day in range(days)
+            ],
+            "roles": [{"role": role, "count": count} for role, count in role_stats],
+            "activity": {
+                "active_users_30d": active_users,
+                "total_users": total_users,
+                "activity_rate": active_users / max(total_users, 1) * 100
+            },
+            "cards": {
+                "total_cards": int(card_summary[0] or 0),
+                "users_with_cards": card_summary[1] or 0,
+                "avg_cards_per_user": round(float(card_summary[2] or 0), 2)
+            },
+            "computed_at": datetime.utcnow().isoformat()
+        }
+
+def _analytics_models():
+    # SQLAlchemy модели: в models.* лежат схемы API
+    from database import User, Terminal, Transaction, Card
+    return User, Terminal, Transaction, Card
+
+def _read_session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session(read_only=True)
+
+# Глобальный экземпляр аналитики
+analytics_engine = AnalyticsEngine(
+    _read_session,
+    _analytics_models,
+    period_granularity=int(os.getenv("ANALYTICS_PERIOD_GRANULARITY", "300"))
+)
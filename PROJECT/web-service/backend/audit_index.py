@@ -0,0 +1,295 @@
+"""
+Индексы сегментов аудит лога PayGo
+Файл лога делится на блоки по ~64KB; для каждого блока хранится смещение,
+длина и диапазон времени, для значений user_id, event_type, severity и
+ip_address - сжатые списки номеров блоков. Индекс лежит рядом с логом (.idx).
+Закрытые сегменты сжимаются поблочно, поэтому индекс продолжает работать
+"""
+
+import base64
+import json
+import logging
+import os
+import zlib
+from array import array
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+BLOCK_BYTES = 64 * 1024
+INDEXED_FIELDS = ("user_id", "event_type", "severity", "ip_address")
+
+# Поля блока: смещение в файле, длина в байтах, строк, минимальное и максимальное время.
+# В сжатом сегменте смещение и длина относятся к сжатому блоку
+OFFSET, LENGTH, COUNT, MIN_TS, MAX_TS = range(5)
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+def segment_base(path: str) -> str:
+    """Путь сегмента без расширения сжатия: по нему называется индекс"""
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def encode_postings(blocks: array) -> str:
+    """Возрастающие номера блоков -> разности в varint -> base64"""
+    output = bytearray()
+    previous = 0
+    for block in blocks:
+        delta = block - previous
+        previous = block
+        while delta >= 0x80:
+            output.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        output.append(delta)
+    return base64.b64encode(bytes(output)).decode("ascii")
+
+def decode_postings(data: str) -> array:
+    blocks = array("I")
+    value = shift = previous = 0
+    for byte in base64.b64decode(data):
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value
+        blocks.append(previous)
+        value = shift = 0
+    return blocks
+
+def timestamp_of(value) -> float:
+    """Время записи в секундах для сравнения диапазонов блоков"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+def record_keys(record: Dict[str, Any]) -> Tuple[float, Tuple]:
+    """(время, значения INDEXED_FIELDS) разобранной строки лога"""
+    return timestamp_of(record["timestamp"]), tuple(record.get(field) for field in INDEXED_FIELDS)
+
+class SegmentIndex:
+    """Индекс одного файла лога.
+
+    seq - постоянный номер сегмента (не меняется при переименовании файла),
+    size - сколько байт файла уже проиндексировано. Последний блок открыт,
+    пока не наберет block_bytes; строки между блоками не делятся.
+    """
+
+    def __init__(self, seq: int, path: str, block_bytes: int = BLOCK_BYTES):
+        self.seq = seq
+        self.path = path
+        self.block_bytes = block_bytes
+        self.size = 0
+        self.blocks: List[List] = []
+        self.postings: Dict[str, Dict[str, array]] = {field: {} for field in INDEXED_FIELDS}
+        # False - файл без индекса, строится при первом поиске
+        self.built = True
+        # None - файл не сжат; stored_size - размер файла на диске
+        self.compression: Optional[str] = None
+        self.stored_size = 0
+        # Сколько первых блоков скопировано в таблицу audit_logs
+        self.shipped_blocks = 0
+        # inode файла чужого писателя: после ротации по тому же пути лежит другой файл
+        self.inode: Optional[int] = None
+
+    def add(self, length: int, timestamp: float, keys: Tuple):
+        """Строка длиной length байт, дописанная в конец файла"""
+        blocks = self.blocks
+        if not blocks or blocks[-1][LENGTH] + length > self.block_bytes:
+            blocks.append([self.size, 0, 0, timestamp, timestamp])
+        block = blocks[-1]
+        block[LENGTH] += length
+        block[COUNT] += 1
+        if timestamp < block[MIN_TS]:
+            block[MIN_TS] = timestamp
+        if timestamp > block[MAX_TS]:
+            block[MAX_TS] = timestamp
+        block_id = len(blocks) - 1
+        for field, value in zip(INDEXED_FIELDS, keys):
+            if value is None:
+                continue
+            value = str(value)
+            posting = self.postings[field].get(value)
+            if posting is None:
+                posting = self.postings[field][value] = array("I")
+            if not posting or posting[-1] != block_id:
+                posting.append(block_id)
+        self.size += length
+        self.stored_size = self.size
+
+    @property
+    def shipped(self) -> bool:
+        return self.shipped_blocks >= len(self.blocks)
+
+    @property
+    def max_timestamp(self) -> float:
+        return max((block[MAX_TS] for block in self.blocks), default=0.0)
+
+    def read_blocks(self, block_ids: List[int]) -> List[Tuple[int, bytes]]:
+        """(номер блока, строки блока) с распаковкой сжатых блоков"""
+        result = []
+        with open(self.path, "rb") as f:
+            if self.inode is not None and os.fstat(f.fileno()).st_ino != self.inode:
+                raise FileNotFoundError(self.path)
+            for block_id in block_ids:
+                block = self.blocks[block_id]
+                f.seek(block[OFFSET])
+                data = f.read(block[LENGTH])
+                if self.compression == "gzip":
+                    data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+                elif self.compression == "zstd":
+                    import zstandard
+                    data = zstandard.ZstdDecompressor().decompress(data)
+                result.append((block_id, data))
+        return result
+
+    def scan(self, start: int = 0):
+        """Индексация строк файла начиная со смещения start (старый лог или хвост после перезапуска)"""
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Недописанная строка - проиндексируется после дозаписи
+                    break
+                try:
+                    timestamp, keys = record_keys(json.loads(line))
+                except (ValueError, KeyError, TypeError):
+                    timestamp, keys = (self.blocks[-1][MAX_TS] if self.blocks else 0.0), (None,) * len(INDEXED_FIELDS)
+                self.add(len(line), timestamp, keys)
+        self.built = True
+
+    def candidates(self, filters: Dict[str, str], start_ts: Optional[float], end_ts: Optional[float],
+                   before_block: Optional[int] = None) -> List[int]:
+        """Блоки, которые могут содержать подходящие записи, от новых к старым"""
+        if not self.blocks:
+            return []
+        postings = [self.postings[field].get(value) for field, value in filters.items()]
+        if not all(postings):
+            return []
+        selected = None
+        # Пересечение начинается с самого короткого списка
+        for posting in sorted(postings, key=len):
+            selected = set(posting) if selected is None else selected.intersection(posting)
+            if not selected:
+                return []
+        limit = len(self.blocks) if before_block is None else min(before_block + 1, len(self.blocks))
+        block_ids = range(limit - 1, -1, -1) if selected is None else sorted(
+            (block_id for block_id in selected if block_id < limit), reverse=True
+        )
+        blocks = self.blocks
+        return [
+            block_id for block_id in block_ids
+            if (start_ts is None or blocks[block_id][MAX_TS] >= start_ts)
+            and (end_ts is None or blocks[block_id][MIN_TS] <= end_ts)
+        ]
+
+    # Файл-спутник
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": INDEX_VERSION,
+            "seq": self.seq,
+            "size": self.size,
+            "block_bytes": self.block_bytes,
+            "compression": self.compression,
+            "stored_size": self.stored_size,
+            "shipped_blocks": self.shipped_blocks,
+            "blocks": self.blocks,
+            "postings": {
+                field: {value: encode_postings(posting) for value, posting in values.items()}
+                for field, values in self.postings.items()
+            }
+        }
+
+    def save(self, path: Optional[str] = None, exclusive: bool = False):
+        """Атомарная запись индекса рядом с файлом лога.
+
+        exclusive - индекс чужого сегмента: записывается, только если его еще
+        нет, чтобы не заменить индекс, сохраненный владельцем после сжатия
+        """
+        path = path or segment_base(self.path) + INDEX_SUFFIX
+        temporary = f"{path}.{os.getpid()}.tmp" if exclusive else path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":")))
+        if not exclusive:
+            os.replace(temporary, path)
+            return
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SegmentIndex"]:
+        """Индекс файла лога path; None - индекса нет или он поврежден"""
+        try:
+            with open(segment_base(path) + INDEX_SUFFIX, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return None
+            index = cls(data["seq"], path, data["block_bytes"])
+            index.size = data["size"]
+            index.compression = data.get("compression")
+            index.stored_size = data.get("stored_size", index.size)
+            index.shipped_blocks = data.get("shipped_blocks", 0)
+            index.blocks = data["blocks"]
+            index.postings = {
+                field: {value: decode_postings(encoded) for value, encoded in data["postings"].get(field, {}).items()}
+                for field in INDEXED_FIELDS
+            }
+            return index
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Поврежденный индекс аудит лога {path}: {e}")
+            return None
+
+def compress_segment(index: SegmentIndex, compression: str, level: Optional[int] = None) -> SegmentIndex:
+    """Сжатая копия несжатого сегмента: каждый блок - отдельный член gzip или кадр zstd.
+
+    Склеенные члены gzip - обычный файл .gz, но любой блок распаковывается
+    отдельно по смещению из индекса. Возвращает индекс нового файла; исходный
+    файл и индекс не меняются.
+    """
+    path = segment_base(index.path) + COMPRESSION_SUFFIXES[compression]
+    if compression == "zstd":
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=level or 3)
+        compress = compressor.compress
+    else:
+        def compress(data: bytes) -> bytes:
+            packer = zlib.compressobj(level or 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return packer.compress(data) + packer.flush()
+    
+    compressed = SegmentIndex(index.seq, path, index.block_bytes)
+    compressed.size = index.size
+    compressed.postings = index.postings
+    compressed.shipped_blocks = index.shipped_blocks
+    compressed.compression = compression
+    offset = 0
+    temporary = path + ".tmp"
+    with open(index.path, "rb") as source, open(temporary, "wb") as target:
+        for block in index.blocks:
+            source.seek(block[OFFSET])
+            data = compress(source.read(block[LENGTH]))
+            target.write(data)
+            compressed.blocks.append([offset, len(data), block[COUNT], block[MIN_TS], block[MAX_TS]])
+            offset += len(data)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(temporary, path)
+    compressed.stored_size = offset
+    return compressed
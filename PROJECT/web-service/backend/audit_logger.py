@@ -1,12 +1,34 @@
+import functools
+import heapq
+import inspect
 import logging
+import ipaddress
 import json
-from datetime import datetime
-from typing import Dict, Any, Optional, List
+import os
+import random
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Dict, Any, Optional, List, Tuple, Callable, Union, FrozenSet
 from enum import Enum
 from pydantic import BaseModel
 import asyncio
 from contextlib import asynccontextmanager
 
+from sqlalchemy import select
+
+try:
+    import fcntl
+except ImportError:  # Windows: один процесс пишет в единственный файл
+    fcntl = None
+
+from audit_index import (
+    SegmentIndex, INDEX_SUFFIX, COMPRESSION_SUFFIXES, compress_segment, segment_base, zstd_available, timestamp_of
+)
+
 logger = logging.getLogger(__name__)
 
 class AuditEventType(str, Enum):
@@ -80,12 +102,474 @@ class AuditLogEntry(BaseModel):
     success: bool = True
     error_message: Optional[str] = None
 
+# Политики fsync: never - только запись в ОС, batch - после каждой записи пачки,
+# interval - не чаще раза в fsync_interval секунд
+FSYNC_NEVER = "never"
+FSYNC_BATCH = "batch"
+FSYNC_INTERVAL = "interval"
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_BATCH, FSYNC_INTERVAL)
+
+_STOP = object()
+
+# Индекс активного сегмента сохраняется на диск не чаще раза в столько секунд;
+# записанное после сохранения доиндексируется при следующем запуске
+INDEX_SAVE_INTERVAL = 30.0
+# Блоков, читаемых поиском за один переход в поток записи
+SEARCH_READ_BLOCKS = 8
+
+# Закрытые сегменты: audit.log.000042, после сжатия audit.log.000042.gz (.zst)
+SEGMENT_DIGITS = 6
+# Блоков сегмента в одном COPY при отправке в audit_logs
+SHIP_BLOCKS = 64
+AUDIT_COLUMNS = ["user_id", "action", "resource_type", "resource_id", "details", "ip_address", "user_agent", "created_at"]
+# Поля записи, которые в audit_logs попадают в details
+ARCHIVE_DETAIL_FIELDS = ("user_id", "session_id", "severity", "description", "details", "success", "error_message")
+
+def _int_or_none(value) -> Optional[int]:
+    return int(value) if isinstance(value, str) and value.isdigit() else (value if type(value) is int else None)
+
+def audit_row(record: Dict[str, Any]) -> tuple:
+    """Строка аудит лога -> запись для COPY в audit_logs в порядке AUDIT_COLUMNS"""
+    ip_address = record.get("ip_address")
+    if ip_address is not None:
+        try:
+            ip_address = str(ipaddress.ip_address(ip_address))
+        except ValueError:
+            ip_address = None
+    created_at = datetime.fromisoformat(record["timestamp"])
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    resource_type = record.get("resource_type")
+    return (
+        _int_or_none(record.get("user_id")),
+        str(record["event_type"])[:100],
+        str(resource_type)[:50] if resource_type else None,
+        _int_or_none(record.get("resource_id")),
+        {field: record.get(field) for field in ARCHIVE_DETAIL_FIELDS},
+        ip_address,
+        record.get("user_agent"),
+        created_at
+    )
+
+def _segment_rows(index: SegmentIndex, block_ids: List[int]) -> List[tuple]:
+    rows = []
+    for _, data in index.read_blocks(block_ids):
+        for line in data.splitlines():
+            try:
+                rows.append(audit_row(json.loads(line)))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return rows
+
 class AuditLogger:
-    def __init__(self):
-        self.log_file = "audit.log"
+    """Аудит лог с групповой записью.
+    
+    log_event только форматирует запись и кладет строку в ограниченную очередь
+    (при заполнении ждет места). Фоновая задача собирает строки в пачку до
+    batch_size или flush_interval и пишет ее одним вызовом write в отдельном
+    потоке, так что файловые операции не блокируют цикл событий. Размер файла
+    для ротации считается по записанным байтам, без stat на каждое событие.
+    
+    Каждый файл лога (сегмент) индексируется при записи: блоки с диапазоном
+    времени и списки блоков по user_id, event_type, severity и ip_address
+    (audit_index.SegmentIndex). Поиск читает только подходящие блоки всех
+    сегментов, от новых записей к старым.
+    
+    Ротация только переименовывает файл в закрытый сегмент. Фоновое
+    обслуживание копирует закрытые сегменты в таблицу audit_logs (если
+    включено ship_to_database), удаляет сегменты сверх max_log_files,
+    max_total_bytes и старше max_age_days, а остальные сжимает поблочно
+    в отдельном пуле потоков.
+
+    Каждый процесс (воркер uvicorn) пишет в свой файл: при первой записи он
+    занимает свободный номер писателя под блокировкой flock - 0 пишет в
+    log_file, 1 - в audit.w1.log и т.д. Номер освобождается при остановке
+    или завершении процесса, и следующий процесс продолжает те же файлы.
+    Сегменты, их индексы и обслуживание принадлежат писателю; поиск
+    сливает записи всех писателей по времени.
+    """
+    
+    def __init__(self, log_file: str = "audit.log", queue_size: int = 10000, batch_size: int = 512,
+                 flush_interval: float = 0.05, fsync_policy: str = FSYNC_INTERVAL, fsync_interval: float = 1.0,
+                 compression: Optional[str] = "auto", max_log_files: int = 10, max_age_days: Optional[float] = None,
+                 max_total_bytes: Optional[int] = None, ship_to_database: bool = False,
+                 maintenance_interval: float = 60.0, pool_provider=None, models_provider=None,
+                 sample_rates: Optional[Dict[str, float]] = None):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Неизвестная политика fsync: {fsync_policy}")
+        if compression == "auto":
+            compression = "zstd" if zstd_available() else "gzip"
+        elif compression in ("none", ""):
+            compression = None
+        if compression is not None and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Неизвестное сжатие аудит лога: {compression}")
+        self.log_file = log_file
         self.max_log_size = 100 * 1024 * 1024  # 100MB
-        self.max_log_files = 10
+        self.max_log_files = max_log_files
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.compression = compression
+        self.max_age_days = max_age_days
+        self.max_total_bytes = max_total_bytes
+        self.ship_to_database = ship_to_database
+        self.maintenance_interval = maintenance_interval
+        # Доля записываемых событий по типу; типы без записи пишутся всегда
+        self.sample_rates = {getattr(key, "value", key): rate for key, rate in (sample_rates or {}).items()}
+        # pool_provider() - DatabaseConnectionPool, models_provider() - (AuditLog, User)
+        self._pool_provider = pool_provider
+        self._models_provider = models_provider
+        
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # Один поток: пачки пишутся строго по порядку
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-writer")
+        # Сжатие и чтение сегментов для отправки не занимают поток записи
+        self._compress_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-compress")
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._maintenance_wakeup: Optional[asyncio.Event] = None
+        # Фоновый и явный проходы обслуживания не отправляют один сегмент одновременно
+        self._maintenance_lock = asyncio.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Файл и его размер принадлежат потоку записи
+        self._file = None
+        self._file_size = 0
+        # Номер писателя, файл его блокировки и активный файл; занимаются при первой записи или обслуживании
+        self._slot: Optional[int] = None
+        self._slot_lock = None
+        self._active_file: Optional[str] = None
+        # Индексы своих сегментов от активного к самому старому
+        self._segments: Optional[List[SegmentIndex]] = None
+        self._next_seq = 1
+        # Индексы сегментов других писателей, прочитанные поиском: номер писателя -> путь -> индекс
+        self._peer_cache: Dict[int, Dict[str, SegmentIndex]] = {}
+        self._index_saved_at = 0.0
+        self._last_fsync = 0.0
+        self._flush_latencies: deque = deque(maxlen=1000)
+        self.stats = {
+            "events": 0, "written": 0, "flushes": 0, "fsyncs": 0, "rotations": 0,
+            "queue_full_waits": 0, "max_queue_depth": 0, "write_errors": 0,
+            "segments_compressed": 0, "bytes_before_compression": 0, "bytes_after_compression": 0,
+            "segments_removed": 0, "rows_shipped": 0, "maintenance_errors": 0, "sampled_out": 0
+        }
+    
+    # Фоновая запись
+    
+    def start(self):
+        if self._writer_task is not None and not self._writer_task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._writer_task = asyncio.create_task(self._run())
+        self._maintenance_wakeup = asyncio.Event()
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+    
+    async def stop(self):
+        """Запись всего, что уже в очереди, закрытие файла и освобождение номера писателя"""
+        loop = asyncio.get_running_loop()
+        if self._writer_task is None:
+            await loop.run_in_executor(self._executor, self._release_slot)
+            return
+        await self._queue.put(_STOP)
+        await self._writer_task
+        self._writer_task = None
+        # Прерванное сжатие повторится после перезапуска: индекс еще описывает несжатый файл
+        self._maintenance_task.cancel()
+        await asyncio.gather(self._maintenance_task, return_exceptions=True)
+        self._maintenance_task = None
+        await loop.run_in_executor(self._executor, self._close_file)
+        await loop.run_in_executor(self._executor, self._release_slot)
+    
+    async def flush(self):
+        """Ожидание записи всех событий, поставленных в очередь до вызова"""
+        if self._writer_task is None or self._writer_task.done():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        await self._queue.put(waiter)
+        await waiter
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            batch: List[tuple] = []
+            waiters = []
+            deadline = loop.time() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, asyncio.Future):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                # flush() и остановка записывают пачку сразу
+                if stopping or waiters or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+            if batch:
+                start_time = time.perf_counter()
+                try:
+                    await loop.run_in_executor(self._executor, self._write_batch, batch)
+                    self.stats["written"] += len(batch)
+                except Exception as e:
+                    self.stats["write_errors"] += 1
+                    logger.error(f"❌ Ошибка записи аудита: {e}")
+                self.stats["flushes"] += 1
+                self._flush_latencies.append(time.perf_counter() - start_time)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+    
+    def _write_batch(self, batch: List[tuple]):
+        """Запись пачки (строка, время, значения индексируемых полей) в потоке записи"""
+        if self._segments is None:
+            self._open_segments()
+        if self._file is None:
+            self._file = open(self._active_file, "ab")
+            self._file_size = self._file.tell()
+        lines = [line.encode("utf-8") for line, _, _ in batch]
+        data = b"".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        self._file_size += len(data)
+        index = self._segments[0]
+        for line, (_, timestamp, keys) in zip(lines, batch):
+            index.add(len(line), timestamp, keys)
+        now = time.monotonic()
+        if now - self._index_saved_at >= INDEX_SAVE_INTERVAL:
+            index.save()
+            self._index_saved_at = now
+        if self.fsync_policy == FSYNC_BATCH or (
+            self.fsync_policy == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval
+        ):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+            self.stats["fsyncs"] += 1
+        if self._file_size > self.max_log_size:
+            self._rotate_log()
+    
+    # Номер писателя
+    
+    def _writer_file(self, slot: int) -> str:
+        """Активный файл писателя: audit.log, audit.w1.log, audit.w2.log..."""
+        if slot == 0:
+            return self.log_file
+        root, ext = os.path.splitext(self.log_file)
+        return f"{root}.w{slot}{ext}"
+    
+    def _try_lock(self, slot: int):
+        """Файл блокировки писателя под flock; None - номер занят другим процессом"""
+        path = self._writer_file(slot)
+        handle = open(os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".lock"), "a")
+        if fcntl is None:
+            return handle
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+        return handle
+    
+    def _claim_slot(self):
+        """Первый свободный номер писателя (в потоке записи); блокировка держится до остановки"""
+        slot = 0
+        lock = self._try_lock(slot)
+        while lock is None:
+            slot += 1
+            lock = self._try_lock(slot)
+        self._slot, self._slot_lock, self._active_file = slot, lock, self._writer_file(slot)
+    
+    def _release_slot(self):
+        """Освобождение номера писателя после закрытия файла (в потоке записи)"""
+        self._segments = None
+        if self._slot_lock is not None:
+            self._slot_lock.close()
+        self._slot = self._slot_lock = self._active_file = None
+    
+    def _writer_slots(self) -> List[int]:
+        """Номера писателей, у которых есть файлы лога (в потоке записи)"""
+        directory = os.path.dirname(self.log_file) or "."
+        root, ext = os.path.splitext(os.path.basename(self.log_file))
+        pattern = re.compile(re.escape(root) + r"(?:\.w(\d+))?" + re.escape(ext) + r"(?:\.\d+(?:\.gz|\.zst)?)?$")
+        slots = set() if self._slot is None else {self._slot}
+        for name in os.listdir(directory) if os.path.isdir(directory) else ():
+            match = pattern.match(name)
+            if match is not None:
+                slots.add(int(match.group(1) or 0))
+        return sorted(slots)
+    
+    # Сегменты
+    
+    def _segment_path(self, seq: int, writer_file: Optional[str] = None) -> str:
+        return f"{writer_file or self._active_file}.{seq:0{SEGMENT_DIGITS}d}"
+    
+    def _open_segments(self):
+        """Индексы своих файлов лога (в потоке записи); при первом вызове занимается номер писателя"""
+        if self._slot is None:
+            self._claim_slot()
+        self._segments, self._next_seq = self._load_writer(self._active_file, manage=True)
+        # Номер активного сегмента сразу виден поиску других процессов
+        self._segments[0].save()
+        self._index_saved_at = time.monotonic()
+    
+    def _peer_writer_segments(self, slot: int) -> List[SegmentIndex]:
+        """Сегменты другого писателя для поиска (в потоке записи).
         
+        Номер, который никто не держит, на время чтения блокируется, и его
+        файлы приводятся в порядок как свои. Файлы занятого номера только
+        читаются; если владелец ротировал или сжал сегмент во время чтения,
+        список перечитывается.
+        """
+        lock = self._try_lock(slot)
+        cache = self._peer_cache.get(slot, {})
+        try:
+            try:
+                segments, _ = self._load_writer(self._writer_file(slot), lock is not None, cache)
+            except FileNotFoundError:
+                segments, _ = self._load_writer(self._writer_file(slot), lock is not None, cache)
+        finally:
+            if lock is not None:
+                lock.close()
+        self._peer_cache[slot] = {index.path: index for index in segments}
+        return segments
+    
+    def _load_writer(self, writer_file: str, manage: bool,
+                     cache: Optional[Dict[str, SegmentIndex]] = None) -> Tuple[List[SegmentIndex], int]:
+        """Индексы файлов писателя от активного к самому старому и следующий номер сегмента.
+        
+        Закрытые сегменты называются по номеру; файлы прежней схемы
+        audit.log.1..N переименовываются в нее от старых к новым. Индекс
+        закрытого файла годится, если покрывает его целиком; индекс активного
+        файла дополняется строками, записанными после его сохранения. Закрытые
+        файлы без индекса индексируются при первом поиске.
+        
+        manage - вызывающий держит блокировку писателя: только тогда файлы
+        переименовываются и удаляются. cache - индексы чужих файлов с прошлого
+        поиска: закрытые сегменты не меняются, активный файл того же inode
+        доиндексируется с места, где остановился.
+        """
+        directory = os.path.dirname(writer_file) or "."
+        pattern = re.compile(re.escape(os.path.basename(writer_file)) + r"\.(\d+)(\.gz|\.zst)?$")
+        found: Dict[int, List[str]] = {}
+        legacy = []
+        for name in os.listdir(directory) if os.path.isdir(directory) else ():
+            match = pattern.match(name)
+            if match is None:
+                continue
+            path = os.path.join(directory, name)
+            if len(match.group(1)) < SEGMENT_DIGITS and not match.group(2):
+                legacy.append((int(match.group(1)), path))
+            else:
+                found.setdefault(int(match.group(1)), []).append(path)
+        stat = os.stat(writer_file) if os.path.exists(writer_file) else None
+        active = cache.get(writer_file) if cache is not None else None
+        if active is None or stat is None or active.inode != stat.st_ino or active.size > stat.st_size:
+            # Индекс может лежать и без файла: процесс занял номер, но еще ничего не записал
+            active = SegmentIndex.load(writer_file)
+            if active and active.size > (stat.st_size if stat else 0):
+                active = None
+        next_seq = max([*found, active.seq if active else 0]) + 1
+        
+        # Старая схема: больший номер - более старый файл
+        for _, path in sorted(legacy, reverse=True) if manage else ():
+            target = self._segment_path(next_seq, writer_file)
+            os.rename(path, target)
+            if os.path.exists(path + INDEX_SUFFIX):
+                os.replace(path + INDEX_SUFFIX, target + INDEX_SUFFIX)
+            found[next_seq] = [target]
+            next_seq += 1
+        
+        if active is None:
+            active = SegmentIndex(next_seq, writer_file)
+            next_seq += 1
+        elif active.seq <= max(found, default=0):
+            active.seq = next_seq
+            next_seq += 1
+        if stat is not None:
+            active.scan(active.size)
+        if cache is not None:
+            active.inode = stat.st_ino if stat else None
+        segments = [active]
+        for seq in sorted(found, reverse=True):
+            index = self._load_sealed(seq, found[seq], writer_file, manage, cache)
+            if index is not None:
+                segments.append(index)
+        return segments, next_seq
+    
+    def _load_sealed(self, seq: int, paths: List[str], writer_file: str, manage: bool,
+                     cache: Optional[Dict[str, SegmentIndex]] = None) -> Optional[SegmentIndex]:
+        """Индекс закрытого сегмента; при manage лишние копии после прерванного сжатия удаляются"""
+        for path in paths:
+            if cache is not None and path in cache:
+                return cache[path]
+        plain = self._segment_path(seq, writer_file)
+        index = SegmentIndex.load(plain)
+        chosen = None
+        if index is not None and index.compression:
+            packed = plain + COMPRESSION_SUFFIXES[index.compression]
+            if os.path.exists(packed) and os.path.getsize(packed) == index.stored_size:
+                chosen = packed
+        if chosen is None:
+            if plain not in paths:
+                # У чужого писателя это может быть сжатие, которое еще не сохранило индекс
+                if manage:
+                    logger.warning(f"Сжатый сегмент аудит лога без индекса пропущен: {paths}")
+                return None
+            chosen = plain
+            if index is None or index.compression or index.stored_size != os.path.getsize(plain):
+                index = SegmentIndex(seq, plain)
+                index.built = False
+        for path in paths if manage else ():
+            if path != chosen:
+                os.remove(path)
+        index.seq = seq
+        index.path = chosen
+        return index
+    
+    def _close_file(self):
+        if self._segments:
+            self._segments[0].save()
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync_policy != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+            self.stats["fsyncs"] += 1
+        self._file.close()
+        self._file = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики очереди и записи"""
+        latencies = sorted(self._flush_latencies)
+        return {
+            **self.stats,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "flush_latency_avg_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "flush_latency_p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 3) if latencies else 0.0
+        }
+    
+    def sampled(self, event_type: AuditEventType) -> bool:
+        """Попадает ли событие этого типа в лог по sample_rates"""
+        rate = self.sample_rates.get(event_type.value)
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return True
+        self.stats["sampled_out"] += 1
+        return False
+    
     async def log_event(self, entry: AuditLogEntry):
         """Логирование события аудита"""
         try:
@@ -105,20 +589,22 @@ class AuditLogger:
                 "error_message": entry.error_message
             }
             
-            # Записываем в файл
+            # Запись в файл выполняет фоновая задача; полная очередь притормаживает источник
             log_line = json.dumps(log_entry, ensure_ascii=False) + "\n"
-            
-            async with asyncio.Lock():
-                with open(self.log_file, "a", encoding="utf-8") as f:
-                    f.write(log_line)
+            keys = (entry.user_id, log_entry["event_type"], log_entry["severity"], entry.ip_address)
+            self.start()
+            if self._queue.full():
+                self.stats["queue_full_waits"] += 1
+            await self._queue.put((log_line, timestamp_of(entry.timestamp), keys))
+            self.stats["events"] += 1
+            depth = self._queue.qsize()
+            if depth > self.stats["max_queue_depth"]:
+                self.stats["max_queue_depth"] = depth
             
             # Также логируем в стандартный лог
             log_level = self._get_log_level(entry.severity)
             logger.log(log_level, f"AUDIT: {entry.description} | User: {entry.user_id} | Event: {entry.event_type.value}")
             
-            # Проверяем размер лога и ротируем при необходимости
-            await self._rotate_log_if_needed()
-            
         except Exception as e:
             logger.error(f"❌ Ошибка записи аудита: {e}")
     
@@ -132,44 +618,217 @@ class AuditLogger:
         }
         return severity_map.get(severity, logging.INFO)
     
-    async def _rotate_log_if_needed(self):
-        """Ротация логов при превышении размера"""
+    def _rotate_log(self):
+        """Ротация лога при превышении размера (в потоке записи).
+        
+        Файл переименовывается в закрытый сегмент со своим номером; сжатие и
+        удаление старых сегментов выполняет фоновое обслуживание.
+        """
         try:
-            if not await self._should_rotate():
-                return
+            self._file.close()
+            self._file = None
             
-            # Переименовываем текущий лог
-            import os
-            for i in range(self.max_log_files - 1, 0, -1):
-                old_name = f"{self.log_file}.{i}"
-                new_name = f"{self.log_file}.{i + 1}"
-                if os.path.exists(old_name):
-                    os.rename(old_name, new_name)
+            # Новый файл откроется следующей записью
+            self._seal(self._segments, self._active_file, self._next_seq)
+            self._next_seq += 1
+            self.stats["rotations"] += 1
+            self._wake_maintenance()
             
-            # Переименовываем текущий лог
-            os.rename(self.log_file, f"{self.log_file}.1")
-            
-            # Создаем новый пустой лог
-            with open(self.log_file, "w") as f:
-                pass
-                
             logger.info("🔄 Аудит лог ротирован")
             
         except Exception as e:
+            # Состояние файлов перечитывается при следующей записи
+            self._segments = None
             logger.error(f"❌ Ошибка ротации аудит лога: {e}")
     
-    async def _should_rotate(self) -> bool:
-        """Проверка необходимости ротации"""
+    def _seal(self, segments: List[SegmentIndex], writer_file: str, seq: int):
+        """Активный файл писателя -> закрытый сегмент, новый активный с номером seq (в потоке записи)"""
+        active = segments[0]
+        path = self._segment_path(active.seq, writer_file)
+        os.rename(writer_file, path)
+        # Индекс закрытого сегмента сохраняется окончательно
+        active.path = path
+        active.save()
+        segments.insert(0, SegmentIndex(seq, writer_file))
+        # Индекс нового файла заменяет индекс закрытого: поиск других процессов видит новый номер
+        segments[0].save()
+    
+    # Обслуживание закрытых сегментов
+    
+    def _wake_maintenance(self):
+        if self._maintenance_wakeup is None or self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._maintenance_wakeup.set)
+    
+    async def _maintenance_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._maintenance_wakeup.wait(), self.maintenance_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._writer_task is None:
+                # Остановка: wait_for в Python 3.11 теряет отмену, пришедшую вместе с пробуждением после ротации
+                return
+            self._maintenance_wakeup.clear()
+            try:
+                await self.maintain()
+            except Exception as e:
+                self.stats["maintenance_errors"] += 1
+                logger.error(f"❌ Ошибка обслуживания аудит лога: {e}")
+    
+    async def maintain(self) -> Dict[str, int]:
+        """Один проход: отправка в audit_logs, удаление по сроку и объему, сжатие.
+        
+        Процесс обслуживает только сегменты своего номера писателя и номеров,
+        которые никто не держит (воркер завершился, а новый номер не занял).
+        Такой номер блокируется на весь проход, так что его сегменты
+        обслуживает один процесс и строки не отправляются дважды.
+        """
+        loop = asyncio.get_running_loop()
+        result = {"shipped_rows": 0, "removed": 0, "compressed": 0}
+        async with self._maintenance_lock:
+            await self._maintain_segments(result)
+            for slot in await loop.run_in_executor(self._executor, self._writer_slots):
+                if slot == self._slot:
+                    continue
+                adopted = await loop.run_in_executor(self._executor, self._adopt_writer, slot)
+                if adopted is None:
+                    continue
+                lock, segments = adopted
+                try:
+                    await self._maintain_segments(result, segments)
+                finally:
+                    lock.close()
+        return result
+    
+    async def _maintain_segments(self, result: Dict[str, int], segments: Optional[List[SegmentIndex]] = None):
+        """Обслуживание сегментов одного писателя; segments - индексы свободного номера, иначе свои"""
+        loop = asyncio.get_running_loop()
+        # Закрытые сегменты меняет только обслуживание, поэтому читать их можно вне потока записи
+        sealed = await loop.run_in_executor(self._executor, self._sealed_segments, segments)
+        if self.ship_to_database:
+            for index in reversed(sealed):
+                if not index.shipped:
+                    result["shipped_rows"] += await self._ship(index)
+        result["removed"] += await loop.run_in_executor(self._executor, self._apply_retention, segments)
+        if self.compression:
+            for index in await loop.run_in_executor(self._executor, self._sealed_segments, segments):
+                if index.compression is None:
+                    compressed = await loop.run_in_executor(
+                        self._compress_executor, compress_segment, index, self.compression
+                    )
+                    if await loop.run_in_executor(self._executor, self._install_compressed, index, compressed, segments):
+                        result["compressed"] += 1
+    
+    def _adopt_writer(self, slot: int) -> Optional[tuple]:
+        """(блокировка, сегменты) номера писателя, который никто не держит, или None (в потоке записи).
+        
+        Активный файл завершившегося писателя закрывается в сегмент: иначе
+        его записи не были бы отправлены и удалены по сроку.
+        """
+        lock = self._try_lock(slot)
+        if lock is None:
+            return None
         try:
-            import os
-            if not os.path.exists(self.log_file):
-                return False
-            
-            size = os.path.getsize(self.log_file)
-            return size > self.max_log_size
-            
+            writer_file = self._writer_file(slot)
+            segments, next_seq = self._load_writer(writer_file, manage=True)
+            if segments[0].size:
+                self._seal(segments, writer_file, next_seq)
         except Exception:
+            lock.close()
+            raise
+        return lock, segments
+    
+    def _sealed_segments(self, segments: Optional[List[SegmentIndex]] = None) -> List[SegmentIndex]:
+        """Закрытые сегменты от новых к старым, с построенными индексами (в потоке записи)"""
+        if segments is None:
+            if self._segments is None:
+                self._open_segments()
+            segments = self._segments
+        for index in segments[1:]:
+            if not index.built:
+                index.scan()
+                index.save()
+        return list(segments[1:])
+    
+    def _install_compressed(self, index: SegmentIndex, compressed: SegmentIndex,
+                            segments: Optional[List[SegmentIndex]] = None) -> bool:
+        """Замена сегмента сжатой копией (в потоке записи, между чтениями поиска)"""
+        if segments is None:
+            segments = self._segments
+        if segments is None or index not in segments:
+            # Сегмент удален, пока сжимался
+            os.remove(compressed.path)
             return False
+        compressed.shipped_blocks = index.shipped_blocks
+        # Сначала индекс: после сбоя между шагами останется лишний несжатый файл, а не битый индекс
+        compressed.save()
+        os.remove(index.path)
+        segments[segments.index(index)] = compressed
+        self.stats["segments_compressed"] += 1
+        self.stats["bytes_before_compression"] += index.stored_size
+        self.stats["bytes_after_compression"] += compressed.stored_size
+        return True
+    
+    def _apply_retention(self, segments: Optional[List[SegmentIndex]] = None) -> int:
+        """Удаление закрытых сегментов сверх срока хранения, числа и объема (в потоке записи).
+        
+        Сегменты сверх max_log_files и max_total_bytes удаляются всегда, по
+        возрасту - только после отправки в базу, если она включена. Пределы
+        считаются для каждого писателя отдельно.
+        """
+        if segments is None:
+            segments = self._segments
+        if segments is None:
+            return 0
+        expires_at = time.time() - self.max_age_days * 86400 if self.max_age_days is not None else None
+        total = segments[0].stored_size
+        kept = [segments[0]]
+        removed = 0
+        for position, index in enumerate(segments[1:], 1):
+            total += index.stored_size
+            over = position > self.max_log_files or (self.max_total_bytes is not None and total > self.max_total_bytes)
+            expired = expires_at is not None and index.max_timestamp < expires_at and (
+                index.shipped or not self.ship_to_database
+            )
+            if not (over or expired):
+                kept.append(index)
+                continue
+            if self.ship_to_database and not index.shipped:
+                logger.warning(f"⚠️ Сегмент аудит лога {index.path} удален до отправки в базу")
+            for path in (index.path, segment_base(index.path) + INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+        segments[:] = kept
+        self.stats["segments_removed"] += removed
+        return removed
+    
+    async def _ship(self, index: SegmentIndex) -> int:
+        """Копирование сегмента в audit_logs порциями по SHIP_BLOCKS блоков.
+        
+        Номер первого неотправленного блока сохраняется в индексе после каждой
+        порции, так что после сбоя отправка продолжается с нее.
+        """
+        loop = asyncio.get_running_loop()
+        AuditLog, User = self._models_provider()
+        pool = self._pool_provider()
+        shipped = 0
+        while not index.shipped:
+            block_ids = list(range(index.shipped_blocks, min(index.shipped_blocks + SHIP_BLOCKS, len(index.blocks))))
+            rows = await loop.run_in_executor(self._compress_executor, _segment_rows, index, block_ids)
+            # user_id ссылается на users: идентификаторы неизвестных пользователей остаются только в details
+            user_ids = {row[0] for row in rows if row[0] is not None}
+            if user_ids:
+                async with pool.get_session() as session:
+                    known = set(await session.scalars(select(User.id).where(User.id.in_(user_ids))))
+                rows = [row if row[0] is None or row[0] in known else (None,) + row[1:] for row in rows]
+            await pool.bulk_copy(AuditLog, AUDIT_COLUMNS, rows)
+            index.shipped_blocks = block_ids[-1] + 1
+            await loop.run_in_executor(self._executor, index.save)
+            shipped += len(rows)
+        self.stats["rows_shipped"] += shipped
+        return shipped
     
     async def log_user_action(self, 
                              user_id: str,
@@ -215,109 +874,316 @@ class AuditLogger:
         
         await self.log_event(entry)
     
+    # Поиск
+    
+    def _plan(self, slot: int, filters: Dict[str, str], start_ts: Optional[float], end_ts: Optional[float],
+              position: Optional[tuple]) -> List[tuple]:
+        """(seq, блоки-кандидаты) по сегментам писателя от новых к старым, после позиции курсора (в потоке записи)"""
+        own = slot == self._slot
+        if own and self._segments is None:
+            self._open_segments()
+        segments = self._segments if own else self._peer_writer_segments(slot)
+        plan = []
+        started = position is None
+        for index in segments:
+            before = None
+            if not started:
+                if index.seq != position[0]:
+                    continue
+                started, before = True, position[1]
+            if not index.built:
+                index.scan()
+                # Индекс чужого сегмента не заменяет сохраненный владельцем после сжатия
+                index.save(exclusive=not own)
+            blocks = index.candidates(filters, start_ts, end_ts, before)
+            if blocks:
+                plan.append((index.seq, blocks))
+        return plan
+    
+    def _read_blocks(self, slot: int, seq: int, block_ids: List[int]) -> List[tuple]:
+        """Содержимое блоков сегмента seq писателя slot (в потоке записи, чтобы ротация или сжатие не заменили свой файл)"""
+        own = slot == self._slot
+        segments = (self._segments or ()) if own else self._peer_cache.get(slot, {}).values()
+        index = next((index for index in segments if index.seq == seq), None)
+        if index is None:
+            return []
+        try:
+            return index.read_blocks(block_ids)
+        except FileNotFoundError:
+            if own:
+                raise
+        # Другой процесс ротировал, сжал или удалил сегмент: номера блоков при этом не меняются
+        index = next((index for index in self._peer_writer_segments(slot) if index.seq == seq), None)
+        return index.read_blocks(block_ids) if index is not None else []
+    
+    async def _iter_writer(self, slot: int, filters: Dict[str, str], needles: List[bytes],
+                           start_ts: Optional[float], end_ts: Optional[float], position: Optional[tuple]):
+        """(время, запись) одного писателя от новых к старым, начиная после позиции курсора"""
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(self._executor, self._plan, slot, filters, start_ts, end_ts, position)
+        for seq, block_ids in plan:
+            for start in range(0, len(block_ids), SEARCH_READ_BLOCKS):
+                chunk = block_ids[start:start + SEARCH_READ_BLOCKS]
+                for block_id, data in await loop.run_in_executor(self._executor, self._read_blocks, slot, seq, chunk):
+                    lines = data.split(b"\n")[:-1]
+                    last = len(lines)
+                    if position and position[0] == seq and position[1] == block_id:
+                        last = min(last, position[2])
+                    for line_number in range(last - 1, -1, -1):
+                        line = lines[line_number]
+                        if not all(needle in line for needle in needles):
+                            continue
+                        try:
+                            log_data = json.loads(line)
+                            timestamp = timestamp_of(log_data["timestamp"])
+                        except (ValueError, KeyError, TypeError):
+                            continue
+                        # Блок может содержать и другие записи - точная проверка фильтров
+                        if any(str(log_data.get(field)) != value for field, value in filters.items()):
+                            continue
+                        if (start_ts is not None and timestamp < start_ts) or (end_ts is not None and timestamp > end_ts):
+                            continue
+                        yield timestamp, self._entry_from_record(log_data, f"{slot}:{seq}:{block_id}:{line_number}")
+    
+    async def iter_audit_logs(self,
+                              user_id: Optional[str] = None,
+                              event_type: Optional[AuditEventType] = None,
+                              severity: Optional[AuditSeverity] = None,
+                              start_date: Optional[datetime] = None,
+                              end_date: Optional[datetime] = None,
+                              ip_address: Optional[str] = None,
+                              cursor: Optional[str] = None):
+        """Записи аудита всех писателей от новых к старым, начиная после курсора"""
+        # События из очереди тоже должны попасть в поиск
+        await self.flush()
+        filters = {
+            field: str(getattr(value, "value", value))
+            for field, value in (("user_id", user_id), ("event_type", event_type),
+                                 ("severity", severity), ("ip_address", ip_address))
+            if value is not None
+        }
+        start_ts = timestamp_of(start_date) if start_date else None
+        end_ts = timestamp_of(end_date) if end_date else None
+        # Строки пишет json.dumps с разделителями по умолчанию: строка без фрагмента
+        # '"поле": значение' фильтру не подходит и не разбирается
+        needles = [json.dumps({field: value}, ensure_ascii=False)[1:-1].encode("utf-8") for field, value in filters.items()]
+        # Курсор - id последних выданных записей писателей через запятую: "писатель:сегмент:блок:строка"
+        positions = {}
+        for part in filter(None, (cursor or "").split(",")):
+            slot, *position = (int(value) for value in part.split(":"))
+            positions[slot] = tuple(position)
+        
+        loop = asyncio.get_running_loop()
+        slots = await loop.run_in_executor(self._executor, self._writer_slots)
+        # Слияние по времени: записи каждого писателя уже идут от новых к старым
+        heads = []
+        for slot in slots:
+            stream = self._iter_writer(slot, filters, needles, start_ts, end_ts, positions.get(slot))
+            head = await anext(stream, None)
+            if head is not None:
+                heapq.heappush(heads, (-head[0], slot, head[1], stream))
+        while heads:
+            _, slot, entry, stream = heapq.heappop(heads)
+            yield entry
+            head = await anext(stream, None)
+            if head is not None:
+                heapq.heappush(heads, (-head[0], slot, head[1], stream))
+    
+    def _entry_from_record(self, log_data: Dict[str, Any], entry_id: str) -> AuditLogEntry:
+        return AuditLogEntry(
+            id=entry_id,
+            timestamp=datetime.fromisoformat(log_data["timestamp"]),
+            user_id=log_data.get("user_id"),
+            session_id=log_data.get("session_id"),
+            ip_address=log_data.get("ip_address"),
+            user_agent=log_data.get("user_agent"),
+            event_type=AuditEventType(log_data["event_type"]),
+            severity=AuditSeverity(log_data["severity"]),
+            description=log_data["description"],
+            details=log_data.get("details"),
+            resource_type=log_data.get("resource_type"),
+            resource_id=log_data.get("resource_id"),
+            success=log_data.get("success", True),
+            error_message=log_data.get("error_message")
+        )
+    
+    async def search_page(self, limit: int = 100, cursor: Optional[str] = None,
+                          **filters) -> Tuple[List[AuditLogEntry], Optional[str]]:
+        """Страница поиска: (записи, курсор следующей страницы или None)"""
+        results = []
+        # Писатели, из которых на странице ничего не выдано, сохраняют позицию прежнего курсора
+        positions = {part.split(":", 1)[0]: part for part in (cursor or "").split(",") if part}
+        async for entry in self.iter_audit_logs(cursor=cursor, **filters):
+            results.append(entry)
+            positions[entry.id.split(":", 1)[0]] = entry.id
+            if len(results) >= limit:
+                return results, ",".join(positions.values())
+        return results, None
+    
     async def search_audit_logs(self,
                                user_id: Optional[str] = None,
                                event_type: Optional[AuditEventType] = None,
                                severity: Optional[AuditSeverity] = None,
                                start_date: Optional[datetime] = None,
                                end_date: Optional[datetime] = None,
-                               limit: int = 100) -> List[AuditLogEntry]:
-        """Поиск по аудит логам"""
+                               limit: int = 100,
+                               ip_address: Optional[str] = None,
+                               cursor: Optional[str] = None) -> List[AuditLogEntry]:
+        """Поиск по аудит логам, новые записи первыми"""
         try:
-            results = []
-            count = 0
-            
-            with open(self.log_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    if count >= limit:
-                        break
-                    
-                    try:
-                        log_data = json.loads(line.strip())
-                        
-                        # Применяем фильтры
-                        if user_id and log_data.get("user_id") != user_id:
-                            continue
-                        if event_type and log_data.get("event_type") != event_type.value:
-                            continue
-                        if severity and log_data.get("severity") != severity.value:
-                            continue
-                        
-                        # Фильтр по дате
-                        if start_date or end_date:
-                            log_timestamp = datetime.fromisoformat(log_data["timestamp"])
-                            if start_date and log_timestamp < start_date:
-                                continue
-                            if end_date and log_timestamp > end_date:
-                                continue
-                        
-                        # Создаем объект записи
-                        entry = AuditLogEntry(
-                            id=str(count),
-                            timestamp=datetime.fromisoformat(log_data["timestamp"]),
-                            user_id=log_data.get("user_id"),
-                            session_id=log_data.get("session_id"),
-                            ip_address=log_data.get("ip_address"),
-                            user_agent=log_data.get("user_agent"),
-                            event_type=AuditEventType(log_data["event_type"]),
-                            severity=AuditSeverity(log_data["severity"]),
-                            description=log_data["description"],
-                            details=log_data.get("details"),
-                            resource_type=log_data.get("resource_type"),
-                            resource_id=log_data.get("resource_id"),
-                            success=log_data.get("success", True),
-                            error_message=log_data.get("error_message")
-                        )
-                        
-                        results.append(entry)
-                        count += 1
-                        
-                    except json.JSONDecodeError:
-                        continue
-            
+            results, _ = await self.search_page(
+                limit, cursor, user_id=user_id, event_type=event_type, severity=severity,
+                start_date=start_date, end_date=end_date, ip_address=ip_address
+            )
             return results
             
         except Exception as e:
             logger.error(f"❌ Ошибка поиска по аудит логам: {e}")
             return []
 
+def _pool():
+    from database.connection_pool import db_pool
+    return db_pool
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    """'payment_processed=0.1,user_login=0.5' -> {тип события: доля}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        event_type, _, rate = item.partition("=")
+        rates[AuditEventType(event_type.strip()).value] = float(rate)
+    return rates
+
+def _audit_models():
+    from database import AuditLog, User
+    return AuditLog, User
+
 # Глобальный экземпляр аудит логгера
-audit_logger = AuditLogger()
+audit_logger = AuditLogger(
+    os.getenv("AUDIT_LOG_FILE", "audit.log"),
+    fsync_policy=os.getenv("AUDIT_LOG_FSYNC", FSYNC_INTERVAL),
+    compression=os.getenv("AUDIT_LOG_COMPRESSION", "auto"),
+    max_age_days=float(os.getenv("AUDIT_LOG_MAX_AGE_DAYS")) if os.getenv("AUDIT_LOG_MAX_AGE_DAYS") else None,
+    max_total_bytes=int(os.getenv("AUDIT_LOG_MAX_TOTAL_MB", "0")) * 1024 * 1024 or None,
+    ship_to_database=os.getenv("AUDIT_LOG_SHIP_TO_DB", "false").lower() == "true",
+    pool_provider=_pool,
+    models_provider=_audit_models,
+    sample_rates=_parse_sample_rates(os.getenv("AUDIT_LOG_SAMPLE_RATES", ""))
+)
+
+# Аргументы, значения которых не попадают в лог
+REDACTED_ARGUMENTS = frozenset({
+    "password", "new_password", "token", "access_token", "refresh_token", "secret",
+    "pin", "cvv", "cvc", "card_number", "biometric_data"
+})
+MAX_CAPTURED_LENGTH = 200
+
+class ArgumentCapture:
+    """Выбранные аргументы вызова для details записи аудита.
+    
+    fields - {ключ в details: источник}, источник - имя параметра функции,
+    путь к атрибуту ("card.last_four") или функция от словаря аргументов.
+    Строки обрезаются до max_length, значения ключей и параметров из redact
+    заменяются на "***", объекты других типов записываются только именем типа - repr
+    произвольных объектов (сессий, запросов) не вызывается.
+    """
+    
+    def __init__(self, func: Callable, fields: Dict[str, Union[str, Callable]],
+                 max_length: int = MAX_CAPTURED_LENGTH, redact: FrozenSet[str] = REDACTED_ARGUMENTS):
+        self._signature = inspect.signature(func)
+        self.max_length = max_length
+        self.redact = frozenset(name.lower() for name in redact)
+        self._fields = [(key, self._getter(key, source)) for key, source in fields.items()]
+    
+    def _getter(self, key: str, source: Union[str, Callable]) -> Callable[[Dict[str, Any]], Any]:
+        if key.lower() in self.redact:
+            return lambda arguments: "***"
+        if callable(source):
+            return source
+        name, *path = source.split(".")
+        if name not in self._signature.parameters:
+            raise ValueError(f"У функции нет параметра {name}")
+        if self.redact.intersection(part.lower() for part in (name, *path)):
+            return lambda arguments: "***"
+        
+        def get(arguments: Dict[str, Any]):
+            value = arguments.get(name)
+            for attribute in path:
+                value = value.get(attribute) if isinstance(value, dict) else getattr(value, attribute, None)
+            return value
+        return get
+    
+    def _safe(self, value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, Enum):
+            value = value.value
+        elif isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        if isinstance(value, str):
+            return value if len(value) <= self.max_length else value[:self.max_length] + "…"
+        if isinstance(value, (list, tuple, set, dict)):
+            return f"<{type(value).__name__} len={len(value)}>"
+        return f"<{type(value).__name__}>"
+    
+    def arguments(self, args: tuple, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return self._signature.bind_partial(*args, **kwargs).arguments
+    
+    def capture(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: self._safe(get(arguments)) for key, get in self._fields}
 
 # Декоратор для автоматического логирования действий
-def audit_log(event_type: AuditEventType, description: str, severity: AuditSeverity = AuditSeverity.INFO):
-    """Декоратор для автоматического логирования действий функций"""
+def audit_log(event_type: AuditEventType, description: str, severity: AuditSeverity = AuditSeverity.INFO,
+              capture: Optional[Dict[str, Union[str, Callable]]] = None, user_field: str = "user_id",
+              max_length: int = MAX_CAPTURED_LENGTH, redact: FrozenSet[str] = REDACTED_ARGUMENTS):
+    """Декоратор для автоматического логирования действий функций.
+    
+    В details попадают имя функции и аргументы из capture (см. ArgumentCapture);
+    user_id берется из аргумента user_field. Аргументы разбираются только для
+    записываемого события: успешный вызов, не прошедший sample_rates логгера,
+    не стоит ничего, кроме проверки. Ошибки записываются всегда.
+    """
     def decorator(func):
+        capturer = ArgumentCapture(func, capture or {}, max_length, redact)
+        
+        def details(args, kwargs) -> Tuple[str, Dict[str, Any]]:
+            arguments = capturer.arguments(args, kwargs)
+            user_id = arguments.get(user_field, kwargs.get(user_field))
+            return (str(user_id) if user_id is not None else "system",
+                    {"function": func.__name__, **capturer.capture(arguments)})
+        
+        @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             try:
                 # Выполняем функцию
                 result = await func(*args, **kwargs)
-                
-                # Логируем успешное выполнение
-                await audit_logger.log_user_action(
-                    user_id=kwargs.get("user_id", "system"),
-                    event_type=event_type,
-                    description=description,
-                    severity=severity,
-                    success=True,
-                    details={"function": func.__name__, "args": str(args), "kwargs": str(kwargs)}
-                )
-                
-                return result
-                
             except Exception as e:
                 # Логируем ошибку
+                user_id, captured = details(args, kwargs)
                 await audit_logger.log_user_action(
-                    user_id=kwargs.get("user_id", "system"),
+                    user_id=user_id,
                     event_type=event_type,
                     description=f"{description} - ОШИБКА: {str(e)}",
                     severity=AuditSeverity.ERROR,
                     success=False,
                     error_message=str(e),
-                    details={"function": func.__name__, "args": str(args), "kwargs": str(kwargs)}
+                    details=captured
                 )
                 raise
+            
+            # Логируем успешное выполнение
+            if audit_logger.sampled(event_type):
+                user_id, captured = details(args, kwargs)
+                await audit_logger.log_user_action(
+                    user_id=user_id,
+                    event_type=event_type,
+                    description=description,
+                    severity=severity,
+                    success=True,
+                    details=captured
+                )
+            return result
         
         return wrapper
     return decorator
-
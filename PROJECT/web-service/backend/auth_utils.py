@@ -0,0 +1,70 @@
+"""
+Аутентификация PayGo API
+Хеширование паролей, JWT токены и зависимости FastAPI для текущего пользователя
+"""
+
+from datetime import datetime, timedelta
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import User, get_db
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+security = HTTPBearer()
+
+def hash_password(password: str) -> str:
+    """Хеш пароля для хранения в users.hashed_password"""
+    return pwd_context.hash(password)
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Проверка пароля по хешу"""
+    return pwd_context.verify(password, hashed_password)
+
+def _create_token(data: dict, expires_delta: timedelta, token_type: str) -> str:
+    to_encode = data.copy()
+    to_encode.update({"exp": datetime.utcnow() + expires_delta, "type": token_type})
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
+
+def create_access_token(data: dict) -> str:
+    """Access токен со сроком ACCESS_TOKEN_EXPIRE_MINUTES"""
+    return _create_token(data, timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES), "access")
+
+def create_refresh_token(data: dict) -> str:
+    """Refresh токен со сроком REFRESH_TOKEN_EXPIRE_DAYS"""
+    return _create_token(data, timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS), "refresh")
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """Пользователь из access токена (заголовок Authorization: Bearer)"""
+    unauthorized = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Неверный токен",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(credentials.credentials, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        raise unauthorized
+    user_id = payload.get("sub")
+    if user_id is None or payload.get("type") != "access":
+        raise unauthorized
+
+    user = await db.get(User, int(user_id))
+    if user is None:
+        raise unauthorized
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Аккаунт деактивирован")
+    return user
+
+async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """Текущий пользователь с ролью admin"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав")
+    return current_user
@@ -0,0 +1,301 @@
+"""
+Снимок административной панели PayGo
+Счетчики хранятся в памяти, обновляются событиями предметной области
+и периодически сверяются с базой данных
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import case, func, select
+
+logger = logging.getLogger(__name__)
+
+# Окно "за месяц" панели и срок хранения почасовых корзин
+MONTH_WINDOW = timedelta(days=30)
+
+def _hour_start(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _hour_bucket(column, dialect_name: str):
+    """Начало часа для GROUP BY в диалекте базы"""
+    if dialect_name == "postgresql":
+        return func.date_trunc("hour", column)
+    return func.strftime("%Y-%m-%d %H:00:00", column)
+
+class DashboardSnapshot:
+    """Данные /admin/dashboard из памяти вместо 13 запросов на каждое открытие.
+
+    Полная сверка - 4 запроса с условной агрегацией и почасовые корзины
+    завершенных транзакций за 30 дней. Между сверками счетчики меняются
+    событиями: новый пользователь, карта, терминал, завершенная транзакция.
+    Сверка читает primary; события во время сверки пропускаются - их коммиты
+    уже видны запросам сверки или будут учтены следующей.
+    """
+
+    def __init__(self, session_factory, models_provider, reconcile_interval: float = 300.0):
+        # session_factory() - асинхронный контекстный менеджер сессии,
+        # models_provider() - (User, Terminal, Transaction, Card)
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        self.reconcile_interval = reconcile_interval
+        self._boot_id = uuid.uuid4().hex[:8]
+        self._counters: Optional[Dict[str, float]] = None
+        # Завершенные транзакции по часу created_at: час -> [число, сумма]
+        self._hourly: Dict[datetime, List[float]] = {}
+        self._version = 0
+        self.as_of: Optional[datetime] = None
+        self.reconciled_at: Optional[datetime] = None
+        self._payload: Optional[Tuple[str, Dict[str, Any]]] = None
+        self._reconciling = False
+        self._reconcile_lock = asyncio.Lock()
+        self._reconcile_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"reconciliations": 0, "events": 0, "events_skipped": 0, "served": 0, "not_modified": 0}
+
+    # Сверка с базой данных
+
+    async def reconcile(self):
+        """Полный пересчет счетчиков из базы данных"""
+        async with self._reconcile_lock:
+            User, Terminal, Transaction, Card = self._models_provider()
+            now = datetime.utcnow()
+            month_ago = now - MONTH_WINDOW
+            # Повтор событий поверх результата сверки учел бы дважды те, чьи
+            # коммиты запросы уже видели: до конца сверки события пропускаются
+            self._reconciling = True
+            try:
+                async with self._session_factory() as session:
+                    users = (await session.execute(select(
+                        func.count(User.id),
+                        func.count(case((User.is_active == True, 1))),
+                        func.count(case((User.is_verified == True, 1)))
+                    ))).one()
+                    terminals = (await session.execute(select(
+                        func.count(Terminal.id),
+                        func.count(case((Terminal.status == "online", 1)))
+                    ))).one()
+                    cards = (await session.execute(select(
+                        func.count(Card.id),
+                        func.count(case((Card.is_active == True, 1)))
+                    ))).one()
+                    transactions = (await session.execute(select(
+                        func.count(Transaction.id),
+                        func.count(case((Transaction.status == "completed", 1))),
+                        func.sum(case((Transaction.status == "completed", Transaction.amount), else_=0))
+                    ))).one()
+                    hour = _hour_bucket(Transaction.created_at, session.get_bind().dialect.name)
+                    hourly_rows = (await session.execute(
+                        select(hour, func.count(Transaction.id), func.sum(Transaction.amount))
+                        .where(Transaction.status == "completed", Transaction.created_at >= _hour_start(month_ago))
+                        .group_by(hour)
+                    )).all()
+
+                self._counters = {
+                    "users_total": users[0], "users_active": users[1], "users_verified": users[2],
+                    "terminals_total": terminals[0], "terminals_online": terminals[1],
+                    "cards_total": cards[0], "cards_active": cards[1],
+                    "transactions_total": transactions[0], "transactions_successful": transactions[1],
+                    "total_amount": float(transactions[2] or 0.0)
+                }
+                self._hourly = {
+                    _hour_start(bucket if isinstance(bucket, datetime) else datetime.fromisoformat(bucket)): [count, float(amount or 0.0)]
+                    for bucket, count, amount in hourly_rows
+                }
+            finally:
+                self._reconciling = False
+
+            self.reconciled_at = now
+            self.stats["reconciliations"] += 1
+            self._changed()
+
+    def request_reconcile(self):
+        """Внеочередная сверка (массовые изменения без отдельных событий)"""
+        self._reconcile_requested.set()
+
+    # События предметной области
+
+    def _apply(self) -> bool:
+        """False - снимок еще не построен или идет сверка: событие учтет сверка"""
+        if self._reconciling:
+            self.stats["events_skipped"] += 1
+            return False
+        if self._counters is None:
+            return False
+        self.stats["events"] += 1
+        return True
+
+    def user_created(self, is_active: bool = True, is_verified: bool = False):
+        if self._apply():
+            self._counters["users_total"] += 1
+            self._counters["users_active"] += int(bool(is_active))
+            self._counters["users_verified"] += int(bool(is_verified))
+            self._changed()
+
+    def card_added(self, is_active: bool = True):
+        if self._apply():
+            self._counters["cards_total"] += 1
+            self._counters["cards_active"] += int(bool(is_active))
+            self._changed()
+
+    def terminal_created(self, status: str = "offline"):
+        if self._apply():
+            self._counters["terminals_total"] += 1
+            self._counters["terminals_online"] += int(status == "online")
+            self._changed()
+
+    def terminal_status_changed(self, old_status: str, new_status: str):
+        if old_status == new_status:
+            return
+        if self._apply():
+            self._counters["terminals_online"] += int(new_status == "online") - int(old_status == "online")
+            self._changed()
+
+    def transaction_created(self):
+        if self._apply():
+            self._counters["transactions_total"] += 1
+            self._changed()
+
+    def transaction_completed(self, amount: float, created_at: datetime):
+        self._completed_delta(1, amount, created_at)
+
+    def transaction_refunded(self, amount: float, created_at: datetime):
+        """Возврат: транзакция больше не считается успешной"""
+        self._completed_delta(-1, amount, created_at)
+
+    def _completed_delta(self, sign: int, amount: float, created_at: datetime):
+        if self._apply():
+            self._counters["transactions_successful"] += sign
+            self._counters["total_amount"] += sign * amount
+            if created_at and created_at >= _hour_start(datetime.utcnow() - MONTH_WINDOW):
+                bucket = self._hourly.setdefault(_hour_start(created_at), [0, 0.0])
+                bucket[0] += sign
+                bucket[1] += sign * amount
+            self._changed()
+
+    def _changed(self):
+        self._version += 1
+        self.as_of = datetime.utcnow()
+
+    # Выдача снимка
+
+    @property
+    def is_ready(self) -> bool:
+        return self._counters is not None
+
+    def _window_totals(self, since: datetime) -> Tuple[int, float]:
+        count, amount = 0, 0.0
+        for hour, (bucket_count, bucket_amount) in self._hourly.items():
+            if hour >= since:
+                count += bucket_count
+                amount += bucket_amount
+        return count, amount
+
+    async def get(self, if_none_match: Optional[str] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """ETag и данные панели, None вместо данных - клиентская копия актуальна (304).
+
+        До первой сверки снимок строится сразу.
+        """
+        if self._counters is None:
+            await self.reconcile()
+        now = datetime.utcnow()
+        # Окна "сегодня" и "30 дней" сдвигаются по часам, поэтому час входит в ETag
+        etag = f'"{self._boot_id}-{self._version}-{_hour_start(now):%Y%m%d%H}"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            self.stats["not_modified"] += 1
+            return etag, None
+        if self._payload is None or self._payload[0] != etag:
+            self._payload = (etag, self._build_payload(now))
+        self.stats["served"] += 1
+        return self._payload
+
+    def _build_payload(self, now: datetime) -> Dict[str, Any]:
+        counters = self._counters
+        month_start = _hour_start(now - MONTH_WINDOW)
+        # Корзины старше окна больше не нужны
+        for hour in [hour for hour in self._hourly if hour < month_start]:
+            del self._hourly[hour]
+        # Граница окна 30 дней округляется до часа
+        monthly_transactions, monthly_amount = self._window_totals(month_start)
+        daily_transactions, daily_amount = self._window_totals(now.replace(hour=0, minute=0, second=0, microsecond=0))
+        total_transactions = counters["transactions_total"]
+        successful_transactions = counters["transactions_successful"]
+        return {
+            "users": {
+                "total": counters["users_total"],
+                "active": counters["users_active"],
+                "verified": counters["users_verified"]
+            },
+            "terminals": {
+                "total": counters["terminals_total"],
+                "online": counters["terminals_online"],
+                "offline": counters["terminals_total"] - counters["terminals_online"]
+            },
+            "transactions": {
+                "total": total_transactions,
+                "successful": successful_transactions,
+                "success_rate": successful_transactions / max(total_transactions, 1) * 100
+            },
+            "cards": {
+                "total": counters["cards_total"],
+                "active": counters["cards_active"]
+            },
+            "financial": {
+                "total_amount": counters["total_amount"],
+                "monthly_amount": monthly_amount,
+                "daily_amount": daily_amount,
+                "monthly_transactions": monthly_transactions,
+                "daily_transactions": daily_transactions,
+                "average_transaction": counters["total_amount"] / max(successful_transactions, 1)
+            },
+            "as_of": self.as_of.isoformat() if self.as_of else None,
+            "reconciled_at": self.reconciled_at.isoformat() if self.reconciled_at else None
+        }
+
+    # Фоновая сверка
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reconcile_loop(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Dashboard reconciliation failed: {e}")
+            try:
+                await asyncio.wait_for(self._reconcile_requested.wait(), timeout=self.reconcile_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._reconcile_requested.clear()
+
+def _dashboard_models():
+    # SQLAlchemy модели: в models.* лежат схемы API
+    from database import User, Terminal, Transaction, Card
+    return User, Terminal, Transaction, Card
+
+def _session():
+    # Не реплика: коммиты, еще не дошедшие до реплики, потерялись бы до следующей сверки
+    from database.connection_pool import db_pool
+    return db_pool.get_session()
+
+# Глобальный экземпляр снимка панели
+dashboard_snapshot = DashboardSnapshot(
+    _session,
+    _dashboard_models,
+    reconcile_interval=float(os.getenv("DASHBOARD_RECONCILE_INTERVAL", "300"))
+)
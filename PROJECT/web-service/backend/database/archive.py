@@ -0,0 +1,377 @@
+"""
+Холодный архив старых транзакций PayGo
+Завершенные транзакции старше окна возврата переносятся из PostgreSQL
+в сжатые колоночные файлы по месяцам, поиск идет через min/max индекс файлов
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import DateTime, select, delete, func
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.partitioning import month_start, add_months, transaction_created_window
+
+logger = logging.getLogger(__name__)
+
+# Возврат возможен в течение 90 дней (refund_transaction), после этого транзакция не меняется
+REFUND_WINDOW_DAYS = 90
+
+# Статусы, после которых транзакция больше не обновляется
+FINAL_STATUSES = ("completed", "failed", "cancelled", "refunded")
+
+ARCHIVE_MAGIC = b"PGCOL1"
+INDEX_FILENAME = "index.json"
+
+# Колонки с min/max в индексе архива
+INDEXED_COLUMNS = ("id", "transaction_id", "created_at")
+
+def _encode_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _decode_column(values: List[Any], column_type: str) -> List[Any]:
+    if column_type == "datetime":
+        return [datetime.fromisoformat(value) if value is not None else None for value in values]
+    return values
+
+def _column_bounds(values: List[Any]) -> Tuple[Any, Any]:
+    present = [value for value in values if value is not None]
+    if not present:
+        return None, None
+    return _encode_value(min(present)), _encode_value(max(present))
+
+def write_columnar_file(path: Path, columns: Dict[str, List[Any]], column_types: Dict[str, str],
+                        compression_level: int = 6) -> Dict[str, Any]:
+    """Запись колонок в файл: заголовок JSON и сжатый блок на каждую колонку.
+
+    Значения одной колонки идут подряд, поэтому повторяющиеся статусы, валюты
+    и терминалы сжимаются намного лучше, чем построчный дамп.
+    """
+    blocks = []
+    header_columns = []
+    offset = 0
+    for name, values in columns.items():
+        raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":")).encode()
+        block = zlib.compress(raw, compression_level)
+        minimum, maximum = _column_bounds(values)
+        header_columns.append({
+            "name": name,
+            "type": column_types.get(name, "json"),
+            "offset": offset,
+            "length": len(block),
+            "sha256": hashlib.sha256(block).hexdigest(),
+            "min": minimum,
+            "max": maximum
+        })
+        blocks.append(block)
+        offset += len(block)
+
+    rows = len(next(iter(columns.values()), []))
+    header = json.dumps({"rows": rows, "codec": "zlib", "columns": header_columns}).encode()
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as archive_file:
+        archive_file.write(ARCHIVE_MAGIC)
+        archive_file.write(struct.pack(">I", len(header)))
+        archive_file.write(header)
+        for block in blocks:
+            archive_file.write(block)
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+    os.replace(tmp_path, path)
+    return {"rows": rows, "bytes": path.stat().st_size, "columns": header_columns}
+
+def read_columnar_file(path: Path, column_names: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+    """Чтение колонок файла (всех или только нужных) с проверкой контрольных сумм"""
+    with open(path, "rb") as archive_file:
+        if archive_file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not a columnar archive")
+        header_length = struct.unpack(">I", archive_file.read(4))[0]
+        header = json.loads(archive_file.read(header_length))
+        data_start = len(ARCHIVE_MAGIC) + 4 + header_length
+        columns = {}
+        for column in header["columns"]:
+            if column_names is not None and column["name"] not in column_names:
+                continue
+            archive_file.seek(data_start + column["offset"])
+            block = archive_file.read(column["length"])
+            if hashlib.sha256(block).hexdigest() != column["sha256"]:
+                raise ValueError(f"Checksum mismatch in {path} column {column['name']}")
+            columns[column["name"]] = _decode_column(json.loads(zlib.decompress(block)), column["type"])
+    return columns
+
+class TransactionArchive:
+    """Перенос старых транзакций в колоночные файлы и поиск по архиву"""
+
+    def __init__(self, archive_dir: str, engine_provider, model_provider,
+                 archive_after_days: int = REFUND_WINDOW_DAYS, rows_per_file: int = 50000,
+                 cache_files: int = 4):
+        self.archive_dir = Path(archive_dir)
+        # engine_provider/model_provider - функции: пул может пересоздать движок,
+        # а модель импортируется только при первом использовании
+        self._engine_provider = engine_provider
+        self._model_provider = model_provider
+        if archive_after_days < REFUND_WINDOW_DAYS:
+            logger.warning(f"archive_after_days={archive_after_days} is inside the refund window, using {REFUND_WINDOW_DAYS}")
+            archive_after_days = REFUND_WINDOW_DAYS
+        self.archive_after_days = archive_after_days
+        self.rows_per_file = rows_per_file
+        self.cache_files = cache_files
+        self._index: Optional[List[Dict[str, Any]]] = None
+        self._file_cache: "OrderedDict[str, Tuple[Dict[str, List[Any]], Dict[Any, int]]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        return self._engine_provider()
+
+    @property
+    def model(self):
+        return self._model_provider()
+
+    @property
+    def _column_types(self) -> Dict[str, str]:
+        return {
+            column.name: "datetime" if isinstance(column.type, DateTime) else "json"
+            for column in self.model.__table__.columns
+        }
+
+    # Индекс архива
+
+    @property
+    def index(self) -> List[Dict[str, Any]]:
+        if self._index is None:
+            index_path = self.archive_dir / INDEX_FILENAME
+            self._index = json.loads(index_path.read_text()) if index_path.exists() else []
+        return self._index
+
+    def _save_index(self):
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        index_path = self.archive_dir / INDEX_FILENAME
+        tmp_path = index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.index, indent=1))
+        os.replace(tmp_path, index_path)
+
+    # Архивация
+
+    async def archive_old_transactions(self) -> Dict[str, Any]:
+        """Перенос завершенных транзакций старше archive_after_days в архив.
+
+        Каждый файл проверяется повторным чтением до удаления строк из основной БД.
+        Файлы, строки которых не успели удалить (сбой между записью и DELETE),
+        дочищаются в начале следующего запуска.
+        """
+        async with self._lock:
+            model = self.model
+            cutoff = datetime.utcnow() - timedelta(days=self.archive_after_days)
+            deleted = await self._finish_pending_deletes()
+            stats = {"files": 0, "rows": 0, "bytes": 0, "deleted": deleted, "cutoff": cutoff.isoformat()}
+
+            async with self.engine.connect() as conn:
+                oldest = await conn.scalar(
+                    select(func.min(model.created_at)).where(
+                        model.created_at < cutoff, model.status.in_(FINAL_STATUSES)
+                    )
+                )
+            if oldest is None:
+                return stats
+
+            month = month_start(oldest.date())
+            while month < cutoff.date():
+                month_end = min(datetime.combine(add_months(month, 1), datetime.min.time()), cutoff)
+                last_id = 0
+                while True:
+                    batch_range = {
+                        "created_from": datetime.combine(month, datetime.min.time()).isoformat(),
+                        "created_to": month_end.isoformat(),
+                        "id_after": last_id
+                    }
+                    rows = await self._fetch_batch(batch_range)
+                    if not rows:
+                        break
+                    batch_range["id_to"] = rows[-1]["id"]
+                    entry = await asyncio.to_thread(self._write_verified_file, month, rows, batch_range)
+                    self.index.append(entry)
+                    self._save_index()
+                    stats["deleted"] += await self._delete_archived(entry)
+                    stats["files"] += 1
+                    stats["rows"] += len(rows)
+                    stats["bytes"] += entry["bytes"]
+                    last_id = rows[-1]["id"]
+                month = add_months(month, 1)
+
+            logger.info(f"Archived {stats['rows']} transactions into {stats['files']} files ({stats['bytes']} bytes)")
+            return stats
+
+    def _batch_conditions(self, batch_range: Dict[str, Any]) -> list:
+        """Условия пакета: месяц created_at, финальный статус и диапазон id"""
+        model = self.model
+        conditions = [
+            model.created_at >= datetime.fromisoformat(batch_range["created_from"]),
+            model.created_at < datetime.fromisoformat(batch_range["created_to"]),
+            model.status.in_(FINAL_STATUSES),
+            model.id > batch_range["id_after"]
+        ]
+        if "id_to" in batch_range:
+            conditions.append(model.id <= batch_range["id_to"])
+        return conditions
+
+    async def _fetch_batch(self, batch_range: Dict[str, Any]) -> List[Dict[str, Any]]:
+        model = self.model
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(*model.__table__.columns)
+                .where(*self._batch_conditions(batch_range))
+                .order_by(model.id)
+                .limit(self.rows_per_file)
+            )
+            return [dict(row) for row in result.mappings()]
+
+    def _write_verified_file(self, month, rows: List[Dict[str, Any]], batch_range: Dict[str, Any]) -> Dict[str, Any]:
+        """Запись файла месяца и проверка: прочитанные строки совпадают с исходными"""
+        month_dir = self.archive_dir / f"{month.year}-{month.month:02d}"
+        month_dir.mkdir(parents=True, exist_ok=True)
+        path = month_dir / f"part-{rows[0]['id']}-{rows[-1]['id']}.pgc"
+        column_names = list(rows[0].keys())
+        columns = {name: [row[name] for row in rows] for name in column_names}
+        written = write_columnar_file(path, columns, self._column_types)
+
+        restored = read_columnar_file(path)
+        restored_rows = [dict(zip(column_names, values)) for values in zip(*(restored[name] for name in column_names))]
+        if restored_rows != rows:
+            path.unlink()
+            raise ValueError(f"Archive verification failed for {path}")
+
+        bounds = {column["name"]: column for column in written["columns"] if column["name"] in INDEXED_COLUMNS}
+        return {
+            "file": str(path.relative_to(self.archive_dir)),
+            "month": f"{month.year}-{month.month:02d}",
+            "rows": written["rows"],
+            "bytes": written["bytes"],
+            "min": {name: bounds[name]["min"] for name in bounds},
+            "max": {name: bounds[name]["max"] for name in bounds},
+            "range": batch_range,
+            "deleted": False
+        }
+
+    async def _delete_archived(self, entry: Dict[str, Any]) -> int:
+        """Удаление заархивированных строк из основной БД одним DELETE по условиям пакета.
+
+        Финальные транзакции старше окна возврата не меняются, а новые получают
+        большие id и свежий created_at, поэтому условия пакета выбирают ровно те
+        строки, что записаны в файл. Условие по месяцу created_at отсекает секции.
+        """
+        async with self.engine.begin() as conn:
+            result = await conn.execute(delete(self.model).where(*self._batch_conditions(entry["range"])))
+            # 0 - строки уже удалены до сбоя, при повторе дочистки
+            if result.rowcount not in (entry["rows"], 0):
+                raise ValueError(f"Archive {entry['file']} holds {entry['rows']} rows, delete matched {result.rowcount}")
+        entry["deleted"] = True
+        self._save_index()
+        return result.rowcount
+
+    async def _finish_pending_deletes(self) -> int:
+        deleted = 0
+        for entry in self.index:
+            if not entry["deleted"]:
+                deleted += await self._delete_archived(entry)
+        return deleted
+
+    # Поиск по архиву
+
+    def _candidate_files(self, transaction_id: str) -> List[Dict[str, Any]]:
+        """Файлы, чьи min/max по transaction_id и created_at допускают искомую транзакцию"""
+        window = transaction_created_window(transaction_id)
+        candidates = []
+        for entry in self.index:
+            minimum, maximum = entry["min"], entry["max"]
+            if minimum.get("transaction_id") is None or not minimum["transaction_id"] <= transaction_id <= maximum["transaction_id"]:
+                continue
+            if window and (maximum["created_at"] < window[0].isoformat() or minimum["created_at"] > window[1].isoformat()):
+                continue
+            candidates.append(entry)
+        return candidates
+
+    def _load_file(self, relative_path: str) -> Tuple[Dict[str, List[Any]], Dict[Any, int]]:
+        cached = self._file_cache.get(relative_path)
+        if cached is not None:
+            self._file_cache.move_to_end(relative_path)
+            return cached
+        columns = read_columnar_file(self.archive_dir / relative_path)
+        positions = {value: position for position, value in enumerate(columns["transaction_id"])}
+        self._file_cache[relative_path] = (columns, positions)
+        while len(self._file_cache) > self.cache_files:
+            self._file_cache.popitem(last=False)
+        return columns, positions
+
+    def _find_row(self, transaction_id: str) -> Optional[Dict[str, Any]]:
+        for entry in self._candidate_files(transaction_id):
+            columns, positions = self._load_file(entry["file"])
+            position = positions.get(transaction_id)
+            if position is not None:
+                return {name: values[position] for name, values in columns.items()}
+        return None
+
+    async def find_transaction(self, transaction_id: str):
+        """Транзакция из архива как объект модели (не привязан к сессии) или None"""
+        if not self.index:
+            return None
+        row = await asyncio.to_thread(self._find_row, transaction_id)
+        return self.model(**row) if row else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self.index),
+            "rows": sum(entry["rows"] for entry in self.index),
+            "bytes": sum(entry["bytes"] for entry in self.index),
+            "months": sorted({entry["month"] for entry in self.index}),
+            "pending_deletes": sum(1 for entry in self.index if not entry["deleted"])
+        }
+
+    # Фоновая архивация
+
+    def start(self, interval: float = 24 * 3600):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._archive_loop(interval))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _archive_loop(self, interval: float):
+        while True:
+            try:
+                await self.archive_old_transactions()
+            except Exception as e:
+                logger.error(f"Transaction archiving failed: {e}")
+            await asyncio.sleep(interval)
+
+def _transaction_model():
+    from models.transaction import Transaction
+    return Transaction
+
+def _pool_engine():
+    from database.connection_pool import db_pool
+    return db_pool.engine
+
+# Глобальный экземпляр архива транзакций
+transaction_archive = TransactionArchive(
+    os.getenv("TRANSACTIONS_ARCHIVE_DIR", "/app/archive/transactions"),
+    _pool_engine,
+    _transaction_model,
+    archive_after_days=int(os.getenv("TRANSACTIONS_ARCHIVE_AFTER_DAYS", str(REFUND_WINDOW_DAYS)))
+)
@@ -51,26 +51,119 @@ CREATE TABLE IF NOT EXISTS terminals (
     hardware_version VARCHAR(20)
 );
 
+-- Транзакции секционированы по месяцам created_at (секции создает
+-- database/partitioning.py, перенос существующей таблицы: python -m database.partitioning migrate).
+-- Колонки повторяют database.Transaction. Первичный ключ секционированной таблицы
+-- включает created_at, глобальную уникальность transaction_id держит таблица
+-- transactions_transaction_id_keys, которую заполняет триггер.
 CREATE TABLE IF NOT EXISTS transactions (
-    id SERIAL PRIMARY KEY,
-    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    card_id INTEGER REFERENCES cards(id) ON DELETE SET NULL,
-    terminal_id INTEGER REFERENCES terminals(id) ON DELETE SET NULL,
-    amount DECIMAL(10, 2) NOT NULL,
-    currency VARCHAR(3) DEFAULT 'USD',
-    status VARCHAR(20) NOT NULL DEFAULT 'pending',
-    transaction_type VARCHAR(20) NOT NULL,
+    id SERIAL,
+    transaction_id VARCHAR NOT NULL,
+    terminal_id INTEGER NOT NULL REFERENCES terminals(id),
+    user_id INTEGER REFERENCES users(id),
+    card_id INTEGER REFERENCES cards(id),
+    amount DOUBLE PRECISION NOT NULL,
+    currency VARCHAR NOT NULL DEFAULT 'RUB',
     description TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR DEFAULT 'pending',
+    payment_method VARCHAR NOT NULL,
+    bank_acquirer VARCHAR,
+    bank_transaction_id VARCHAR,
+    bank_response TEXT,
+    card_mask VARCHAR,
+    receipt_number VARCHAR,
+    fiscal_data TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
     processed_at TIMESTAMP,
-    reference_id VARCHAR(100) UNIQUE,
-    merchant_id VARCHAR(100),
-    location_lat DECIMAL(10, 8),
-    location_lng DECIMAL(11, 8),
-    ip_address INET,
-    user_agent TEXT,
-    metadata JSONB
+    completed_at TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS transactions_transaction_id_keys (
+    transaction_id VARCHAR PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION transactions_transaction_id_keys_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM transactions_transaction_id_keys WHERE transaction_id = OLD.transaction_id;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        IF NOT (NEW.transaction_id IS DISTINCT FROM OLD.transaction_id) THEN
+            RETURN NULL;
+        END IF;
+        DELETE FROM transactions_transaction_id_keys WHERE transaction_id = OLD.transaction_id;
+    END IF;
+    INSERT INTO transactions_transaction_id_keys (transaction_id, created_at) VALUES (NEW.transaction_id, NEW.created_at);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_transaction_id_keys_sync ON transactions;
+CREATE TRIGGER transactions_transaction_id_keys_sync AFTER INSERT OR UPDATE OR DELETE ON transactions
+    FOR EACH ROW EXECUTE FUNCTION transactions_transaction_id_keys_sync();
+
+-- Секция по умолчанию для строк вне подготовленных месяцев
+CREATE TABLE IF NOT EXISTS transactions_default PARTITION OF transactions DEFAULT;
+
+-- Секции на текущий и три следующих месяца
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR i IN 0..3 LOOP
+        month_start := date_trunc('month', CURRENT_DATE)::DATE + (i || ' months')::INTERVAL;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+            'transactions_y' || to_char(month_start, 'YYYY') || 'm' || to_char(month_start, 'MM'),
+            month_start,
+            (month_start + INTERVAL '1 month')::DATE
+        );
+    END LOOP;
+END $$;
+
+-- История heartbeat: бит на интервал heartbeat за сутки, одна строка на терминал и день
+CREATE TABLE IF NOT EXISTS terminal_heartbeat_days (
+    terminal_id INTEGER NOT NULL REFERENCES terminals(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    up_bits BYTEA NOT NULL,
+    error_bits BYTEA NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (terminal_id, day)
+);
+
+-- Версии конфигурации терминалов и шаблонов парка; записи не изменяются
+CREATE TABLE IF NOT EXISTS terminal_config_versions (
+    owner_type VARCHAR(16) NOT NULL,
+    owner_key VARCHAR(255) NOT NULL,
+    version INTEGER NOT NULL,
+    template VARCHAR(255),
+    config JSONB NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner_type, owner_key, version)
+);
+
+-- Логи терминалов; пишутся пакетами через COPY
+CREATE TABLE IF NOT EXISTS terminal_logs (
+    id BIGSERIAL PRIMARY KEY,
+    terminal_id INTEGER NOT NULL REFERENCES terminals(id) ON DELETE CASCADE,
+    level VARCHAR(10) NOT NULL,
+    message TEXT NOT NULL,
+    component VARCHAR(50),
+    additional_data JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Подписки на push: у токена устройства (подписки Web Push) один владелец
+CREATE TABLE IF NOT EXISTS push_subscriptions (
+    provider VARCHAR(16) NOT NULL,
+    token TEXT NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (provider, token)
 );
 
 CREATE TABLE IF NOT EXISTS audit_logs (
@@ -110,6 +203,46 @@ CREATE TABLE IF NOT EXISTS notifications (
     metadata JSONB
 );
 
+-- Очередь push уведомлений: строка удаляется после отправки
+CREATE TABLE IF NOT EXISTS notification_queue (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    type VARCHAR(50) NOT NULL,
+    priority VARCHAR(20) NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    message TEXT NOT NULL,
+    data JSONB,
+    coalesced INTEGER NOT NULL DEFAULT 1,
+    due_at TIMESTAMP NOT NULL,
+    claimed_by VARCHAR(64),
+    claimed_until TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Исходящие события: пишутся в транзакции изменения, id - порядковый номер в потоке
+CREATE TABLE IF NOT EXISTS event_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    event_type VARCHAR(50) NOT NULL,
+    aggregate_id VARCHAR(100),
+    user_id INTEGER,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Позиция потребителя событий: id последнего обработанного события
+CREATE TABLE IF NOT EXISTS event_consumer_offsets (
+    consumer VARCHAR(50) PRIMARY KEY,
+    position BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Ведущий процесс конвейера событий: ретрансляция, постоянные потребители и очистка outbox
+CREATE TABLE IF NOT EXISTS event_pipeline_leases (
+    name VARCHAR(50) PRIMARY KEY,
+    owner VARCHAR(64) NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
 -- ОПТИМИЗИРОВАННЫЕ ИНДЕКСЫ ДЛЯ ПРОИЗВОДИТЕЛЬНОСТИ
 
 -- Индексы для таблицы users
@@ -146,28 +279,32 @@ CREATE INDEX IF NOT EXISTS idx_terminals_last_heartbeat ON terminals(last_heartb
 CREATE INDEX IF NOT EXISTS idx_terminals_created_at ON terminals(created_at);
 CREATE INDEX IF NOT EXISTS idx_terminals_location_coords ON terminals USING gist (ll_to_earth(location_lat, location_lng));
 
--- Индексы для таблицы transactions
-CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id);
+-- Индексы для таблицы transactions (создаются на каждой секции).
+-- Диапазоны дат отсекаются секциями, поэтому отдельные индексы по created_at
+-- и частичные индексы "за последние N дней" не нужны.
+CREATE INDEX IF NOT EXISTS ix_transactions_transaction_id ON transactions(transaction_id);
 CREATE INDEX IF NOT EXISTS idx_transactions_card_id ON transactions(card_id);
-CREATE INDEX IF NOT EXISTS idx_transactions_terminal_id ON transactions(terminal_id);
-CREATE INDEX IF NOT EXISTS idx_transactions_status ON transactions(status);
-CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(transaction_type);
-CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions(amount);
-CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions(created_at);
-CREATE INDEX IF NOT EXISTS idx_transactions_processed_at ON transactions(processed_at);
-CREATE INDEX IF NOT EXISTS idx_transactions_reference_id ON transactions(reference_id);
-CREATE INDEX IF NOT EXISTS idx_transactions_merchant_id ON transactions(merchant_id);
-CREATE INDEX IF NOT EXISTS idx_transactions_currency ON transactions(currency);
 
 -- Составные индексы для сложных запросов
-CREATE INDEX IF NOT EXISTS idx_transactions_user_status ON transactions(user_id, status);
 CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions(user_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_transactions_terminal_date ON transactions(terminal_id, created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_transactions_amount_range ON transactions(amount) WHERE amount > 0;
-CREATE INDEX IF NOT EXISTS idx_transactions_location_coords ON transactions USING gist (ll_to_earth(location_lat, location_lng));
+CREATE INDEX IF NOT EXISTS idx_transactions_status_date ON transactions(status, created_at);
+
+-- Окна доступности по всему парку читаются по дням
+CREATE INDEX IF NOT EXISTS idx_terminal_heartbeat_days_day ON terminal_heartbeat_days(day);
+
+-- Логи терминалов читаются по терминалу, уровню или компоненту за период
+CREATE INDEX IF NOT EXISTS idx_terminal_logs_terminal_created ON terminal_logs(terminal_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_terminal_logs_level_created ON terminal_logs(level, created_at);
+CREATE INDEX IF NOT EXISTS idx_terminal_logs_component_created ON terminal_logs(component, created_at);
 
--- Индекс для поиска по диапазону дат
-CREATE INDEX IF NOT EXISTS idx_transactions_date_range ON transactions(created_at) WHERE created_at >= CURRENT_DATE - INTERVAL '30 days';
+-- Устройства пользователя и выборка подписок для рассылок по порядку пользователей
+CREATE INDEX IF NOT EXISTS idx_push_subscriptions_user ON push_subscriptions(user_id, provider);
+
+-- Загрузка очереди уведомлений при запуске по времени отправки
+CREATE INDEX IF NOT EXISTS idx_notification_queue_due_at ON notification_queue(due_at);
+-- Строки без владельца или с истекшей арендой забирает другой процесс
+CREATE INDEX IF NOT EXISTS idx_notification_queue_claimed_until ON notification_queue(claimed_until);
 
 -- Индексы для таблицы audit_logs
 CREATE INDEX IF NOT EXISTS idx_audit_logs_user_id ON audit_logs(user_id);
@@ -207,9 +344,6 @@ CREATE INDEX IF NOT EXISTS idx_users_active_only ON users(id, username, email) W
 -- Индекс только для активных карт
 CREATE INDEX IF NOT EXISTS idx_cards_active_only ON cards(id, user_id, card_type) WHERE is_active = TRUE;
 
--- Индекс только для успешных транзакций
-CREATE INDEX IF NOT EXISTS idx_transactions_successful ON transactions(id, user_id, amount, created_at) WHERE status = 'completed';
-
 -- Индекс только для активных сессий
 CREATE INDEX IF NOT EXISTS idx_sessions_active_only ON sessions(id, user_id, last_activity) WHERE is_active = TRUE AND expires_at > CURRENT_TIMESTAMP;
 
@@ -218,9 +352,6 @@ CREATE INDEX IF NOT EXISTS idx_sessions_active_only ON sessions(id, user_id, las
 -- Индекс для поиска по описанию транзакций
 CREATE INDEX IF NOT EXISTS idx_transactions_description_search ON transactions USING gin(to_tsvector('english', description));
 
--- Индекс для поиска по метаданным (JSONB)
-CREATE INDEX IF NOT EXISTS idx_transactions_metadata ON transactions USING gin(metadata);
-
 -- Индекс для поиска по деталям аудита
 CREATE INDEX IF NOT EXISTS idx_audit_logs_details ON audit_logs USING gin(details);
 
@@ -229,22 +360,8 @@ CREATE INDEX IF NOT EXISTS idx_audit_logs_details ON audit_logs USING gin(detail
 -- Индекс для поиска терминалов по расстоянию
 CREATE INDEX IF NOT EXISTS idx_terminals_geo ON terminals USING gist (ll_to_earth(location_lat, location_lng));
 
--- Индекс для поиска транзакций по местоположению
-CREATE INDEX IF NOT EXISTS idx_transactions_geo ON transactions USING gist (ll_to_earth(location_lat, location_lng));
-
--- ИНДЕКСЫ ДЛЯ ВРЕМЕННЫХ РЯДОВ
-
--- Индекс для агрегации по времени (часы, дни, месяцы)
-CREATE INDEX IF NOT EXISTS idx_transactions_time_series ON transactions(date_trunc('hour', created_at), status, amount);
-
--- Индекс для поиска по временным окнам
-CREATE INDEX IF NOT EXISTS idx_transactions_time_windows ON transactions(created_at) WHERE created_at >= CURRENT_DATE - INTERVAL '90 days';
-
 -- УНИКАЛЬНЫЕ ИНДЕКСЫ И ОГРАНИЧЕНИЯ
 
--- Уникальный индекс для reference_id транзакций
-CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_reference_unique ON transactions(reference_id) WHERE reference_id IS NOT NULL;
-
 -- Уникальный индекс для одной активной сессии на пользователя
 CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_user_unique ON sessions(user_id) WHERE is_active = TRUE;
 
@@ -253,14 +370,8 @@ CREATE UNIQUE INDEX IF NOT EXISTS idx_cards_default_unique ON cards(user_id) WHE
 
 -- ИНДЕКСЫ ДЛЯ СТАТИСТИКИ И АНАЛИТИКИ
 
--- Индекс для подсчета транзакций по пользователю
-CREATE INDEX IF NOT EXISTS idx_transactions_user_count ON transactions(user_id, created_at);
-
--- Индекс для подсчета транзакций по терминалу
-CREATE INDEX IF NOT EXISTS idx_transactions_terminal_count ON transactions(terminal_id, created_at);
-
--- Индекс для анализа сумм транзакций
-CREATE INDEX IF NOT EXISTS idx_transactions_amount_analysis ON transactions(amount, created_at, status);
+-- Подсчет транзакций по пользователю и терминалу покрывают idx_transactions_user_date
+-- и idx_transactions_terminal_date
 
 -- СОЗДАНИЕ ФУНКЦИЙ ДЛЯ ОБНОВЛЕНИЯ ВРЕМЕННЫХ МЕТОК
 
@@ -276,7 +387,6 @@ $$ language 'plpgsql';
 CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_cards_updated_at BEFORE UPDATE ON cards FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_terminals_updated_at BEFORE UPDATE ON terminals FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
-CREATE TRIGGER update_transactions_updated_at BEFORE UPDATE ON transactions FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
 -- ФУНКЦИИ ДЛЯ ОЧИСТКИ УСТАРЕВШИХ ДАННЫХ
 
@@ -446,7 +556,5 @@ ANALYZE;
 
 -- Комментарии по использованию индексов
 COMMENT ON INDEX idx_transactions_user_date IS 'Оптимизирует поиск транзакций пользователя по дате';
-COMMENT ON INDEX idx_transactions_amount_range IS 'Оптимизирует поиск транзакций по сумме';
 COMMENT ON INDEX idx_users_name_search IS 'Оптимизирует полнотекстовый поиск по имени пользователя';
-COMMENT ON INDEX idx_transactions_geo IS 'Оптимизирует геопоиск транзакций';
 COMMENT ON INDEX idx_terminals_geo IS 'Оптимизирует геопоиск терминалов';
@@ -0,0 +1,246 @@
+"""
+Статистика выполнения SQL запросов для PayGo
+Время каждого запроса, гистограммы по отпечатку запроса и журнал медленных запросов
+"""
+
+import re
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple
+
+# Границы бакетов гистограммы задержек (мс), последний бакет - все, что больше
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Параметры с такими именами никогда не попадают в журнал
+SENSITIVE_PARAM_NAMES = ("password", "pin", "cvv", "cvc", "token", "secret", "card_number", "biometric", "hash")
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"\$\d+|%\(\w+\)s|%s|(?<!:):\w+|\?")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST_RE = re.compile(r"(\(\?(?:, \?)*\))(?:\s*,\s*\1)+")
+_SPACE_RE = re.compile(r"\s+")
+_PAN_RE = re.compile(r"\d{12,19}")
+
+def fingerprint_statement(statement: str) -> str:
+    """Нормализованный отпечаток запроса: литералы и параметры заменены на ?"""
+    fingerprint = _COMMENT_RE.sub(" ", statement)
+    fingerprint = _STRING_RE.sub("?", fingerprint)
+    fingerprint = _PARAM_RE.sub("?", fingerprint)
+    fingerprint = _NUMBER_RE.sub("?", fingerprint)
+    fingerprint = _SPACE_RE.sub(" ", fingerprint).strip()
+    # IN (?, ?, ?) и многострочные VALUES не должны плодить разные отпечатки
+    fingerprint = _IN_LIST_RE.sub("(?+)", fingerprint)
+    fingerprint = _VALUES_LIST_RE.sub(r"\1, ...", fingerprint)
+    return fingerprint
+
+def _redact_value(name: Optional[str], value: Any) -> Any:
+    if name and any(sensitive in name.lower() for sensitive in SENSITIVE_PARAM_NAMES):
+        return "***"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        # Номера карт маскируются до последних 4 цифр
+        value = _PAN_RE.sub(lambda match: "*" * (len(match.group()) - 4) + match.group()[-4:], value)
+        return value if len(value) <= 64 else value[:64] + "..."
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return repr(value)[:64]
+
+def redact_parameters(parameters: Any) -> Any:
+    """Копия параметров запроса без секретов и полных номеров карт"""
+    if isinstance(parameters, dict):
+        return {name: _redact_value(name, value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        # executemany: показываем только первые наборы параметров
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return [redact_parameters(item) for item in parameters[:3]]
+        return [_redact_value(None, value) for value in parameters]
+    return _redact_value(None, parameters)
+
+def _cursor_row_count(cursor) -> Optional[int]:
+    """Число строк: затронутых (rowcount) или уже полученных асинхронным адаптером"""
+    rowcount = getattr(cursor, "rowcount", -1)
+    if rowcount is not None and rowcount >= 0:
+        return rowcount
+    # Адаптеры asyncpg/aiosqlite буферизуют результат SELECT целиком при execute
+    rows = getattr(cursor, "_rows", None)
+    if rows is not None:
+        try:
+            return len(rows)
+        except TypeError:
+            return None
+    return None
+
+class _StatementStats:
+    """Гистограмма задержек и счетчики одного отпечатка запроса"""
+
+    __slots__ = ("count", "total_time", "max_time", "rows", "errors", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, duration: float, rows: Optional[int]):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        if rows:
+            self.rows += rows
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, duration * 1000)] += 1
+
+    def percentile_ms(self, q: float) -> float:
+        """Оценка перцентиля по гистограмме (верхняя граница бакета, не больше максимума)"""
+        if not self.count:
+            return 0.0
+        threshold = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= threshold:
+                if index < len(LATENCY_BUCKETS_MS):
+                    return min(float(LATENCY_BUCKETS_MS[index]), round(self.max_time * 1000, 3))
+                break
+        return round(self.max_time * 1000, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "avg_ms": round(self.total_time / max(self.count, 1) * 1000, 3),
+            "max_ms": round(self.max_time * 1000, 3),
+            "p50_ms": self.percentile_ms(0.50),
+            "p95_ms": self.percentile_ms(0.95),
+            "p99_ms": self.percentile_ms(0.99),
+            "histogram_ms": {
+                **{f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                "inf": self.buckets[-1]
+            }
+        }
+
+class QueryStatsCollector:
+    """Сбор статистики по событиям before/after_cursor_execute движка"""
+
+    MAX_FINGERPRINTS = 2000  # защита от неограниченного роста при динамическом SQL
+    MAX_STATEMENT_LENGTH = 2000
+
+    def __init__(self, slow_query_threshold: float = 1.0, slow_query_log_size: int = 100,
+                 explain_slow_queries: bool = False):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self._statements: Dict[str, _StatementStats] = {}
+        self._slow_queries = deque(maxlen=slow_query_log_size)
+        # Медленные SELECT, ожидающие EXPLAIN: исходные параметры держим только до разбора плана
+        self._explain_queue = deque(maxlen=slow_query_log_size)
+        self._lock = threading.Lock()
+        self.query_count = 0
+        self.slow_query_count = 0
+        self.error_count = 0
+        self.total_query_time = 0.0
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start_time = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start_time = getattr(context, "_query_start_time", None)
+        if start_time is None:
+            return
+        duration = time.perf_counter() - start_time
+        fingerprint = fingerprint_statement(statement)
+        rows = _cursor_row_count(cursor)
+
+        with self._lock:
+            self.query_count += 1
+            self.total_query_time += duration
+            self._stats_for(fingerprint).record(duration, rows)
+
+            if duration >= self.slow_query_threshold:
+                self.slow_query_count += 1
+                entry = {
+                    "fingerprint": fingerprint,
+                    "statement": statement[:self.MAX_STATEMENT_LENGTH],
+                    "parameters": redact_parameters(parameters),
+                    "duration_ms": round(duration * 1000, 3),
+                    "rows": rows,
+                    "executemany": executemany,
+                    "timestamp": time.time(),
+                    "plan": None
+                }
+                self._slow_queries.append(entry)
+                if self.explain_slow_queries and not executemany and fingerprint.lower().startswith("select"):
+                    self._explain_queue.append((entry, statement, parameters))
+
+    def handle_error(self, exception_context):
+        """Ошибка выполнения: учитываем в счетчиках отпечатка"""
+        statement = exception_context.statement
+        if not statement:
+            return
+        with self._lock:
+            self.error_count += 1
+            self._stats_for(fingerprint_statement(statement)).errors += 1
+
+    def _stats_for(self, fingerprint: str) -> _StatementStats:
+        stats = self._statements.get(fingerprint)
+        if stats is None:
+            if len(self._statements) >= self.MAX_FINGERPRINTS:
+                fingerprint = "<other>"
+                stats = self._statements.get(fingerprint)
+            if stats is None:
+                stats = self._statements[fingerprint] = _StatementStats()
+        return stats
+
+    def pop_explain_candidates(self) -> List[Tuple[Dict[str, Any], str, Any]]:
+        """Забрать накопленные запросы для EXPLAIN"""
+        with self._lock:
+            candidates = list(self._explain_queue)
+            self._explain_queue.clear()
+        return candidates
+
+    def get_statement_stats(self, limit: int = 50, order_by: str = "total_time") -> List[Dict[str, Any]]:
+        """Отпечатки запросов, отсортированные по суммарному времени, числу или p95"""
+        with self._lock:
+            items = list(self._statements.items())
+        sort_keys = {
+            "total_time": lambda item: item[1].total_time,
+            "count": lambda item: item[1].count,
+            "p95": lambda item: item[1].percentile_ms(0.95),
+            "max": lambda item: item[1].max_time
+        }
+        items.sort(key=sort_keys.get(order_by, sort_keys["total_time"]), reverse=True)
+        return [{"fingerprint": fingerprint, **stats.to_dict()} for fingerprint, stats in items[:limit]]
+
+    def get_slow_queries(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Последние медленные запросы, новые первыми"""
+        with self._lock:
+            entries = list(self._slow_queries)
+        return [dict(entry) for entry in reversed(entries)][:limit]
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "query_count": self.query_count,
+            "slow_queries": self.slow_query_count,
+            "query_errors": self.error_count,
+            "total_query_time": self.total_query_time,
+            "avg_query_time": self.total_query_time / max(self.query_count, 1),
+            "fingerprints": len(self._statements),
+            "slow_query_threshold": self.slow_query_threshold
+        }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow_queries.clear()
+            self._explain_queue.clear()
+            self.query_count = 0
+            self.slow_query_count = 0
+            self.error_count = 0
+            self.total_query_time = 0.0
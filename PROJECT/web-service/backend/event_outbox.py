@@ -0,0 +1,614 @@
+"""
+Поток событий PayGo после фиксации транзакций
+События пишутся в таблицу event_outbox в той же транзакции, что и изменение,
+ретранслятор публикует их по порядку id в поток (в памяти или Redis Streams),
+потребители обрабатывают их асинхронно и сохраняют свою позицию в
+event_consumer_offsets: доставка хотя бы один раз, отставание на потребителя
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, Iterable
+
+from sqlalchemy import DateTime, bindparam, delete, func, or_, select, update
+
+logger = logging.getLogger(__name__)
+
+# Времен доставки на потребителя для перцентилей
+LATENCY_SAMPLES = 1000
+
+# Строка event_pipeline_leases ведущего процесса
+LEASE_NAME = "event_pipeline"
+
+# Позиции воркеров в event_consumer_offsets; воркер без отметки дольше
+# WORKER_STALE_LEASES сроков аренды считается остановленным
+WORKER_PREFIX = "worker:"
+WORKER_STALE_LEASES = 2
+
+class Event:
+    """Событие потока; id - номер строки event_outbox"""
+
+    __slots__ = ("id", "type", "aggregate_id", "user_id", "payload", "created_at")
+
+    def __init__(self, event_id: int, event_type: str, aggregate_id: Optional[str], user_id: Optional[int],
+                 payload: Dict[str, Any], created_at: datetime):
+        self.id = event_id
+        self.type = event_type
+        self.aggregate_id = aggregate_id
+        self.user_id = user_id
+        self.payload = payload
+        self.created_at = created_at
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "id": self.id, "type": self.type, "aggregate_id": self.aggregate_id, "user_id": self.user_id,
+            "payload": self.payload, "created_at": self.created_at.isoformat()
+        }, ensure_ascii=False, default=str)
+
+    @classmethod
+    def from_json(cls, data: str) -> "Event":
+        item = json.loads(data)
+        return cls(item["id"], item["type"], item["aggregate_id"], item["user_id"], item["payload"],
+                   datetime.fromisoformat(item["created_at"]))
+
+def add_event(session, event_type: str, payload: Dict[str, Any], aggregate_id: Optional[str] = None,
+              user_id: Optional[int] = None):
+    """Событие в текущей транзакции session: попадет в поток, только если транзакция зафиксирована"""
+    from database import OutboxEvent
+    session.add(OutboxEvent(
+        event_type=event_type, aggregate_id=aggregate_id, user_id=user_id,
+        payload=payload, created_at=datetime.utcnow()
+    ))
+
+class LocalEventStream:
+    """Одна копия приложения: опубликованные события в памяти до подтверждения всеми потребителями"""
+
+    # Поток в памяти процесса: каждый воркер ретранслирует outbox в свой поток
+    shared = False
+
+    def __init__(self):
+        self._events: List[Event] = []
+        self._published = asyncio.Condition()
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def last_id(self) -> int:
+        return self._events[-1].id if self._events else 0
+
+    async def publish(self, events: List[Event]):
+        for event in events:
+            if not self._events or event.id > self._events[-1].id:
+                self._events.append(event)
+                continue
+            # Новый ведущий публикует заново с позиции постоянных потребителей
+            index = bisect.bisect_left(self._events, event.id, key=lambda item: item.id)
+            if index == len(self._events) or self._events[index].id != event.id:
+                self._events.insert(index, event)
+        async with self._published:
+            self._published.notify_all()
+
+    async def read(self, after_id: int, count: int, timeout: float) -> List[Event]:
+        """События после after_id; ждет новых не дольше timeout"""
+        start = bisect.bisect_right(self._events, after_id, key=lambda event: event.id)
+        if start == len(self._events):
+            async with self._published:
+                start = bisect.bisect_right(self._events, after_id, key=lambda event: event.id)
+                if start == len(self._events):
+                    try:
+                        await asyncio.wait_for(self._published.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        return []
+                    start = bisect.bisect_right(self._events, after_id, key=lambda event: event.id)
+        return self._events[start:start + count]
+
+    async def trim(self, position: int):
+        """Удаление событий, обработанных всеми потребителями"""
+        del self._events[:bisect.bisect_right(self._events, position, key=lambda event: event.id)]
+
+class RedisEventStream:
+    """Несколько копий приложения: Redis Stream, id записи потока - {id события}-0"""
+
+    # Общий поток: его читают все процессы, публикует только ведущий
+    shared = True
+
+    def __init__(self, redis_url: str, key: str = "paygo:events"):
+        self.redis_url = redis_url
+        self.key = key
+        self.redis = None
+
+    async def connect(self):
+        import aioredis
+        self.redis = aioredis.from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        await self.redis.ping()
+
+    async def close(self):
+        if self.redis:
+            await self.redis.close()
+
+    async def last_id(self) -> int:
+        items = await self.redis.xrevrange(self.key, count=1)
+        return int(items[0][0].split("-")[0]) if items else 0
+
+    async def publish(self, events: List[Event]):
+        last_id = await self.last_id()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for event in events:
+                if event.id > last_id:
+                    pipe.xadd(self.key, {"event": event.to_json()}, id=f"{event.id}-0")
+            # Событие уже опубликовано другой копией - ошибка XADD с меньшим id пропускается
+            await pipe.execute(raise_on_error=False)
+
+    async def read(self, after_id: int, count: int, timeout: float) -> List[Event]:
+        result = await self.redis.xread({self.key: f"{after_id}-0"}, count=count, block=int(timeout * 1000))
+        return [Event.from_json(fields["event"]) for _, items in result for _, fields in items]
+
+    async def trim(self, position: int):
+        await self.redis.xtrim(self.key, minid=f"{position + 1}-0", approximate=False)
+
+class EventConsumer:
+    """Потребитель: handler(события) вызывается порциями до batch_size событий типов event_types.
+
+    durable=False - состояние потребителя восстанавливается из БД при
+    запуске (например, счетчики в памяти), поэтому после перезапуска он
+    читает только новые события и не хранит позицию. Такой потребитель
+    работает в каждом процессе, постоянный - только в ведущем.
+    """
+
+    def __init__(self, name: str, handler: Callable[[List[Event]], Awaitable[Any]],
+                 event_types: Optional[Iterable[str]] = None, batch_size: int = 200, durable: bool = True):
+        self.name = name
+        self.handler = handler
+        self.event_types = set(event_types) if event_types is not None else None
+        self.batch_size = batch_size
+        self.durable = durable
+        self.position = 0
+        self.latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self.stats = {"processed": 0, "skipped": 0, "batches": 0, "errors": 0, "redelivered": 0}
+
+class EventPipeline:
+    """Ретранслятор event_outbox -> поток и потребители потока.
+
+    Ретранслятор читает строки с id больше опубликованного по relay_batch
+    и публикует их по порядку. Номера id выдаются до фиксации, поэтому
+    пропуск в номерах может быть еще не зафиксированной транзакцией:
+    ретранслятор ждет его gap_timeout секунд и только потом идет дальше
+    (номер, занятый откатившейся транзакцией). Потребитель сохраняет позицию
+    после обработки порции, ошибка обработчика повторяет ту же порцию, а после
+    перезапуска события с позиции доставляются снова - обработчики должны
+    переносить повтор. Строки outbox, обработанные всеми постоянными
+    потребителями, удаляются раз в cleanup_interval.
+
+    Из воркеров с общей БД ведущий - владелец аренды в event_pipeline_leases
+    на lease секунд: только он публикует в общий поток, ведет постоянных
+    потребителей и удаляет строки outbox. Потребители без позиции работают в
+    каждом воркере: с общим потоком читают его, с потоком в памяти воркер
+    сам ретранслирует outbox в свой поток. Каждый воркер при продлении аренды
+    записывает наименьшую позицию таких потребителей в event_consumer_offsets
+    (worker:...), и ведущий удаляет только строки, прочитанные всеми
+    постоянными потребителями и всеми воркерами, отметившимися за последние
+    WORKER_STALE_LEASES аренды. Сроки аренды и отметок считаются по часам БД.
+    """
+
+    def __init__(self, stream, session_factory, models_provider, consumers_provider=None,
+                 relay_batch: int = 500, poll_interval: float = 0.5, gap_timeout: float = 5.0,
+                 retry_delay: float = 1.0, cleanup_interval: float = 60.0, lease: float = 15.0):
+        # models_provider() - (OutboxEvent, EventConsumerOffset, EventPipelineLease),
+        # consumers_provider() - потребители, регистрируемые при запуске
+        self.stream = stream
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        self._consumers_provider = consumers_provider
+        self.relay_batch = relay_batch
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        self.retry_delay = retry_delay
+        self.cleanup_interval = cleanup_interval
+        self.lease = lease
+        worker_id = uuid.uuid4().hex[:8]
+        self.owner = f"{socket.gethostname()[:40]}:{os.getpid()}:{worker_id}"
+        # Строка позиции воркера в event_consumer_offsets
+        self.worker_key = WORKER_PREFIX + worker_id
+        self.leader = False
+        self._lease_until = 0.0
+        self.consumers: Dict[str, EventConsumer] = {}
+        self._published = 0
+        # (номер, с какого момента ждем) - первый пропуск в номерах outbox
+        self._gap: Optional[Tuple[int, float]] = None
+        # (id, created_at) опубликованных событий для отставания по времени
+        self._recent: List[Tuple[int, datetime]] = []
+        self._relay_lock = asyncio.Lock()
+        self._relay_wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        # Задачи ведущего: постоянные потребители и ретранслятор общего потока
+        self._leader_tasks: List[asyncio.Task] = []
+        self.stats = {"published": 0, "relay_batches": 0, "gaps_skipped": 0, "outbox_deleted": 0, "leader_changes": 0}
+
+    def register(self, consumer: EventConsumer):
+        self.consumers[consumer.name] = consumer
+
+    def notify(self):
+        """Подсказка ретранслятору после COMMIT с событиями: не ждать poll_interval"""
+        self._relay_wakeup.set()
+
+    async def start(self):
+        if self._tasks:
+            return
+        if self._consumers_provider is not None and not self.consumers:
+            for consumer in self._consumers_provider():
+                self.register(consumer)
+        await self.stream.connect()
+        OutboxEvent = self._models_provider()[0]
+        async with self._session_factory() as session:
+            head = await session.scalar(select(func.max(OutboxEvent.id))) or 0
+        for consumer in self.consumers.values():
+            if not consumer.durable:
+                consumer.position = head
+        self._published = head
+        try:
+            await self._report_position()
+            await self._elect()
+        except Exception as e:
+            logger.error(f"Ошибка аренды конвейера событий: {e}")
+        self._tasks = [asyncio.create_task(self._lease_loop())]
+        if not self.stream.shared:
+            self._tasks.append(asyncio.create_task(self._relay_loop()))
+        self._tasks.extend(
+            asyncio.create_task(self._consume_loop(consumer))
+            for consumer in self.consumers.values() if not consumer.durable
+        )
+
+    async def stop(self):
+        await self._cancel(self._tasks)
+        self._tasks = []
+        if self.leader:
+            await self._follow()
+        try:
+            await self._release()
+        except Exception as e:
+            logger.error(f"Ошибка аренды конвейера событий: {e}")
+        await self.stream.close()
+
+    @staticmethod
+    async def _cancel(tasks: List[asyncio.Task]):
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    # Ведущий процесс
+
+    async def _elect(self):
+        """Захват или продление аренды; смена роли процесса"""
+        deadline = time.monotonic() + self.lease
+        if await self._acquire():
+            self._lease_until = deadline
+            if not self.leader:
+                await self._lead()
+        elif self.leader:
+            logger.warning("Аренда конвейера событий перешла другому процессу")
+            await self._follow()
+
+    async def _acquire(self) -> bool:
+        """True - аренда у этого процесса: свободная, истекшая или своя продлена"""
+        _, _, EventPipelineLease = self._models_provider()
+        async with self._session_factory() as session:
+            # Срок по часам БД: при расхождении часов воркеров аренду не получат двое
+            dialect_name = session.get_bind().dialect.name
+            values = {"owner": self.owner, "expires_at": _db_now(dialect_name, self.lease)}
+            result = await session.execute(
+                update(EventPipelineLease)
+                .where(EventPipelineLease.name == LEASE_NAME,
+                       or_(EventPipelineLease.owner == self.owner, EventPipelineLease.expires_at < _db_now(dialect_name)))
+                .values(**values)
+            )
+            acquired = result.rowcount == 1
+            if not acquired:
+                result = await session.execute(
+                    _insert(session.get_bind().dialect.name)(EventPipelineLease)
+                    .values(name=LEASE_NAME, **values).on_conflict_do_nothing(index_elements=[EventPipelineLease.name])
+                )
+                acquired = result.rowcount == 1
+            await session.commit()
+        return acquired
+
+    async def _release(self):
+        """Аренда и позиция остановленного процесса сразу не задерживают другие"""
+        _, EventConsumerOffset, EventPipelineLease = self._models_provider()
+        async with self._session_factory() as session:
+            await session.execute(
+                delete(EventPipelineLease)
+                .where(EventPipelineLease.name == LEASE_NAME, EventPipelineLease.owner == self.owner)
+            )
+            await session.execute(delete(EventConsumerOffset).where(EventConsumerOffset.consumer == self.worker_key))
+            await session.commit()
+
+    async def _report_position(self):
+        """Наименьшая позиция потребителей без позиции этого воркера: до нее ведущий может удалять outbox"""
+        positions = [consumer.position for consumer in self.consumers.values() if not consumer.durable]
+        if not positions:
+            return
+        EventConsumerOffset = self._models_provider()[1]
+        async with self._session_factory() as session:
+            await session.execute(
+                _upsert_offset(EventConsumerOffset, session.get_bind().dialect.name),
+                {"consumer": self.worker_key, "position": min(positions)}
+            )
+            await session.commit()
+
+    async def _lead(self):
+        """Постоянные потребители с сохраненных позиций; события после них публикуются снова"""
+        OutboxEvent, EventConsumerOffset, _ = self._models_provider()
+        async with self._session_factory() as session:
+            offsets = dict((await session.execute(
+                select(EventConsumerOffset.consumer, EventConsumerOffset.position)
+            )).all())
+            head = await session.scalar(select(func.max(OutboxEvent.id))) or 0
+        durable = [consumer for consumer in self.consumers.values() if consumer.durable]
+        for consumer in durable:
+            consumer.position = offsets.get(consumer.name, 0)
+        async with self._relay_lock:
+            # Воркер с потоком в памяти уже ретранслировал новые события для своих потребителей
+            positions = [consumer.position for consumer in durable] + ([] if self.stream.shared else [self._published])
+            self._published = min(positions, default=head)
+            del self._recent[bisect.bisect_right(self._recent, (self._published, datetime.max)):]
+        self.leader = True
+        self.stats["leader_changes"] += 1
+        self._leader_tasks = [asyncio.create_task(self._consume_loop(consumer)) for consumer in durable]
+        if self.stream.shared:
+            self._leader_tasks.append(asyncio.create_task(self._relay_loop()))
+        self._relay_wakeup.set()
+        logger.info(f"Конвейер событий: ведущий процесс {self.owner}")
+
+    async def _follow(self):
+        self.leader = False
+        await self._cancel(self._leader_tasks)
+        self._leader_tasks = []
+
+    async def _lease_loop(self):
+        # Аренда продлевается втрое чаще срока
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._report_position()
+                await self._elect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка аренды конвейера событий: {e}")
+                if self.leader and time.monotonic() >= self._lease_until:
+                    # Не продлили вовремя - аренду мог забрать другой процесс
+                    await self._follow()
+
+    # Ретранслятор
+
+    async def relay_once(self) -> int:
+        """Публикация следующей порции outbox; число опубликованных событий"""
+        async with self._relay_lock:
+            return await self._relay_batch()
+
+    async def _relay_batch(self) -> int:
+        OutboxEvent = self._models_provider()[0]
+        async with self._session_factory() as session:
+            rows = (await session.execute(
+                select(OutboxEvent).where(OutboxEvent.id > self._published)
+                .order_by(OutboxEvent.id).limit(self.relay_batch)
+            )).scalars().all()
+        events = []
+        expected = self._published + 1
+        for row in rows:
+            if row.id != expected:
+                now = time.monotonic()
+                if self._gap is None or self._gap[0] != expected:
+                    self._gap = (expected, now)
+                if now - self._gap[1] < self.gap_timeout:
+                    break
+                logger.warning(f"Пропуск номеров outbox {expected}..{row.id - 1} дольше {self.gap_timeout} с")
+                self.stats["gaps_skipped"] += row.id - expected
+            events.append(Event(row.id, row.event_type, row.aggregate_id, row.user_id, row.payload, row.created_at))
+            expected = row.id + 1
+        if not events:
+            return 0
+        await self.stream.publish(events)
+        self._published = events[-1].id
+        self._recent.extend((event.id, event.created_at) for event in events)
+        self.stats["published"] += len(events)
+        self.stats["relay_batches"] += 1
+        return len(events)
+
+    async def cleanup(self):
+        """Удаление строк outbox и событий потока, обработанных всеми потребителями"""
+        position = min((consumer.position for consumer in self.consumers.values()), default=self._published)
+        # Строки outbox и общий поток чистит только ведущий: у остальных позиции постоянных потребителей устарели
+        if self.leader:
+            floor = await self._committed_floor()
+            if floor:
+                OutboxEvent = self._models_provider()[0]
+                async with self._session_factory() as session:
+                    result = await session.execute(delete(OutboxEvent).where(OutboxEvent.id <= floor))
+                    await session.commit()
+                self.stats["outbox_deleted"] += result.rowcount
+            if self.stream.shared:
+                position = min(position, floor)
+        elif self.stream.shared:
+            return
+        await self.stream.trim(position)
+        del self._recent[:bisect.bisect_right(self._recent, (position, datetime.max))]
+
+    async def _committed_floor(self) -> int:
+        """Наименьшая сохраненная позиция: постоянных потребителей и всех работающих воркеров"""
+        _, EventConsumerOffset, _ = self._models_provider()
+        durable = [consumer.name for consumer in self.consumers.values() if consumer.durable]
+        async with self._session_factory() as session:
+            dialect_name = session.get_bind().dialect.name
+            workers = EventConsumerOffset.consumer.like(WORKER_PREFIX + "%")
+            alive = EventConsumerOffset.updated_at >= _db_now(dialect_name, -self.lease * WORKER_STALE_LEASES)
+            committed = dict((await session.execute(
+                select(EventConsumerOffset.consumer, EventConsumerOffset.position)
+                .where(or_(EventConsumerOffset.consumer.in_(durable), workers & alive))
+            )).all())
+            # Потребитель без сохраненной позиции еще ничего не подтвердил
+            positions = [committed.pop(name, 0) for name in durable] + list(committed.values())
+            # Отметки остановленных аварийно воркеров больше не задерживают очистку
+            await session.execute(delete(EventConsumerOffset).where(workers, ~alive))
+            await session.commit()
+        return min(positions, default=self._published)
+
+    async def _relay_loop(self):
+        next_cleanup = time.monotonic() + self.cleanup_interval
+        while True:
+            try:
+                published = await self.relay_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка публикации событий outbox: {e}")
+                published = 0
+            if time.monotonic() >= next_cleanup:
+                next_cleanup = time.monotonic() + self.cleanup_interval
+                try:
+                    await self.cleanup()
+                except Exception as e:
+                    logger.error(f"Ошибка очистки outbox: {e}")
+            if published < self.relay_batch:
+                # Ждем подсказки после COMMIT, пропуск в номерах проверяется каждый тик
+                self._relay_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._relay_wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    # Потребители
+
+    async def _consume_loop(self, consumer: EventConsumer):
+        while True:
+            try:
+                events = await self.stream.read(consumer.position, consumer.batch_size, self.poll_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка чтения потока событий ({consumer.name}): {e}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+            if not events:
+                continue
+            selected = [event for event in events if consumer.event_types is None or event.type in consumer.event_types]
+            attempt = 0
+            while selected:
+                try:
+                    await consumer.handler(selected)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    attempt += 1
+                    consumer.stats["errors"] += 1
+                    consumer.stats["redelivered"] += len(selected)
+                    logger.error(f"Ошибка обработки событий ({consumer.name}), попытка {attempt}: {e}")
+                    await asyncio.sleep(min(self.retry_delay * 2 ** (attempt - 1), 30.0))
+            now = datetime.utcnow()
+            consumer.latencies.extend((now - event.created_at).total_seconds() for event in selected)
+            consumer.stats["processed"] += len(selected)
+            consumer.stats["skipped"] += len(events) - len(selected)
+            consumer.stats["batches"] += 1
+            consumer.position = events[-1].id
+            if consumer.durable:
+                try:
+                    await self._commit_offset(consumer)
+                except Exception as e:
+                    # Позиция сохранится со следующей порцией
+                    logger.error(f"Ошибка сохранения позиции потребителя {consumer.name}: {e}")
+
+    async def _commit_offset(self, consumer: EventConsumer):
+        EventConsumerOffset = self._models_provider()[1]
+        async with self._session_factory() as session:
+            await session.execute(
+                _upsert_offset(EventConsumerOffset, session.get_bind().dialect.name),
+                {"consumer": consumer.name, "position": consumer.position}
+            )
+            await session.commit()
+
+    def consumer_lag(self, consumer: EventConsumer) -> Dict[str, Any]:
+        """Отставание: опубликованных, но не обработанных событий и возраст самого старого из них"""
+        index = bisect.bisect_right(self._recent, (consumer.position, datetime.max))
+        oldest = self._recent[index][1] if index < len(self._recent) else None
+        return {
+            "lag_events": max(self._published - consumer.position, 0),
+            "lag_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        consumers = {}
+        for name, consumer in self.consumers.items():
+            latencies = sorted(consumer.latencies)
+            consumers[name] = {
+                **consumer.stats,
+                "position": consumer.position,
+                **self.consumer_lag(consumer),
+                "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+                "latency_p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 1) if latencies else 0.0
+            }
+        return {**self.stats, "leader": self.leader, "published_position": self._published, "consumers": consumers}
+
+def _insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def _db_now(dialect_name: str, offset: float = 0.0):
+    """Текущее время БД в UTC (без часового пояса), сдвинутое на offset секунд"""
+    if dialect_name == "postgresql":
+        now = func.timezone("UTC", func.now(), type_=DateTime)
+        return now + timedelta(seconds=offset) if offset else now
+    # SQLite: тот же формат, что у DateTime SQLAlchemy, строки сравниваются по порядку времени
+    return func.strftime("%Y-%m-%d %H:%M:%f", "now", f"{offset:+.3f} seconds")
+
+def _upsert_offset(EventConsumerOffset, dialect_name: str):
+    statement = _insert(dialect_name)(EventConsumerOffset).values(
+        consumer=bindparam("consumer"), position=bindparam("position"), updated_at=_db_now(dialect_name)
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[EventConsumerOffset.consumer],
+        set_={"position": statement.excluded.position, "updated_at": statement.excluded.updated_at}
+    )
+
+def _event_stream():
+    # Без Redis поток работает в пределах одной копии приложения
+    redis_url = os.getenv("EVENT_STREAM_REDIS_URL")
+    return RedisEventStream(redis_url) if redis_url else LocalEventStream()
+
+def _session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session()
+
+def _outbox_models():
+    from database import OutboxEvent, EventConsumerOffset, EventPipelineLease
+    return OutboxEvent, EventConsumerOffset, EventPipelineLease
+
+def _payment_consumers():
+    # Постоянных потребителей ведет ведущий процесс, выбирать их по копиям не нужно
+    from payment_events import payment_consumers
+    return payment_consumers()
+
+# Глобальный конвейер событий
+event_pipeline = EventPipeline(
+    _event_stream(), _session, _outbox_models, _payment_consumers,
+    poll_interval=float(os.getenv("EVENT_OUTBOX_POLL_INTERVAL", "0.5")),
+    gap_timeout=float(os.getenv("EVENT_OUTBOX_GAP_TIMEOUT", "5"))
+)
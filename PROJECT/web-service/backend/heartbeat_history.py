@@ -0,0 +1,339 @@
+"""
+История heartbeat терминалов PayGo
+Бит на каждый интервал heartbeat за сутки, запись в базу пачками,
+аптайм, список простоев и доступность парка за произвольное окно
+"""
+
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+import numpy as np
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+# Число установленных битов в каждом значении байта
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+
+def _epoch(value: datetime) -> float:
+    # Время в базе хранится в UTC без часового пояса
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+class HeartbeatHistory:
+    """Битовые карты heartbeat по дням: строка (терминал, день) занимает 2 x 180 байт при интервале 60 с.
+
+    Heartbeat отмечается в памяти, фоновая задача сливает накопленные дни
+    в базу пачкой (OR с уже записанными битами). Чтения объединяют данные
+    базы с еще не записанными.
+    """
+
+    def __init__(self, session_factory, models_provider, interval: int = 60, flush_interval: float = 30.0):
+        # session_factory() - асинхронный контекстный менеджер сессии,
+        # models_provider() - модель TerminalHeartbeatDay
+        if 86400 % interval:
+            raise ValueError("Интервал heartbeat должен делить сутки без остатка")
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        self.interval = interval
+        self.slots_per_day = 86400 // interval
+        self.day_bytes = (self.slots_per_day + 7) // 8
+        self.flush_interval = flush_interval
+        # (terminal_id, день) -> (up_bits, error_bits), еще не записанные в базу
+        self._pending: Dict[Tuple[int, date], Tuple[bytearray, bytearray]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "flushes": 0, "rows_written": 0}
+
+    # Запись
+
+    def record(self, terminal_id: int, at: Optional[datetime] = None, status: str = "online"):
+        """Отметка heartbeat в интервале, куда попадает время at"""
+        at = at or datetime.utcnow()
+        slot = int(_epoch(at) % 86400) // self.interval
+        key = (terminal_id, at.date())
+        bits = self._pending.get(key)
+        if bits is None:
+            bits = self._pending[key] = (bytearray(self.day_bytes), bytearray(self.day_bytes))
+        # Статус error отмечается отдельно, терминал при этом на связи
+        for target in (bits[0], bits[1]) if getattr(status, "value", status) == "error" else (bits[0],):
+            target[slot >> 3] |= 0x80 >> (slot & 7)
+        self.stats["recorded"] += 1
+
+    async def flush(self) -> int:
+        """Запись накопленных дней в базу одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            HeartbeatDay = self._models_provider()
+            try:
+                async with self._session_factory() as session:
+                    dialect_name = session.get_bind().dialect.name
+                    # SELECT ... FOR UPDATE не блокирует еще не существующие строки: два
+                    # процесса, впервые пишущие день, заменили бы биты друг друга. Пустые
+                    # строки создаются заранее, дальше OR идет под блокировкой строк
+                    empty = bytes(self.day_bytes)
+                    await session.execute(_insert_missing(HeartbeatDay, dialect_name), [
+                        {"terminal_id": terminal_id, "day": day, "up_bits": empty, "error_bits": empty}
+                        for terminal_id, day in sorted(pending)
+                    ])
+                    existing = await self._fetch(
+                        session, HeartbeatDay, {terminal_id for terminal_id, _ in pending},
+                        sorted({day for _, day in pending}), lock=True
+                    )
+                    rows = []
+                    for key, (up_bits, error_bits) in pending.items():
+                        stored = existing.get(key)
+                        if stored:
+                            up_bits = _or_bytes(up_bits, stored[0])
+                            error_bits = _or_bytes(error_bits, stored[1])
+                        rows.append({"terminal_id": key[0], "day": key[1],
+                                     "up_bits": bytes(up_bits), "error_bits": bytes(error_bits)})
+                    await session.execute(_upsert(HeartbeatDay, dialect_name), rows)
+                    await session.commit()
+            except Exception:
+                # Отметки возвращаются в буфер и попадут в следующую запись
+                for key, bits in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = bits if current is None else (
+                        _or_bytes(current[0], bits[0]), _or_bytes(current[1], bits[1])
+                    )
+                raise
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(rows)
+            return len(rows)
+
+    # Чтение
+
+    async def _fetch(self, session, HeartbeatDay, terminal_ids: Optional[Iterable[int]],
+                     days: List[date], lock: bool = False) -> Dict[Tuple[int, date], Tuple[bytes, bytes]]:
+        query = select(HeartbeatDay.terminal_id, HeartbeatDay.day, HeartbeatDay.up_bits, HeartbeatDay.error_bits).where(
+            HeartbeatDay.day.in_(days)
+        )
+        if terminal_ids is not None:
+            query = query.where(HeartbeatDay.terminal_id.in_(list(terminal_ids)))
+        if lock:
+            query = query.with_for_update()
+        result = await session.execute(query)
+        return {(terminal_id, day): (up_bits, error_bits) for terminal_id, day, up_bits, error_bits in result}
+
+    async def _load(self, terminal_ids: Optional[Iterable[int]], days: List[date]):
+        """Строки за указанные дни вместе с еще не записанными отметками"""
+        HeartbeatDay = self._models_provider()
+        async with self._session_factory() as session:
+            loaded = await self._fetch(session, HeartbeatDay, terminal_ids, days)
+        wanted = set(terminal_ids) if terminal_ids is not None else None
+        days = set(days)
+        for (terminal_id, day), bits in list(self._pending.items()):
+            if day in days and (wanted is None or terminal_id in wanted):
+                stored = loaded.get((terminal_id, day))
+                loaded[(terminal_id, day)] = bits if stored is None else (
+                    _or_bytes(stored[0], bits[0]), _or_bytes(stored[1], bits[1])
+                )
+        return loaded
+
+    def _window(self, start: datetime, end: Optional[datetime]) -> Tuple[int, int]:
+        """Окно в номерах интервалов от начала эпохи, будущее не учитывается"""
+        now = datetime.utcnow()
+        end = min(end or now, now)
+        start_slot = int(_epoch(start)) // self.interval
+        end_slot = -(-int(_epoch(end)) // self.interval)
+        return start_slot, max(end_slot, start_slot)
+
+    def _day_range(self, day: date, start_slot: int, end_slot: int) -> Tuple[int, int]:
+        """Интервалы дня, попадающие в окно"""
+        day_slot = int(_epoch(_day_start(day))) // self.interval
+        return max(start_slot - day_slot, 0), min(end_slot - day_slot, self.slots_per_day)
+
+    def _slot_time(self, slot: int) -> datetime:
+        return datetime.utcfromtimestamp(slot * self.interval)
+
+    async def terminal_uptime(self, terminal_id: int, start: datetime, end: Optional[datetime] = None) -> Dict[str, Any]:
+        """Аптайм, интервалы в статусе error и простои терминала за окно"""
+        start_slot, end_slot = self._window(start, end)
+        first_day = self._slot_time(start_slot).date()
+        last_day = self._slot_time(max(end_slot - 1, start_slot)).date()
+        days = await self._load([terminal_id], _days_between(first_day, last_day))
+
+        # Биты окна подряд: по одному дню, отсутствующий день - нули
+        up = np.zeros(end_slot - start_slot, dtype=bool)
+        errors = np.zeros(end_slot - start_slot, dtype=bool)
+        day = first_day
+        while day <= last_day:
+            bits = days.get((terminal_id, day))
+            if bits:
+                lo, hi = self._day_range(day, start_slot, end_slot)
+                offset = int(_epoch(_day_start(day))) // self.interval - start_slot
+                up[offset + lo:offset + hi] = _unpack(bits[0], self.slots_per_day)[lo:hi]
+                errors[offset + lo:offset + hi] = _unpack(bits[1], self.slots_per_day)[lo:hi]
+            day += timedelta(days=1)
+
+        # Простои - серии интервалов без heartbeat
+        edges = np.flatnonzero(np.diff(np.concatenate(([1], up.view(np.int8), [1]))))
+        outages = [
+            {
+                "start": self._slot_time(start_slot + int(begin)).isoformat(),
+                "end": self._slot_time(start_slot + int(finish)).isoformat(),
+                "minutes": (int(finish) - int(begin)) * self.interval / 60
+            }
+            for begin, finish in zip(edges[::2], edges[1::2])
+        ]
+        total_slots = len(up)
+        up_slots = int(up.sum())
+        return {
+            "terminal_id": terminal_id,
+            "period_start": self._slot_time(start_slot).isoformat(),
+            "period_end": self._slot_time(end_slot).isoformat(),
+            "interval_seconds": self.interval,
+            "total_slots": total_slots,
+            "up_slots": up_slots,
+            "error_slots": int(errors.sum()),
+            "uptime_percentage": up_slots / total_slots * 100 if total_slots else 0.0,
+            "outages": outages
+        }
+
+    async def fleet_availability(self, start: datetime, end: Optional[datetime] = None,
+                                 terminal_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+        """Доступность парка и каждого терминала за окно.
+
+        Без списка terminal_ids учитываются терминалы с историей в окне.
+        """
+        start_slot, end_slot = self._window(start, end)
+        first_day = self._slot_time(start_slot).date()
+        last_day = self._slot_time(max(end_slot - 1, start_slot)).date()
+        total_slots = end_slot - start_slot
+
+        # Крайние дни окна и дни с еще не записанными отметками читаются с ключом
+        # (терминал, день), остальные - только (терминал, up_bits) и считаются целиком
+        keyed_days = {first_day, last_day} | {
+            day for _, day in self._pending if first_day <= day <= last_day
+        }
+        keyed = await self._load(terminal_ids, sorted(keyed_days))
+        HeartbeatDay = self._models_provider()
+        query = select(HeartbeatDay.terminal_id, HeartbeatDay.up_bits).where(
+            HeartbeatDay.day >= first_day, HeartbeatDay.day <= last_day, HeartbeatDay.day.notin_(keyed_days)
+        )
+        if terminal_ids is not None:
+            query = query.where(HeartbeatDay.terminal_id.in_(list(terminal_ids)))
+        async with self._session_factory() as session:
+            # Выполнение на уровне соединения, без построчной обработки ORM
+            connection = await session.connection()
+            full_days = (await connection.execute(query)).all()
+
+        row_terminals = np.fromiter(
+            [terminal_id for terminal_id, _ in full_days] + [terminal_id for terminal_id, _ in keyed],
+            dtype=np.int64, count=len(full_days) + len(keyed)
+        )
+        counts = np.zeros(len(row_terminals), dtype=np.int64)
+        if full_days:
+            matrix = np.frombuffer(b"".join(up_bits for _, up_bits in full_days), dtype=np.uint8)
+            counts[:len(full_days)] = _POPCOUNT[matrix.reshape(len(full_days), self.day_bytes)].sum(axis=1, dtype=np.int64)
+        if keyed:
+            # Крайние дни - по маске интервалов, попадающих в окно
+            keyed_matrix = np.unpackbits(np.frombuffer(
+                b"".join(bits[0] for bits in keyed.values()), dtype=np.uint8
+            ).reshape(len(keyed), self.day_bytes), axis=1)
+            row_days = np.array([day.toordinal() for _, day in keyed], dtype=np.int64)
+            for day in keyed_days:
+                day_rows = np.flatnonzero(row_days == day.toordinal())
+                lo, hi = self._day_range(day, start_slot, end_slot)
+                counts[len(full_days) + day_rows] = keyed_matrix[day_rows, lo:hi].sum(axis=1)
+
+        terminals, rows = np.unique(
+            np.concatenate([np.array(sorted(set(terminal_ids)), dtype=np.int64), row_terminals])
+            if terminal_ids is not None else row_terminals,
+            return_inverse=True
+        )
+        up_slots = np.zeros(len(terminals), dtype=np.int64)
+        np.add.at(up_slots, rows[len(rows) - len(counts):], counts)
+
+        return {
+            "period_start": self._slot_time(start_slot).isoformat(),
+            "period_end": self._slot_time(end_slot).isoformat(),
+            "terminals": len(terminals),
+            "availability_percentage": float(up_slots.sum()) / (total_slots * len(terminals)) * 100
+            if total_slots and len(terminals) else 0.0,
+            "per_terminal": dict(zip(terminals.tolist(), (up_slots / max(total_slots, 1) * 100).tolist()))
+        }
+
+    # Фоновая запись
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Heartbeat history flush failed: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Heartbeat history flush failed: {e}")
+
+def _or_bytes(left, right) -> bytearray:
+    return bytearray((int.from_bytes(left, "big") | int.from_bytes(right, "big")).to_bytes(len(left), "big"))
+
+def _days_between(first_day: date, last_day: date) -> List[date]:
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+def _unpack(bits: bytes, slots: int) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(bits, dtype=np.uint8))[:slots].astype(bool)
+
+def _insert(HeartbeatDay, dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(HeartbeatDay)
+
+def _insert_missing(HeartbeatDay, dialect_name: str):
+    """INSERT строк, которых еще нет; существующие не меняются"""
+    return _insert(HeartbeatDay, dialect_name).on_conflict_do_nothing(
+        index_elements=[HeartbeatDay.terminal_id, HeartbeatDay.day]
+    )
+
+def _upsert(HeartbeatDay, dialect_name: str):
+    """INSERT с заменой битов существующей строки (значения уже объединены)"""
+    statement = _insert(HeartbeatDay, dialect_name)
+    return statement.on_conflict_do_update(
+        index_elements=[HeartbeatDay.terminal_id, HeartbeatDay.day],
+        set_={"up_bits": statement.excluded.up_bits, "error_bits": statement.excluded.error_bits,
+              "updated_at": datetime.utcnow()}
+    )
+
+def _heartbeat_day_model():
+    from database import TerminalHeartbeatDay
+    return TerminalHeartbeatDay
+
+def _session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session()
+
+# Глобальный экземпляр истории heartbeat
+heartbeat_history = HeartbeatHistory(
+    _session,
+    _heartbeat_day_model,
+    interval=int(os.getenv("TERMINAL_HEARTBEAT_INTERVAL", "60")),
+    flush_interval=float(os.getenv("TERMINAL_HEARTBEAT_FLUSH_INTERVAL", "30"))
+)
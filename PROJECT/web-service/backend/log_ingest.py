@@ -0,0 +1,298 @@
+"""
+Прием логов терминалов PayGo
+Пакеты NDJSON в gzip/zstd разбираются потоково по мере чтения тела запроса,
+строки ставятся в ограниченную очередь и копируются в terminal_logs порциями
+через COPY фоновыми писателями; при заполненной очереди - отказ с Retry-After
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+LOG_COLUMNS = ["terminal_id", "level", "message", "component", "additional_data", "created_at"]
+
+class IngestBusy(Exception):
+    """Очередь записи заполнена; строки пакета до resume_from уже приняты"""
+
+    def __init__(self, retry_after: int, resume_from: int = 0):
+        super().__init__(f"Очередь приема логов заполнена, повтор через {retry_after} с")
+        self.retry_after = retry_after
+        self.resume_from = resume_from
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+class BatchTooLarge(ValueError):
+    pass
+
+class _StreamDecoder:
+    """Потоковая распаковка gzip (в том числе склеенных файлов) и zstd с ограничением размера"""
+
+    def __init__(self, encoding: Optional[str], max_bytes: int):
+        self.encoding = (encoding or "identity").strip().lower()
+        self.max_bytes = max_bytes
+        self.output_bytes = 0
+        if self.encoding in ("gzip", "x-gzip"):
+            self._decompressor = self._gzip()
+        elif self.encoding == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise UnsupportedEncoding("Сжатие zstd не поддерживается сервером")
+            self._zstd = zstandard.ZstdDecompressor()
+            self._decompressor = self._zstd.decompressobj()
+        elif self.encoding == "identity":
+            self._decompressor = None
+        else:
+            raise UnsupportedEncoding(f"Неподдерживаемое сжатие: {encoding}")
+
+    @staticmethod
+    def _gzip():
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> bytes:
+        if self._decompressor is None:
+            output = data
+        elif self.encoding == "zstd":
+            output = self._decompressor.decompress(data)
+            while self._decompressor.eof and self._decompressor.unused_data:
+                # Следующий кадр zstd в том же потоке
+                data = self._decompressor.unused_data
+                self._decompressor = self._zstd.decompressobj()
+                output += self._decompressor.decompress(data)
+        else:
+            output = self._decompressor.decompress(data)
+            while self._decompressor.eof and self._decompressor.unused_data:
+                # Ротация логов на терминале склеивает gzip-файлы
+                data = self._decompressor.unused_data
+                self._decompressor = self._gzip()
+                output += self._decompressor.decompress(data)
+        self.output_bytes += len(output)
+        if self.output_bytes > self.max_bytes:
+            raise BatchTooLarge(f"Пакет логов больше {self.max_bytes} байт после распаковки")
+        return output
+
+def _timestamp(value, received_at: datetime) -> datetime:
+    # Время терминала: ISO 8601 или секунды Unix; хранится в UTC без часового пояса
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return received_at
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    return received_at
+
+def parse_line(line: bytes, terminal_pk: int, received_at: datetime) -> Optional[Tuple]:
+    """Строка NDJSON -> запись для COPY в порядке LOG_COLUMNS; None - строка не разобрана"""
+    try:
+        record = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(record, dict) or not isinstance(record.get("message"), str):
+        return None
+    level = str(record.get("level", "INFO")).upper()
+    if level not in LEVELS:
+        return None
+    additional_data = record.get("additional_data")
+    return (
+        terminal_pk, level, record["message"], record.get("component"),
+        additional_data if isinstance(additional_data, dict) else None,
+        _timestamp(record.get("timestamp"), received_at)
+    )
+
+class LogIngestor:
+    """Прием пакетов логов: разбор в обработчике запроса, запись фоновыми писателями.
+
+    Тело запроса читается и распаковывается порциями, строки разбираются
+    orjson и складываются в пачки по batch_lines. Пачки ждут в очереди из
+    queue_batches мест; писатели забирают несколько пачек сразу и пишут их
+    одним COPY. Если очередь полна до начала пакета - IngestBusy (HTTP 429)
+    без чтения тела; если она не освободилась за put_timeout посреди пакета -
+    IngestBusy с номером строки, с которой терминал досылает остаток.
+    """
+
+    def __init__(self, pool_provider, table_provider, batch_lines: int = 5000, queue_batches: int = 200,
+                 writers: int = 2, copy_rows: int = 50000, put_timeout: float = 5.0,
+                 max_batch_bytes: int = 128 * 1024 * 1024):
+        # pool_provider() - DatabaseConnectionPool с bulk_copy, table_provider() - модель TerminalLog
+        self._pool_provider = pool_provider
+        self._table_provider = table_provider
+        self.batch_lines = batch_lines
+        self.queue_batches = queue_batches
+        self.writers = writers
+        self.copy_rows = copy_rows
+        self.put_timeout = put_timeout
+        self.max_batch_bytes = max_batch_bytes
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._queued_rows = 0
+        # (время, строк) последних COPY для оценки скорости записи и Retry-After
+        self._recent_writes: deque = deque(maxlen=20)
+        self.stats = {
+            "batches": 0, "lines_accepted": 0, "lines_rejected": 0, "lines_written": 0,
+            "lines_dropped": 0, "copies": 0, "throttled": 0
+        }
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_batches)
+        self._tasks = [asyncio.create_task(self._writer()) for _ in range(self.writers)]
+
+    async def stop(self):
+        """Остановка после записи всего, что уже в очереди"""
+        if not self._tasks:
+            return
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Прием
+
+    def retry_after(self) -> int:
+        """Секунды до освобождения очереди при текущей скорости записи"""
+        written = sum(rows for _, rows in self._recent_writes)
+        elapsed = sum(seconds for seconds, _ in self._recent_writes)
+        rate = written / elapsed if elapsed > 0 else 0.0
+        if rate <= 0:
+            return 5
+        return max(1, min(60, math.ceil(self._queued_rows / rate)))
+
+    def _throttle(self, resume_from: int) -> IngestBusy:
+        self.stats["throttled"] += 1
+        return IngestBusy(self.retry_after(), resume_from)
+
+    async def _enqueue(self, rows: List[Tuple], resume_from: int):
+        try:
+            await asyncio.wait_for(self._queue.put(rows), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            raise self._throttle(resume_from)
+        self._queued_rows += len(rows)
+
+    async def ingest(self, terminal_pk: int, chunks: AsyncIterator[bytes],
+                     encoding: Optional[str] = None) -> Dict[str, Any]:
+        """Пакет NDJSON терминала; {"accepted": строк, "rejected": строк}"""
+        if self._queue is None:
+            self.start()
+        if self._queue.full():
+            raise self._throttle(0)
+        decoder = _StreamDecoder(encoding, self.max_batch_bytes)
+        received_at = datetime.utcnow()
+        tail = b""
+        rows: List[Tuple] = []
+        accepted = rejected = 0
+        # Прочитано строк пакета / из них уже в очереди (с этой строки досылать)
+        consumed = committed = 0
+
+        async def flush():
+            nonlocal rows, accepted, committed
+            await self._enqueue(rows, committed)
+            accepted += len(rows)
+            committed = consumed
+            rows = []
+
+        async def add(line: bytes):
+            nonlocal consumed, rejected
+            consumed += 1
+            if not line.strip():
+                return
+            row = parse_line(line, terminal_pk, received_at)
+            if row is None:
+                rejected += 1
+                return
+            rows.append(row)
+            if len(rows) >= self.batch_lines:
+                await flush()
+
+        async for chunk in chunks:
+            lines = (tail + decoder.feed(chunk)).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                await add(line)
+        if tail.strip():
+            await add(tail)
+        if rows:
+            await flush()
+
+        self.stats["batches"] += 1
+        self.stats["lines_accepted"] += accepted
+        self.stats["lines_rejected"] += rejected
+        return {"accepted": accepted, "rejected": rejected}
+
+    # Запись
+
+    async def _writer(self):
+        while True:
+            batch = await self._queue.get()
+            if batch is None:
+                return
+            rows = list(batch)
+            stop = False
+            # Несколько пачек из очереди - одним COPY
+            while len(rows) < self.copy_rows and not self._queue.empty():
+                more = self._queue.get_nowait()
+                if more is None:
+                    stop = True
+                    break
+                rows.extend(more)
+            await self._copy(rows)
+            if stop:
+                return
+
+    async def _copy(self, rows: List[Tuple]):
+        start_time = time.perf_counter()
+        try:
+            await self._pool_provider().bulk_copy(self._table_provider(), LOG_COLUMNS, rows)
+        except Exception as e:
+            self.stats["lines_dropped"] += len(rows)
+            logger.error(f"Terminal log copy failed, {len(rows)} lines dropped: {e}")
+        else:
+            self.stats["lines_written"] += len(rows)
+            self.stats["copies"] += 1
+            self._recent_writes.append((time.perf_counter() - start_time, len(rows)))
+        finally:
+            self._queued_rows -= len(rows)
+
+    async def drain(self):
+        """Ожидание записи всего, что сейчас в очереди"""
+        while self._queue is not None and self._queued_rows > 0:
+            await asyncio.sleep(0.01)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "queued_batches": self._queue.qsize() if self._queue else 0,
+            "queued_lines": self._queued_rows,
+            "queue_capacity": self.queue_batches
+        }
+
+def _pool():
+    from database.connection_pool import db_pool
+    return db_pool
+
+def _log_table():
+    from database import TerminalLog
+    return TerminalLog
+
+# Глобальный приемник логов терминалов
+log_ingestor = LogIngestor(
+    _pool, _log_table,
+    queue_batches=int(os.getenv("TERMINAL_LOG_QUEUE_BATCHES", "200")),
+    writers=int(os.getenv("TERMINAL_LOG_WRITERS", "2"))
+)
@@ -9,7 +9,16 @@ import asyncio
 import logging
 
 # Импорты для работы с БД
-from database import init_db, close_db, get_database, Database
+from database import init_db, close_db, get_database, get_database_pool_stats, Database
+from database.archive import transaction_archive
+from dashboard_snapshot import dashboard_snapshot
+from terminal_registry import terminal_registry
+from heartbeat_history import heartbeat_history
+from terminal_channel import terminal_channel
+from log_ingest import log_ingestor
+from audit_logger import audit_logger
+from notification_queue import notification_queue
+from event_outbox import event_pipeline
 from models.user import User, UserCreate, UserLogin, UserResponse
 from models.terminal import Terminal, TerminalCreate, TerminalResponse
 from models.transaction import Transaction, TransactionCreate, TransactionResponse
@@ -29,11 +38,32 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Запуск PayGo Backend...")
     await init_db()
     logger.info("✅ База данных инициализирована")
+    try:
+        await terminal_registry.rebuild()
+    except Exception as e:
+        # Пустой реестр заполнится heartbeat и событиями терминалов
+        logger.error(f"Не удалось загрузить реестр терминалов: {e}")
+    transaction_archive.start()
+    dashboard_snapshot.start()
+    heartbeat_history.start()
+    await terminal_channel.start()
+    log_ingestor.start()
+    audit_logger.start()
+    await notification_queue.start()
+    await event_pipeline.start()
     
     yield
     
     # Очистка при завершении
     logger.info("🛑 Завершение работы PayGo Backend...")
+    await event_pipeline.stop()
+    await notification_queue.stop()
+    await terminal_channel.stop()
+    await log_ingestor.stop()
+    await audit_logger.stop()
+    await transaction_archive.stop()
+    await dashboard_snapshot.stop()
+    await heartbeat_history.stop()
     await close_db()
     logger.info("✅ Соединение с БД закрыто")
 
@@ -66,10 +96,10 @@ app.add_middleware(
 # Схема аутентификации
 security = HTTPBearer()
 
-# Dependency для получения базы данных
+# Dependency для получения соединения из пула приложения
 async def get_db():
-    async with get_database() as database:
-        yield database
+    async for connection in get_database():
+        yield connection
 
 # Middleware для логирования запросов
 @app.middleware("http")
@@ -88,10 +118,14 @@ async def log_requests(request, call_next):
 @app.get("/api/health")
 async def health_check():
     """Проверка состояния сервиса"""
+    # Только чтение статистики пула: проба не переподключается и не занимает соединение
+    pool_stats = get_database_pool_stats()
+    
     return {
-        "status": "healthy",
+        "status": "healthy" if pool_stats["connected"] else "degraded",
         "service": "PayGo Backend",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "database": pool_stats
     }
 
 @app.get("/api/info")
@@ -9,7 +9,7 @@ import asyncio
 import logging
 
 # Импорты для работы с БД
-from database import init_db, close_db, get_database, Database
+from database import init_db, close_db, get_database, get_database_pool_stats, Database
 from models.user import User, UserCreate, UserLogin, UserResponse
 from models.terminal import Terminal, TerminalCreate, TerminalResponse
 from models.transaction import Transaction, TransactionCreate, TransactionResponse
@@ -66,10 +66,10 @@ app.add_middleware(
 # Схема аутентификации
 security = HTTPBearer()
 
-# Dependency для получения базы данных
+# Dependency для получения соединения из пула приложения
 async def get_db():
-    async with get_database() as database:
-        yield database
+    async for connection in get_database():
+        yield connection
 
 # Middleware для логирования запросов
 @app.middleware("http")
@@ -91,10 +91,14 @@ app.include_router(legal_documents_router, prefix="/api/v1/legal", tags=["Пра
 @app.get("/api/health")
 async def health_check():
     """Проверка состояния сервиса"""
+    # Только чтение статистики пула: проба не переподключается и не занимает соединение
+    pool_stats = get_database_pool_stats()
+    
     return {
-        "status": "healthy",
+        "status": "healthy" if pool_stats["connected"] else "degraded",
         "service": "PayGo Backend",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "database": pool_stats
     }
 
 @app.get("/api/info")
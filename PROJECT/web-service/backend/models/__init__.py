@@ -1,13 +1,13 @@
 # Модели данных PayGo API
 
-from .user import User, UserCreate, UserUpdate, UserInDB, UserResponse
-from .terminal import Terminal, TerminalCreate, TerminalUpdate, TerminalInDB, TerminalResponse
+from .user import User, UserCreate, UserUpdate, UserResponse
+from .terminal import Terminal, TerminalCreate, TerminalUpdate, TerminalResponse
 from .transaction import Transaction, TransactionCreate, TransactionUpdate, TransactionInDB, TransactionResponse
 from .card import Card, CardCreate, CardUpdate, CardInDB, CardResponse
 
 __all__ = [
-    "User", "UserCreate", "UserUpdate", "UserInDB", "UserResponse",
-    "Terminal", "TerminalCreate", "TerminalUpdate", "TerminalInDB", "TerminalResponse", 
+    "User", "UserCreate", "UserUpdate", "UserResponse",
+    "Terminal", "TerminalCreate", "TerminalUpdate", "TerminalResponse",
     "Transaction", "TransactionCreate", "TransactionUpdate", "TransactionInDB", "TransactionResponse",
     "Card", "CardCreate", "CardUpdate", "CardInDB", "CardResponse",
 ] 
\ No newline at end of file
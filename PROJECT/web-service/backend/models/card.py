@@ -1,12 +1,10 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
-from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
 from pydantic import BaseModel, validator
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
-from database import Base
+# SQLAlchemy модель: таблица cards описана один раз в database
+from database import Card
 
 # Типы карт
 class CardType(str, Enum):
@@ -31,40 +29,6 @@ class BankIssuer(str, Enum):
     CENTRINVEST = "centrinvest"
     OTHER = "other"
 
-# SQLAlchemy модель
-class Card(Base):
-    __tablename__ = "cards"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    
-    # Основные данные карты
-    card_token = Column(String, unique=True, index=True, nullable=False)  # Токен вместо номера
-    card_mask = Column(String, nullable=False)  # Замаскированный номер (например: **** **** **** 1234)
-    card_holder_name = Column(String, nullable=False)
-    
-    # Тип и система
-    card_type = Column(String, nullable=False)
-    payment_system = Column(String, nullable=False)
-    bank_issuer = Column(String, nullable=False)
-    
-    # Статус карты
-    is_active = Column(Boolean, default=True)
-    is_primary = Column(Boolean, default=False)  # Основная карта пользователя
-    is_verified = Column(Boolean, default=False)
-    
-    # Дополнительная информация
-    expiry_month = Column(Integer, nullable=True)
-    expiry_year = Column(Integer, nullable=True)
-    
-    # Временные метки
-    created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
-    last_used = Column(DateTime, nullable=True)
-    
-    # Отношения
-    user = relationship("User", back_populates="cards")
-
 # Pydantic схемы
 class CardBase(BaseModel):
     card_holder_name: str
@@ -3,6 +3,9 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+# SQLAlchemy модель: таблица terminals описана в database, здесь только схемы API
+from database import Terminal
+
 class TerminalStatus(str, Enum):
     ONLINE = "online"
     OFFLINE = "offline"
@@ -69,8 +72,28 @@ class TerminalConfiguration(BaseModel):
     merchant_id: str
     acquiring_settings: Dict[str, Any] = {}
 
-class Terminal(TerminalBase):
-    id: str
+# Параметры хранилища конфигурации: у всех полей есть значения по умолчанию
+class TerminalConfig(BaseModel):
+    max_transaction_amount: float = 50000.0  # рублей
+    min_transaction_amount: float = 1.0
+    session_timeout: int = 300  # секунд
+    receipt_print_enabled: bool = True
+    sound_enabled: bool = True
+    language: str = "ru"
+    currency: str = "RUB"
+    tax_rate: float = 0.20
+    merchant_id: Optional[str] = None
+    acquiring_settings: Dict[str, Any] = {}
+
+class TerminalHeartbeat(BaseModel):
+    terminal_id: str  # серийный номер терминала
+    status: TerminalStatus
+    ip_address: Optional[str] = None
+    hardware_info: Optional[Dict[str, Any]] = None
+    current_transaction_count: Optional[int] = None
+
+class TerminalResponse(TerminalBase):
+    id: int
     serial_number: str
     model: str
     manufacturer: str
@@ -78,7 +101,7 @@ class Terminal(TerminalBase):
     created_at: datetime
     updated_at: datetime
     last_ping: Optional[datetime] = None
-    software_version: str
+    software_version: Optional[str] = None
     hardware: Optional[TerminalHardware] = None
     configuration: Optional[TerminalConfiguration] = None
     
@@ -115,6 +138,10 @@ class TerminalCommand(BaseModel):
     status: str = "pending"  # pending, executing, completed, failed
     result: Optional[str] = None
 
+class TerminalCommandCreate(BaseModel):
+    command_type: str  # reboot, update, configure, etc.
+    command_data: Dict[str, Any] = {}
+
 class TerminalHealthCheck(BaseModel):
     terminal_id: str
     timestamp: datetime
@@ -1,13 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey
-from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
 from pydantic import BaseModel, validator
 from typing import Optional, Dict
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
 
-from database import Base
+# SQLAlchemy модель: таблица transactions описана один раз в database,
+# по ней строятся секционирование и init.sql
+from database import Transaction
 
 # Статусы транзакций
 class TransactionStatus(str, Enum):
@@ -33,45 +32,6 @@ class BankAcquirer(str, Enum):
     CENTRINVEST = "centrinvest"
     SBP = "sbp"
 
-# SQLAlchemy модель
-class Transaction(Base):
-    __tablename__ = "transactions"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    transaction_id = Column(String, unique=True, index=True, nullable=False)
-    
-    # Связи
-    terminal_id = Column(Integer, ForeignKey("terminals.id"), nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Может быть анонимная транзакция
-    
-    # Основные данные
-    amount = Column(Float, nullable=False)
-    currency = Column(String, default="RUB", nullable=False)
-    description = Column(Text, nullable=True)
-    
-    # Статус и метод оплаты
-    status = Column(String, default=TransactionStatus.PENDING)
-    payment_method = Column(String, nullable=False)
-    bank_acquirer = Column(String, nullable=True)
-    
-    # Данные от банка
-    bank_transaction_id = Column(String, nullable=True)
-    bank_response = Column(Text, nullable=True)  # JSON ответ от банка
-    
-    # Дополнительная информация
-    card_mask = Column(String, nullable=True)  # Замаскированный номер карты
-    receipt_number = Column(String, nullable=True)
-    fiscal_data = Column(Text, nullable=True)  # Данные фискального чека
-    
-    # Временные метки
-    created_at = Column(DateTime, server_default=func.now())
-    processed_at = Column(DateTime, nullable=True)
-    completed_at = Column(DateTime, nullable=True)
-    
-    # Отношения
-    terminal = relationship("Terminal", back_populates="transactions")
-    user = relationship("User", back_populates="transactions")
-
 # Pydantic схемы
 class TransactionBase(BaseModel):
     amount: float
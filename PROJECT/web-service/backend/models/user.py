@@ -3,6 +3,9 @@ from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
+# SQLAlchemy модель: таблица users описана в database, здесь только схемы API
+from database import User
+
 class UserRole(str, Enum):
     USER = "user"                    # Обычный клиент
     ADMIN = "admin"                  # Администратор системы
@@ -92,10 +95,10 @@ class UserNotificationSettings(BaseModel):
     system_updates: bool = False
     marketing_notifications: bool = False
 
-class User(UserBase):
-    id: str
-    created_at: datetime
-    updated_at: datetime
+class UserResponse(UserBase):
+    id: int
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
     last_login: Optional[datetime] = None
     failed_login_attempts: int = 0
     is_locked: bool = False
@@ -116,7 +119,12 @@ class UserLoginResponse(BaseModel):
     refresh_token: str
     token_type: str = "bearer"
     expires_in: int
-    user: User
+    user: UserResponse
+
+class Token(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str = "bearer"
 
 class PasswordChange(BaseModel):
     current_password: str
@@ -126,6 +134,10 @@ class PasswordChange(BaseModel):
 class PasswordReset(BaseModel):
     email: EmailStr
 
+class UserBiometry(BaseModel):
+    type: BiometricType
+    template_data: str  # Зашифрованные биометрические данные
+
 class BiometricAuth(BaseModel):
     user_id: str
     biometric_type: BiometricType
@@ -0,0 +1,315 @@
+"""
+Массовая рассылка push уведомлений PayGo
+Пользователи или их подписки читаются потоком, токены устройств собираются в пачки по
+провайдерам (multicast), пачки отправляет ограниченный пул исполнителей
+с лимитом запросов провайдера и повторами с задержкой со случайным разбросом
+"""
+
+import asyncio
+import inspect
+import logging
+import random
+import time
+from typing import Optional, Dict, Any, List, Tuple, Callable, AsyncIterator, Iterable, Union
+
+logger = logging.getLogger(__name__)
+
+class ProviderError(Exception):
+    """Ошибка вызова провайдера целиком; retryable=False - пачку повторять бессмысленно"""
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class ProviderResult:
+    """Итог отправки пачки: токены для повтора и недействительные токены"""
+
+    __slots__ = ("retry", "invalid")
+
+    def __init__(self, retry: Optional[List[str]] = None, invalid: Optional[List[str]] = None):
+        self.retry = retry or []
+        self.invalid = invalid or []
+
+class PushProvider:
+    """Провайдер push: max_batch токенов за вызов, не больше rate вызовов в секунду"""
+
+    name = "push"
+    max_batch = 500
+    rate = 100.0
+    burst = 20
+
+    async def send_batch(self, tokens: List[str], notification) -> ProviderResult:
+        raise NotImplementedError
+
+class FCMProvider(PushProvider):
+    """Firebase Cloud Messaging: multicast до 500 токенов одним запросом"""
+
+    name = "fcm"
+    max_batch = 500
+
+    async def send_batch(self, tokens: List[str], notification) -> ProviderResult:
+        # В реальном проекте здесь будет messaging.send_each_for_multicast
+        await asyncio.sleep(0.1)  # Имитация отправки
+        logger.debug(f"📱 FCM multicast отправлен: {notification.title}, {len(tokens)} устройств")
+        return ProviderResult()
+
+class WebPushProvider(PushProvider):
+    """Web Push: у протокола нет multicast, подписки пачки отправляются параллельно"""
+
+    name = "web"
+    max_batch = 100
+
+    async def _send_one(self, subscription: str, notification):
+        # В реальном проекте здесь будет интеграция с web-push библиотекой
+        await asyncio.sleep(0.1)  # Имитация отправки
+
+    async def send_batch(self, tokens: List[str], notification) -> ProviderResult:
+        results = await asyncio.gather(*(self._send_one(token, notification) for token in tokens),
+                                       return_exceptions=True)
+        retry = [token for token, result in zip(tokens, results) if isinstance(result, Exception)]
+        logger.debug(f"🌐 Веб-push отправлен: {notification.title}, {len(tokens) - len(retry)} подписок")
+        return ProviderResult(retry=retry)
+
+class TokenBucket:
+    """Не больше rate вызовов в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+async def _chunks(user_ids: Union[Iterable[str], AsyncIterator[str]], size: int) -> AsyncIterator[List[str]]:
+    chunk = []
+    if hasattr(user_ids, "__aiter__"):
+        async for user_id in user_ids:
+            chunk.append(user_id)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    else:
+        for user_id in user_ids:
+            chunk.append(user_id)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+class ReachCounter:
+    """Число пользователей, которым доставлен хотя бы один токен.
+
+    Пользователь хранится, только пока его токены лежат в пачках или
+    отправляются, и пока рассылка читает его порцию: после этого повторно
+    он не встретится. Память зависит от буферов и очереди, а не от числа
+    пользователей рассылки.
+    """
+
+    __slots__ = ("reached", "peak", "_open")
+
+    def __init__(self):
+        self.reached = 0
+        self.peak = 0
+        # Пользователь -> [незавершенных ссылок, уже учтен]
+        self._open: Dict[str, List] = {}
+
+    def add(self, user_id: str):
+        entry = self._open.get(user_id)
+        if entry is None:
+            self._open[user_id] = [1, False]
+            self.peak = max(self.peak, len(self._open))
+        else:
+            entry[0] += 1
+
+    def sent(self, user_id: str):
+        entry = self._open[user_id]
+        if not entry[1]:
+            entry[1] = True
+            self.reached += 1
+
+    def done(self, user_id: str):
+        entry = self._open[user_id]
+        entry[0] -= 1
+        if not entry[0]:
+            del self._open[user_id]
+
+class NotificationDispatcher:
+    """Рассылка одного уведомления большому числу пользователей.
+
+    Идентификаторы пользователей читаются порциями по fetch_users, их токены
+    (tokens_provider(user_ids) -> [(провайдер, пользователь, токен)], обычная
+    или асинхронная функция) раскладываются по провайдерам и уходят пачками по max_batch провайдера
+    в очередь из queue_batches мест. Очередь разбирают workers исполнителей,
+    поэтому память и число задач не зависят от размера рассылки. Вызов
+    провайдера ждет его TokenBucket; ошибки повторяются до max_attempts раз
+    с задержкой base_delay * 2^попытка со случайным разбросом, повторяются
+    только не доставленные токены. Недействительные токены передаются
+    invalid_handler(провайдер, токены) одним списком на пачку.
+    """
+
+    def __init__(self, tokens_provider: Callable[[List[str]], List[Tuple[str, str, str]]],
+                 providers: List[PushProvider], workers: int = 32, fetch_users: int = 1000,
+                 queue_batches: int = 64, max_attempts: int = 4, base_delay: float = 0.5,
+                 max_delay: float = 30.0, invalid_handler=None):
+        self._tokens_provider = tokens_provider
+        self.providers = {provider.name: provider for provider in providers}
+        self._buckets = {provider.name: TokenBucket(provider.rate, provider.burst) for provider in providers}
+        self.workers = workers
+        self.fetch_users = fetch_users
+        self.queue_batches = queue_batches
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._invalid_handler = invalid_handler
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Задержка перед повтором: полный случайный разброс до base_delay * 2^attempt"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    async def dispatch(self, user_ids: Union[Iterable[str], AsyncIterator[str]], notification) -> Dict[str, Any]:
+        """Отправка notification всем user_ids; метрики рассылки"""
+        async def token_chunks():
+            async for chunk in _chunks(user_ids, self.fetch_users):
+                tokens = self._tokens_provider(chunk)
+                if inspect.isawaitable(tokens):
+                    tokens = await tokens
+                yield len(chunk), tokens
+        return await self._dispatch(token_chunks(), notification)
+
+    async def dispatch_tokens(self, tokens: AsyncIterator[List[Tuple[str, str, str]]], notification) -> Dict[str, Any]:
+        """Отправка готовому потоку порций (провайдер, пользователь, токен), упорядоченному по пользователю"""
+        async def token_chunks():
+            last_user = None
+            async for chunk in tokens:
+                users = 0
+                for _, user_id, _ in chunk:
+                    if user_id != last_user:
+                        users += 1
+                        last_user = user_id
+                yield users, chunk
+        return await self._dispatch(token_chunks(), notification)
+
+    async def _dispatch(self, token_chunks: AsyncIterator[Tuple[int, List[Tuple[str, str, str]]]],
+                        notification) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        stats = {
+            "users": 0, "users_reached": 0, "tokens": 0, "tokens_sent": 0, "tokens_failed": 0,
+            "tokens_invalid": 0, "batches": 0, "retries": 0,
+            "providers": {name: {"batches": 0, "tokens_sent": 0} for name in self.providers}
+        }
+        reach = ReachCounter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_batches)
+        workers = [
+            asyncio.create_task(self._worker(queue, notification, stats, reach))
+            for _ in range(self.workers)
+        ]
+        try:
+            buffers: Dict[str, List[Tuple[str, str]]] = {name: [] for name in self.providers}
+            # Пользователи текущей порции держатся в reach, пока она не разложена по пачкам:
+            # иначе пользователь, чьи токены уже отправлены, был бы учтен еще раз.
+            # Последний пользователь порции держится и в следующей - его токены могут продолжаться
+            held: Dict[str, None] = {}
+            async for users, chunk in token_chunks:
+                stats["users"] += users
+                for provider_name, user_id, token in chunk:
+                    buffer = buffers.get(provider_name)
+                    if buffer is None:
+                        continue
+                    if user_id not in held:
+                        held[user_id] = None
+                        reach.add(user_id)
+                    reach.add(user_id)
+                    buffer.append((user_id, token))
+                    stats["tokens"] += 1
+                    if len(buffer) >= self.providers[provider_name].max_batch:
+                        await queue.put((provider_name, buffer))
+                        buffers[provider_name] = []
+                last_user = next(reversed(held), None)
+                for user_id in held:
+                    if user_id != last_user:
+                        reach.done(user_id)
+                held = {} if last_user is None else {last_user: None}
+            for user_id in held:
+                reach.done(user_id)
+            for provider_name, buffer in buffers.items():
+                if buffer:
+                    await queue.put((provider_name, buffer))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        stats["users_reached"] = reach.reached
+        stats["elapsed_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+        logger.info(
+            f"📢 Массовая отправка: {stats['users_reached']}/{stats['users']} пользователей, "
+            f"{stats['tokens_sent']}/{stats['tokens']} устройств, {stats['batches']} пачек за {stats['elapsed_ms']} мс"
+        )
+        return stats
+
+    async def _worker(self, queue: asyncio.Queue, notification, stats: Dict[str, Any], reach: ReachCounter):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            provider_name, batch = item
+            try:
+                await self._send(provider_name, batch, notification, stats, reach)
+            except Exception as e:
+                stats["tokens_failed"] += len(batch)
+                logger.error(f"❌ Ошибка отправки пачки {provider_name}: {e}")
+            finally:
+                for user_id, _ in batch:
+                    reach.done(user_id)
+
+    async def _send(self, provider_name: str, batch: List[Tuple[str, str]], notification,
+                    stats: Dict[str, Any], reach: ReachCounter):
+        provider = self.providers[provider_name]
+        users = dict((token, user_id) for user_id, token in batch)
+        pending = list(users)
+        invalid: List[str] = []
+        for attempt in range(self.max_attempts):
+            if attempt:
+                stats["retries"] += 1
+            await self._buckets[provider_name].acquire()
+            retry_after = None
+            try:
+                result = await provider.send_batch(pending, notification)
+            except ProviderError as e:
+                if not e.retryable:
+                    break
+                retry_after = e.retry_after
+                result = ProviderResult(retry=pending)
+            stats["batches"] += 1
+            stats["providers"][provider_name]["batches"] += 1
+            failed = set(result.retry) | set(result.invalid)
+            sent = [token for token in pending if token not in failed]
+            stats["tokens_sent"] += len(sent)
+            stats["providers"][provider_name]["tokens_sent"] += len(sent)
+            for token in sent:
+                reach.sent(users[token])
+            invalid.extend(result.invalid)
+            pending = result.retry
+            if not pending:
+                break
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(self.backoff(attempt, retry_after))
+        stats["tokens_failed"] += len(pending)
+        if invalid:
+            stats["tokens_invalid"] += len(invalid)
+            if self._invalid_handler is not None:
+                await self._invalid_handler(provider_name, [(users[token], token) for token in invalid])
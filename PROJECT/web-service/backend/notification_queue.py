@@ -0,0 +1,472 @@
+"""
+Очередь push уведомлений PayGo
+Уведомления сохраняются в таблице notification_queue и отправляются строго
+по классам приоритета: безопасность, транзакции, обычные, низкие. Уведомления
+низкого приоритета одного типа объединяются в окне пользователя, отложенные
+отправки и повторы ждут в колесе таймеров
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+
+from sqlalchemy import and_, delete, or_, update
+
+from notification_service import Notification, NotificationType, NotificationPriority
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета в порядке отправки
+PRIORITY_CLASSES = ("security", "transaction", "normal", "low")
+# Оповещения, которые нельзя объединять: каждое доходит отдельно и сразу
+NEVER_COALESCE = {NotificationType.SECURITY_ALERT, NotificationType.TRANSACTION_FAILED}
+COALESCE_PRIORITIES = {NotificationPriority.LOW, NotificationPriority.NORMAL}
+# Строк в одном DELETE отправленных уведомлений
+DELETE_CHUNK = 500
+# Времен ожидания на класс для перцентилей
+WAIT_SAMPLES = 1000
+
+class DeliveryError(Exception):
+    """Ни одно устройство пользователя не приняло уведомление - отправка повторяется"""
+
+def priority_class(notification: Notification) -> int:
+    """Номер класса в PRIORITY_CLASSES: безопасность и транзакции идут раньше по типу, а не только по priority"""
+    if notification.type == NotificationType.SECURITY_ALERT or notification.priority == NotificationPriority.URGENT:
+        return 0
+    if notification.type in (NotificationType.TRANSACTION_SUCCESS, NotificationType.TRANSACTION_FAILED) \
+            or notification.priority == NotificationPriority.HIGH:
+        return 1
+    if notification.priority == NotificationPriority.NORMAL:
+        return 2
+    return 3
+
+def coalescable(notification: Notification) -> bool:
+    return notification.type not in NEVER_COALESCE and notification.priority in COALESCE_PRIORITIES
+
+class TimerWheel:
+    """Хешированное колесо таймеров: добавление O(1), за тик просматривается один слот.
+
+    Таймер дальше slots * tick остается в слоте и срабатывает на обороте,
+    когда наступит его тик.
+    """
+
+    def __init__(self, tick: float = 0.05, slots: int = 1024, now: Optional[float] = None):
+        self.tick = tick
+        self._slots: List[List[Tuple[int, Any]]] = [[] for _ in range(slots)]
+        self._current = int((time.monotonic() if now is None else now) / tick)
+        self.size = 0
+
+    def schedule(self, due: float, item):
+        """item сработает в первый тик не раньше due (время time.monotonic())"""
+        tick = max(math.ceil(due / self.tick), self._current + 1)
+        self._slots[tick % len(self._slots)].append((tick, item))
+        self.size += 1
+
+    def advance(self, now: float) -> List[Any]:
+        """Сработавшие к моменту now элементы"""
+        target = int(now / self.tick)
+        fired = []
+        slots = len(self._slots)
+        for tick in range(self._current + 1, self._current + 1 + min(max(target - self._current, 0), slots)):
+            slot = self._slots[tick % slots]
+            if not slot:
+                continue
+            keep = []
+            for entry in slot:
+                if entry[0] <= target:
+                    fired.append(entry[1])
+                else:
+                    keep.append(entry)
+            self._slots[tick % slots] = keep
+        self._current = max(self._current, target)
+        self.size -= len(fired)
+        return fired
+
+class _Entry:
+    """Уведомление в очереди; id - строка notification_queue"""
+
+    __slots__ = ("id", "rank", "notification", "count", "attempts", "ready_at")
+
+    def __init__(self, entry_id: Optional[int], rank: int, notification: Notification, count: int = 1):
+        self.id = entry_id
+        self.rank = rank
+        self.notification = notification
+        self.count = count
+        self.attempts = 0
+        self.ready_at = 0.0
+
+class _Window:
+    """Окно объединения (пользователь, тип): первое уведомление уходит сразу, остальные - одним в конце"""
+
+    __slots__ = ("ends_at", "pending", "lock")
+
+    def __init__(self, ends_at: float):
+        self.ends_at = ends_at
+        self.pending: Optional[_Entry] = None
+        self.lock = asyncio.Lock()
+
+class NotificationQueue:
+    """Приоритетная очередь уведомлений с объединением и отложенной отправкой.
+
+    Каждое уведомление сначала записывается в notification_queue (одновременные
+    постановки - одной транзакцией) и удаляется пачками после отправки, поэтому
+    после перезапуска неотправленные уведомления загружаются снова (доставка
+    хотя бы один раз). Строку держит процесс, который ее записал или забрал:
+    claimed_by и аренда claimed_until на lease секунд, которую он продлевает.
+    Строки без владельца или с истекшей арендой забирает один процесс
+    условным UPDATE, так что воркеры не загружают одни и те же уведомления,
+    а уведомления завершившегося воркера отправляет другой. Готовые
+    уведомления лежат в куче по (класс, порядок поступления); workers
+    исполнителей всегда берут уведомление старшего класса, так что рассылка
+    низкого приоритета не задерживает оповещения безопасности. Уведомление
+    низкого или обычного приоритета открывает окно coalesce_window секунд
+    для (пользователь, тип): повторы в окне объединяются в одно уведомление
+    с data["coalesced"] = число уведомлений, которое уходит в конце окна.
+    Отложенные отправки, концы окон и повторы после ошибки ждут в TimerWheel.
+    """
+
+    def __init__(self, send: Callable[[Notification], Awaitable[Any]], session_factory, models_provider,
+                 workers: int = 8, coalesce_window: float = 60.0, tick: float = 0.05, wheel_slots: int = 1024,
+                 max_attempts: int = 5, retry_delay: float = 2.0, lease: float = 60.0):
+        # send(notification) - отправка пользователю, исключение - повтор;
+        # session_factory() - асинхронный контекстный менеджер сессии,
+        # models_provider() - модель NotificationQueueEntry
+        self._send = send
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        self.workers = workers
+        self.coalesce_window = coalesce_window
+        self.tick = tick
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.owner = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wheel = TimerWheel(tick, wheel_slots)
+        self._ready: List[Tuple[int, int, _Entry]] = []
+        self._order = itertools.count()
+        self._windows: Dict[Tuple[str, str], _Window] = {}
+        self._completed: List[int] = []
+        self._deleting = 0
+        self._writes: List[Tuple[Any, asyncio.Future]] = []
+        self._writer: Optional[asyncio.Task] = None
+        self.write_stats = {"batches": 0, "writes": 0}
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight = 0
+        self._stats = [
+            {"enqueued": 0, "coalesced": 0, "sent": 0, "failed": 0, "retried": 0, "ready": 0,
+             "waits": deque(maxlen=WAIT_SAMPLES)}
+            for _ in PRIORITY_CLASSES
+        ]
+
+    async def start(self):
+        """Загрузка неотправленных уведомлений без владельца и запуск исполнителей"""
+        if self._tasks:
+            return
+        await self._claim()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._timer_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        try:
+            await self._flush_completed()
+        except Exception as e:
+            logger.error(f"Ошибка удаления отправленных уведомлений: {e}")
+        try:
+            await self._release()
+        except Exception as e:
+            logger.error(f"Ошибка аренды уведомлений: {e}")
+
+    async def enqueue(self, notification: Notification, send_at: Optional[datetime] = None) -> str:
+        """Постановка в очередь; send_at - отправить не раньше. Возвращает id строки очереди"""
+        rank = priority_class(notification)
+        stats = self._stats[rank]
+        stats["enqueued"] += 1
+        now = time.monotonic()
+        delay = (send_at - datetime.now()).total_seconds() if send_at else 0.0
+        if delay <= 0 and coalescable(notification):
+            key = (notification.user_id, notification.type.value)
+            window = self._windows.get(key)
+            if window is not None and window.ends_at > now:
+                async with window.lock:
+                    if window.pending is not None:
+                        await self._merge(window.pending, notification)
+                        stats["coalesced"] += 1
+                        return str(window.pending.id)
+                    window.pending = await self._insert(
+                        notification, rank, datetime.now() + timedelta(seconds=window.ends_at - now)
+                    )
+                    return str(window.pending.id)
+            window = self._windows[key] = _Window(now + self.coalesce_window)
+            self._wheel.schedule(window.ends_at, (key, window))
+        entry = await self._insert(notification, rank, datetime.now() + timedelta(seconds=max(delay, 0.0)))
+        if delay > 0:
+            self._wheel.schedule(now + delay, entry)
+        else:
+            self._push(entry)
+        return str(entry.id)
+
+    # Хранение
+
+    async def _insert(self, notification: Notification, rank: int, due_at: datetime) -> _Entry:
+        QueueEntry = self._models_provider()
+        row = QueueEntry(
+            user_id=int(notification.user_id), type=notification.type.value, priority=notification.priority.value,
+            title=notification.title, message=notification.message, data=notification.data, due_at=due_at,
+            claimed_by=self.owner, claimed_until=datetime.now() + timedelta(seconds=self.lease)
+        )
+        await self._write(row)
+        notification.id = str(row.id)
+        return _Entry(row.id, rank, notification)
+
+    async def _merge(self, entry: _Entry, notification: Notification):
+        """Последнее уведомление окна заменяет накопленное, счетчик объединенных растет"""
+        entry.count += 1
+        notification.id = str(entry.id)
+        notification.data = {**(notification.data or {}), "coalesced": entry.count}
+        entry.notification = notification
+        QueueEntry = self._models_provider()
+        await self._write(
+            update(QueueEntry).where(QueueEntry.id == entry.id).values(
+                title=notification.title, message=notification.message,
+                data=notification.data, coalesced=entry.count
+            )
+        )
+
+    async def _write(self, operation):
+        """Запись в составе общей транзакции: одновременные постановки ждут один COMMIT"""
+        future = asyncio.get_running_loop().create_future()
+        self._writes.append((operation, future))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_batches())
+        await future
+
+    async def _write_batches(self):
+        while self._writes:
+            batch, self._writes = self._writes, []
+            try:
+                async with self._session_factory() as session:
+                    for operation, _ in batch:
+                        if isinstance(operation, self._models_provider()):
+                            session.add(operation)
+                        else:
+                            await session.flush()
+                            await session.execute(operation)
+                    await session.commit()
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.write_stats["batches"] += 1
+            self.write_stats["writes"] += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    async def _claim(self):
+        """Строки без владельца или с истекшей арендой другого процесса - в очередь этого.
+
+        Условие проверяется в самом UPDATE: из одновременных процессов строку
+        получает один, остальные ее не видят или не проходят повторную проверку.
+        """
+        QueueEntry = self._models_provider()
+        wall_now = datetime.now()
+        async with self._session_factory() as session:
+            rows = (await session.execute(
+                update(QueueEntry)
+                .where(or_(
+                    QueueEntry.claimed_by.is_(None),
+                    and_(QueueEntry.claimed_by != self.owner, QueueEntry.claimed_until < wall_now)
+                ))
+                .values(claimed_by=self.owner, claimed_until=wall_now + timedelta(seconds=self.lease))
+                .returning(QueueEntry)
+                .execution_options(synchronize_session=False)
+            )).scalars().all()
+            await session.commit()
+        now = time.monotonic()
+        for row in sorted(rows, key=lambda row: (row.due_at, row.id)):
+            data = row.data
+            if row.coalesced > 1:
+                data = {**(data or {}), "coalesced": row.coalesced}
+            notification = Notification(
+                id=str(row.id), user_id=str(row.user_id), type=row.type, priority=row.priority,
+                title=row.title, message=row.message, data=data
+            )
+            entry = _Entry(row.id, priority_class(notification), notification, row.coalesced)
+            delay = (row.due_at - wall_now).total_seconds()
+            if delay > 0:
+                self._wheel.schedule(now + delay, entry)
+            else:
+                self._push(entry)
+        if rows:
+            logger.info(f"📬 Загружено {len(rows)} неотправленных уведомлений")
+
+    async def _renew(self):
+        """Продление аренды своих строк"""
+        QueueEntry = self._models_provider()
+        async with self._session_factory() as session:
+            await session.execute(
+                update(QueueEntry).where(QueueEntry.claimed_by == self.owner)
+                .values(claimed_until=datetime.now() + timedelta(seconds=self.lease))
+            )
+            await session.commit()
+
+    async def _release(self):
+        """Неотправленные строки остановленной очереди сразу доступны другим процессам"""
+        QueueEntry = self._models_provider()
+        async with self._session_factory() as session:
+            await session.execute(
+                update(QueueEntry).where(QueueEntry.claimed_by == self.owner)
+                .values(claimed_by=None, claimed_until=None)
+            )
+            await session.commit()
+
+    async def _flush_completed(self):
+        """Удаление отправленных уведомлений пачками по DELETE_CHUNK"""
+        if not self._completed:
+            return
+        completed, self._completed = self._completed, []
+        self._deleting = len(completed)
+        QueueEntry = self._models_provider()
+        try:
+            async with self._session_factory() as session:
+                for start in range(0, len(completed), DELETE_CHUNK):
+                    await session.execute(delete(QueueEntry).where(QueueEntry.id.in_(completed[start:start + DELETE_CHUNK])))
+                await session.commit()
+        except Exception:
+            self._completed.extend(completed)
+            raise
+        finally:
+            self._deleting = 0
+
+    # Отправка
+
+    def _push(self, entry: _Entry):
+        entry.ready_at = time.monotonic()
+        heapq.heappush(self._ready, (entry.rank, next(self._order), entry))
+        self._stats[entry.rank]["ready"] += 1
+        self._wakeup.set()
+
+    def _advance(self):
+        for item in self._wheel.advance(time.monotonic()):
+            if isinstance(item, _Entry):
+                self._push(item)
+                continue
+            key, window = item
+            if window.lock.locked():
+                # Запись объединенного уведомления еще идет - окно закроется в следующий тик
+                self._wheel.schedule(time.monotonic(), item)
+                continue
+            if self._windows.get(key) is window:
+                del self._windows[key]
+            if window.pending is not None:
+                self._push(window.pending)
+
+    async def _timer_loop(self):
+        # Аренда продлевается втрое чаще срока, заодно забираются строки завершившихся процессов
+        claim_at = time.monotonic() + self.lease / 3
+        while True:
+            await asyncio.sleep(self.tick)
+            self._advance()
+            try:
+                await self._flush_completed()
+            except Exception as e:
+                logger.error(f"Ошибка удаления отправленных уведомлений: {e}")
+            if time.monotonic() >= claim_at:
+                claim_at = time.monotonic() + self.lease / 3
+                try:
+                    await self._renew()
+                    await self._claim()
+                except Exception as e:
+                    logger.error(f"Ошибка аренды уведомлений: {e}")
+
+    async def _worker(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, _, entry = heapq.heappop(self._ready)
+            stats = self._stats[entry.rank]
+            stats["ready"] -= 1
+            stats["waits"].append(time.monotonic() - entry.ready_at)
+            self._in_flight += 1
+            try:
+                await self._send(entry.notification)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                entry.attempts += 1
+                if entry.attempts < self.max_attempts:
+                    stats["retried"] += 1
+                    self._wheel.schedule(time.monotonic() + self.retry_delay * 2 ** (entry.attempts - 1), entry)
+                    continue
+                stats["failed"] += 1
+                logger.error(f"❌ Уведомление {entry.id} не отправлено после {entry.attempts} попыток: {e}")
+            else:
+                stats["sent"] += 1
+            finally:
+                self._in_flight -= 1
+            self._completed.append(entry.id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        classes = {}
+        for name, stats in zip(PRIORITY_CLASSES, self._stats):
+            waits = sorted(stats["waits"])
+            classes[name] = {
+                **{field: value for field, value in stats.items() if field != "waits"},
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 3) if waits else 0.0,
+                "wait_p99_ms": round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 3) if waits else 0.0
+            }
+        return {
+            "classes": classes,
+            "ready": len(self._ready),
+            "scheduled": self._wheel.size,
+            "coalescing_windows": len(self._windows),
+            "in_flight": self._in_flight,
+            "pending_deletes": len(self._completed) + self._deleting,
+            "write_batches": self.write_stats["batches"],
+            "writes": self.write_stats["writes"]
+        }
+
+async def _send_notification(notification: Notification):
+    from notification_service import notification_service
+    if await notification_service.send_notification(notification.user_id, notification):
+        return
+    # send_notification не бросает исключений: False и без устройств - доставлять некуда
+    devices = await notification_service.store.devices(notification.user_id)
+    if any(devices.values()):
+        raise DeliveryError(f"Уведомление {notification.id} не доставлено пользователю {notification.user_id}")
+
+def _session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session()
+
+def _queue_model():
+    from database import NotificationQueueEntry
+    return NotificationQueueEntry
+
+# Глобальная очередь уведомлений
+notification_queue = NotificationQueue(
+    _send_notification, _session, _queue_model,
+    workers=int(os.getenv("NOTIFICATION_QUEUE_WORKERS", "8")),
+    coalesce_window=float(os.getenv("NOTIFICATION_COALESCE_WINDOW", "60"))
+)
@@ -2,11 +2,14 @@ import asyncio
 import logging
 import json
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Iterable, AsyncIterator, Union, Any
 from enum import Enum
 import aiohttp
 from pydantic import BaseModel
 
+from notification_dispatch import NotificationDispatcher, PushProvider, FCMProvider, WebPushProvider
+from push_subscriptions import PushSubscriptionStore, push_subscription_store
+
 logger = logging.getLogger(__name__)
 
 class NotificationType(str, Enum):
@@ -35,35 +38,34 @@ class Notification(BaseModel):
     is_read: bool = False
 
 class PushNotificationService:
-    def __init__(self):
-        self.web_subscriptions: Dict[str, List[str]] = {}  # user_id -> [subscription_ids]
-        self.mobile_tokens: Dict[str, List[str]] = {}      # user_id -> [device_tokens]
+    def __init__(self, providers: Optional[List[PushProvider]] = None, workers: int = 32,
+                 store: Optional[PushSubscriptionStore] = None):
+        # Подписки хранятся в таблице push_subscriptions
+        self.store = store or push_subscription_store
+        # Массовые рассылки: пачки токенов по провайдерам, ограниченный пул исполнителей
+        self.dispatcher = NotificationDispatcher(
+            self.store.tokens_for_users, providers or [WebPushProvider(), FCMProvider()],
+            workers=workers, invalid_handler=self.store.remove_invalid
+        )
         
     async def subscribe_web_push(self, user_id: str, subscription_info: str):
         """Подписка на веб-push уведомления"""
-        if user_id not in self.web_subscriptions:
-            self.web_subscriptions[user_id] = []
-        
-        if subscription_info not in self.web_subscriptions[user_id]:
-            self.web_subscriptions[user_id].append(subscription_info)
+        if await self.store.subscribe(user_id, WebPushProvider.name, subscription_info):
             logger.info(f"✅ Пользователь {user_id} подписался на веб-push уведомления")
     
     async def subscribe_mobile_push(self, user_id: str, device_token: str):
         """Подписка на мобильные push уведомления"""
-        if user_id not in self.mobile_tokens:
-            self.mobile_tokens[user_id] = []
-        
-        if device_token not in self.mobile_tokens[user_id]:
-            self.mobile_tokens[user_id].append(device_token)
+        if await self.store.subscribe(user_id, FCMProvider.name, device_token):
             logger.info(f"✅ Пользователь {user_id} подписался на мобильные push уведомления")
     
     async def send_web_push(self, user_id: str, notification: Notification):
         """Отправка веб-push уведомления"""
-        if user_id not in self.web_subscriptions:
+        subscriptions = (await self.store.devices(user_id)).get(WebPushProvider.name)
+        if not subscriptions:
             return False
         
         success_count = 0
-        for subscription in self.web_subscriptions[user_id]:
+        for subscription in subscriptions:
             try:
                 # Здесь должна быть интеграция с реальным сервисом (например, web-push)
                 # Для примера используем заглушку
@@ -78,11 +80,12 @@ class PushNotificationService:
     
     async def send_mobile_push(self, user_id: str, notification: Notification):
         """Отправка мобильного push уведомления"""
-        if user_id not in self.mobile_tokens:
+        tokens = (await self.store.devices(user_id)).get(FCMProvider.name)
+        if not tokens:
             return False
         
         success_count = 0
-        for token in self.mobile_tokens[user_id]:
+        for token in tokens:
             try:
                 # Здесь должна быть интеграция с FCM (Firebase Cloud Messaging)
                 await self._send_fcm_push(token, notification)
@@ -96,14 +99,15 @@ class PushNotificationService:
     
     async def send_notification(self, user_id: str, notification: Notification):
         """Отправка уведомления всеми доступными способами"""
+        devices = await self.store.devices(user_id)
         tasks = []
         
         # Отправка веб-push
-        if user_id in self.web_subscriptions:
+        if devices.get(WebPushProvider.name):
             tasks.append(self.send_web_push(user_id, notification))
         
         # Отправка мобильного push
-        if user_id in self.mobile_tokens:
+        if devices.get(FCMProvider.name):
             tasks.append(self.send_mobile_push(user_id, notification))
         
         # Выполняем все задачи параллельно
@@ -121,15 +125,18 @@ class PushNotificationService:
         
         return False
     
-    async def send_bulk_notifications(self, user_ids: List[str], notification: Notification):
-        """Массовая отправка уведомлений"""
-        tasks = [self.send_notification(user_id, notification) for user_id in user_ids]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        success_count = sum(1 for result in results if isinstance(result, bool) and result)
-        logger.info(f"📢 Массовая отправка: {success_count}/{len(user_ids)} успешно")
-        
-        return success_count
+    async def send_bulk_notifications(self, user_ids: Union[Iterable[str], AsyncIterator[str]],
+                                      notification: Notification):
+        """Массовая отправка уведомлений; user_ids - список или асинхронный поток"""
+        stats = await self.dispatcher.dispatch(user_ids, notification)
+        if stats["users_reached"]:
+            notification.sent_at = datetime.now()
+        return stats["users_reached"]
+    
+    async def send_campaign(self, notification: Notification, chunk_size: int = 5000) -> Dict[str, Any]:
+        """Рассылка всем активным пользователям с включенными push; метрики рассылки"""
+        tokens = self.store.stream_campaign_tokens(chunk_size)
+        return await self.dispatcher.dispatch_tokens(tokens, notification)
     
     async def _send_web_push_impl(self, subscription: str, notification: Notification):
         """Реализация отправки веб-push (заглушка)"""
@@ -143,26 +150,26 @@ class PushNotificationService:
         await asyncio.sleep(0.1)  # Имитация отправки
         logger.debug(f"📱 FCM push отправлен: {notification.title}")
     
-    def get_user_subscriptions(self, user_id: str) -> Dict:
+    async def get_user_subscriptions(self, user_id: str) -> Dict:
         """Получение информации о подписках пользователя"""
+        devices = await self.store.devices(user_id)
+        web_push = len(devices.get(WebPushProvider.name, ()))
+        mobile_push = len(devices.get(FCMProvider.name, ()))
         return {
-            "web_push": len(self.web_subscriptions.get(user_id, [])),
-            "mobile_push": len(self.mobile_tokens.get(user_id, [])),
-            "total": len(self.web_subscriptions.get(user_id, [])) + len(self.mobile_tokens.get(user_id, []))
+            "web_push": web_push,
+            "mobile_push": mobile_push,
+            "total": web_push + mobile_push
         }
     
     async def unsubscribe_web_push(self, user_id: str, subscription_info: str):
         """Отписка от веб-push уведомлений"""
-        if user_id in self.web_subscriptions and subscription_info in self.web_subscriptions[user_id]:
-            self.web_subscriptions[user_id].remove(subscription_info)
+        if await self.store.unsubscribe(user_id, WebPushProvider.name, subscription_info):
             logger.info(f"❌ Пользователь {user_id} отписался от веб-push уведомлений")
     
     async def unsubscribe_mobile_push(self, user_id: str, device_token: str):
         """Отписка от мобильных push уведомлений"""
-        if user_id in self.mobile_tokens and device_token in self.mobile_tokens[user_id]:
-            self.mobile_tokens[user_id].remove(device_token)
+        if await self.store.unsubscribe(user_id, FCMProvider.name, device_token):
             logger.info(f"❌ Пользователь {user_id} отписался от мобильных push уведомлений")
 
 # Глобальный экземпляр сервиса
 notification_service = PushNotificationService()
-
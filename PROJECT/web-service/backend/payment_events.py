@@ -0,0 +1,155 @@
+"""
+События платежей PayGo
+confirm_payment пишет payment.completed / payment.failed в event_outbox в
+транзакции смены статуса; потребители потока отправляют push о платеже,
+обновляют счетчики дашборда и реестра терминалов и пишут аудит лог
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import select
+
+from event_outbox import Event, EventConsumer, add_event
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_COMPLETED = "payment.completed"
+PAYMENT_FAILED = "payment.failed"
+
+def add_payment_event(session, transaction, terminal_id: Optional[str]):
+    """Событие о результате платежа в транзакции session (до COMMIT)"""
+    completed = transaction.status == "completed"
+    add_event(
+        session, PAYMENT_COMPLETED if completed else PAYMENT_FAILED,
+        {
+            "transaction_id": transaction.transaction_id,
+            "terminal_id": terminal_id,
+            "amount": float(transaction.amount),
+            "currency": transaction.currency or "RUB",
+            "payment_method": transaction.payment_method,
+            "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
+            "error": None if completed else transaction.bank_response
+        },
+        aggregate_id=transaction.transaction_id, user_id=transaction.user_id
+    )
+
+class TransactionAlerts:
+    """Push о платеже пользователям, у которых включены transaction_alerts, через очередь уведомлений"""
+
+    def __init__(self, queue_provider, session_factory, models_provider):
+        # queue_provider() - NotificationQueue, models_provider() - NotificationSettings
+        self._queue_provider = queue_provider
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+
+    async def __call__(self, events: List[Event]):
+        from notification_service import Notification, NotificationType
+        events = [event for event in events if event.user_id is not None]
+        if not events:
+            return
+        NotificationSettings = self._models_provider()
+        async with self._session_factory() as session:
+            disabled = set((await session.scalars(
+                select(NotificationSettings.user_id).where(
+                    NotificationSettings.user_id.in_({event.user_id for event in events}),
+                    NotificationSettings.transaction_alerts.is_(False)
+                )
+            )).all())
+        notifications = []
+        for event in events:
+            if event.user_id in disabled:
+                continue
+            payload = event.payload
+            if event.type == PAYMENT_COMPLETED:
+                notification_type = NotificationType.TRANSACTION_SUCCESS
+                title, message = "Оплата прошла", f"Списано {payload['amount']:.2f} {payload['currency']}"
+            else:
+                notification_type = NotificationType.TRANSACTION_FAILED
+                title, message = "Платеж отклонен", f"Платеж на {payload['amount']:.2f} {payload['currency']} не выполнен"
+            notifications.append(Notification(
+                user_id=str(event.user_id), type=notification_type, title=title, message=message,
+                data={"transaction_id": payload["transaction_id"]}
+            ))
+        # Одновременные постановки очередь записывает одной транзакцией
+        queue = self._queue_provider()
+        await asyncio.gather(*(queue.enqueue(notification) for notification in notifications))
+
+class PaymentRollups:
+    """Счетчики дашборда и реестра терминалов по завершенным платежам"""
+
+    def __init__(self, snapshot_provider, registry_provider):
+        self._snapshot_provider = snapshot_provider
+        self._registry_provider = registry_provider
+
+    async def __call__(self, events: List[Event]):
+        snapshot = self._snapshot_provider()
+        registry = self._registry_provider()
+        for event in events:
+            payload = event.payload
+            created_at = datetime.fromisoformat(payload["created_at"]) if payload.get("created_at") else event.created_at
+            snapshot.transaction_completed(payload["amount"], created_at)
+            if payload.get("terminal_id"):
+                registry.record_transaction(payload["terminal_id"], payload["amount"])
+
+class PaymentAudit:
+    """Записи аудит лога о результатах платежей"""
+
+    def __init__(self, audit_provider):
+        self._audit_provider = audit_provider
+
+    async def __call__(self, events: List[Event]):
+        from audit_logger import AuditLogEntry, AuditEventType, AuditSeverity
+        audit = self._audit_provider()
+        await asyncio.gather(*(
+            audit.log_event(AuditLogEntry(
+                timestamp=event.created_at,
+                user_id=str(event.user_id) if event.user_id is not None else None,
+                event_type=AuditEventType.PAYMENT_PROCESSED,
+                severity=AuditSeverity.INFO if event.type == PAYMENT_COMPLETED else AuditSeverity.WARNING,
+                description=f"Платеж {event.aggregate_id}: {'выполнен' if event.type == PAYMENT_COMPLETED else 'отклонен'}",
+                details={**event.payload, "event_id": event.id},
+                resource_type="transaction",
+                resource_id=event.aggregate_id,
+                success=event.type == PAYMENT_COMPLETED,
+                error_message=event.payload.get("error")
+            ))
+            for event in events
+        ))
+
+def _read_session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session(read_only=True)
+
+def _settings_model():
+    from database import NotificationSettings
+    return NotificationSettings
+
+def _notification_queue():
+    from notification_queue import notification_queue
+    return notification_queue
+
+def _dashboard_snapshot():
+    from dashboard_snapshot import dashboard_snapshot
+    return dashboard_snapshot
+
+def _terminal_registry():
+    from terminal_registry import terminal_registry
+    return terminal_registry
+
+def _audit_logger():
+    from audit_logger import audit_logger
+    return audit_logger
+
+def payment_consumers() -> List[EventConsumer]:
+    """Потребители событий платежей глобального конвейера"""
+    return [
+        EventConsumer("notifications", TransactionAlerts(_notification_queue, _read_session, _settings_model),
+                      {PAYMENT_COMPLETED, PAYMENT_FAILED}),
+        # Счетчики в памяти пересчитываются из БД при запуске - позиция не хранится
+        EventConsumer("rollups", PaymentRollups(_dashboard_snapshot, _terminal_registry),
+                      {PAYMENT_COMPLETED}, durable=False),
+        EventConsumer("audit", PaymentAudit(_audit_logger), {PAYMENT_COMPLETED, PAYMENT_FAILED})
+    ]
@@ -293,16 +293,18 @@ class PaymentProcessor:
                 )
             
             # Получение основной карты пользователя
-            from database import SessionLocal
+            from sqlalchemy import select
+            from database.connection_pool import db_pool
             from models.card import Card
             
-            db = SessionLocal()
-            try:
-                user_card = db.query(Card).filter(
-                    Card.user_id == transaction.user_id,
-                    Card.is_primary == True,
-                    Card.is_active == True
-                ).first()
+            async with db_pool.get_session() as db:
+                user_card = await db.scalar(
+                    select(Card).where(
+                        Card.user_id == transaction.user_id,
+                        Card.is_primary == True,
+                        Card.is_active == True
+                    )
+                )
                 
                 if not user_card:
                     return PaymentResult(
@@ -325,9 +327,6 @@ class PaymentProcessor:
                     receipt_number=f"BIO{int(datetime.utcnow().timestamp())}"
                 )
                 
-            finally:
-                db.close()
-                
         except Exception as e:
             return PaymentResult(
                 success=False,
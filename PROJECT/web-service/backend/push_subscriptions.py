@@ -0,0 +1,232 @@
+"""
+Подписки на push уведомления PayGo
+Подписки хранятся в таблице push_subscriptions; устройства пользователя
+читаются через кеш процесса и Redis и сбрасываются при изменении, рассылки
+читают подписки курсором, недействительные токены удаляются пачками
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, FrozenSet, AsyncIterator
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("web", "fcm")
+# Токенов в одном DELETE при очистке
+DELETE_CHUNK = 500
+
+def _user_key(user_id) -> int:
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный идентификатор пользователя: {user_id}")
+
+class PushSubscriptionStore:
+    """Подписки пользователей: (провайдер, токен) -> пользователь.
+
+    Первичный ключ (provider, token) дает семантику множества: повторная
+    подписка ничего не меняет, токен, перешедший к другому пользователю,
+    переносится. Устройства пользователя ({провайдер: frozenset токенов})
+    кешируются в процессе на cache_ttl секунд (LRU на cache_size
+    пользователей) и в Redis; запись сбрасывает оба кеша, поэтому другие
+    процессы видят изменения не позже чем через cache_ttl.
+    """
+
+    def __init__(self, session_factory, read_session_factory, models_provider, cache_provider=None,
+                 cache_size: int = 50000, cache_ttl: float = 60.0, redis_ttl: int = 3600):
+        # session_factory() / read_session_factory() - асинхронные контекстные менеджеры сессии,
+        # models_provider() - (PushSubscription, User, NotificationSettings),
+        # cache_provider() - RedisCache или None
+        self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self._models_provider = models_provider
+        self._cache_provider = cache_provider
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.redis_ttl = redis_ttl
+        # пользователь -> (истекает, устройства)
+        self._local: "OrderedDict[int, Tuple[float, Dict[str, FrozenSet[str]]]]" = OrderedDict()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "loads": 0, "subscribed": 0, "unsubscribed": 0, "invalid_removed": 0}
+
+    # Кеш
+
+    def _redis(self):
+        return self._cache_provider() if self._cache_provider else None
+
+    @staticmethod
+    def _redis_key(user_id: int) -> str:
+        return f"push:devices:{user_id}"
+
+    def _remember(self, user_id: int, devices: Dict[str, FrozenSet[str]]):
+        self._local[user_id] = (time.monotonic() + self.cache_ttl, devices)
+        self._local.move_to_end(user_id)
+        while len(self._local) > self.cache_size:
+            self._local.popitem(last=False)
+
+    async def _invalidate(self, user_ids):
+        redis = self._redis()
+        for user_id in set(user_ids):
+            self._local.pop(user_id, None)
+            if redis is not None:
+                await redis.delete(self._redis_key(user_id))
+
+    async def devices(self, user_id) -> Dict[str, FrozenSet[str]]:
+        """Устройства пользователя по провайдерам; словарь общий с кешем, не изменять"""
+        user_id = _user_key(user_id)
+        cached = self._local.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._local.move_to_end(user_id)
+            self.stats["local_hits"] += 1
+            return cached[1]
+        redis = self._redis()
+        if redis is not None:
+            stored = await redis.get_data(self._redis_key(user_id))
+            if isinstance(stored, dict):
+                self.stats["redis_hits"] += 1
+                devices = {provider: frozenset(tokens) for provider, tokens in stored.items()}
+                self._remember(user_id, devices)
+                return devices
+        PushSubscription, _, _ = self._models_provider()
+        async with self._session_factory() as session:
+            rows = (await session.execute(
+                select(PushSubscription.provider, PushSubscription.token).where(PushSubscription.user_id == user_id)
+            )).all()
+        grouped: Dict[str, set] = {}
+        for provider, token in rows:
+            grouped.setdefault(provider, set()).add(token)
+        devices = {provider: frozenset(tokens) for provider, tokens in grouped.items()}
+        self.stats["loads"] += 1
+        self._remember(user_id, devices)
+        if redis is not None:
+            await redis.set_data(self._redis_key(user_id), {p: sorted(t) for p, t in devices.items()}, self.redis_ttl)
+        return devices
+
+    # Запись
+
+    async def subscribe(self, user_id, provider: str, token: str) -> bool:
+        """Подписка устройства; False - уже была у этого пользователя"""
+        if provider not in PROVIDERS:
+            raise ValueError(f"Неизвестный провайдер push: {provider}")
+        user_id = _user_key(user_id)
+        PushSubscription, _, _ = self._models_provider()
+        for _ in range(3):
+            async with self._session_factory() as session:
+                owner = await session.scalar(
+                    select(PushSubscription.user_id).where(
+                        PushSubscription.provider == provider, PushSubscription.token == token
+                    )
+                )
+                if owner == user_id:
+                    return False
+                if owner is None:
+                    session.add(PushSubscription(provider=provider, token=token, user_id=user_id))
+                else:
+                    # Устройство перешло к другому пользователю
+                    subscription = await session.get(PushSubscription, (provider, token))
+                    subscription.user_id = user_id
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # Параллельная подписка того же токена - повтор с чтения владельца
+                    await session.rollback()
+                    continue
+            await self._invalidate([user_id] + ([owner] if owner is not None else []))
+            self.stats["subscribed"] += 1
+            return True
+        raise RuntimeError(f"Не удалось сохранить подписку {provider} пользователя {user_id}")
+
+    async def unsubscribe(self, user_id, provider: str, token: str) -> bool:
+        user_id = _user_key(user_id)
+        PushSubscription, _, _ = self._models_provider()
+        async with self._session_factory() as session:
+            result = await session.execute(
+                delete(PushSubscription).where(
+                    PushSubscription.provider == provider, PushSubscription.token == token,
+                    PushSubscription.user_id == user_id
+                )
+            )
+            await session.commit()
+        await self._invalidate([user_id])
+        if result.rowcount:
+            self.stats["unsubscribed"] += 1
+        return bool(result.rowcount)
+
+    async def remove_invalid(self, provider: str, tokens: List[Tuple[str, str]]) -> int:
+        """Удаление токенов, отклоненных провайдером: (пользователь, токен), DELETE на DELETE_CHUNK токенов"""
+        PushSubscription, _, _ = self._models_provider()
+        removed = 0
+        async with self._session_factory() as session:
+            for start in range(0, len(tokens), DELETE_CHUNK):
+                chunk = [token for _, token in tokens[start:start + DELETE_CHUNK]]
+                result = await session.execute(
+                    delete(PushSubscription).where(
+                        PushSubscription.provider == provider, PushSubscription.token.in_(chunk)
+                    )
+                )
+                removed += result.rowcount
+            await session.commit()
+        await self._invalidate(_user_key(user_id) for user_id, _ in tokens)
+        self.stats["invalid_removed"] += removed
+        return removed
+
+    # Рассылки
+
+    async def tokens_for_users(self, user_ids: List[str]) -> List[Tuple[str, str, str]]:
+        """(провайдер, пользователь, токен) порции пользователей одним запросом, без кеша"""
+        PushSubscription, _, _ = self._models_provider()
+        keys = [int(user_id) for user_id in user_ids if str(user_id).isdigit()]
+        if not keys:
+            return []
+        async with self._read_session_factory() as session:
+            rows = (await session.execute(
+                select(PushSubscription.provider, PushSubscription.user_id, PushSubscription.token)
+                .where(PushSubscription.user_id.in_(keys))
+            )).all()
+        return [(provider, str(user_id), token) for provider, user_id, token in rows]
+
+    async def stream_campaign_tokens(self, chunk_size: int = 5000) -> AsyncIterator[List[Tuple[str, str, str]]]:
+        """Подписки активных пользователей с включенными push порциями, курсором по user_id"""
+        PushSubscription, User, NotificationSettings = self._models_provider()
+        async with self._read_session_factory() as session:
+            result = await session.stream(
+                select(PushSubscription.provider, PushSubscription.user_id, PushSubscription.token)
+                .join(User, User.id == PushSubscription.user_id)
+                .outerjoin(NotificationSettings, NotificationSettings.user_id == User.id)
+                .where(User.is_active.is_(True), or_(
+                    NotificationSettings.push_notifications.is_(None),
+                    NotificationSettings.push_notifications.is_(True)
+                ))
+                .order_by(PushSubscription.user_id)
+                .execution_options(yield_per=chunk_size)
+            )
+            async for rows in result.partitions(chunk_size):
+                yield [(provider, str(user_id), token) for provider, user_id, token in rows]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "cached_users": len(self._local)}
+
+def _session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session()
+
+def _read_session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session(read_only=True)
+
+def _subscription_models():
+    from database import PushSubscription, User, NotificationSettings
+    return PushSubscription, User, NotificationSettings
+
+def _redis_cache():
+    try:
+        from cache.redis_cache import redis_cache
+    except ImportError:
+        return None
+    return redis_cache
+
+# Глобальное хранилище подписок на push
+push_subscription_store = PushSubscriptionStore(_session, _read_session, _subscription_models, _redis_cache)
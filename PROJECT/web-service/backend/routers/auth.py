@@ -1,10 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, or_
 from datetime import datetime, timedelta
 
 from models.user import User, UserCreate, UserLogin, Token, UserResponse
 from database import get_db
+from dashboard_snapshot import dashboard_snapshot
 from auth_utils import (
     create_access_token, 
     create_refresh_token,
@@ -19,13 +21,13 @@ router = APIRouter()
 security = HTTPBearer()
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """Регистрация нового пользователя"""
     
     # Проверка существования пользователя
-    existing_user = db.query(User).filter(
-        (User.email == user_data.email) | (User.phone == user_data.phone)
-    ).first()
+    existing_user = await db.scalar(
+        select(User).where(or_(User.email == user_data.email, User.phone == user_data.phone))
+    )
     
     if existing_user:
         raise HTTPException(
@@ -47,17 +49,18 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    dashboard_snapshot.user_created(db_user.is_active, db_user.is_verified)
     
     return db_user
 
 @router.post("/login", response_model=Token)
-async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_db)):
     """Вход пользователя в систему"""
     
     # Поиск пользователя
-    user = db.query(User).filter(User.email == user_credentials.email).first()
+    user = await db.scalar(select(User).where(User.email == user_credentials.email))
     
     if not user or not verify_password(user_credentials.password, user.hashed_password):
         raise HTTPException(
@@ -78,7 +81,7 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     
     # Обновление времени последнего входа
     user.last_login = datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     return {
         "access_token": access_token,
@@ -87,7 +90,7 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     }
 
 @router.post("/refresh", response_model=Token)
-async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
+async def refresh_token(refresh_token: str, db: AsyncSession = Depends(get_db)):
     """Обновление access токена по refresh токену"""
     
     try:
@@ -108,7 +111,7 @@ async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
         )
     
     # Проверка пользователя
-    user = db.query(User).filter(User.id == int(user_id)).first()
+    user = await db.get(User, int(user_id))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -140,7 +143,7 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 @router.post("/verify-email")
-async def verify_email(token: str, db: Session = Depends(get_db)):
+async def verify_email(token: str, db: AsyncSession = Depends(get_db)):
     """Верификация email по токену"""
     
     # Здесь должна быть логика верификации email
@@ -149,10 +152,10 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
     return {"message": "Email успешно подтвержден"}
 
 @router.post("/forgot-password")
-async def forgot_password(email: str, db: Session = Depends(get_db)):
+async def forgot_password(email: str, db: AsyncSession = Depends(get_db)):
     """Запрос восстановления пароля"""
     
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         # В целях безопасности не сообщаем, что пользователь не найден
         return {"message": "Если email существует, письмо с инструкциями отправлено"}
@@ -163,7 +166,7 @@ async def forgot_password(email: str, db: Session = Depends(get_db)):
     return {"message": "Письмо с инструкциями отправлено"}
 
 @router.post("/reset-password")
-async def reset_password(token: str, new_password: str, db: Session = Depends(get_db)):
+async def reset_password(token: str, new_password: str, db: AsyncSession = Depends(get_db)):
     """Сброс пароля по токену"""
     
     # Здесь должна быть логика проверки токена сброса пароля
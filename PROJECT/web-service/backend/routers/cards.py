@@ -1,16 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 import uuid
 import hashlib
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, select, update
 
 from models.card import (
     Card, CardCreate, CardUpdate, CardResponse, CardStats,
     CardBindingRequest, CardBindingResponse, CardVerification
 )
 from database import get_db
+from dashboard_snapshot import dashboard_snapshot
 from auth_utils import get_current_user, get_current_admin_user
 from models.user import User
 from card_tokenizer import tokenize_card, generate_card_mask
@@ -20,18 +21,20 @@ router = APIRouter()
 @router.get("/", response_model=List[CardResponse])
 async def get_my_cards(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение списка карт текущего пользователя"""
     
-    cards = db.query(Card).filter(Card.user_id == current_user.id).order_by(Card.created_at.desc()).all()
-    return cards
+    cards = await db.scalars(
+        select(Card).where(Card.user_id == current_user.id).order_by(Card.created_at.desc())
+    )
+    return cards.all()
 
 @router.post("/", response_model=CardResponse, status_code=status.HTTP_201_CREATED)
 async def add_card(
     card_data: CardCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Добавление новой карты"""
     
@@ -40,7 +43,7 @@ async def add_card(
         card_token = tokenize_card(card_data.card_number)
         
         # Проверка, что карта не добавлена ранее
-        existing_card = db.query(Card).filter(Card.card_token == card_token).first()
+        existing_card = await db.scalar(select(Card).where(Card.card_token == card_token))
         if existing_card:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -56,7 +59,7 @@ async def add_card(
         #     raise HTTPException(status_code=400, detail="Карта не прошла верификацию")
         
         # Определение, будет ли эта карта основной
-        is_primary = db.query(Card).filter(Card.user_id == current_user.id).count() == 0
+        is_primary = await db.scalar(select(func.count(Card.id)).where(Card.user_id == current_user.id)) == 0
         
         # Создание записи карты
         db_card = Card(
@@ -73,8 +76,9 @@ async def add_card(
         )
         
         db.add(db_card)
-        db.commit()
-        db.refresh(db_card)
+        await db.commit()
+        await db.refresh(db_card)
+        dashboard_snapshot.card_added(db_card.is_active)
         
         return db_card
         
@@ -93,11 +97,11 @@ async def add_card(
 async def get_card(
     card_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение информации о карте"""
     
-    card = db.query(Card).filter(Card.id == card_id).first()
+    card = await db.get(Card, card_id)
     if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -119,11 +123,11 @@ async def update_card(
     card_id: int,
     card_update: CardUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Обновление информации о карте"""
     
-    card = db.query(Card).filter(Card.id == card_id).first()
+    card = await db.get(Card, card_id)
     if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -142,13 +146,15 @@ async def update_card(
     
     # Если устанавливаем карту как основную, сбрасываем флаг у других карт
     if update_data.get("is_primary") == True:
-        db.query(Card).filter(Card.user_id == current_user.id, Card.id != card_id).update({"is_primary": False})
+        await db.execute(
+            update(Card).where(Card.user_id == current_user.id, Card.id != card_id).values(is_primary=False)
+        )
     
     for field, value in update_data.items():
         setattr(card, field, value)
     
-    db.commit()
-    db.refresh(card)
+    await db.commit()
+    await db.refresh(card)
     
     return card
 
@@ -156,11 +162,11 @@ async def update_card(
 async def delete_card(
     card_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Удаление карты"""
     
-    card = db.query(Card).filter(Card.id == card_id).first()
+    card = await db.get(Card, card_id)
     if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -176,17 +182,19 @@ async def delete_card(
     
     # Если удаляем основную карту, назначаем другую основной
     if card.is_primary:
-        other_card = db.query(Card).filter(
-            Card.user_id == current_user.id,
-            Card.id != card_id,
-            Card.is_active == True
-        ).first()
+        other_card = await db.scalar(
+            select(Card).where(
+                Card.user_id == current_user.id,
+                Card.id != card_id,
+                Card.is_active == True
+            )
+        )
         
         if other_card:
             other_card.is_primary = True
     
-    db.delete(card)
-    db.commit()
+    await db.delete(card)
+    await db.commit()
     
     return {"message": "Карта успешно удалена"}
 
@@ -194,11 +202,11 @@ async def delete_card(
 async def set_primary_card(
     card_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Установка карты как основной"""
     
-    card = db.query(Card).filter(Card.id == card_id).first()
+    card = await db.get(Card, card_id)
     if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -219,11 +227,11 @@ async def set_primary_card(
         )
     
     # Сброс флага у других карт
-    db.query(Card).filter(Card.user_id == current_user.id).update({"is_primary": False})
+    await db.execute(update(Card).where(Card.user_id == current_user.id).values(is_primary=False))
     
     # Установка флага для выбранной карты
     card.is_primary = True
-    db.commit()
+    await db.commit()
     
     return {"message": "Карта установлена как основная"}
 
@@ -231,11 +239,11 @@ async def set_primary_card(
 async def verify_card(
     card_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Верификация карты малой суммой"""
     
-    card = db.query(Card).filter(Card.id == card_id).first()
+    card = await db.get(Card, card_id)
     if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -279,7 +287,7 @@ async def verify_card(
 async def create_card_binding(
     binding_request: CardBindingRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Создание запроса на привязку карты через банк"""
     
@@ -310,33 +318,45 @@ async def create_card_binding(
 @router.get("/stats/my", response_model=CardStats)
 async def get_my_card_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение статистики по картам текущего пользователя"""
     
     # Подсчет карт
-    total_cards = db.query(Card).filter(Card.user_id == current_user.id).count()
-    active_cards = db.query(Card).filter(Card.user_id == current_user.id, Card.is_active == True).count()
-    verified_cards = db.query(Card).filter(Card.user_id == current_user.id, Card.is_verified == True).count()
+    total_cards = await db.scalar(select(func.count(Card.id)).where(Card.user_id == current_user.id))
+    active_cards = await db.scalar(
+        select(func.count(Card.id)).where(Card.user_id == current_user.id, Card.is_active == True)
+    )
+    verified_cards = await db.scalar(
+        select(func.count(Card.id)).where(Card.user_id == current_user.id, Card.is_verified == True)
+    )
     
     # Подсчет транзакций
     from models.transaction import Transaction
-    transactions_count = db.query(Transaction).filter(Transaction.user_id == current_user.id).count()
-    total_spent = db.query(func.sum(Transaction.amount)).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.status == "completed"
-    ).scalar() or 0.0
+    transactions_count = await db.scalar(
+        select(func.count(Transaction.id)).where(Transaction.user_id == current_user.id)
+    )
+    total_spent = await db.scalar(
+        select(func.sum(Transaction.amount)).where(
+            Transaction.user_id == current_user.id,
+            Transaction.status == "completed"
+        )
+    ) or 0.0
     
     # Статистика по платежным системам
-    payment_systems = db.query(Card.payment_system, func.count(Card.id)).filter(
-        Card.user_id == current_user.id
-    ).group_by(Card.payment_system).all()
+    payment_systems = await db.execute(
+        select(Card.payment_system, func.count(Card.id))
+        .where(Card.user_id == current_user.id)
+        .group_by(Card.payment_system)
+    )
     by_payment_system = {system: count for system, count in payment_systems}
     
     # Статистика по банкам
-    banks = db.query(Card.bank_issuer, func.count(Card.id)).filter(
-        Card.user_id == current_user.id
-    ).group_by(Card.bank_issuer).all()
+    banks = await db.execute(
+        select(Card.bank_issuer, func.count(Card.id))
+        .where(Card.user_id == current_user.id)
+        .group_by(Card.bank_issuer)
+    )
     by_bank = {bank: count for bank, count in banks}
     
     stats = CardStats(
@@ -360,14 +380,14 @@ async def get_all_cards(
     limit: int = Query(100, ge=1, le=1000),
     user_id: Optional[int] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение всех карт (только для администраторов)"""
     
-    query = db.query(Card)
+    query = select(Card)
     
     if user_id:
-        query = query.filter(Card.user_id == user_id)
+        query = query.where(Card.user_id == user_id)
     
-    cards = query.offset(skip).limit(limit).all()
-    return cards 
\ No newline at end of file
+    cards = await db.scalars(query.offset(skip).limit(limit))
+    return cards.all() 
\ No newline at end of file
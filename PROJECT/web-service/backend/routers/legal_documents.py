@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from typing import List, Optional
 import logging
 
@@ -10,10 +11,9 @@ from schemas.legal_documents import (
     DocumentAcceptanceRequest, DocumentAcceptanceResponse,
     UserDocumentsStatus, DocumentVersionHistory
 )
-from models.legal_documents import DocumentType
-from auth.dependencies import get_current_user, get_current_admin_user
+from models.legal_documents import DocumentType, UserDocumentAcceptance
+from auth_utils import get_current_user, get_current_admin_user
 from models.user import User
-from models.user_document_acceptance import UserDocumentAcceptance
 
 router = APIRouter(prefix="/api/legal", tags=["Правовые документы"])
 logger = logging.getLogger(__name__)
@@ -21,11 +21,11 @@ logger = logging.getLogger(__name__)
 @router.get("/documents/{document_type}", response_model=LegalDocumentResponse)
 async def get_active_document(
     document_type: DocumentType,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение активного документа по типу"""
     service = LegalDocumentsService(db)
-    document = service.get_active_document(document_type)
+    document = await service.get_active_document(document_type)
     
     if not document:
         raise HTTPException(
@@ -38,37 +38,37 @@ async def get_active_document(
 @router.get("/documents/{document_type}/history", response_model=List[dict])
 async def get_document_history(
     document_type: DocumentType,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение истории версий документа"""
     service = LegalDocumentsService(db)
-    return service.get_document_version_history(document_type)
+    return await service.get_document_version_history(document_type)
 
 @router.get("/documents/{document_type}/versions", response_model=List[LegalDocumentResponse])
 async def get_document_versions(
     document_type: DocumentType,
     include_inactive: bool = False,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение всех версий документа по типу"""
     service = LegalDocumentsService(db)
-    return service.get_documents_by_type(document_type, include_inactive)
+    return await service.get_documents_by_type(document_type, include_inactive)
 
 @router.get("/user/status", response_model=UserDocumentsStatus)
 async def get_user_documents_status(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение статуса документов текущего пользователя"""
     service = LegalDocumentsService(db)
-    return service.get_user_documents_status(current_user.id)
+    return await service.get_user_documents_status(current_user.id)
 
 @router.post("/user/accept", response_model=DocumentAcceptanceResponse)
 async def accept_document(
     acceptance_data: DocumentAcceptanceRequest,
     request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Принятие документа пользователем"""
     service = LegalDocumentsService(db)
@@ -77,7 +77,7 @@ async def accept_document(
     ip_address = request.client.host if request.client else None
     user_agent = request.headers.get("user-agent")
     
-    success = service.accept_document(
+    success = await service.accept_document(
         user_id=current_user.id,
         document_id=acceptance_data.document_id,
         ip_address=ip_address or acceptance_data.ip_address,
@@ -91,46 +91,48 @@ async def accept_document(
         )
     
     # Получаем информацию о принятии
-    acceptance = db.query(UserDocumentAcceptance).filter(
-        UserDocumentAcceptance.user_id == current_user.id,
-        UserDocumentAcceptance.document_id == acceptance_data.document_id
-    ).first()
+    acceptance = await db.scalar(
+        select(UserDocumentAcceptance).where(
+            UserDocumentAcceptance.user_id == current_user.id,
+            UserDocumentAcceptance.document_id == acceptance_data.document_id
+        )
+    )
     
     return acceptance
 
 @router.get("/user/acceptances", response_model=List[DocumentAcceptanceResponse])
 async def get_user_acceptances(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение всех принятых пользователем документов"""
-    acceptances = db.query(UserDocumentAcceptance).filter(
-        UserDocumentAcceptance.user_id == current_user.id
-    ).all()
+    acceptances = await db.scalars(
+        select(UserDocumentAcceptance).where(UserDocumentAcceptance.user_id == current_user.id)
+    )
     
-    return acceptances
+    return acceptances.all()
 
 # Административные endpoints
 @router.post("/admin/documents", response_model=LegalDocumentResponse)
 async def create_document(
     document_data: LegalDocumentCreate,
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Создание нового правового документа (только для администраторов)"""
     service = LegalDocumentsService(db)
-    return service.create_document(document_data)
+    return await service.create_document(document_data)
 
 @router.put("/admin/documents/{document_id}", response_model=LegalDocumentResponse)
 async def update_document(
     document_id: int,
     update_data: LegalDocumentUpdate,
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Обновление правового документа (только для администраторов)"""
     service = LegalDocumentsService(db)
-    document = service.update_document(document_id, update_data)
+    document = await service.update_document(document_id, update_data)
     
     if not document:
         raise HTTPException(
@@ -144,11 +146,11 @@ async def update_document(
 async def deactivate_document(
     document_id: int,
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Деактивация правового документа (только для администраторов)"""
     service = LegalDocumentsService(db)
-    success = service.deactivate_document(document_id)
+    success = await service.deactivate_document(document_id)
     
     if not success:
         raise HTTPException(
@@ -162,34 +164,34 @@ async def deactivate_document(
 async def get_document_stats(
     document_id: int,
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение статистики принятия документа (только для администраторов)"""
     service = LegalDocumentsService(db)
-    return service.get_document_acceptance_stats(document_id)
+    return await service.get_document_acceptance_stats(document_id)
 
 @router.get("/admin/documents", response_model=List[LegalDocumentResponse])
 async def get_all_documents(
     include_inactive: bool = False,
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение всех документов (только для администраторов)"""
     service = LegalDocumentsService(db)
     documents = []
     
     for doc_type in DocumentType:
-        docs = service.get_documents_by_type(doc_type, include_inactive)
+        docs = await service.get_documents_by_type(doc_type, include_inactive)
         documents.extend(docs)
     
     return documents
 
 # Публичные endpoints для отображения документов
 @router.get("/public/offer")
-async def get_public_offer(db: Session = Depends(get_db)):
+async def get_public_offer(db: AsyncSession = Depends(get_db)):
     """Публичный доступ к оферте"""
     service = LegalDocumentsService(db)
-    document = service.get_active_document(DocumentType.OFFER)
+    document = await service.get_active_document(DocumentType.OFFER)
     
     if not document:
         raise HTTPException(
@@ -208,10 +210,10 @@ async def get_public_offer(db: Session = Depends(get_db)):
     }
 
 @router.get("/public/terms")
-async def get_public_terms(db: Session = Depends(get_db)):
+async def get_public_terms(db: AsyncSession = Depends(get_db)):
     """Публичный доступ к условиям использования"""
     service = LegalDocumentsService(db)
-    document = service.get_active_document(DocumentType.TERMS)
+    document = await service.get_active_document(DocumentType.TERMS)
     
     if not document:
         raise HTTPException(
@@ -230,10 +232,10 @@ async def get_public_terms(db: Session = Depends(get_db)):
     }
 
 @router.get("/public/privacy")
-async def get_public_privacy(db: Session = Depends(get_db)):
+async def get_public_privacy(db: AsyncSession = Depends(get_db)):
     """Публичный доступ к политике конфиденциальности"""
     service = LegalDocumentsService(db)
-    document = service.get_active_document(DocumentType.PRIVACY)
+    document = await service.get_active_document(DocumentType.PRIVACY)
     
     if not document:
         raise HTTPException(
@@ -1,47 +1,58 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request, Response, WebSocket
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+import zlib
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import case, func, select
 
 from models.terminal import (
-    Terminal, TerminalCreate, TerminalUpdate, TerminalResponse,
-    TerminalHeartbeat, TerminalConfig, TerminalStats, TerminalStatus
+    TerminalCreate, TerminalUpdate, TerminalResponse,
+    TerminalHeartbeat, TerminalConfig, TerminalStats, TerminalStatus, TerminalCommandCreate, PaymentMethod
 )
-from database import get_db
+from database import Terminal, Transaction, User, get_db, get_read_db
+from database.connection_pool import db_pool
+from dashboard_snapshot import dashboard_snapshot
+from terminal_registry import terminal_registry
 from auth_utils import get_current_user, get_current_admin_user
-from models.user import User
+from models.transaction import TransactionStatus
+from heartbeat_history import heartbeat_history
+from terminal_channel import terminal_channel
+from terminal_config import terminal_config_store, KEEP_TEMPLATE
+from log_ingest import log_ingestor, IngestBusy, UnsupportedEncoding, BatchTooLarge
 
 router = APIRouter()
 
+PATCH_MEDIA_TYPE = "application/json-patch+json"
+
 @router.get("/", response_model=List[TerminalResponse])
 async def get_terminals(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     status: Optional[TerminalStatus] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Получение списка терминалов (только для администраторов)"""
     
-    query = db.query(Terminal)
+    query = select(Terminal)
     
     if status:
-        query = query.filter(Terminal.status == status)
+        query = query.where(Terminal.status == status)
     
-    terminals = query.offset(skip).limit(limit).all()
-    return terminals
+    terminals = await db.scalars(query.offset(skip).limit(limit))
+    return terminals.all()
 
 @router.post("/", response_model=TerminalResponse, status_code=status.HTTP_201_CREATED)
 async def create_terminal(
     terminal_data: TerminalCreate,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Создание нового терминала"""
     
-    # Проверка уникальности terminal_id
-    existing_terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_data.terminal_id).first()
+    # Проверка уникальности серийного номера
+    existing_terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_data.serial_number))
     if existing_terminal:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -50,17 +61,29 @@ async def create_terminal(
     
     # Создание терминала
     db_terminal = Terminal(
-        terminal_id=terminal_data.terminal_id,
+        serial_number=terminal_data.serial_number,
         name=terminal_data.name,
         location=terminal_data.location,
         address=terminal_data.address,
+        latitude=terminal_data.latitude,
+        longitude=terminal_data.longitude,
+        supported_payment_methods=terminal_data.supported_payment_methods,
         terminal_type=terminal_data.terminal_type,
+        model=terminal_data.model,
+        manufacturer=terminal_data.manufacturer,
+        is_active=terminal_data.is_active,
         status=TerminalStatus.OFFLINE
     )
     
     db.add(db_terminal)
-    db.commit()
-    db.refresh(db_terminal)
+    await db.commit()
+    await db.refresh(db_terminal)
+    dashboard_snapshot.terminal_created(db_terminal.status)
+    terminal_registry.upsert(
+        db_terminal.serial_number, db_terminal.name, db_terminal.location, db_terminal.status,
+        latitude=db_terminal.latitude, longitude=db_terminal.longitude,
+        payment_methods=db_terminal.supported_payment_methods
+    )
     
     return db_terminal
 
@@ -68,11 +91,11 @@ async def create_terminal(
 async def get_terminal(
     terminal_id: str,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение информации о терминале"""
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -86,11 +109,11 @@ async def update_terminal(
     terminal_id: str,
     terminal_update: TerminalUpdate,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Обновление информации о терминале"""
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -103,8 +126,12 @@ async def update_terminal(
         setattr(terminal, field, value)
     
     terminal.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(terminal)
+    await db.commit()
+    await db.refresh(terminal)
+    terminal_registry.update_info(
+        terminal.serial_number, terminal.name, terminal.location,
+        terminal.latitude, terminal.longitude, terminal.supported_payment_methods
+    )
     
     return terminal
 
@@ -112,30 +139,31 @@ async def update_terminal(
 async def delete_terminal(
     terminal_id: str,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Удаление терминала"""
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Терминал не найден"
         )
     
-    db.delete(terminal)
-    db.commit()
+    await db.delete(terminal)
+    await db.commit()
+    terminal_registry.remove(terminal_id)
     
     return {"message": "Терминал успешно удален"}
 
 @router.post("/heartbeat")
 async def terminal_heartbeat(
     heartbeat_data: TerminalHeartbeat,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение heartbeat от терминала"""
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == heartbeat_data.terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == heartbeat_data.terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -143,74 +171,179 @@ async def terminal_heartbeat(
         )
     
     # Обновление статуса и времени последнего heartbeat
+    previous_status = terminal.status
     terminal.status = heartbeat_data.status
-    terminal.last_heartbeat = datetime.utcnow()
-    
-    if heartbeat_data.ip_address:
-        terminal.ip_address = heartbeat_data.ip_address
+    terminal.last_ping = datetime.utcnow()
     
     if heartbeat_data.hardware_info:
         terminal.hardware_info = heartbeat_data.hardware_info
     
-    if heartbeat_data.current_transaction_count is not None:
-        terminal.total_transactions = heartbeat_data.current_transaction_count
-    
-    db.commit()
+    await db.commit()
+    dashboard_snapshot.terminal_status_changed(previous_status, terminal.status)
+    terminal_registry.heartbeat(
+        terminal.serial_number, terminal.status, terminal.last_ping,
+        heartbeat_data.current_transaction_count
+    )
+    heartbeat_history.record(terminal.id, terminal.last_ping, terminal.status)
     
     return {"message": "Heartbeat получен", "terminal_status": "updated"}
 
+@router.post("/{terminal_id}/logs", status_code=status.HTTP_202_ACCEPTED)
+async def ingest_terminal_logs(
+    terminal_id: str,
+    request: Request
+):
+    """Пакет логов терминала: NDJSON, сжатие по Content-Encoding (gzip, zstd).
+    
+    Сессия нужна только для поиска id терминала и закрывается до чтения тела:
+    медленная загрузка не держит соединение пула.
+    """
+    
+    terminal_pk = None
+    if terminal_registry.get(terminal_id) is not None:
+        async with db_pool.get_session(read_only=True) as db:
+            terminal_pk = await db.scalar(select(Terminal.id).where(Terminal.serial_number == terminal_id))
+    if terminal_pk is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Терминал не найден"
+        )
+    
+    try:
+        return await log_ingestor.ingest(terminal_pk, request.stream(), request.headers.get("content-encoding"))
+    except IngestBusy as e:
+        # Терминал повторяет пакет со строки resume_from через Retry-After секунд
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": str(e), "resume_from": e.resume_from},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except UnsupportedEncoding as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    except BatchTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except zlib.error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Поврежденный gzip")
+
+@router.put("/config-templates/{name}")
+async def update_config_template(
+    name: str,
+    config: TerminalConfig,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Новая версия общего шаблона конфигурации парка"""
+    
+    version = await terminal_config_store.update_template(name, config.dict(exclude_unset=True))
+    # Терминалы шаблона запросят изменения по своему ETag
+    await terminal_channel.broadcast("config_template", {"template": name, "version": version})
+    
+    return {"message": "Шаблон конфигурации обновлен", "template": name, "version": version}
+
 @router.get("/{terminal_id}/config", response_model=TerminalConfig)
 async def get_terminal_config(
     terminal_id: str,
-    db: Session = Depends(get_db)
+    request: Request
 ):
-    """Получение конфигурации терминала"""
+    """Получение конфигурации терминала.
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
-    if not terminal:
+    ETag - пара версий (терминал, шаблон). Совпадение If-None-Match - 304;
+    с заголовком Accept: application/json-patch+json возвращается JSON Patch
+    от версии клиента вместо полной конфигурации.
+    """
+    
+    state, patch = await terminal_config_store.poll(
+        terminal_id,
+        request.headers.get("if-none-match"),
+        patch=PATCH_MEDIA_TYPE in request.headers.get("accept", "")
+    )
+    if state is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Терминал не найден"
         )
     
-    # Если конфигурации нет, возвращаем дефолтную
-    if not terminal.config:
-        return TerminalConfig()
-    
-    return TerminalConfig(**terminal.config)
+    headers = {"ETag": state.etag, "X-Config-Hash": state.content_hash, "Cache-Control": "no-cache"}
+    if patch == []:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if patch is not None:
+        return JSONResponse(patch, media_type=PATCH_MEDIA_TYPE, headers=headers)
+    # Конфигурация проверена при записи, повторная валидация не нужна
+    return JSONResponse(state.config, headers=headers)
 
 @router.put("/{terminal_id}/config")
 async def update_terminal_config(
     terminal_id: str,
     config: TerminalConfig,
+    template: Optional[str] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Обновление конфигурации терминала"""
+    """Обновление конфигурации терминала: новая версия с явно заданными параметрами.
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+    Незаданные параметры берутся из шаблона парка (template) и значений по умолчанию.
+    """
+    
+    terminal = await db.scalar(select(Terminal.id).where(Terminal.serial_number == terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Терминал не найден"
         )
     
-    terminal.config = config.dict()
-    terminal.updated_at = datetime.utcnow()
-    db.commit()
+    state, patch = await terminal_config_store.update_terminal(
+        terminal_id, config.dict(exclude_unset=True), template if template is not None else KEEP_TEMPLATE
+    )
+    # Терминалу отправляются только изменения
+    if patch:
+        await terminal_channel.send(terminal_id, "config", {"etag": state.etag, "patch": patch})
+    
+    return {"message": "Конфигурация обновлена", "etag": state.etag, "content_hash": state.content_hash}
+
+@router.post("/{terminal_id}/commands")
+async def send_terminal_command(
+    terminal_id: str,
+    command: TerminalCommandCreate,
+    current_user: User = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Отправка команды терминалу через канал WebSocket"""
     
-    return {"message": "Конфигурация обновлена"}
+    terminal = await db.scalar(select(Terminal.id).where(Terminal.serial_number == terminal_id))
+    if not terminal:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Терминал не найден"
+        )
+    
+    seq = await terminal_channel.send(terminal_id, "command", command.dict())
+    # Неподключенный терминал получит команду при следующем подключении
+    return {"message": "Команда поставлена в очередь", "seq": seq}
+
+@router.websocket("/{terminal_id}/channel")
+async def terminal_channel_socket(
+    websocket: WebSocket,
+    terminal_id: str
+):
+    """Канал команд и конфигурации терминала.
+    
+    Существование терминала проверяется по реестру в памяти, чтобы соединения
+    не занимали сессии базы данных.
+    """
+    if terminal_registry.get(terminal_id) is None:
+        await websocket.close(code=4404)
+        return
+    await terminal_channel.serve(websocket, terminal_id)
 
 @router.get("/{terminal_id}/stats", response_model=TerminalStats)
 async def get_terminal_stats(
     terminal_id: str,
     days: int = Query(30, ge=1, le=365),
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Получение статистики терминала"""
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -221,40 +354,77 @@ async def get_terminal_stats(
     period_end = datetime.utcnow()
     period_start = period_end - timedelta(days=days)
     
-    # Здесь должна быть логика подсчета статистики из транзакций
-    # Пока возвращаем заглушку
+    # Транзакции периода одним запросом с условной агрегацией
+    transactions_count, successful_transactions, failed_transactions, total_amount = (await db.execute(
+        select(
+            func.count(Transaction.id),
+            func.count(case((Transaction.status == TransactionStatus.COMPLETED, 1))),
+            func.count(case((Transaction.status == TransactionStatus.FAILED, 1))),
+            func.sum(case((Transaction.status == TransactionStatus.COMPLETED, Transaction.amount), else_=0))
+        ).where(
+            Transaction.terminal_id == terminal.id,
+            Transaction.created_at >= period_start,
+            Transaction.created_at < period_end
+        )
+    )).one()
+    total_amount = float(total_amount or 0.0)
+    
+    # Аптайм и интервалы в статусе error из истории heartbeat
+    uptime = await heartbeat_history.terminal_uptime(terminal.id, period_start, period_end)
     
     stats = TerminalStats(
         terminal_id=terminal_id,
         period_start=period_start,
         period_end=period_end,
-        transactions_count=terminal.total_transactions,
-        successful_transactions=terminal.total_transactions,  # Заглушка
-        failed_transactions=0,  # Заглушка
-        total_amount=terminal.total_amount,
-        average_amount=terminal.total_amount / max(terminal.total_transactions, 1),
-        uptime_percentage=95.5,  # Заглушка
-        error_count=0  # Заглушка
+        transactions_count=transactions_count,
+        successful_transactions=successful_transactions,
+        failed_transactions=failed_transactions,
+        total_amount=total_amount,
+        average_amount=total_amount / max(successful_transactions, 1),
+        uptime_percentage=uptime["uptime_percentage"],
+        error_count=uptime["error_slots"]
     )
     
     return stats
 
+@router.get("/{terminal_id}/outages")
+async def get_terminal_outages(
+    terminal_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Простои терминала (интервалы без heartbeat) за период, по умолчанию - последние сутки"""
+    
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
+    if not terminal:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Терминал не найден"
+        )
+    
+    end = end or datetime.utcnow()
+    uptime = await heartbeat_history.terminal_uptime(terminal.id, start or end - timedelta(days=1), end)
+    return {**uptime, "terminal_id": terminal_id}
+
 @router.post("/{terminal_id}/maintenance")
 async def set_terminal_maintenance(
     terminal_id: str,
     enable: bool = True,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Включение/выключение режима обслуживания терминала"""
     
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Терминал не найден"
         )
     
+    previous_status = terminal.status
     if enable:
         terminal.status = TerminalStatus.MAINTENANCE
         message = "Режим обслуживания включен"
@@ -263,35 +433,71 @@ async def set_terminal_maintenance(
         message = "Режим обслуживания выключен"
     
     terminal.updated_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
+    dashboard_snapshot.terminal_status_changed(previous_status, terminal.status)
+    terminal_registry.set_status(terminal_id, terminal.status)
+    await terminal_channel.send(terminal_id, "maintenance", {"enabled": enable})
     
     return {"message": message}
 
+@router.get("/availability/fleet")
+async def get_fleet_availability(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Доступность парка терминалов за период, по умолчанию - последние 30 дней"""
+    
+    end = end or datetime.utcnow()
+    availability = await heartbeat_history.fleet_availability(start or end - timedelta(days=30), end)
+    per_terminal = availability.pop("per_terminal")
+    # Десять наименее доступных терминалов (по внутреннему id)
+    availability["least_available"] = [
+        {"id": terminal_id, "uptime_percentage": uptime}
+        for terminal_id, uptime in sorted(per_terminal.items(), key=lambda item: item[1])[:10]
+    ]
+    return availability
+
+@router.get("/search/nearest")
+async def find_nearest_terminals(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    limit: int = Query(10, ge=1, le=100),
+    max_distance_km: Optional[float] = Query(None, gt=0),
+    status: Optional[TerminalStatus] = None,
+    payment_method: Optional[PaymentMethod] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Ближайшие к точке терминалы с фильтрами по статусу и способу оплаты"""
+    
+    # Поиск по сетке координат реестра в памяти, без запроса к базе данных
+    return terminal_registry.nearby(
+        latitude, longitude, limit=limit, radius_km=max_distance_km,
+        status=status, payment_method=payment_method
+    )
+
+@router.get("/search/radius")
+async def find_terminals_in_radius(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(..., gt=0, le=500),
+    limit: int = Query(500, ge=1, le=5000),
+    status: Optional[TerminalStatus] = None,
+    payment_method: Optional[PaymentMethod] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Терминалы в радиусе от точки, ближние первыми"""
+    
+    return terminal_registry.nearby(
+        latitude, longitude, limit=limit, radius_km=radius_km,
+        status=status, payment_method=payment_method
+    )
+
 @router.get("/status/summary")
 async def get_terminals_summary(
-    current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_admin_user)
 ):
     """Получение сводной статистики по всем терминалам"""
     
-    # Подсчет терминалов по статусам
-    total_terminals = db.query(Terminal).count()
-    online_terminals = db.query(Terminal).filter(Terminal.status == TerminalStatus.ONLINE).count()
-    offline_terminals = db.query(Terminal).filter(Terminal.status == TerminalStatus.OFFLINE).count()
-    maintenance_terminals = db.query(Terminal).filter(Terminal.status == TerminalStatus.MAINTENANCE).count()
-    error_terminals = db.query(Terminal).filter(Terminal.status == TerminalStatus.ERROR).count()
-    
-    # Общая статистика
-    total_transactions = db.query(func.sum(Terminal.total_transactions)).scalar() or 0
-    total_amount = db.query(func.sum(Terminal.total_amount)).scalar() or 0.0
-    
-    return {
-        "total_terminals": total_terminals,
-        "online_terminals": online_terminals,
-        "offline_terminals": offline_terminals,
-        "maintenance_terminals": maintenance_terminals,
-        "error_terminals": error_terminals,
-        "total_transactions": total_transactions,
-        "total_amount": total_amount,
-        "average_amount": total_amount / max(total_transactions, 1)
-    } 
\ No newline at end of file
+    # Счетчики ведет реестр терминалов в памяти
+    return terminal_registry.summary() 
\ No newline at end of file
@@ -1,33 +1,51 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime, timedelta
 import uuid
 
 from models.transaction import (
-    Transaction, TransactionCreate, TransactionUpdate, TransactionResponse,
+    TransactionCreate, TransactionUpdate, TransactionResponse,
     PaymentRequest, PaymentResponse, PaymentConfirmation, TransactionStats,
     TransactionReceipt, TransactionStatus, PaymentMethod
 )
-from models.terminal import Terminal
-from models.user import User
-from database import get_db
+from database import Terminal, Transaction, User, get_db, get_read_db
+from database.partitioning import transaction_created_window
+from database.archive import transaction_archive, REFUND_WINDOW_DAYS
+from dashboard_snapshot import dashboard_snapshot
+from event_outbox import event_pipeline
+from payment_events import add_payment_event
 from auth_utils import get_current_user, get_current_admin_user
 from payment_processor import process_payment
-from sqlalchemy import func
+from sqlalchemy import func, select
 import json
 
 router = APIRouter()
 
+def _transaction_by_id(transaction_id: str):
+    """Поиск по transaction_id с окном created_at: PostgreSQL читает одну-две секции вместо всех"""
+    query = select(Transaction).where(Transaction.transaction_id == transaction_id)
+    window = transaction_created_window(transaction_id)
+    if window:
+        query = query.where(Transaction.created_at.between(*window))
+    return query
+
+async def _find_transaction(db: AsyncSession, transaction_id: str):
+    """Транзакция из основной БД, а если ее там нет - из холодного архива"""
+    transaction = await db.scalar(_transaction_by_id(transaction_id))
+    if transaction is None:
+        transaction = await transaction_archive.find_transaction(transaction_id)
+    return transaction
+
 @router.post("/payment-request", response_model=PaymentResponse)
 async def create_payment_request(
     payment_data: PaymentRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Создание запроса на платеж от терминала"""
     
     # Проверка существования терминала
-    terminal = db.query(Terminal).filter(Terminal.terminal_id == payment_data.terminal_id).first()
+    terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == payment_data.terminal_id))
     if not terminal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -44,12 +62,12 @@ async def create_payment_request(
     # Поиск пользователя по телефону (если указан)
     user_id = None
     if payment_data.user_phone:
-        user = db.query(User).filter(User.phone == payment_data.user_phone).first()
+        user = await db.scalar(select(User).where(User.phone == payment_data.user_phone))
         if user:
             user_id = user.id
     
     # Генерация уникального ID транзакции
-    transaction_id = f"TXN_{terminal.terminal_id}_{int(datetime.utcnow().timestamp())}_{uuid.uuid4().hex[:8]}"
+    transaction_id = f"TXN_{terminal.serial_number}_{int(datetime.utcnow().timestamp())}_{uuid.uuid4().hex[:8]}"
     
     # Создание транзакции
     db_transaction = Transaction(
@@ -63,8 +81,9 @@ async def create_payment_request(
     )
     
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
+    await db.commit()
+    await db.refresh(db_transaction)
+    dashboard_snapshot.transaction_created()
     
     # Подготовка ответа в зависимости от метода оплаты
     expires_at = datetime.utcnow() + timedelta(minutes=5)  # 5 минут на оплату
@@ -78,7 +97,7 @@ async def create_payment_request(
     # Дополнительные данные для конкретных методов оплаты
     if payment_data.payment_method == PaymentMethod.QR_CODE:
         # Генерация QR кода для СБП
-        qr_data = f"https://qr.nspk.ru/AD10006M8A01{payment_data.amount:012.0f}S{terminal.terminal_id}I{transaction_id}"
+        qr_data = f"https://qr.nspk.ru/AD10006M8A01{payment_data.amount:012.0f}S{terminal.serial_number}I{transaction_id}"
         response_data["qr_code"] = qr_data
     
     elif payment_data.payment_method in [PaymentMethod.BIOMETRY_FACE, PaymentMethod.BIOMETRY_FINGERPRINT]:
@@ -90,12 +109,12 @@ async def create_payment_request(
 @router.post("/payment-confirm")
 async def confirm_payment(
     confirmation: PaymentConfirmation,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Подтверждение платежа от терминала"""
     
     # Поиск транзакции
-    transaction = db.query(Transaction).filter(Transaction.transaction_id == confirmation.transaction_id).first()
+    transaction = await db.scalar(_transaction_by_id(confirmation.transaction_id))
     if not transaction:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -112,11 +131,12 @@ async def confirm_payment(
     # Проверка подписи терминала (в реальной системе)
     # verify_terminal_signature(confirmation.terminal_signature, transaction)
     
+    terminal_key = None
     try:
         # Изменение статуса на обработку
         transaction.status = TransactionStatus.PROCESSING
         transaction.processed_at = datetime.utcnow()
-        db.commit()
+        await db.commit()
         
         # Обработка платежа через банк/СБП
         payment_result = await process_payment(transaction, confirmation.payment_data)
@@ -130,17 +150,19 @@ async def confirm_payment(
             transaction.card_mask = payment_result.card_mask
             transaction.receipt_number = payment_result.receipt_number
             
-            # Обновление статистики терминала
-            terminal = db.query(Terminal).filter(Terminal.id == transaction.terminal_id).first()
-            terminal.total_transactions += 1
-            terminal.total_amount += transaction.amount
+            # Счетчики терминала обновляет реестр по событию payment.completed
+            terminal = await db.get(Terminal, transaction.terminal_id)
+            terminal_key = terminal.serial_number
             
         else:
             # Неудачный платеж
             transaction.status = TransactionStatus.FAILED
             transaction.bank_response = payment_result.error_message
         
-        db.commit()
+        # Событие фиксируется вместе со статусом: push, счетчики и аудит обрабатываются после COMMIT
+        add_payment_event(db, transaction, terminal_key)
+        await db.commit()
+        event_pipeline.notify()
         
         return {
             "transaction_id": transaction.transaction_id,
@@ -150,10 +172,14 @@ async def confirm_payment(
         }
         
     except Exception as e:
-        # Ошибка при обработке
+        # Ошибка при обработке: сессия могла упасть на flush, статус пишется в новой транзакции
+        await db.rollback()
+        await db.refresh(transaction)
         transaction.status = TransactionStatus.FAILED
         transaction.bank_response = str(e)
-        db.commit()
+        add_payment_event(db, transaction, terminal_key)
+        await db.commit()
+        event_pipeline.notify()
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -169,38 +195,38 @@ async def get_transactions(
     date_from: Optional[datetime] = None,
     date_to: Optional[datetime] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Получение списка транзакций (только для администраторов)"""
     
-    query = db.query(Transaction)
+    query = select(Transaction)
     
     if status:
-        query = query.filter(Transaction.status == status)
+        query = query.where(Transaction.status == status)
     
     if terminal_id:
-        terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+        terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
         if terminal:
-            query = query.filter(Transaction.terminal_id == terminal.id)
+            query = query.where(Transaction.terminal_id == terminal.id)
     
     if date_from:
-        query = query.filter(Transaction.created_at >= date_from)
+        query = query.where(Transaction.created_at >= date_from)
     
     if date_to:
-        query = query.filter(Transaction.created_at <= date_to)
+        query = query.where(Transaction.created_at <= date_to)
     
-    transactions = query.order_by(Transaction.created_at.desc()).offset(skip).limit(limit).all()
-    return transactions
+    transactions = await db.scalars(query.order_by(Transaction.created_at.desc()).offset(skip).limit(limit))
+    return transactions.all()
 
 @router.get("/{transaction_id}", response_model=TransactionResponse)
 async def get_transaction(
     transaction_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение информации о транзакции"""
     
-    transaction = db.query(Transaction).filter(Transaction.transaction_id == transaction_id).first()
+    transaction = await _find_transaction(db, transaction_id)
     if not transaction:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -221,11 +247,11 @@ async def get_transaction(
 async def get_transaction_receipt(
     transaction_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение чека транзакции"""
     
-    transaction = db.query(Transaction).filter(Transaction.transaction_id == transaction_id).first()
+    transaction = await _find_transaction(db, transaction_id)
     if not transaction:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -247,7 +273,7 @@ async def get_transaction_receipt(
             detail="Чек доступен только для завершенных транзакций"
         )
     
-    terminal = db.query(Terminal).filter(Terminal.id == transaction.terminal_id).first()
+    terminal = await db.get(Terminal, transaction.terminal_id)
     
     fiscal_data = None
     if transaction.fiscal_data:
@@ -272,11 +298,11 @@ async def refund_transaction(
     transaction_id: str,
     reason: Optional[str] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Возврат средств по транзакции"""
     
-    transaction = db.query(Transaction).filter(Transaction.transaction_id == transaction_id).first()
+    transaction = await db.scalar(_transaction_by_id(transaction_id))
     if not transaction:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -291,7 +317,7 @@ async def refund_transaction(
     
     # Проверка времени (обычно возврат доступен в течение определенного периода)
     days_since_transaction = (datetime.utcnow() - transaction.completed_at).days
-    if days_since_transaction > 90:  # 90 дней
+    if days_since_transaction > REFUND_WINDOW_DAYS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Срок для возврата истек"
@@ -302,7 +328,8 @@ async def refund_transaction(
         # refund_result = await process_refund(transaction)
         
         transaction.status = TransactionStatus.REFUNDED
-        db.commit()
+        await db.commit()
+        dashboard_snapshot.transaction_refunded(transaction.amount, transaction.created_at)
         
         return {"message": "Возврат успешно выполнен"}
         
@@ -317,47 +344,60 @@ async def get_transactions_stats(
     days: int = Query(30, ge=1, le=365),
     terminal_id: Optional[str] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Получение статистики по транзакциям"""
     
     period_end = datetime.utcnow()
     period_start = period_end - timedelta(days=days)
     
-    query = db.query(Transaction).filter(
+    conditions = [
         Transaction.created_at >= period_start,
         Transaction.created_at <= period_end
-    )
+    ]
     
     if terminal_id:
-        terminal = db.query(Terminal).filter(Terminal.terminal_id == terminal_id).first()
+        terminal = await db.scalar(select(Terminal).where(Terminal.serial_number == terminal_id))
         if terminal:
-            query = query.filter(Transaction.terminal_id == terminal.id)
+            conditions.append(Transaction.terminal_id == terminal.id)
     
     # Подсчет статистики
-    total_count = query.count()
-    successful_count = query.filter(Transaction.status == TransactionStatus.COMPLETED).count()
-    failed_count = query.filter(Transaction.status == TransactionStatus.FAILED).count()
+    total_count = await db.scalar(select(func.count(Transaction.id)).where(*conditions))
+    successful_count = await db.scalar(
+        select(func.count(Transaction.id)).where(*conditions, Transaction.status == TransactionStatus.COMPLETED)
+    )
+    failed_count = await db.scalar(
+        select(func.count(Transaction.id)).where(*conditions, Transaction.status == TransactionStatus.FAILED)
+    )
     
-    total_amount = query.filter(Transaction.status == TransactionStatus.COMPLETED).with_entities(func.sum(Transaction.amount)).scalar() or 0.0
+    total_amount = await db.scalar(
+        select(func.sum(Transaction.amount)).where(*conditions, Transaction.status == TransactionStatus.COMPLETED)
+    ) or 0.0
     average_amount = total_amount / max(successful_count, 1)
     
     # Статистика по методам оплаты
     payment_methods_stats = {}
-    for method in PaymentMethod:
-        count = query.filter(Transaction.payment_method == method.value).count()
+    methods = await db.execute(
+        select(Transaction.payment_method, func.count(Transaction.id))
+        .where(*conditions)
+        .group_by(Transaction.payment_method)
+    )
+    for method, count in methods:
         if count > 0:
-            payment_methods_stats[method.value] = count
+            payment_methods_stats[method] = count
     
     # Статистика по часам (последние 24 часа)
     by_hour = {}
     for hour in range(24):
         start_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=23-hour)
         end_hour = start_hour + timedelta(hours=1)
-        count = query.filter(
-            Transaction.created_at >= start_hour,
-            Transaction.created_at < end_hour
-        ).count()
+        count = await db.scalar(
+            select(func.count(Transaction.id)).where(
+                *conditions,
+                Transaction.created_at >= start_hour,
+                Transaction.created_at < end_hour
+            )
+        )
         by_hour[hour] = count
     
     stats = TransactionStats(
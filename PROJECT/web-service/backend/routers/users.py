@@ -1,12 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from sqlalchemy import func
+from sqlalchemy import func, select, or_
 
 from models.user import User, UserUpdate, UserResponse, UserBiometry
 from models.card import Card, CardResponse
 from models.transaction import Transaction, TransactionResponse
-from database import get_db
+from database import get_db, get_read_db
 from auth_utils import get_current_user, get_current_admin_user
 
 router = APIRouter()
@@ -20,13 +20,13 @@ async def get_my_profile(current_user: User = Depends(get_current_user)):
 async def update_my_profile(
     user_update: UserUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Обновление профиля текущего пользователя"""
     
     # Проверка уникальности email и phone, если они изменяются
     if user_update.email and user_update.email != current_user.email:
-        existing_user = db.query(User).filter(User.email == user_update.email, User.id != current_user.id).first()
+        existing_user = await db.scalar(select(User).where(User.email == user_update.email, User.id != current_user.id))
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -34,7 +34,7 @@ async def update_my_profile(
             )
     
     if user_update.phone and user_update.phone != current_user.phone:
-        existing_user = db.query(User).filter(User.phone == user_update.phone, User.id != current_user.id).first()
+        existing_user = await db.scalar(select(User).where(User.phone == user_update.phone, User.id != current_user.id))
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -46,41 +46,45 @@ async def update_my_profile(
     for field, value in update_data.items():
         setattr(current_user, field, value)
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
     
     return current_user
 
 @router.get("/me/cards", response_model=List[CardResponse])
 async def get_my_cards(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение списка карт текущего пользователя"""
     
-    cards = db.query(Card).filter(Card.user_id == current_user.id).all()
-    return cards
+    cards = await db.scalars(select(Card).where(Card.user_id == current_user.id))
+    return cards.all()
 
 @router.get("/me/transactions", response_model=List[TransactionResponse])
 async def get_my_transactions(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение истории транзакций текущего пользователя"""
     
-    transactions = db.query(Transaction).filter(
-        Transaction.user_id == current_user.id
-    ).order_by(Transaction.created_at.desc()).offset(skip).limit(limit).all()
+    transactions = await db.scalars(
+        select(Transaction)
+        .where(Transaction.user_id == current_user.id)
+        .order_by(Transaction.created_at.desc())
+        .offset(skip)
+        .limit(limit)
+    )
     
-    return transactions
+    return transactions.all()
 
 @router.post("/me/biometry")
 async def add_biometry_data(
     biometry_data: UserBiometry,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Добавление биометрических данных пользователя"""
     
@@ -94,7 +98,7 @@ async def add_biometry_data(
 async def remove_biometry_data(
     biometry_type: str,  # "face" или "fingerprint"
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Удаление биометрических данных пользователя"""
     
@@ -110,24 +114,32 @@ async def remove_biometry_data(
 @router.get("/me/stats")
 async def get_my_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Получение статистики пользователя"""
     
     # Подсчет статистики
-    total_transactions = db.query(Transaction).filter(Transaction.user_id == current_user.id).count()
-    successful_transactions = db.query(Transaction).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.status == "completed"
-    ).count()
+    total_transactions = await db.scalar(
+        select(func.count(Transaction.id)).where(Transaction.user_id == current_user.id)
+    )
+    successful_transactions = await db.scalar(
+        select(func.count(Transaction.id)).where(
+            Transaction.user_id == current_user.id,
+            Transaction.status == "completed"
+        )
+    )
     
-    total_spent = db.query(func.sum(Transaction.amount)).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.status == "completed"
-    ).scalar() or 0.0
+    total_spent = await db.scalar(
+        select(func.sum(Transaction.amount)).where(
+            Transaction.user_id == current_user.id,
+            Transaction.status == "completed"
+        )
+    ) or 0.0
     
-    total_cards = db.query(Card).filter(Card.user_id == current_user.id).count()
-    active_cards = db.query(Card).filter(Card.user_id == current_user.id, Card.is_active == True).count()
+    total_cards = await db.scalar(select(func.count(Card.id)).where(Card.user_id == current_user.id))
+    active_cards = await db.scalar(
+        select(func.count(Card.id)).where(Card.user_id == current_user.id, Card.is_active == True)
+    )
     
     return {
         "total_transactions": total_transactions,
@@ -148,31 +160,33 @@ async def get_all_users(
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = None,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Получение списка всех пользователей (только для администраторов)"""
     
-    query = db.query(User)
+    query = select(User)
     
     if search:
-        query = query.filter(
-            (User.full_name.ilike(f"%{search}%")) |
-            (User.email.ilike(f"%{search}%")) |
-            (User.phone.ilike(f"%{search}%"))
+        query = query.where(
+            or_(
+                User.full_name.ilike(f"%{search}%"),
+                User.email.ilike(f"%{search}%"),
+                User.phone.ilike(f"%{search}%")
+            )
         )
     
-    users = query.offset(skip).limit(limit).all()
-    return users
+    users = await db.scalars(query.offset(skip).limit(limit))
+    return users.all()
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user_by_id(
     user_id: int,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение пользователя по ID (только для администраторов)"""
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -186,11 +200,11 @@ async def update_user_status(
     user_id: int,
     is_active: bool,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Изменение статуса пользователя (активен/неактивен)"""
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -198,7 +212,7 @@ async def update_user_status(
         )
     
     user.is_active = is_active
-    db.commit()
+    await db.commit()
     
     status_text = "активирован" if is_active else "деактивирован"
     return {"message": f"Пользователь {status_text}"}
@@ -207,7 +221,7 @@ async def update_user_status(
 async def delete_user(
     user_id: int,
     current_user: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Удаление пользователя (только для администраторов)"""
     
@@ -217,14 +231,14 @@ async def delete_user(
             detail="Нельзя удалить самого себя"
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Пользователь не найден"
         )
     
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
     
     return {"message": "Пользователь успешно удален"} 
\ No newline at end of file
@@ -1,6 +1,6 @@
 from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, desc, func, select, update
 from datetime import datetime
 import logging
 
@@ -12,20 +12,22 @@ logger = logging.getLogger(__name__)
 class LegalDocumentsService:
     """Сервис для работы с правовыми документами"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def create_document(self, document_data: LegalDocumentCreate) -> LegalDocument:
+    async def create_document(self, document_data: LegalDocumentCreate) -> LegalDocument:
         """Создание нового правового документа"""
         try:
             # Деактивируем предыдущие версии того же типа
             if document_data.requires_acceptance:
-                self.db.query(LegalDocument).filter(
-                    and_(
-                        LegalDocument.type == document_data.type,
-                        LegalDocument.is_active == True
-                    )
-                ).update({"is_active": False})
+                await self.db.execute(
+                    update(LegalDocument).where(
+                        and_(
+                            LegalDocument.type == document_data.type,
+                            LegalDocument.is_active == True
+                        )
+                    ).values(is_active=False)
+                )
             
             # Создаем новый документ
             db_document = LegalDocument(
@@ -38,43 +40,46 @@ class LegalDocumentsService:
             )
             
             self.db.add(db_document)
-            self.db.commit()
-            self.db.refresh(db_document)
+            await self.db.commit()
+            await self.db.refresh(db_document)
             
             logger.info(f"Создан новый документ: {document_data.type} v{document_data.version}")
             return db_document
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Ошибка создания документа: {e}")
             raise
     
-    def get_active_document(self, document_type: DocumentType) -> Optional[LegalDocument]:
+    async def get_active_document(self, document_type: DocumentType) -> Optional[LegalDocument]:
         """Получение активного документа по типу"""
-        return self.db.query(LegalDocument).filter(
-            and_(
-                LegalDocument.type == document_type,
-                LegalDocument.is_active == True
+        return await self.db.scalar(
+            select(LegalDocument).where(
+                and_(
+                    LegalDocument.type == document_type,
+                    LegalDocument.is_active == True
+                )
             )
-        ).first()
+        )
     
-    def get_document_by_id(self, document_id: int) -> Optional[LegalDocument]:
+    async def get_document_by_id(self, document_id: int) -> Optional[LegalDocument]:
         """Получение документа по ID"""
-        return self.db.query(LegalDocument).filter(LegalDocument.id == document_id).first()
+        return await self.db.get(LegalDocument, document_id)
     
-    def get_documents_by_type(self, document_type: DocumentType, include_inactive: bool = False) -> List[LegalDocument]:
+    async def get_documents_by_type(self, document_type: DocumentType, include_inactive: bool = False) -> List[LegalDocument]:
         """Получение документов по типу"""
-        query = self.db.query(LegalDocument).filter(LegalDocument.type == document_type)
+        query = select(LegalDocument).where(LegalDocument.type == document_type)
         
         if not include_inactive:
-            query = query.filter(LegalDocument.is_active == True)
+            query = query.where(LegalDocument.is_active == True)
         
-        return query.order_by(desc(LegalDocument.effective_date)).all()
+        documents = await self.db.scalars(query.order_by(desc(LegalDocument.effective_date)))
+        return documents.all()
     
-    def update_document(self, document_id: int, update_data: LegalDocumentUpdate) -> Optional[LegalDocument]:
+    async def update_document(self, document_id: int, update_data: LegalDocumentUpdate) -> Optional[LegalDocument]:
         """Обновление документа"""
         try:
-            document = self.get_document_by_id(document_id)
+            document = await self.get_document_by_id(document_id)
             if not document:
                 return None
             
@@ -84,41 +89,43 @@ class LegalDocumentsService:
                 setattr(document, field, value)
             
             document.updated_at = datetime.utcnow()
-            self.db.commit()
-            self.db.refresh(document)
+            await self.db.commit()
+            await self.db.refresh(document)
             
             logger.info(f"Обновлен документ ID {document_id}")
             return document
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Ошибка обновления документа: {e}")
             raise
     
-    def deactivate_document(self, document_id: int) -> bool:
+    async def deactivate_document(self, document_id: int) -> bool:
         """Деактивация документа"""
         try:
-            document = self.get_document_by_id(document_id)
+            document = await self.get_document_by_id(document_id)
             if not document:
                 return False
             
             document.is_active = False
             document.updated_at = datetime.utcnow()
-            self.db.commit()
+            await self.db.commit()
             
             logger.info(f"Деактивирован документ ID {document_id}")
             return True
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Ошибка деактивации документа: {e}")
             raise
     
-    def get_document_version_history(self, document_type: DocumentType) -> List[Dict[str, Any]]:
+    async def get_document_version_history(self, document_type: DocumentType) -> List[Dict[str, Any]]:
         """Получение истории версий документа"""
-        documents = self.db.query(LegalDocument).filter(
-            LegalDocument.type == document_type
-        ).order_by(desc(LegalDocument.effective_date)).all()
+        documents = (await self.db.scalars(
+            select(LegalDocument)
+            .where(LegalDocument.type == document_type)
+            .order_by(desc(LegalDocument.effective_date))
+        )).all()
         
         return [
             {
@@ -132,21 +139,23 @@ class LegalDocumentsService:
             for doc in documents
         ]
     
-    def accept_document(self, user_id: int, document_id: int, ip_address: str = None, user_agent: str = None) -> bool:
+    async def accept_document(self, user_id: int, document_id: int, ip_address: str = None, user_agent: str = None) -> bool:
         """Принятие документа пользователем"""
         try:
             # Проверяем, что документ существует и активен
-            document = self.get_document_by_id(document_id)
+            document = await self.get_document_by_id(document_id)
             if not document or not document.is_active:
                 return False
             
             # Проверяем, не принял ли пользователь уже этот документ
-            existing_acceptance = self.db.query(UserDocumentAcceptance).filter(
-                and_(
-                    UserDocumentAcceptance.user_id == user_id,
-                    UserDocumentAcceptance.document_id == document_id
+            existing_acceptance = await self.db.scalar(
+                select(UserDocumentAcceptance).where(
+                    and_(
+                        UserDocumentAcceptance.user_id == user_id,
+                        UserDocumentAcceptance.document_id == document_id
+                    )
                 )
-            ).first()
+            )
             
             if existing_acceptance:
                 logger.info(f"Пользователь {user_id} уже принял документ {document_id}")
@@ -161,28 +170,28 @@ class LegalDocumentsService:
             )
             
             self.db.add(acceptance)
-            self.db.commit()
+            await self.db.commit()
             
             logger.info(f"Пользователь {user_id} принял документ {document_id}")
             return True
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Ошибка принятия документа: {e}")
             raise
     
-    def get_user_documents_status(self, user_id: int) -> Dict[str, Any]:
+    async def get_user_documents_status(self, user_id: int) -> Dict[str, Any]:
         """Получение статуса документов пользователя"""
         try:
             # Получаем все активные документы
-            active_documents = self.db.query(LegalDocument).filter(
-                LegalDocument.is_active == True
-            ).all()
+            active_documents = (await self.db.scalars(
+                select(LegalDocument).where(LegalDocument.is_active == True)
+            )).all()
             
             # Получаем принятые пользователем документы
-            accepted_documents = self.db.query(UserDocumentAcceptance).filter(
-                UserDocumentAcceptance.user_id == user_id
-            ).all()
+            accepted_documents = (await self.db.scalars(
+                select(UserDocumentAcceptance).where(UserDocumentAcceptance.user_id == user_id)
+            )).all()
             
             accepted_ids = {acc.document_id for acc in accepted_documents}
             
@@ -222,16 +231,21 @@ class LegalDocumentsService:
             logger.error(f"Ошибка получения статуса документов: {e}")
             raise
     
-    def get_document_acceptance_stats(self, document_id: int) -> Dict[str, Any]:
+    async def get_document_acceptance_stats(self, document_id: int) -> Dict[str, Any]:
         """Получение статистики принятия документа"""
         try:
-            total_acceptances = self.db.query(UserDocumentAcceptance).filter(
-                UserDocumentAcceptance.document_id == document_id
-            ).count()
+            total_acceptances = await self.db.scalar(
+                select(func.count(UserDocumentAcceptance.id)).where(
+                    UserDocumentAcceptance.document_id == document_id
+                )
+            )
             
-            recent_acceptances = self.db.query(UserDocumentAcceptance).filter(
-                UserDocumentAcceptance.document_id == document_id
-            ).order_by(desc(UserDocumentAcceptance.accepted_at)).limit(10).all()
+            recent_acceptances = (await self.db.scalars(
+                select(UserDocumentAcceptance)
+                .where(UserDocumentAcceptance.document_id == document_id)
+                .order_by(desc(UserDocumentAcceptance.accepted_at))
+                .limit(10)
+            )).all()
             
             return {
                 "document_id": document_id,
@@ -0,0 +1,96 @@
+"""
+Фоновый мониторинг системных ресурсов для PayGo
+Замеры CPU, памяти, диска и задержки event loop в кольцевом буфере
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+class SystemSampler:
+    """Периодические замеры ресурсов без блокировки event loop.
+
+    Проверки здоровья читают последние значения из буфера мгновенно,
+    вместо psutil.cpu_percent(interval=1) на каждый запрос.
+    """
+
+    def __init__(self, interval: float = 1.0, history_size: int = 300, disk_path: str = "/"):
+        self.interval = interval
+        self.disk_path = disk_path
+        self._samples = deque(maxlen=history_size)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запуск фонового сбора замеров"""
+        if not self.is_running:
+            # Первый вызов cpu_percent(None) только задает точку отсчета
+            psutil.cpu_percent(interval=None)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фонового сбора замеров"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            # Задержка пробуждения - время, на которое loop был занят другим кодом
+            loop_lag = max(loop.time() - expected, 0.0)
+            try:
+                self._samples.append(self._take_sample(loop_lag))
+            except Exception as e:
+                logger.warning(f"System sample failed: {e}")
+
+    def _take_sample(self, loop_lag: float) -> Dict[str, float]:
+        return {
+            "timestamp": time.time(),
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": psutil.virtual_memory().percent,
+            "disk_percent": psutil.disk_usage(self.disk_path).percent,
+            "loop_lag_ms": round(loop_lag * 1000, 3)
+        }
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        """Последний замер или None, если замеров еще нет"""
+        return self._samples[-1] if self._samples else None
+
+    def history(self, limit: Optional[int] = None) -> List[Dict[str, float]]:
+        samples = list(self._samples)
+        return samples[-limit:] if limit else samples
+
+    def summary(self) -> Dict[str, Any]:
+        """Последние значения и задержка event loop за окно буфера"""
+        samples = list(self._samples)
+        latest = samples[-1] if samples else self._take_sample(0.0)
+        loop_lags = sorted(sample["loop_lag_ms"] for sample in samples) or [0.0]
+        return {
+            "cpu_percent": latest["cpu_percent"],
+            "memory_percent": latest["memory_percent"],
+            "disk_percent": latest["disk_percent"],
+            "loop_lag_ms": latest["loop_lag_ms"],
+            "loop_lag_p95_ms": loop_lags[min(int(0.95 * len(loop_lags)), len(loop_lags) - 1)],
+            "loop_lag_max_ms": loop_lags[-1],
+            "samples": len(samples),
+            "sample_age_seconds": round(time.time() - latest["timestamp"], 3)
+        }
+
+# Глобальный экземпляр фонового мониторинга
+system_sampler = SystemSampler()
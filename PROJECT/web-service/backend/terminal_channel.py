@@ -0,0 +1,355 @@
+"""
+Канал PayGo для доставки команд и конфигурации терминалам по WebSocket
+Реестр соединений в каждой копии приложения, рассылка между копиями через Redis pub/sub,
+подтверждения и повторная отправка неподтвержденных сообщений при переподключении
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+DIRECT_CHANNEL = "terminals:direct"
+BROADCAST_CHANNEL = "terminals:broadcast"
+
+# Неподтвержденных сообщений на терминал и рассылок на всех хранится не больше
+OUTBOX_LIMIT = 1000
+BROADCAST_RETENTION = 1000
+
+# Области нумерации: сообщения терминалу и рассылки всем терминалам
+SCOPE_TERMINAL = "terminal"
+SCOPE_BROADCAST = "broadcast"
+
+def _frame(scope: str, seq: int, message_type: str, payload: Dict[str, Any]) -> str:
+    return json.dumps({
+        "type": message_type, "scope": scope, "seq": seq,
+        "payload": payload, "sent_at": datetime.utcnow().isoformat()
+    }, ensure_ascii=False, default=str)
+
+class LocalChannelBackend:
+    """Одна копия приложения: pub/sub и неподтвержденные сообщения в памяти процесса"""
+
+    def __init__(self):
+        self._handlers: List[Callable[[str, str], None]] = []
+        self._outbox: Dict[str, "OrderedDict[int, str]"] = {}
+        self._seq: Dict[str, int] = {}
+        self._broadcasts: "OrderedDict[int, str]" = OrderedDict()
+        self._broadcast_seq = 0
+        self._broadcast_acks: Dict[str, int] = {}
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        self._handlers.clear()
+
+    async def subscribe(self, handler: Callable[[str, str], None]):
+        self._handlers.append(handler)
+
+    async def publish(self, channel: str, data: str):
+        for handler in list(self._handlers):
+            handler(channel, data)
+
+    async def append(self, terminal_id: str, build_frame: Callable[[int], str]) -> Tuple[int, str]:
+        seq = self._seq[terminal_id] = self._seq.get(terminal_id, 0) + 1
+        frame = build_frame(seq)
+        outbox = self._outbox.setdefault(terminal_id, OrderedDict())
+        outbox[seq] = frame
+        while len(outbox) > OUTBOX_LIMIT:
+            outbox.popitem(last=False)
+        return seq, frame
+
+    async def pending(self, terminal_id: str) -> List[Tuple[int, str]]:
+        return list(self._outbox.get(terminal_id, {}).items())
+
+    async def ack(self, terminal_id: str, seq: int):
+        outbox = self._outbox.get(terminal_id)
+        while outbox and next(iter(outbox)) <= seq:
+            outbox.popitem(last=False)
+
+    async def append_broadcast(self, build_frame: Callable[[int], str]) -> Tuple[int, str]:
+        self._broadcast_seq += 1
+        frame = self._broadcasts[self._broadcast_seq] = build_frame(self._broadcast_seq)
+        while len(self._broadcasts) > BROADCAST_RETENTION:
+            self._broadcasts.popitem(last=False)
+        return self._broadcast_seq, frame
+
+    async def pending_broadcasts(self, terminal_id: str) -> List[Tuple[int, str]]:
+        # Новый терминал получает только рассылки после первого подключения
+        acked = self._broadcast_acks.setdefault(terminal_id, self._broadcast_seq)
+        return [(seq, frame) for seq, frame in self._broadcasts.items() if seq > acked]
+
+    async def ack_broadcast(self, terminal_id: str, seq: int):
+        self._broadcast_acks[terminal_id] = max(self._broadcast_acks.get(terminal_id, 0), seq)
+
+class RedisChannelBackend:
+    """Несколько копий приложения: pub/sub Redis, сообщения в отсортированных множествах по номеру"""
+
+    def __init__(self, redis_url: str, prefix: str = "paygo:terminal_channel"):
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self.redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._handlers: List[Callable[[str, str], None]] = []
+
+    async def connect(self):
+        import aioredis
+        self.redis = aioredis.from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        await self.redis.ping()
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.close()
+        if self.redis:
+            await self.redis.close()
+
+    async def subscribe(self, handler: Callable[[str, str], None]):
+        self._handlers.append(handler)
+        if self._pubsub is None:
+            self._pubsub = self.redis.pubsub()
+            await self._pubsub.subscribe(DIRECT_CHANNEL, BROADCAST_CHANNEL)
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    for handler in self._handlers:
+                        handler(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Terminal channel subscription failed: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, channel: str, data: str):
+        await self.redis.publish(channel, data)
+
+    async def append(self, terminal_id: str, build_frame: Callable[[int], str]) -> Tuple[int, str]:
+        seq = await self.redis.incr(f"{self.prefix}:seq:{terminal_id}")
+        frame = build_frame(seq)
+        key = f"{self.prefix}:outbox:{terminal_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {frame: seq})
+            pipe.zremrangebyrank(key, 0, -OUTBOX_LIMIT - 1)
+            await pipe.execute()
+        return seq, frame
+
+    async def pending(self, terminal_id: str) -> List[Tuple[int, str]]:
+        items = await self.redis.zrange(f"{self.prefix}:outbox:{terminal_id}", 0, -1, withscores=True)
+        return [(int(seq), frame) for frame, seq in items]
+
+    async def ack(self, terminal_id: str, seq: int):
+        await self.redis.zremrangebyscore(f"{self.prefix}:outbox:{terminal_id}", "-inf", seq)
+
+    async def append_broadcast(self, build_frame: Callable[[int], str]) -> Tuple[int, str]:
+        seq = await self.redis.incr(f"{self.prefix}:broadcast_seq")
+        frame = build_frame(seq)
+        key = f"{self.prefix}:broadcasts"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {frame: seq})
+            pipe.zremrangebyrank(key, 0, -BROADCAST_RETENTION - 1)
+            await pipe.execute()
+        return seq, frame
+
+    async def pending_broadcasts(self, terminal_id: str) -> List[Tuple[int, str]]:
+        acks = f"{self.prefix}:broadcast_acks"
+        acked = await self.redis.hget(acks, terminal_id)
+        if acked is None:
+            # Новый терминал получает только рассылки после первого подключения
+            await self.redis.hsetnx(acks, terminal_id, int(await self.redis.get(f"{self.prefix}:broadcast_seq") or 0))
+            return []
+        items = await self.redis.zrangebyscore(f"{self.prefix}:broadcasts", f"({acked}", "+inf", withscores=True)
+        return [(int(seq), frame) for frame, seq in items]
+
+    async def ack_broadcast(self, terminal_id: str, seq: int):
+        acks = f"{self.prefix}:broadcast_acks"
+        acked = await self.redis.hget(acks, terminal_id)
+        if acked is None or int(acked) < seq:
+            await self.redis.hset(acks, terminal_id, seq)
+
+class _Connection:
+    """Соединение терминала: очередь отправки и задача записи в сокет"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        # Последние отправленные номера: повтор из очереди после досылки не отправляется
+        self.sent = {SCOPE_TERMINAL: 0, SCOPE_BROADCAST: 0}
+        self.writer: Optional[asyncio.Task] = None
+
+    def push(self, scope: str, seq: int, frame: str) -> bool:
+        try:
+            self.queue.put_nowait((scope, seq, frame))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def send(self, scope: str, seq: int, frame: str):
+        if seq > self.sent[scope]:
+            await self.websocket.send_text(frame)
+            self.sent[scope] = seq
+
+    async def write_loop(self):
+        while True:
+            scope, seq, frame = await self.queue.get()
+            await self.send(scope, seq, frame)
+
+class TerminalChannel:
+    """Доставка сообщений подключенным терминалам.
+
+    Сообщение терминалу получает номер в его очереди и хранится до
+    подтверждения (ack с номером подтверждает и все предыдущие). Рассылка
+    всем терминалам - одна публикация, каждая копия приложения раскладывает
+    один и тот же кадр по своим соединениям. При подключении терминал
+    получает все неподтвержденные сообщения и пропущенные рассылки.
+    """
+
+    def __init__(self, backend, send_queue_size: int = 256):
+        self.backend = backend
+        self.send_queue_size = send_queue_size
+        self._connections: Dict[str, _Connection] = {}
+        self._started = False
+        self.stats = {"sent": 0, "broadcasts": 0, "delivered": 0, "resent": 0, "acks": 0, "dropped_slow": 0}
+
+    @property
+    def connected(self) -> int:
+        return len(self._connections)
+
+    def is_connected(self, terminal_id: str) -> bool:
+        return terminal_id in self._connections
+
+    async def start(self):
+        if not self._started:
+            await self.backend.connect()
+            await self.backend.subscribe(self._on_message)
+            self._started = True
+
+    async def stop(self):
+        for connection in list(self._connections.values()):
+            await self._close(connection, 1001)
+        self._connections.clear()
+        if self._started:
+            await self.backend.close()
+            self._started = False
+
+    # Отправка
+
+    async def send(self, terminal_id: str, message_type: str, payload: Dict[str, Any]) -> int:
+        """Сообщение одному терминалу; номер в очереди терминала"""
+        seq, frame = await self.backend.append(
+            terminal_id, lambda seq: _frame(SCOPE_TERMINAL, seq, message_type, payload)
+        )
+        await self.backend.publish(DIRECT_CHANNEL, f"{terminal_id}\n{seq}\n{frame}")
+        self.stats["sent"] += 1
+        return seq
+
+    async def broadcast(self, message_type: str, payload: Dict[str, Any]) -> int:
+        """Сообщение всем терминалам одной публикацией"""
+        seq, frame = await self.backend.append_broadcast(
+            lambda seq: _frame(SCOPE_BROADCAST, seq, message_type, payload)
+        )
+        await self.backend.publish(BROADCAST_CHANNEL, f"{seq}\n{frame}")
+        self.stats["broadcasts"] += 1
+        return seq
+
+    def _on_message(self, channel: str, data: str):
+        if channel == BROADCAST_CHANNEL:
+            seq, frame = data.split("\n", 1)
+            seq = int(seq)
+            for terminal_id, connection in list(self._connections.items()):
+                self._push(terminal_id, connection, SCOPE_BROADCAST, seq, frame)
+        elif channel == DIRECT_CHANNEL:
+            terminal_id, seq, frame = data.split("\n", 2)
+            connection = self._connections.get(terminal_id)
+            if connection is not None:
+                self._push(terminal_id, connection, SCOPE_TERMINAL, int(seq), frame)
+
+    def _push(self, terminal_id: str, connection: _Connection, scope: str, seq: int, frame: str):
+        if connection.push(scope, seq, frame):
+            self.stats["delivered"] += 1
+            return
+        # Терминал не успевает читать: соединение закрывается, сообщения
+        # остаются неподтвержденными и будут досланы при переподключении
+        self.stats["dropped_slow"] += 1
+        if self._connections.get(terminal_id) is connection:
+            del self._connections[terminal_id]
+        asyncio.create_task(self._close(connection, 1013))
+
+    # Соединение терминала
+
+    async def serve(self, websocket: WebSocket, terminal_id: str):
+        """Обслуживание WebSocket терминала до отключения"""
+        await websocket.accept()
+        connection = _Connection(websocket, self.send_queue_size)
+        previous = self._connections.get(terminal_id)
+        # Сообщения, пришедшие во время досылки, копятся в очереди соединения
+        self._connections[terminal_id] = connection
+        if previous is not None:
+            await self._close(previous, 4000)
+        try:
+            for scope, pending in (
+                (SCOPE_TERMINAL, await self.backend.pending(terminal_id)),
+                (SCOPE_BROADCAST, await self.backend.pending_broadcasts(terminal_id))
+            ):
+                for seq, frame in pending:
+                    await connection.send(scope, seq, frame)
+                    self.stats["resent"] += 1
+            connection.writer = asyncio.create_task(connection.write_loop())
+
+            while True:
+                message = json.loads(await websocket.receive_text())
+                if message.get("type") == "ack":
+                    self.stats["acks"] += 1
+                    if message.get("scope") == SCOPE_BROADCAST:
+                        await self.backend.ack_broadcast(terminal_id, int(message["seq"]))
+                    else:
+                        await self.backend.ack(terminal_id, int(message["seq"]))
+                elif message.get("type") == "ping":
+                    await websocket.send_text('{"type": "pong"}')
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Invalid frame from terminal {terminal_id}: {e}")
+            await self._close(connection, 1003)
+        finally:
+            if self._connections.get(terminal_id) is connection:
+                del self._connections[terminal_id]
+            if connection.writer:
+                connection.writer.cancel()
+
+    async def _close(self, connection: _Connection, code: int):
+        if connection.writer:
+            connection.writer.cancel()
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass
+
+def _channel_backend():
+    # Без Redis канал работает в пределах одной копии приложения
+    redis_url = os.getenv("TERMINAL_CHANNEL_REDIS_URL")
+    return RedisChannelBackend(redis_url) if redis_url else LocalChannelBackend()
+
+# Глобальный экземпляр канала терминалов
+terminal_channel = TerminalChannel(
+    _channel_backend(),
+    send_queue_size=int(os.getenv("TERMINAL_CHANNEL_QUEUE_SIZE", "256"))
+)
@@ -0,0 +1,281 @@
+"""
+Версии конфигурации терминалов PayGo
+Каждое изменение - новая версия с хешем содержимого, общие шаблоны для парка,
+кеш версий в памяти, ответы 304 и JSON Patch от версии клиента
+"""
+
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+logger = logging.getLogger(__name__)
+
+OWNER_TERMINAL = "terminal"
+OWNER_TEMPLATE = "template"
+
+# Признак "шаблон не меняется" при обновлении конфигурации терминала
+KEEP_TEMPLATE = object()
+
+def content_hash(config: Dict[str, Any]) -> str:
+    """SHA-256 канонического JSON: одинаковое содержимое - одинаковый хеш"""
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _pointer(path: str, key: str) -> str:
+    return f"{path}/{str(key).replace('~', '~0').replace('/', '~1')}"
+
+def json_patch(old: Dict[str, Any], new: Dict[str, Any], path: str = "") -> List[Dict[str, Any]]:
+    """Операции JSON Patch (RFC 6902), переводящие old в new; списки заменяются целиком"""
+    operations = []
+    for key in old:
+        if key not in new:
+            operations.append({"op": "remove", "path": _pointer(path, key)})
+    for key, value in new.items():
+        if key not in old:
+            operations.append({"op": "add", "path": _pointer(path, key), "value": value})
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            operations.extend(json_patch(old[key], value, _pointer(path, key)))
+        elif old[key] != value:
+            operations.append({"op": "replace", "path": _pointer(path, key), "value": value})
+    return operations
+
+def make_etag(version: int, template_version: int) -> str:
+    return f'"{version}.{template_version}"'
+
+def parse_etag(etag: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not etag:
+        return None
+    try:
+        version, template_version = etag.strip().removeprefix("W/").strip('"').split(".")
+        return int(version), int(template_version)
+    except ValueError:
+        return None
+
+class ConfigState:
+    """Итоговая конфигурация терминала для пары версий (терминал, шаблон)"""
+
+    __slots__ = ("terminal_id", "version", "template", "template_version", "config", "content_hash", "etag")
+
+    def __init__(self, terminal_id: str, version: int, template: Optional[str], template_version: int,
+                 config: Dict[str, Any]):
+        self.terminal_id = terminal_id
+        self.version = version
+        self.template = template
+        self.template_version = template_version
+        self.config = config
+        self.content_hash = content_hash(config)
+        self.etag = make_etag(version, template_version)
+
+class TerminalConfigStore:
+    """Конфигурация терминала = значения по умолчанию + шаблон парка + собственные параметры.
+
+    Версии терминалов и шаблонов хранятся в одной таблице и не меняются
+    после записи, поэтому кешируются в памяти по (владелец, версия) без
+    инвалидации. Шаблон читается и разбирается один раз на все терминалы.
+    Опрос - один запрос номеров текущих версий.
+    """
+
+    def __init__(self, session_factory, models_provider, defaults_provider, cache_size: int = 10000):
+        # session_factory() - асинхронный контекстный менеджер сессии,
+        # models_provider() - (Terminal, TerminalConfigVersion),
+        # defaults_provider() - значения конфигурации по умолчанию
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        self._defaults_provider = defaults_provider
+        self._defaults: Optional[Dict[str, Any]] = None
+        self._heads_statement = None
+        self.cache_size = cache_size
+        # (тип владельца, ключ, версия) -> (шаблон, параметры)
+        self._versions: "OrderedDict[Tuple[str, str, int], Tuple[Optional[str], Dict[str, Any]]]" = OrderedDict()
+        # (терминал, версия, версия шаблона) -> ConfigState
+        self._states: "OrderedDict[Tuple[str, int, int], ConfigState]" = OrderedDict()
+        self.stats = {"polls": 0, "not_modified": 0, "patches": 0, "full": 0, "version_loads": 0, "resolutions": 0}
+
+    @property
+    def defaults(self) -> Dict[str, Any]:
+        if self._defaults is None:
+            self._defaults = self._defaults_provider()
+        return self._defaults
+
+    # Кеш
+
+    def _remember(self, cache: OrderedDict, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return value
+
+    async def _version(self, session, owner_type: str, owner_key: str, version: int) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        key = (owner_type, owner_key, version)
+        cached = self._versions.get(key)
+        if cached is not None:
+            self._versions.move_to_end(key)
+            return cached
+        _, ConfigVersion = self._models_provider()
+        if version == 0 and owner_type == OWNER_TERMINAL:
+            # Версия 0 - конфигурация, записанная до появления версий
+            Terminal, _ = self._models_provider()
+            legacy = await session.scalar(select(Terminal.configuration).where(Terminal.serial_number == owner_key))
+            value = (None, legacy or {})
+        elif version == 0:
+            value = (None, {})
+        else:
+            row = (await session.execute(
+                select(ConfigVersion.template, ConfigVersion.config).where(
+                    ConfigVersion.owner_type == owner_type,
+                    ConfigVersion.owner_key == owner_key,
+                    ConfigVersion.version == version
+                )
+            )).first()
+            if row is None:
+                return None
+            value = (row[0], row[1] or {})
+        self.stats["version_loads"] += 1
+        return self._remember(self._versions, key, value)
+
+    async def _state(self, session, terminal_id: str, version: int, template_version: int) -> Optional[ConfigState]:
+        key = (terminal_id, version, template_version)
+        state = self._states.get(key)
+        if state is not None:
+            self._states.move_to_end(key)
+            return state
+        terminal = await self._version(session, OWNER_TERMINAL, terminal_id, version)
+        if terminal is None:
+            return None
+        template_name, overrides = terminal
+        template = {}
+        if template_name:
+            loaded = await self._version(session, OWNER_TEMPLATE, template_name, template_version)
+            if loaded is None:
+                return None
+            template = loaded[1]
+        self.stats["resolutions"] += 1
+        config = {**self.defaults, **template, **overrides}
+        return self._remember(self._states, key, ConfigState(terminal_id, version, template_name, template_version, config))
+
+    # Чтение
+
+    def _heads_query(self):
+        # Запрос строится один раз: псевдоним таблицы и подзапрос на каждый опрос
+        # стоили бы дороже самого запроса
+        if self._heads_statement is None:
+            _, ConfigVersion = self._models_provider()
+            template = aliased(ConfigVersion)
+            self._heads_statement = select(
+                ConfigVersion.version,
+                select(func.max(template.version)).where(
+                    template.owner_type == OWNER_TEMPLATE, template.owner_key == ConfigVersion.template
+                ).scalar_subquery()
+            ).where(
+                ConfigVersion.owner_type == OWNER_TERMINAL, ConfigVersion.owner_key == bindparam("terminal_id")
+            ).order_by(ConfigVersion.version.desc()).limit(1)
+        return self._heads_statement
+
+    async def _heads(self, session, terminal_id: str) -> Optional[Tuple[int, int]]:
+        """Текущие версии терминала и его шаблона одним запросом; None - терминала нет"""
+        row = (await session.execute(self._heads_query(), {"terminal_id": terminal_id})).first()
+        if row is not None:
+            return row[0], row[1] or 0
+        Terminal, _ = self._models_provider()
+        exists = await session.scalar(select(Terminal.id).where(Terminal.serial_number == terminal_id))
+        return (0, 0) if exists else None
+
+    async def current(self, terminal_id: str) -> Optional[ConfigState]:
+        async with self._session_factory() as session:
+            heads = await self._heads(session, terminal_id)
+            if heads is None:
+                return None
+            return await self._state(session, terminal_id, *heads)
+
+    async def poll(self, terminal_id: str, if_none_match: Optional[str] = None,
+                   patch: bool = False) -> Tuple[Optional[ConfigState], Optional[List[Dict[str, Any]]]]:
+        """Опрос терминала: (состояние, операции JSON Patch).
+
+        Состояние None - терминала нет. Если ETag клиента совпадает с текущим,
+        операции - пустой список (ответ 304); если запрошен patch и версия
+        клиента известна - операции от нее; иначе None (полная конфигурация).
+        """
+        self.stats["polls"] += 1
+        async with self._session_factory() as session:
+            heads = await self._heads(session, terminal_id)
+            if heads is None:
+                return None, None
+            state = await self._state(session, terminal_id, *heads)
+            client = parse_etag(if_none_match)
+            if client == heads:
+                self.stats["not_modified"] += 1
+                return state, []
+            if patch and client is not None:
+                base = await self._state(session, terminal_id, *client)
+                if base is not None:
+                    self.stats["patches"] += 1
+                    return state, json_patch(base.config, state.config)
+        self.stats["full"] += 1
+        return state, None
+
+    # Запись
+
+    async def _write(self, owner_type: str, owner_key: str, template: Optional[str], config: Dict[str, Any]) -> Tuple[int, bool]:
+        """Новая версия владельца; (версия, создана ли). Одинаковое содержимое новой версии не создает."""
+        _, ConfigVersion = self._models_provider()
+        digest = content_hash({"template": template, "config": config})
+        for _ in range(3):
+            async with self._session_factory() as session:
+                head = (await session.execute(
+                    select(ConfigVersion.version, ConfigVersion.content_hash).where(
+                        ConfigVersion.owner_type == owner_type, ConfigVersion.owner_key == owner_key
+                    ).order_by(ConfigVersion.version.desc()).limit(1)
+                )).first()
+                if head is not None and head[1] == digest:
+                    return head[0], False
+                version = (head[0] if head else 0) + 1
+                session.add(ConfigVersion(
+                    owner_type=owner_type, owner_key=owner_key, version=version,
+                    template=template, config=config, content_hash=digest
+                ))
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # Параллельная запись заняла номер версии - повтор с новым номером
+                    await session.rollback()
+                    continue
+            self._remember(self._versions, (owner_type, owner_key, version), (template, config))
+            return version, True
+        raise RuntimeError(f"Не удалось записать версию конфигурации {owner_type}:{owner_key}")
+
+    async def update_terminal(self, terminal_id: str, overrides: Dict[str, Any],
+                              template=KEEP_TEMPLATE) -> Tuple[ConfigState, List[Dict[str, Any]]]:
+        """Новая версия параметров терминала; (новое состояние, JSON Patch от предыдущего)"""
+        previous = await self.current(terminal_id)
+        if template is KEEP_TEMPLATE:
+            template = previous.template if previous else None
+        await self._write(OWNER_TERMINAL, terminal_id, template, overrides)
+        state = await self.current(terminal_id)
+        return state, json_patch(previous.config, state.config) if previous else []
+
+    async def update_template(self, name: str, config: Dict[str, Any]) -> int:
+        """Новая версия шаблона; терминалы получат ее при следующем опросе"""
+        version, _ = await self._write(OWNER_TEMPLATE, name, None, config)
+        return version
+
+def _config_models():
+    from database import Terminal, TerminalConfigVersion
+    return Terminal, TerminalConfigVersion
+
+def _config_defaults():
+    from models.terminal import TerminalConfig
+    return TerminalConfig().dict()
+
+def _session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session()
+
+# Глобальное хранилище конфигурации терминалов
+terminal_config_store = TerminalConfigStore(_session, _config_models, _config_defaults)
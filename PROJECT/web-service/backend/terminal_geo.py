@@ -0,0 +1,156 @@
+"""
+Пространственный индекс терминалов PayGo
+Сетка ячеек по широте и долготе двух уровней для поиска ближайших терминалов
+и терминалов в радиусе без обращения к базе данных
+"""
+
+import math
+from typing import Optional, Callable, Dict, List, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Размеры ячеек в градусах: ~5 км для запросов в городе, ~110 км - вдали от терминалов
+GRID_LEVELS = (0.05, 1.0)
+# Колец ячеек вокруг точки запроса на одном уровне до перехода на следующий
+MAX_RINGS = 12
+
+def haversine_km(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Расстояния по большому кругу от точки до массива точек, км"""
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes - longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def _ring(row: int, col: int, radius: int):
+    """Ячейки на границе квадрата radius вокруг (row, col)"""
+    if radius == 0:
+        yield row, col
+        return
+    for dcol in range(-radius, radius + 1):
+        yield row - radius, col + dcol
+        yield row + radius, col + dcol
+    for drow in range(-radius + 1, radius):
+        yield row + drow, col - radius
+        yield row + drow, col + radius
+
+class GeoGrid:
+    """Слоты терминалов в ячейках сетки (индекс широты, индекс долготы).
+
+    Поиск обходит кольца ячеек вокруг точки запроса, пока расстояние до
+    непросмотренных ячеек не превысит расстояние до k-го найденного терминала
+    (или радиус поиска). Точные расстояния считаются формулой гаверсинусов
+    векторно только для кандидатов из просмотренных ячеек. Если мелкой сетки
+    не хватило, поиск повторяется на крупной, затем - перебором всех точек.
+    Переход через меридиан 180° не учитывается.
+    """
+
+    def __init__(self, levels: Tuple[float, ...] = GRID_LEVELS, max_rings: int = MAX_RINGS):
+        self.levels = levels
+        self.max_rings = max_rings
+        self._cells: List[Dict[Tuple[int, int], List[int]]] = [{} for _ in levels]
+        self._latitude = np.full(1024, np.nan)
+        self._longitude = np.full(1024, np.nan)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _cell(self, level: int, latitude: float, longitude: float) -> Tuple[int, int]:
+        size = self.levels[level]
+        return math.floor(latitude / size), math.floor(longitude / size)
+
+    def set(self, slot: int, latitude: float, longitude: float):
+        """Положение слота; повторный вызов переносит слот в новые ячейки"""
+        if slot >= len(self._latitude):
+            capacity = max(slot + 1, 2 * len(self._latitude))
+            self._latitude = np.concatenate([self._latitude, np.full(capacity - len(self._latitude), np.nan)])
+            self._longitude = np.concatenate([self._longitude, np.full(capacity - len(self._longitude), np.nan)])
+        if not np.isnan(self._latitude[slot]):
+            if self._latitude[slot] == latitude and self._longitude[slot] == longitude:
+                return
+            self.discard(slot)
+        self._latitude[slot] = latitude
+        self._longitude[slot] = longitude
+        for level, cells in enumerate(self._cells):
+            cells.setdefault(self._cell(level, latitude, longitude), []).append(slot)
+        self._count += 1
+
+    def discard(self, slot: int):
+        if slot >= len(self._latitude) or np.isnan(self._latitude[slot]):
+            return
+        latitude, longitude = float(self._latitude[slot]), float(self._longitude[slot])
+        for level, cells in enumerate(self._cells):
+            cell = self._cell(level, latitude, longitude)
+            bucket = cells[cell]
+            bucket.remove(slot)
+            if not bucket:
+                del cells[cell]
+        self._latitude[slot] = np.nan
+        self._longitude[slot] = np.nan
+        self._count -= 1
+
+    def position(self, slot: int) -> Optional[Tuple[float, float]]:
+        if slot >= len(self._latitude) or np.isnan(self._latitude[slot]):
+            return None
+        return float(self._latitude[slot]), float(self._longitude[slot])
+
+    def _bound_km(self, level: int, latitude: float, longitude: float, row: int, col: int, rings: int) -> float:
+        """Нижняя граница расстояния до точек вне колец 0..rings"""
+        size = self.levels[level]
+        dlat = min(latitude - (row - rings) * size, (row + rings + 1) * size - latitude)
+        dlon = min(longitude - (col - rings) * size, (col + rings + 1) * size - longitude)
+        # Долгота сжимается к полюсам: берется самая высокая широта просмотренной полосы
+        widest = min(abs(latitude) + (rings + 1) * size, 90.0)
+        return KM_PER_DEGREE * min(dlat, dlon * math.cos(math.radians(widest)))
+
+    def nearest(self, latitude: float, longitude: float, limit: Optional[int] = None,
+                radius_km: Optional[float] = None,
+                accept: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(слоты, расстояния в км) по возрастанию расстояния.
+
+        limit - сколько ближайших вернуть (None - все в радиусе), radius_km -
+        предел расстояния; нужен хотя бы один из них. accept(slots) - маска
+        слотов, проходящих фильтры.
+        """
+        if limit is None and radius_km is None:
+            raise ValueError("Нужен limit или radius_km")
+        for level in range(len(self.levels)):
+            row, col = self._cell(level, latitude, longitude)
+            cells = self._cells[level]
+            slots = np.empty(0, dtype=np.int64)
+            distances = np.empty(0)
+            for rings in range(self.max_rings + 1):
+                found = [slot for cell in _ring(row, col, rings) for slot in cells.get(cell, ())]
+                if found:
+                    slots, distances = self._merge(slots, distances, np.array(found, dtype=np.int64),
+                                                   latitude, longitude, limit, radius_km, accept)
+                bound = self._bound_km(level, latitude, longitude, row, col, rings)
+                if radius_km is not None and bound >= radius_km:
+                    return slots, distances
+                if limit is not None and len(slots) >= limit and distances[-1] <= bound:
+                    return slots, distances
+        # Ни один уровень не дал гарантированного ответа - перебор всех точек
+        found = np.flatnonzero(~np.isnan(self._latitude))
+        return self._merge(np.empty(0, dtype=np.int64), np.empty(0), found,
+                           latitude, longitude, limit, radius_km, accept)
+
+    def _merge(self, slots, distances, found, latitude, longitude, limit, radius_km, accept):
+        """Добавление кандидатов к найденным: фильтры, расстояния, отсев лишних"""
+        if accept is not None and len(found):
+            found = found[accept(found)]
+        found_distances = haversine_km(latitude, longitude, self._latitude[found], self._longitude[found])
+        if radius_km is not None:
+            inside = found_distances <= radius_km
+            found, found_distances = found[inside], found_distances[inside]
+        slots = np.concatenate([slots, found])
+        distances = np.concatenate([distances, found_distances])
+        if limit is not None and len(slots) > limit:
+            keep = np.argpartition(distances, limit - 1)[:limit]
+            slots, distances = slots[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return slots[order], distances[order]
@@ -0,0 +1,369 @@
+"""
+Реестр терминалов PayGo в памяти
+Статус, последний heartbeat и счетчики каждого терминала в компактных массивах,
+куча по времени heartbeat для поиска терминалов без связи, сетка координат
+для поиска ближайших терминалов
+"""
+
+import heapq
+import logging
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from terminal_geo import GeoGrid
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("online", "offline", "maintenance", "error")
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+PAYMENT_METHODS = ("nfc", "qr_code", "biometric", "card_insert")
+_PAYMENT_METHOD_BITS = {method: 1 << bit for bit, method in enumerate(PAYMENT_METHODS)}
+
+# Терминал без heartbeat дольше этого считается проблемным
+STALE_AFTER_SECONDS = 3600
+
+def _status_code(status) -> int:
+    # Неизвестный статус учитывается как error
+    return _STATUS_CODES.get(getattr(status, "value", status), _STATUS_CODES["error"])
+
+def _methods_mask(methods) -> int:
+    mask = 0
+    for method in methods or ():
+        mask |= _PAYMENT_METHOD_BITS.get(getattr(method, "value", method), 0)
+    return mask
+
+def _to_timestamp(value: Optional[datetime]) -> float:
+    # Время в базе хранится в UTC без часового пояса
+    if not value:
+        return 0.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class TerminalRegistry:
+    """Состояние терминалов в памяти: сводка за O(1), проблемные терминалы за O(k).
+
+    Каждому терминалу выделяется слот; поля хранятся в параллельных массивах
+    array, а не в словарях на терминал. Счетчики по статусам и суммы ведутся
+    при каждом изменении. Куча (время heartbeat, слот) с ленивым удалением
+    устаревших записей выдает терминалы, переставшие присылать heartbeat.
+    Координаты слотов лежат в сетке GeoGrid для поиска ближайших терминалов.
+    """
+
+    def __init__(self, session_factory=None, models_provider=None, stale_after: float = STALE_AFTER_SECONDS):
+        # session_factory() - асинхронный контекстный менеджер сессии,
+        # models_provider() - модели (Terminal, Transaction)
+        self._session_factory = session_factory
+        self._models_provider = models_provider
+        self.stale_after = stale_after
+        self._clear()
+
+    def _clear(self):
+        self._slots: Dict[str, int] = {}
+        self._terminal_ids: List[Optional[str]] = []
+        # Слоты удаленных терминалов для повторного использования
+        self._free_slots: List[int] = []
+        self._info: List[Tuple[str, str]] = []  # (name, location)
+        self._status = array("b")
+        self._methods = array("B")  # битовая маска PAYMENT_METHODS
+        self._last_heartbeat = array("d")  # секунды Unix, 0 - heartbeat не было
+        self._transactions = array("q")
+        self._amount = array("d")
+        self._status_counts = [0] * len(STATUSES)
+        self._total_transactions = 0
+        self._total_amount = 0.0
+        self._heap: List[Tuple[float, int]] = []
+        # Слоты, уже признанные проблемными (heartbeat старше stale_after)
+        self._stale: set = set()
+        self._geo = GeoGrid()
+        self.loaded_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # Загрузка из базы данных
+
+    async def rebuild(self):
+        """Полная загрузка реестра из таблицы terminals (при запуске).
+
+        Терминал в реестре - его серийный номер, heartbeat - last_ping.
+        Счетчики считаются по завершенным транзакциям: в terminals их нет.
+        """
+        Terminal, Transaction = self._models_provider()
+        totals = (
+            select(
+                Transaction.terminal_id,
+                func.count(Transaction.id).label("transactions"),
+                func.sum(Transaction.amount).label("amount")
+            )
+            .where(Transaction.status == "completed")
+            .group_by(Transaction.terminal_id)
+            .subquery()
+        )
+        async with self._session_factory() as session:
+            result = await session.execute(
+                select(
+                    Terminal.serial_number, Terminal.name, Terminal.location, Terminal.status,
+                    Terminal.last_ping, totals.c.transactions, totals.c.amount,
+                    Terminal.latitude, Terminal.longitude, Terminal.supported_payment_methods
+                )
+                .outerjoin(totals, totals.c.terminal_id == Terminal.id)
+            )
+            rows = result.all()
+        self.load(rows)
+        logger.info(f"Terminal registry loaded {len(self)} terminals")
+
+    def load(self, rows):
+        """Замена содержимого: строки (terminal_id, name, location, status, last_heartbeat,
+        transactions, amount, latitude, longitude, payment_methods)"""
+        self._clear()
+        for (terminal_id, name, location, status, last_heartbeat, transactions, amount,
+             latitude, longitude, payment_methods) in rows:
+            self.upsert(terminal_id, name, location, status, last_heartbeat, transactions or 0, amount or 0.0,
+                        latitude, longitude, payment_methods)
+        self.loaded_at = datetime.utcnow()
+
+    # Изменения
+
+    def upsert(self, terminal_id: str, name: str = "", location: str = "", status="offline",
+               last_heartbeat: Optional[datetime] = None, transactions: int = 0, amount: float = 0.0,
+               latitude: Optional[float] = None, longitude: Optional[float] = None, payment_methods=None):
+        """Добавление терминала или замена всех его полей"""
+        slot = self._slots.get(terminal_id)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+                self._terminal_ids[slot] = terminal_id
+                self._info[slot] = (name, location)
+                self._status[slot] = _status_code(status)
+            else:
+                slot = len(self._terminal_ids)
+                self._terminal_ids.append(terminal_id)
+                self._info.append((name, location))
+                self._status.append(_status_code(status))
+                self._methods.append(0)
+                self._last_heartbeat.append(0.0)
+                self._transactions.append(0)
+                self._amount.append(0.0)
+            self._slots[terminal_id] = slot
+            self._status_counts[self._status[slot]] += 1
+        else:
+            self._info[slot] = (name, location)
+            self._set_status(slot, status)
+        self._set_place(slot, latitude, longitude, payment_methods)
+        self._set_counters(slot, transactions, amount)
+        self._set_heartbeat(slot, _to_timestamp(last_heartbeat))
+        return slot
+
+    def update_info(self, terminal_id: str, name: str, location: str, latitude: Optional[float] = None,
+                    longitude: Optional[float] = None, payment_methods=None) -> bool:
+        """Новые описание, координаты и способы оплаты; счетчики и heartbeat не меняются"""
+        slot = self._slots.get(terminal_id)
+        if slot is None:
+            return False
+        self._info[slot] = (name, location)
+        self._set_place(slot, latitude, longitude, payment_methods)
+        return True
+
+    def heartbeat(self, terminal_id: str, status, at: Optional[datetime] = None,
+                  transactions: Optional[int] = None) -> bool:
+        """Heartbeat терминала; False - терминала нет в реестре"""
+        slot = self._slots.get(terminal_id)
+        if slot is None:
+            return False
+        self._set_status(slot, status)
+        self._set_heartbeat(slot, _to_timestamp(at) if at else time.time())
+        if transactions is not None:
+            self._set_counters(slot, transactions, self._amount[slot])
+        return True
+
+    def set_status(self, terminal_id: str, status) -> bool:
+        slot = self._slots.get(terminal_id)
+        if slot is None:
+            return False
+        self._set_status(slot, status)
+        return True
+
+    def replace_status(self, old_status, new_status) -> int:
+        """Массовая смена статуса (режим обслуживания для всех терминалов)"""
+        old_code, new_code = _status_code(old_status), _status_code(new_status)
+        changed = 0
+        for slot, code in enumerate(self._status):
+            if code == old_code:
+                self._status[slot] = new_code
+                changed += 1
+        self._status_counts[old_code] -= changed
+        self._status_counts[new_code] += changed
+        return changed
+
+    def remove(self, terminal_id: str) -> bool:
+        slot = self._slots.pop(terminal_id, None)
+        if slot is None:
+            return False
+        self._set_counters(slot, 0, 0.0)
+        self._set_heartbeat(slot, 0.0)
+        self._set_place(slot, None, None, None)
+        self._status_counts[self._status[slot]] -= 1
+        self._status[slot] = -1
+        self._terminal_ids[slot] = None
+        self._free_slots.append(slot)
+        return True
+
+    def record_transaction(self, terminal_id: str, amount: float) -> bool:
+        """Завершенная транзакция терминала"""
+        slot = self._slots.get(terminal_id)
+        if slot is None:
+            return False
+        self._set_counters(slot, self._transactions[slot] + 1, self._amount[slot] + amount)
+        return True
+
+    def _set_status(self, slot: int, status):
+        code = _status_code(status)
+        if code != self._status[slot]:
+            self._status_counts[self._status[slot]] -= 1
+            self._status_counts[code] += 1
+            self._status[slot] = code
+
+    def _set_place(self, slot: int, latitude: Optional[float], longitude: Optional[float], payment_methods):
+        self._methods[slot] = _methods_mask(payment_methods)
+        if latitude is None or longitude is None:
+            self._geo.discard(slot)
+        else:
+            self._geo.set(slot, latitude, longitude)
+
+    def _set_counters(self, slot: int, transactions: int, amount: float):
+        self._total_transactions += transactions - self._transactions[slot]
+        self._total_amount += amount - self._amount[slot]
+        self._transactions[slot] = transactions
+        self._amount[slot] = amount
+
+    def _set_heartbeat(self, slot: int, timestamp: float):
+        self._last_heartbeat[slot] = timestamp
+        self._stale.discard(slot)
+        if timestamp:
+            heapq.heappush(self._heap, (timestamp, slot))
+            # Каждый heartbeat добавляет запись; устаревшие копии вычищаются перестройкой
+            if len(self._heap) > 4 * len(self._terminal_ids) + 1024:
+                self._compact_heap()
+
+    def _compact_heap(self):
+        self._heap = [
+            (timestamp, slot) for slot, timestamp in enumerate(self._last_heartbeat)
+            if timestamp and slot not in self._stale
+        ]
+        heapq.heapify(self._heap)
+
+    # Чтение
+
+    def _advance_staleness(self, now: float):
+        """Перенос терминалов с heartbeat старше stale_after из кучи в множество проблемных"""
+        cutoff = now - self.stale_after
+        heap = self._heap
+        while heap and heap[0][0] < cutoff:
+            timestamp, slot = heapq.heappop(heap)
+            # Запись актуальна, только если с тех пор не было нового heartbeat
+            if self._last_heartbeat[slot] == timestamp:
+                self._stale.add(slot)
+
+    def problematic(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Терминалы без heartbeat дольше stale_after, давно молчащие первыми"""
+        self._advance_staleness(now or time.time())
+        slots = sorted(self._stale, key=lambda slot: self._last_heartbeat[slot])
+        if limit is not None:
+            slots = slots[:limit]
+        return [
+            {
+                "terminal_id": self._terminal_ids[slot],
+                "name": self._info[slot][0],
+                "location": self._info[slot][1],
+                "status": STATUSES[self._status[slot]],
+                "last_heartbeat": datetime.utcfromtimestamp(self._last_heartbeat[slot]).isoformat()
+            }
+            for slot in slots
+        ]
+
+    def problematic_count(self, now: Optional[float] = None) -> int:
+        self._advance_staleness(now or time.time())
+        return len(self._stale)
+
+    def status_counts(self) -> Dict[str, int]:
+        return dict(zip(STATUSES, self._status_counts))
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка по всем терминалам без обращения к базе данных"""
+        counts = self.status_counts()
+        return {
+            "total_terminals": len(self),
+            "online_terminals": counts["online"],
+            "offline_terminals": counts["offline"],
+            "maintenance_terminals": counts["maintenance"],
+            "error_terminals": counts["error"],
+            "total_transactions": self._total_transactions,
+            "total_amount": self._total_amount,
+            "average_amount": self._total_amount / max(self._total_transactions, 1)
+        }
+
+    def nearby(self, latitude: float, longitude: float, limit: Optional[int] = 10,
+               radius_km: Optional[float] = None, status=None, payment_method=None) -> List[Dict[str, Any]]:
+        """Ближайшие к точке терминалы (limit) и/или терминалы в радиусе, ближние первыми"""
+        status_code = _status_code(status) if status is not None else None
+        method_bit = _PAYMENT_METHOD_BITS.get(getattr(payment_method, "value", payment_method), 0) \
+            if payment_method is not None else None
+
+        def accept(slots: np.ndarray) -> np.ndarray:
+            mask = np.ones(len(slots), dtype=bool)
+            if status_code is not None:
+                mask &= np.frombuffer(self._status, dtype=np.int8)[slots] == status_code
+            if method_bit is not None:
+                mask &= (np.frombuffer(self._methods, dtype=np.uint8)[slots] & method_bit) != 0
+            return mask
+
+        filters = accept if status_code is not None or method_bit is not None else None
+        slots, distances = self._geo.nearest(latitude, longitude, limit, radius_km, filters)
+        results = []
+        for slot, distance in zip(slots.tolist(), distances.tolist()):
+            slot_latitude, slot_longitude = self._geo.position(slot)
+            mask = self._methods[slot]
+            results.append({
+                "terminal_id": self._terminal_ids[slot],
+                "name": self._info[slot][0],
+                "location": self._info[slot][1],
+                "status": STATUSES[self._status[slot]],
+                "latitude": slot_latitude,
+                "longitude": slot_longitude,
+                "supported_payment_methods": [method for method in PAYMENT_METHODS if mask & _PAYMENT_METHOD_BITS[method]],
+                "distance_km": round(distance, 3)
+            })
+        return results
+
+    def get(self, terminal_id: str) -> Optional[Dict[str, Any]]:
+        slot = self._slots.get(terminal_id)
+        if slot is None:
+            return None
+        last_heartbeat = self._last_heartbeat[slot]
+        return {
+            "terminal_id": terminal_id,
+            "name": self._info[slot][0],
+            "location": self._info[slot][1],
+            "status": STATUSES[self._status[slot]],
+            "last_heartbeat": datetime.utcfromtimestamp(last_heartbeat) if last_heartbeat else None,
+            "total_transactions": self._transactions[slot],
+            "total_amount": self._amount[slot]
+        }
+
+def _terminal_models():
+    from database import Terminal, Transaction
+    return Terminal, Transaction
+
+def _read_session():
+    from database.connection_pool import db_pool
+    return db_pool.get_session(read_only=True)
+
+# Глобальный реестр терминалов
+terminal_registry = TerminalRegistry(_read_session, _terminal_models)
@@ -1,4 +1,5 @@
 import pytest
+import pytest_asyncio
 import asyncio
 import os
 import tempfile
@@ -7,16 +8,17 @@ from unittest.mock import AsyncMock, MagicMock
 import redis.asyncio as redis
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import StaticPool, NullPool
 
 # Импортируем наши модули
 from main import app
-from database import get_db, Base
-from config import get_settings
+from database import get_db, get_read_db, Base
+from database.connection_pool import DatabaseConnectionPool, to_async_url
+from config import settings
 
 # Тестовая конфигурация
-TEST_DATABASE_URL = "sqlite:///:memory:"
 TEST_REDIS_URL = "redis://localhost:6379/1"
 
 @pytest.fixture(scope="session")
@@ -27,24 +29,30 @@ def event_loop():
     loop.close()
 
 @pytest.fixture(scope="session")
-def test_settings():
+def test_database_url(tmp_path_factory):
+    """Файловая БД во временном каталоге сессии: синхронный движок создает схему,
+    асинхронный обслуживает роутеры"""
+    return f"sqlite:///{tmp_path_factory.mktemp('db') / 'test_paygo.db'}"
+
+@pytest.fixture(scope="session")
+def test_settings(test_database_url):
     """Тестовые настройки"""
-    settings = get_settings()
-    settings.database_url = TEST_DATABASE_URL
-    settings.redis_url = TEST_REDIS_URL
-    settings.secret_key = "test_secret_key_12345"
-    settings.debug = True
+    settings.DATABASE_URL = test_database_url
+    settings.REDIS_URL = TEST_REDIS_URL
+    settings.SECRET_KEY = "test_secret_key_12345"
+    settings.DEBUG = True
     return settings
 
 @pytest.fixture(scope="session")
-def test_engine():
+def test_engine(test_database_url):
     """Тестовый движок базы данных"""
     engine = create_engine(
-        TEST_DATABASE_URL,
+        test_database_url,
         connect_args={"check_same_thread": False},
         poolclass=StaticPool,
     )
-    return engine
+    yield engine
+    engine.dispose()
 
 @pytest.fixture(scope="session")
 def test_session_factory(test_engine):
@@ -56,6 +64,12 @@ def test_session_factory(test_engine):
     )
     return TestingSessionLocal
 
+@pytest.fixture(scope="session")
+def test_async_session_factory(test_database_url):
+    """Фабрика асинхронных сессий для подмены get_db"""
+    async_engine = create_async_engine(to_async_url(test_database_url), poolclass=NullPool)
+    return async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
 @pytest.fixture(scope="function")
 def test_db(test_engine, test_session_factory):
     """Тестовая база данных"""
@@ -71,6 +85,38 @@ def test_db(test_engine, test_session_factory):
     session.close()
     Base.metadata.drop_all(bind=test_engine)
 
+@pytest_asyncio.fixture
+async def make_db_pool(tmp_path):
+    """Фабрика пулов приложения над файловыми SQLite БД во временном каталоге теста.
+
+    Схема создается синхронным движком (metadata - по умолчанию database.Base,
+    tables - подмножество таблиц), пул работает через aiosqlite; остальные
+    именованные параметры передаются конструктору пула. Все созданные пулы
+    закрываются после теста.
+    """
+    pools = []
+    
+    async def make(name="test.db", metadata=None, tables=None, pool_size=4, pool_class=DatabaseConnectionPool,
+                   **pool_options):
+        path = tmp_path / name
+        engine = create_engine(f"sqlite:///{path}")
+        (metadata or Base.metadata).create_all(engine, tables=tables)
+        engine.dispose()
+        pool = pool_class(f"sqlite+aiosqlite:///{path}", pool_size=pool_size, max_overflow=0, **pool_options)
+        await pool.initialize()
+        pools.append(pool)
+        return pool
+    
+    yield make
+    
+    for pool in pools:
+        await pool.close()
+
+@pytest_asyncio.fixture
+async def db_pool(make_db_pool):
+    """Пул приложения над SQLite БД со всеми таблицами database.Base"""
+    return await make_db_pool()
+
 @pytest.fixture(scope="function")
 def mock_redis():
     """Мок Redis клиента"""
@@ -89,19 +135,18 @@ def mock_redis():
     return mock_redis
 
 @pytest.fixture(scope="function")
-def test_client(test_db, mock_redis):
+def test_client(test_db, test_async_session_factory, mock_redis):
     """Тестовый клиент FastAPI"""
-    def override_get_db():
-        try:
-            yield test_db
-        finally:
-            pass
+    async def override_get_db():
+        async with test_async_session_factory() as session:
+            yield session
     
     def override_get_redis():
         return mock_redis
     
-    # Подменяем зависимости
+    # Подменяем зависимости: эндпоинты чтения тоже работают с тестовой БД
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     # app.dependency_overrides[get_redis] = override_get_redis
     
     with TestClient(app) as client:
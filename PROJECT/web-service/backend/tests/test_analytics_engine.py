@@ -0,0 +1,190 @@
+import pytest
+import pytest_asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+
+import database as database_module
+import database.connection_pool as connection_pool_module
+
+class TestAnalyticsEngine:
+    """Аналитика одним потоковым запросом и агрегацией NumPy вместо запросов по дням"""
+    
+    TRANSACTIONS = 50000
+    BENCHMARK_ROWS = 10000000
+    ROUND_TRIP = 0.0005  # 0.5ms сетевой задержки на запрос до PostgreSQL
+    
+    @pytest_asyncio.fixture
+    async def pool(self, db_pool, monkeypatch):
+        import random
+        
+        # Глобальный экземпляр читает через db_pool приложения
+        monkeypatch.setattr(connection_pool_module, "db_pool", db_pool)
+        rng = random.Random(11)
+        now = datetime.utcnow()
+        await db_pool.bulk_insert(database_module.User, [
+            {"email": f"user{i}@paygo.ru", "phone": f"+7900{i:07d}", "full_name": f"User {i}", "hashed_password": "x",
+             "role": rng.choice(["user", "user", "operator", "admin"]),
+             "created_at": now - timedelta(seconds=rng.randint(0, 60 * 24 * 3600))}
+            for i in range(3000)
+        ])
+        await db_pool.bulk_insert(database_module.Terminal, [
+            {"serial_number": f"T{i:04d}", "name": f"Терминал {i}", "location": "Москва", "address": "ул. Тверская",
+             "terminal_type": "stationary", "model": "PG-1", "manufacturer": "PayGo"}
+            for i in range(1, 201)
+        ])
+        await db_pool.bulk_insert(database_module.Card, [
+            {"user_id": rng.randint(1, 1000), "masked_number": "**** 1234", "bank_name": "Сбербанк",
+             "card_type": "debit", "expires_at": now + timedelta(days=700), "token": f"tok{i}"}
+            for i in range(2500)
+        ])
+        await db_pool.bulk_insert(database_module.Transaction, [
+            {"transaction_id": f"TXN_{i}", "user_id": rng.randint(1, 3000), "terminal_id": rng.randint(1, 200),
+             "amount": round(rng.lognormvariate(6, 1), 2),
+             "status": rng.choices(["completed", "failed"], weights=[9, 1])[0],
+             "payment_method": rng.choice(["nfc", "qr_code", "biometric"]),
+             "created_at": now - timedelta(seconds=rng.randint(0, 400 * 24 * 3600))}
+            for i in range(self.TRANSACTIONS)
+        ])
+        return db_pool
+    
+    async def _legacy_daily(self, db, days: int, end_date: datetime) -> List[Dict[str, Any]]:
+        """Прежняя реализация: два запроса на каждый день периода"""
+        from sqlalchemy import func, select
+        Transaction = database_module.Transaction
+        start_date = end_date - timedelta(days=days)
+        daily_stats = []
+        for i in range(days):
+            day_start = start_date + timedelta(days=i)
+            day_end = day_start + timedelta(days=1)
+            conditions = [Transaction.created_at >= day_start, Transaction.created_at < day_end,
+                          Transaction.status == "completed"]
+            count = await db.scalar(select(func.count(Transaction.id)).where(*conditions))
+            amount = await db.scalar(select(func.sum(Transaction.amount)).where(*conditions)) or 0.0
+            daily_stats.append({"date": day_start.date().isoformat(), "transactions": count, "amount": amount})
+        return daily_stats
+    
+    @pytest.mark.performance
+    @pytest.mark.asyncio
+    async def test_analytics_single_query_matches_daily_queries(self, pool):
+        from analytics_engine import AnalyticsEngine, _analytics_models, _read_session
+        
+        engine = AnalyticsEngine(_read_session, _analytics_models, period_granularity=3600)
+        event.listen(pool.engine.sync_engine, "before_cursor_execute", lambda *args: time.sleep(self.ROUND_TRIP))
+        
+        start_time = time.perf_counter()
+        async with pool.get_session(read_only=True) as db:
+            legacy_daily = await self._legacy_daily(db, 365, engine.period_end())
+        legacy_time = time.perf_counter() - start_time
+        
+        queries_before = pool.query_stats.query_count
+        start_time = time.perf_counter()
+        analytics = await engine.transaction_analytics(365)
+        engine_time = time.perf_counter() - start_time
+        engine_queries = pool.query_stats.query_count - queries_before
+        
+        start_time = time.perf_counter()
+        cached = await engine.transaction_analytics(365)
+        cached_time = time.perf_counter() - start_time
+        
+        print(f"Transaction Analytics (days=365, {self.TRANSACTIONS} rows, {self.ROUND_TRIP * 1000}ms round trip):")
+        print(f"  Per-day queries (before): {legacy_time * 1000:.0f}ms, 730 queries")
+        print(f"  Single streamed query + NumPy (after): {engine_time * 1000:.0f}ms, {engine_queries} queries")
+        print(f"  Cached: {cached_time * 1000:.3f}ms")
+        
+        assert engine_queries <= 2
+        assert cached is analytics
+        assert len(analytics["daily_stats"]) == 365
+        for legacy_day, day in zip(legacy_daily, analytics["daily_stats"]):
+            assert day["transactions"] == legacy_day["transactions"]
+            assert day["amount"] == pytest.approx(legacy_day["amount"], abs=0.01)
+        assert sum(week["transactions"] for week in analytics["weekly_stats"]) == sum(
+            day["transactions"] for day in legacy_daily
+        )
+        assert sum(method["transactions"] for method in analytics["payment_methods"]) == sum(
+            hour["transactions"] for hour in analytics["hourly_stats"]
+        )
+        assert analytics["top_terminals"][0]["terminal_id"].startswith("T")
+        amounts = [terminal["amount"] for terminal in analytics["top_terminals"]]
+        assert amounts == sorted(amounts, reverse=True)
+        percentiles = analytics["amount_percentiles"]
+        assert percentiles["p50"] < percentiles["p95"] < percentiles["p99"]
+        assert engine_time < legacy_time
+    
+    @pytest.mark.asyncio
+    async def test_user_analytics_card_stats(self, pool):
+        from sqlalchemy import func, select
+        from analytics_engine import AnalyticsEngine, _analytics_models, _read_session
+        
+        engine = AnalyticsEngine(_read_session, _analytics_models)
+        analytics = await engine.user_analytics(days=30)
+        
+        async with pool.get_session(read_only=True) as db:
+            users_with_cards = await db.scalar(select(func.count(func.distinct(database_module.Card.user_id))))
+            registrations = await db.scalar(select(func.count(database_module.User.id)).where(
+                database_module.User.created_at >= datetime.utcnow() - timedelta(days=30)
+            ))
+        
+        assert analytics["cards"]["total_cards"] == 2500
+        assert analytics["cards"]["users_with_cards"] == users_with_cards
+        assert analytics["cards"]["avg_cards_per_user"] == round(2500 / users_with_cards, 2)
+        assert sum(day["registrations"] for day in analytics["daily_registrations"]) == registrations
+    
+    @pytest.mark.performance
+    def test_vectorized_aggregation_10m_rows(self):
+        import numpy as np
+        from analytics_engine import PeriodAccumulator, _to_epoch
+        
+        rng = np.random.default_rng(5)
+        start = datetime(2025, 1, 1)
+        start_ts = _to_epoch(start)
+        chunk = 1000000
+        
+        accumulator = PeriodAccumulator(start, 365)
+        total_amount = 0.0
+        generate_time = 0.0
+        start_time = time.perf_counter()
+        for _ in range(self.BENCHMARK_ROWS // chunk):
+            generate_start = time.perf_counter()
+            timestamps = start_ts + rng.uniform(0, 365 * 86400, chunk)
+            amounts = rng.lognormal(6, 1, chunk)
+            methods = rng.integers(0, 3, chunk)
+            terminals = rng.integers(1, 5000, chunk)
+            generate_time += time.perf_counter() - generate_start
+            accumulator.add(timestamps, amounts, methods, terminals)
+            total_amount += amounts.sum()
+        percentiles = accumulator.percentiles()
+        vectorized_time = time.perf_counter() - start_time - generate_time
+        
+        # Те же разбивки построчно на Python для сравнения (200k строк)
+        sample = 200000
+        rows = list(zip(
+            (start_ts + rng.uniform(0, 365 * 86400, sample)).tolist(),
+            rng.lognormal(6, 1, sample).tolist(),
+            rng.choice(["nfc", "qr_code", "biometric"], sample).tolist(),
+            rng.integers(1, 5000, sample).tolist()
+        ))
+        start_time = time.perf_counter()
+        breakdowns = ({}, {}, {}, {})
+        for timestamp, amount, method, terminal in rows:
+            keys = (int((timestamp - start_ts) // 86400), int(timestamp % 86400 // 3600), method, terminal)
+            for breakdown, key in zip(breakdowns, keys):
+                bucket = breakdown.setdefault(key, [0, 0.0])
+                bucket[0] += 1
+                bucket[1] += amount
+        sorted(amount for _, amount, _, _ in rows)
+        python_rate = sample / (time.perf_counter() - start_time)
+        
+        print(f"Vectorized Aggregation ({self.BENCHMARK_ROWS} rows):")
+        print(f"  NumPy: {vectorized_time:.2f}s ({self.BENCHMARK_ROWS / vectorized_time / 1e6:.1f}M rows/s)")
+        print(f"  Python loop: {python_rate / 1e6:.2f}M rows/s")
+        
+        assert accumulator.rows == self.BENCHMARK_ROWS
+        assert accumulator.daily_count.sum() == self.BENCHMARK_ROWS
+        assert accumulator.terminal_amount.sum() == pytest.approx(total_amount)
+        assert percentiles["p50"] == pytest.approx(np.exp(6), rel=0.01)
+        # Перцентили из гистограммы фиксированного размера, суммы не сохраняются
+        assert accumulator.amount_histogram.nbytes < 64 * 1024
+        assert self.BENCHMARK_ROWS / vectorized_time > python_rate * 5
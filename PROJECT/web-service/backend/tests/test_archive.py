@@ -0,0 +1,99 @@
+import pytest
+import pytest_asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any
+
+import database as database_module
+
+class TestTransactionArchive:
+    """Перенос старых транзакций в колоночный архив и поиск через min/max индекс"""
+    
+    ROWS = 200000
+    
+    @pytest_asyncio.fixture
+    async def engine(self, make_db_pool):
+        pool = await make_db_pool("archive.db", tables=[database_module.Transaction.__table__])
+        return pool.engine
+    
+    def _generate_rows(self) -> List[Dict[str, Any]]:
+        import calendar
+        import random
+        
+        rng = random.Random(42)
+        now = datetime.utcnow().replace(microsecond=0)
+        rows = []
+        for index in range(self.ROWS):
+            created_at = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            status = rng.choices(["completed", "failed", "pending"], weights=[90, 5, 5])[0]
+            terminal = rng.randint(1, 200)
+            rows.append({
+                "id": index + 1,
+                "transaction_id": f"TXN_T{terminal:03d}_{calendar.timegm(created_at.timetuple())}_{index:08x}",
+                "terminal_id": terminal,
+                "user_id": rng.randint(1, 5000),
+                "amount": round(rng.uniform(10, 5000), 2),
+                "currency": "RUB",
+                "status": status,
+                "payment_method": rng.choice(["nfc", "qr_code", "biometric"]),
+                "card_mask": f"**** **** **** {rng.randint(0, 9999):04d}",
+                "receipt_number": f"R{index:010d}" if status == "completed" else None,
+                "created_at": created_at,
+                "completed_at": created_at + timedelta(seconds=3) if status == "completed" else None
+            })
+        return rows
+    
+    @pytest.mark.performance
+    @pytest.mark.asyncio
+    async def test_archive_and_query_through(self, engine, tmp_path):
+        import json
+        import random
+        from sqlalchemy import func, insert, select
+        from database.archive import TransactionArchive, FINAL_STATUSES, _transaction_model
+        Transaction = _transaction_model()
+        
+        rows = self._generate_rows()
+        async with engine.begin() as conn:
+            await conn.execute(insert(Transaction), rows)
+        
+        archive = TransactionArchive(
+            str(tmp_path / "archive"), lambda: engine, _transaction_model, rows_per_file=20000
+        )
+        start_time = time.perf_counter()
+        stats = await archive.archive_old_transactions()
+        archive_time = time.perf_counter() - start_time
+        
+        cutoff = datetime.fromisoformat(stats["cutoff"])
+        archived = [row for row in rows if row["created_at"] < cutoff and row["status"] in FINAL_STATUSES]
+        async with engine.connect() as conn:
+            remaining = await conn.scalar(select(func.count(Transaction.id)))
+        
+        raw_bytes = sum(len(json.dumps(row, default=str)) for row in archived)
+        
+        # Поиск по архиву: новый экземпляр читает индекс с диска
+        reader = TransactionArchive(str(tmp_path / "archive"), lambda: engine, _transaction_model)
+        sample = random.Random(7).sample(archived, 200)
+        candidates = [len(reader._candidate_files(row["transaction_id"])) for row in sample]
+        start_time = time.perf_counter()
+        found = [await reader.find_transaction(row["transaction_id"]) for row in sample]
+        lookup_time = (time.perf_counter() - start_time) / len(sample)
+        
+        print(f"Transaction Archive ({self.ROWS} rows):")
+        print(f"  Archived {stats['rows']} rows into {stats['files']} files in {archive_time:.2f}s ({stats['rows'] / archive_time:.0f} rows/s)")
+        print(f"  Size: {stats['bytes'] / stats['rows']:.1f} bytes/row vs {raw_bytes / stats['rows']:.1f} bytes/row as JSON ({raw_bytes / stats['bytes']:.1f}x)")
+        print(f"  Lookup: {lookup_time * 1000:.2f}ms avg, {max(candidates)} of {len(reader.index)} files checked at most")
+        
+        assert stats["rows"] == len(archived) == stats["deleted"]
+        assert remaining == self.ROWS - len(archived)
+        assert reader.get_stats()["pending_deletes"] == 0
+        assert raw_bytes / stats["bytes"] > 3
+        
+        assert max(candidates) <= 2
+        for row, transaction in zip(sample, found):
+            assert transaction is not None
+            assert transaction.transaction_id == row["transaction_id"]
+            assert transaction.amount == row["amount"]
+            assert transaction.created_at == row["created_at"]
+        
+        recent = next(row for row in rows if row["created_at"] >= cutoff)
+        assert await reader.find_transaction(recent["transaction_id"]) is None
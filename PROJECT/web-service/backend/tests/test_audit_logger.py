@@ -0,0 +1,627 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import time
+import statistics
+import os
+import json
+from datetime import datetime, timedelta
+
+import database as database_module
+
+class TestAuditGroupCommit:
+    """Групповая запись аудит лога фоновой задачей вместо open() на каждое событие"""
+    
+    PRODUCERS = 50
+    EVENTS_PER_PRODUCER = 400
+    
+    def _entry(self, producer: int, sequence: int):
+        from audit_logger import AuditLogEntry, AuditEventType
+        return AuditLogEntry(
+            timestamp=datetime(2024, 5, 1, 12, 0, 0) + timedelta(milliseconds=sequence),
+            user_id=f"user_{producer}", ip_address="10.0.0.1",
+            event_type=AuditEventType.PAYMENT_PROCESSED,
+            description=f"Платеж {producer}:{sequence}", details={"sequence": sequence}
+        )
+    
+    async def _produce(self, audit, producers: int, events: int):
+        async def producer(index: int):
+            for sequence in range(events):
+                await audit.log_event(self._entry(index, sequence))
+                if sequence % 10 == 0:
+                    await asyncio.sleep(0)
+        await asyncio.gather(*(producer(index) for index in range(producers)))
+    
+    @pytest.mark.asyncio
+    async def test_group_commit_throughput(self, tmp_path):
+        """Все события записаны по порядку, запись пачками быстрее построчной"""
+        import logging
+        from audit_logger import AuditLogger, FSYNC_INTERVAL
+        logging.getLogger("audit_logger").setLevel(logging.WARNING)
+        total = self.PRODUCERS * self.EVENTS_PER_PRODUCER
+        
+        # Прежняя запись: open/write/close и stat на каждое событие в цикле событий
+        legacy_file = tmp_path / "legacy.log"
+        
+        class LegacyAuditLogger(AuditLogger):
+            async def log_event(self, entry):
+                log_line = json.dumps({
+                    "timestamp": entry.timestamp.isoformat(), "user_id": entry.user_id,
+                    "session_id": entry.session_id, "ip_address": entry.ip_address,
+                    "event_type": entry.event_type.value, "severity": entry.severity.value,
+                    "description": entry.description, "details": entry.details,
+                    "resource_type": entry.resource_type, "resource_id": entry.resource_id,
+                    "success": entry.success, "error_message": entry.error_message
+                }, ensure_ascii=False) + "\n"
+                async with asyncio.Lock():
+                    with open(legacy_file, "a", encoding="utf-8") as f:
+                        f.write(log_line)
+                os.path.getsize(legacy_file)
+        
+        start_time = time.perf_counter()
+        await self._produce(LegacyAuditLogger(str(legacy_file)), self.PRODUCERS, self.EVENTS_PER_PRODUCER)
+        legacy_rate = total / (time.perf_counter() - start_time)
+        
+        audit = AuditLogger(str(tmp_path / "audit.log"), fsync_policy=FSYNC_INTERVAL)
+        audit.start()
+        start_time = time.perf_counter()
+        await self._produce(audit, self.PRODUCERS, self.EVENTS_PER_PRODUCER)
+        await audit.flush()
+        group_rate = total / (time.perf_counter() - start_time)
+        stats = audit.get_stats()
+        await audit.stop()
+        
+        written = [json.loads(line) for line in (tmp_path / "audit.log").read_text(encoding="utf-8").splitlines()]
+        print(f"Audit Group Commit ({total:,} events from {self.PRODUCERS} producers):")
+        print(f"  Per-event open (before): {legacy_rate:,.0f} events/s")
+        print(f"  Group commit (after): {group_rate:,.0f} events/s, {stats['flushes']} flushes, "
+              f"flush p99 {stats['flush_latency_p99_ms']:.2f}ms")
+        
+        assert len(written) == total == stats["written"]
+        for index in range(self.PRODUCERS):
+            sequences = [e["details"]["sequence"] for e in written if e["user_id"] == f"user_{index}"]
+            assert sequences == list(range(self.EVENTS_PER_PRODUCER))
+        assert stats["flushes"] < total / 10
+        assert group_rate > legacy_rate
+    
+    @pytest.mark.asyncio
+    async def test_backpressure_and_drain(self, tmp_path):
+        """Очередь ограничена, медленный диск притормаживает источники, остановка дописывает очередь"""
+        from audit_logger import AuditLogger, FSYNC_BATCH
+        
+        audit = AuditLogger(str(tmp_path / "audit.log"), queue_size=100, batch_size=50, fsync_policy=FSYNC_BATCH)
+        write_batch = audit._write_batch
+        
+        def slow_write(data: bytes):
+            time.sleep(0.005)
+            write_batch(data)
+        
+        audit._write_batch = slow_write
+        audit.start()
+        await self._produce(audit, 10, 100)
+        await audit.stop()
+        stats = audit.get_stats()
+        
+        assert len((tmp_path / "audit.log").read_text(encoding="utf-8").splitlines()) == 1000
+        assert stats["max_queue_depth"] <= 100
+        assert stats["queue_full_waits"] > 0
+        # batch: fsync после каждой пачки и при закрытии
+        assert stats["fsyncs"] == stats["flushes"] + 1
+        assert stats["queue_depth"] == 0
+
+class TestAuditLogSearch:
+    """Поиск по аудит логу через индексы сегментов вместо разбора файла целиком"""
+    
+    EVENTS = 120000
+    USERS = 2000
+    
+    async def _write_log(self, directory):
+        import logging
+        import random
+        from audit_logger import AuditLogger, AuditLogEntry, AuditEventType, AuditSeverity
+        logging.getLogger("audit_logger").setLevel(logging.WARNING)
+        
+        rng = random.Random(21)
+        audit = AuditLogger(str(directory / "audit.log"), batch_size=2000, compression=None)
+        audit.max_log_size = 6 * 1024 * 1024
+        event_types = list(AuditEventType)
+        start = datetime(2024, 5, 1)
+        for i in range(self.EVENTS):
+            await audit.log_event(AuditLogEntry(
+                timestamp=start + timedelta(seconds=i),
+                user_id=f"user_{rng.randrange(self.USERS)}",
+                ip_address=f"10.0.{rng.randrange(4)}.{rng.randrange(250)}",
+                event_type=rng.choice(event_types),
+                severity=rng.choices(list(AuditSeverity), weights=[90, 7, 2, 1])[0],
+                description=f"Событие {i}", details={"sequence": i}
+            ))
+        await audit.stop()
+        return audit
+    
+    def _scan_all(self, directory, predicate):
+        """Прежний поиск: json.loads каждой строки; файлы и строки от новых к старым"""
+        import gzip
+        # Сразу после ротации активного файла еще нет; номер закрытого сегмента растет со временем
+        paths = [path for path in [directory / "audit.log"] if path.exists()] + sorted(
+            (path for path in directory.glob("audit.log.*") if path.suffix != ".idx"),
+            key=lambda path: int(path.name.split(".")[2]), reverse=True
+        )
+        matches = []
+        for path in paths:
+            with (gzip.open if path.suffix == ".gz" else open)(path, "rt", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            matches.extend(record for record in reversed(records) if predicate(record))
+        return matches
+    
+    async def _all_pages(self, audit, page_size: int, **filters):
+        sequences, cursor = [], None
+        while True:
+            entries, cursor = await audit.search_page(page_size, cursor, **filters)
+            sequences.extend(entry.details["sequence"] for entry in entries)
+            if cursor is None:
+                return sequences
+    
+    @pytest.mark.asyncio
+    async def test_indexed_search_matches_scan(self, tmp_path):
+        """Постраничный поиск по всем сегментам совпадает с полным разбором и намного быстрее"""
+        from audit_logger import AuditLogger, AuditEventType, AuditSeverity
+        
+        written = await self._write_log(tmp_path)
+        assert written.stats["rotations"] >= 3
+        # Новый экземпляр (перезапуск) читает индексы из файлов-спутников
+        audit = AuditLogger(str(tmp_path / "audit.log"))
+        
+        cases = [
+            ({"user_id": "user_7"}, lambda r: r["user_id"] == "user_7"),
+            ({"severity": AuditSeverity.CRITICAL, "event_type": AuditEventType.LOGIN_FAILED},
+             lambda r: r["severity"] == "critical" and r["event_type"] == "login_failed"),
+            ({"ip_address": "10.0.1.17", "start_date": datetime(2024, 5, 1, 10), "end_date": datetime(2024, 5, 1, 20)},
+             lambda r: r["ip_address"] == "10.0.1.17" and "2024-05-01T10:00:00" <= r["timestamp"] <= "2024-05-01T20:00:00"),
+        ]
+        for filters, predicate in cases:
+            expected = [record["details"]["sequence"] for record in self._scan_all(tmp_path, predicate)]
+            assert expected
+            assert await self._all_pages(audit, 37, **filters) == expected
+        
+        # Последние события пользователя: первая страница
+        scan_times, index_times = [], []
+        for i in range(10):
+            user_id = f"user_{i * 97}"
+            start_time = time.perf_counter()
+            self._scan_all(tmp_path, lambda r: r["user_id"] == user_id)[:100]
+            scan_times.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            entries = await audit.search_audit_logs(user_id=user_id, limit=100)
+            index_times.append(time.perf_counter() - start_time)
+            assert entries and all(entry.user_id == user_id for entry in entries)
+        
+        scan_median = statistics.median(scan_times)
+        index_median = statistics.median(index_times)
+        print(f"Audit Log Search ({self.EVENTS:,} events, {written.stats['rotations'] + 1} segments):")
+        print(f"  Full scan (before): {scan_median * 1000:.1f}ms, indexed (after): {index_median * 1000:.2f}ms")
+        assert index_median < scan_median / 10
+    
+    @pytest.mark.asyncio
+    async def test_segments_without_index(self, tmp_path):
+        """Файлы без индексов индексируются при первом поиске, после дозаписи индекс догоняет файл"""
+        from audit_logger import AuditLogger, AuditLogEntry, AuditEventType
+        from audit_index import INDEX_SUFFIX
+        
+        await self._write_log(tmp_path)
+        for path in tmp_path.glob("*" + INDEX_SUFFIX):
+            path.unlink()
+        # Строка, дописанная в активный файл в обход логгера
+        with open(tmp_path / "audit.log", "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "timestamp": "2024-06-01T00:00:00", "user_id": "user_7", "event_type": "user_login",
+                "severity": "info", "description": "Вход", "details": {"sequence": -1}
+            }) + "\n")
+        
+        audit = AuditLogger(str(tmp_path / "audit.log"))
+        expected = [record["details"]["sequence"] for record in self._scan_all(tmp_path, lambda r: r["user_id"] == "user_7")]
+        assert expected[0] == -1
+        assert await self._all_pages(audit, 50, user_id="user_7") == expected
+        rotated = [path for path in tmp_path.glob("audit.log.*") if path.suffix != INDEX_SUFFIX]
+        assert len(list(tmp_path.glob("audit.log.*" + INDEX_SUFFIX))) == len(rotated)
+        
+        await audit.log_event(AuditLogEntry(
+            timestamp=datetime(2024, 6, 2), user_id="user_7", event_type=AuditEventType.USER_LOGOUT,
+            description="Выход", details={"sequence": -2}
+        ))
+        assert (await self._all_pages(audit, 50, user_id="user_7"))[:2] == [-2, -1]
+        await audit.stop()
+
+    @pytest.mark.asyncio
+    async def test_writers_keep_own_files(self, tmp_path):
+        """Каждый процесс пишет и ротирует свой файл, поиск сливает записи всех писателей по времени"""
+        import logging
+        from pathlib import Path
+        from audit_logger import AuditLogger, AuditLogEntry, AuditEventType
+        logging.getLogger("audit_logger").setLevel(logging.WARNING)
+
+        # Экземпляры с общим log_file занимают номера писателей под flock, как воркеры uvicorn
+        writers = [AuditLogger(str(tmp_path / "audit.log"), batch_size=500, compression=None) for _ in range(2)]
+        for writer in writers:
+            writer.max_log_size = 512 * 1024
+        start = datetime(2024, 5, 1)
+        for i in range(20000):
+            await writers[i % 2].log_event(AuditLogEntry(
+                timestamp=start + timedelta(seconds=i), user_id=f"user_{i % 7}",
+                event_type=AuditEventType.PAYMENT_PROCESSED, description=f"Платеж {i}", details={"sequence": i}
+            ))
+        for writer in writers:
+            await writer.flush()
+
+        assert sorted(writer._slot for writer in writers) == [0, 1]
+        assert {Path(writer._active_file).name for writer in writers} == {"audit.log", "audit.w1.log"}
+        for parity, writer in enumerate(writers):
+            active = Path(writer._active_file)
+            sealed = sorted(
+                (path for path in tmp_path.glob(active.name + ".*") if path.suffix != ".idx"),
+                key=lambda path: int(path.suffix[1:])
+            )
+            assert len(sealed) == writer.stats["rotations"] >= 2
+            sequences = [
+                json.loads(line)["details"]["sequence"]
+                for path in [*sealed, active] if path.exists() for line in path.read_text(encoding="utf-8").splitlines()
+            ]
+            assert sequences == list(range(parity, 20000, 2))
+
+        reader = AuditLogger(str(tmp_path / "audit.log"))
+        assert await self._all_pages(reader, 333) == list(range(19999, -1, -1))
+        assert await self._all_pages(reader, 50, user_id="user_3") == [i for i in range(19999, -1, -1) if i % 7 == 3]
+        newest = await writers[0].search_audit_logs(limit=3)
+        assert [entry.details["sequence"] for entry in newest] == [19999, 19998, 19997]
+
+        # Номер остановленного писателя занимает следующий процесс и продолжает его файлы
+        stopped = writers[0]._slot
+        await writers[0].stop()
+        successor = AuditLogger(str(tmp_path / "audit.log"), compression=None)
+        await successor.log_event(AuditLogEntry(
+            timestamp=start + timedelta(seconds=20000), user_id="user_0",
+            event_type=AuditEventType.PAYMENT_PROCESSED, description="Платеж 20000", details={"sequence": 20000}
+        ))
+        await successor.flush()
+        assert successor._slot == stopped
+        assert (await self._all_pages(reader, 5000))[:2] == [20000, 19999]
+        await successor.stop()
+        await writers[1].stop()
+
+class TestAuditLogTiering:
+    """Закрытые сегменты аудит лога: сжатие поблочно, срок хранения и отправка в audit_logs"""
+    
+    @pytest_asyncio.fixture
+    async def archive_pool(self, make_db_pool):
+        return await make_db_pool(
+            "archive.db", tables=[database_module.User.__table__, database_module.AuditLog.__table__], pool_size=2
+        )
+    
+    async def _write(self, directory, events: int, compression=None, user_id=lambda i: f"user_{i % 50}",
+                     start=datetime(2024, 5, 1), **options):
+        import logging
+        from audit_logger import AuditLogger, AuditLogEntry, AuditEventType
+        logging.getLogger("audit_logger").setLevel(logging.WARNING)
+        
+        audit = AuditLogger(str(directory / "audit.log"), batch_size=1000, compression=compression,
+                            max_log_files=100, **options)
+        audit.max_log_size = 1024 * 1024
+        for i in range(events):
+            await audit.log_event(AuditLogEntry(
+                timestamp=start + timedelta(seconds=i), user_id=user_id(i), ip_address="10.0.0.1",
+                event_type=AuditEventType.PAYMENT_PROCESSED, resource_type="transaction", resource_id=str(i),
+                description=f"Платеж {i}", details={"sequence": i}
+            ))
+        await audit.flush()
+        return audit
+    
+    async def _sequences(self, audit, **filters):
+        sequences, cursor = [], None
+        while True:
+            entries, cursor = await audit.search_page(500, cursor, **filters)
+            sequences.extend(entry.details["sequence"] for entry in entries)
+            if cursor is None:
+                return sequences
+    
+    @pytest.mark.asyncio
+    async def test_compressed_segments_searchable(self, tmp_path):
+        """После сжатия поиск дает те же записи, файлы меньше, индексы переживают перезапуск"""
+        from audit_logger import AuditLogger
+        
+        written = await self._write(tmp_path, 60000)
+        await written.stop()
+        plain_bytes = sum(path.stat().st_size for path in tmp_path.glob("audit.log.*") if path.suffix != ".idx")
+        reader = AuditLogger(str(tmp_path / "audit.log"), compression=None)
+        expected = await self._sequences(reader, user_id="user_7")
+        expected_range = await self._sequences(
+            reader, start_date=datetime(2024, 5, 1, 3), end_date=datetime(2024, 5, 1, 4)
+        )
+        
+        audit = AuditLogger(str(tmp_path / "audit.log"), compression="gzip", max_log_files=100)
+        start_time = time.perf_counter()
+        result = await audit.maintain()
+        compress_time = time.perf_counter() - start_time
+        packed = sorted(tmp_path.glob("audit.log.*.gz"))
+        packed_bytes = sum(path.stat().st_size for path in packed)
+        
+        print(f"Audit Log Tiering ({written.stats['rotations']} sealed segments):")
+        print(f"  Plain: {plain_bytes / 1024 / 1024:.1f}MB, gzip blocks: {packed_bytes / 1024 / 1024:.1f}MB, "
+              f"compressed in {compress_time * 1000:.0f}ms")
+        
+        assert result["compressed"] == written.stats["rotations"] == len(packed)
+        assert not [path for path in tmp_path.glob("audit.log.*") if path.suffix not in (".gz", ".idx")]
+        assert packed_bytes < plain_bytes / 3
+        assert await self._sequences(audit, user_id="user_7") == expected
+        assert await self._sequences(
+            audit, start_date=datetime(2024, 5, 1, 3), end_date=datetime(2024, 5, 1, 4)
+        ) == expected_range
+        # Сжатый сегмент - обычный gzip-файл
+        assert (await self._sequences(audit)) == list(range(59999, -1, -1))
+        restarted = AuditLogger(str(tmp_path / "audit.log"), compression="gzip", max_log_files=100)
+        assert await self._sequences(restarted, user_id="user_7") == expected
+        assert (await restarted.maintain())["compressed"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_background_compression_during_writes(self, tmp_path):
+        """Сжатие идет фоном после ротации, запись и поиск не теряют событий"""
+        import gzip
+        
+        audit = await self._write(tmp_path, 50000, compression="gzip")
+        for _ in range(200):
+            if not [path for path in tmp_path.glob("audit.log.0*") if path.suffix not in (".gz", ".idx")]:
+                break
+            await asyncio.sleep(0.05)
+        stats = audit.get_stats()
+        
+        assert stats["rotations"] >= 3
+        assert stats["segments_compressed"] == stats["rotations"]
+        assert stats["bytes_after_compression"] < stats["bytes_before_compression"] / 3
+        assert await self._sequences(audit, user_id="user_3") == list(range(49953, -1, -50))
+        first = min(tmp_path.glob("audit.log.*.gz"))
+        with gzip.open(first, "rt", encoding="utf-8") as f:
+            assert json.loads(f.readline())["details"]["sequence"] == 0
+        await audit.stop()
+    
+    @pytest.mark.asyncio
+    async def test_retention_and_legacy_names(self, tmp_path):
+        """Файлы audit.log.N переименовываются по номерам, лишние и старые сегменты удаляются"""
+        from audit_logger import AuditLogger
+        
+        written = await self._write(tmp_path, 30000)
+        await written.stop()
+        # Прежняя схема: audit.log.1 - самый новый закрытый файл
+        sealed = sorted(path for path in tmp_path.glob("audit.log.*") if path.suffix != ".idx")
+        for number, path in enumerate(reversed(sealed), 1):
+            path.rename(tmp_path / f"audit.log.{number}")
+            (tmp_path / (path.name + ".idx")).unlink()
+        
+        audit = AuditLogger(str(tmp_path / "audit.log"), compression=None, max_log_files=100)
+        assert await self._sequences(audit, user_id="user_1") == list(range(29951, -1, -50))
+        migrated = sorted(path.name for path in tmp_path.glob("audit.log.*") if path.suffix != ".idx")
+        assert len(migrated) == len(sealed) and all(len(name.split(".")[2]) == 6 for name in migrated)
+        
+        audit.max_log_files = 2
+        assert (await audit.maintain())["removed"] == len(sealed) - 2
+        remaining = await self._sequences(audit)
+        assert remaining == list(range(29999, 29999 - len(remaining), -1))
+        assert len([path for path in tmp_path.glob("audit.log.*") if path.suffix != ".idx"]) == 2
+        
+        # Все записи старше срока хранения: остается только активный файл
+        audit.max_age_days = 30
+        assert (await audit.maintain())["removed"] == 2
+        assert not list(tmp_path.glob("audit.log.0*"))
+        active_lines = len((tmp_path / "audit.log").read_text(encoding="utf-8").splitlines())
+        assert await self._sequences(audit) == remaining[:active_lines]
+    
+    @pytest.mark.asyncio
+    async def test_ship_to_database(self, tmp_path, archive_pool):
+        """Закрытые сегменты копируются в audit_logs порциями, повторный проход ничего не дублирует"""
+        from sqlalchemy import func, select, text
+        from audit_logger import AuditLogger, _audit_models
+        
+        pool = archive_pool
+        async with pool.get_session() as db:
+            await db.execute(text(
+                "INSERT INTO users (id, email, phone, full_name, hashed_password, role) "
+                "VALUES (7, 'a@paygo.ru', '+70000000000', 'Тест', 'x', 'user')"
+            ))
+            await db.commit()
+        
+        written = await self._write(tmp_path, 20500, user_id=lambda i: ("7", "99", "user_3")[i % 3])
+        await written.stop()
+        audit = AuditLogger(
+            str(tmp_path / "audit.log"), compression="gzip", ship_to_database=True, max_log_files=100,
+            pool_provider=lambda: pool,
+            models_provider=_audit_models
+        )
+        result = await audit.maintain()
+        
+        AuditLog = database_module.AuditLog
+        async with pool.get_session(read_only=True) as db:
+            total = await db.scalar(select(func.count()).select_from(AuditLog))
+            users = dict((await db.execute(
+                select(AuditLog.user_id, func.count()).group_by(AuditLog.user_id)
+            )).all())
+            sample = (await db.execute(
+                select(AuditLog.action, AuditLog.resource_id, AuditLog.ip_address, AuditLog.details)
+                .where(AuditLog.resource_id == 4)
+            )).one()
+        
+        assert result["shipped_rows"] == total
+        assert result["compressed"] == written.stats["rotations"]
+        assert 0 < total < 20500
+        # Пользователи, которых нет в users, остаются только в details
+        assert users[7] == len(range(0, total, 3)) and users[None] == total - users[7]
+        assert sample[0] == "payment_processed" and sample[2] == "10.0.0.1"
+        assert sample[3]["user_id"] == "99" and sample[3]["description"] == "Платеж 4"
+        assert (await AuditLogger(
+            str(tmp_path / "audit.log"), compression="gzip", ship_to_database=True, max_log_files=100,
+            pool_provider=lambda: pool,
+            models_provider=_audit_models
+        ).maintain())["shipped_rows"] == 0
+
+    @pytest.mark.asyncio
+    async def test_workers_maintain_own_segments(self, tmp_path, archive_pool):
+        """Воркеры отправляют в audit_logs только свои сегменты, сегменты завершившегося - один из оставшихся"""
+        import logging
+        from sqlalchemy import func, select
+        from audit_logger import AuditLogger, AuditLogEntry, AuditEventType, _audit_models
+        logging.getLogger("audit_logger").setLevel(logging.WARNING)
+
+        pool = archive_pool
+        AuditLog = database_module.AuditLog
+
+        async def shipped():
+            async with pool.get_session(read_only=True) as db:
+                return (await db.execute(select(
+                    func.count(), func.count(func.distinct(AuditLog.resource_id)),
+                    func.count(func.distinct(AuditLog.resource_id)).filter(AuditLog.resource_id % 2 == 1)
+                ))).one()
+
+        # Фоновое обслуживание воркеров запускается ротациями одновременно с записью
+        workers = [
+            AuditLogger(str(tmp_path / "audit.log"), batch_size=1000, compression="gzip", ship_to_database=True,
+                        max_log_files=100, pool_provider=lambda: pool,
+                        models_provider=_audit_models)
+            for _ in range(2)
+        ]
+        for worker in workers:
+            worker.max_log_size = 1024 * 1024
+        start = datetime(2024, 5, 1)
+        for i in range(30000):
+            await workers[i % 2].log_event(AuditLogEntry(
+                timestamp=start + timedelta(seconds=i), user_id=f"user_{i % 50}", ip_address="10.0.0.1",
+                event_type=AuditEventType.PAYMENT_PROCESSED, resource_type="transaction", resource_id=str(i),
+                description=f"Платеж {i}", details={"sequence": i}
+            ))
+        await asyncio.gather(*(worker.flush() for worker in workers))
+        await asyncio.gather(*(worker.maintain() for worker in workers))
+
+        total, distinct, _ = await shipped()
+        assert all(worker.stats["rotations"] >= 2 for worker in workers)
+        assert total == distinct == sum(worker.stats["rows_shipped"] for worker in workers)
+
+        # Остановленный воркер не закрыл активный файл: его закрывает и отправляет оставшийся
+        stopped_file = workers[1]._active_file
+        await workers[1].stop()
+        result = await workers[0].maintain()
+        total, distinct, odd = await shipped()
+        assert result["shipped_rows"] > 0
+        assert total == distinct and odd == 15000
+        assert not os.path.exists(stopped_file)
+        assert (await workers[0].maintain())["shipped_rows"] == 0
+        await workers[0].stop()
+
+class TestAuditDecoratorCapture:
+    """Декоратор audit_log: выбранные аргументы вместо str(args), без разбора для отброшенных событий"""
+    
+    class FakeSession:
+        """Объект с дорогим repr, как сессия ORM или запрос"""
+        def __init__(self):
+            self.identity_map = {i: f"object {i}" for i in range(20000)}
+        
+        def __repr__(self):
+            return f"FakeSession({self.identity_map!r})"
+    
+    class Card:
+        last_four = "4242"
+        number = "4242424242424242"
+    
+    @pytest.fixture
+    def audit(self, tmp_path, monkeypatch):
+        import logging
+        import audit_logger as audit_module
+        logging.getLogger("audit_logger").setLevel(logging.WARNING)
+        audit = audit_module.AuditLogger(str(tmp_path / "audit.log"), compression=None)
+        monkeypatch.setattr(audit_module, "audit_logger", audit)
+        return audit
+    
+    def _records(self, tmp_path):
+        path = tmp_path / "audit.log"
+        return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] if path.exists() else []
+    
+    @pytest.mark.asyncio
+    async def test_capture_policy(self, audit, tmp_path):
+        """В details только выбранные поля: обрезанные, скрытые, без repr объектов"""
+        from decimal import Decimal
+        from audit_logger import audit_log, AuditEventType
+        
+        @audit_log(AuditEventType.PAYMENT_PROCESSED, "Платеж", capture={
+            "amount": "amount", "card": "card.last_four", "card_number": "card.number",
+            "note": "note", "password": "password", "session": "session", "items": "items",
+            "currency": lambda arguments: arguments["options"].get("currency")
+        })
+        async def pay(session, user_id, card, amount, password, note="", items=(), options=None):
+            if amount <= 0:
+                raise ValueError("Сумма должна быть положительной")
+            return amount
+        
+        session = self.FakeSession()
+        assert await pay(session, 7, self.Card(), Decimal("10.50"), "secret", note="x" * 500,
+                         items=[1, 2, 3], options={"currency": "RUB"}) == Decimal("10.50")
+        with pytest.raises(ValueError):
+            await pay(session, user_id=8, card=self.Card(), amount=0, password="secret", options={})
+        await audit.stop()
+        
+        success, failure = self._records(tmp_path)
+        assert success["user_id"] == "7" and success["success"] is True
+        assert success["details"] == {
+            "function": "pay", "amount": "10.50", "card": "4242", "card_number": "***",
+            "note": "x" * 200 + "…", "password": "***", "session": "<FakeSession>",
+            "items": "<list len=3>", "currency": "RUB"
+        }
+        assert failure["user_id"] == "8" and failure["success"] is False
+        assert failure["severity"] == "error" and failure["details"]["amount"] == 0
+        assert "secret" not in json.dumps([success, failure])
+    
+    @pytest.mark.asyncio
+    async def test_decorator_overhead(self, audit, tmp_path):
+        """Отброшенное по sample_rates событие почти бесплатно, записанное - без str(args)"""
+        from audit_logger import audit_log, AuditEventType, AuditSeverity
+        import audit_logger as audit_module
+        
+        def legacy_audit_log(event_type, description):
+            # Прежний декоратор: str(args) и str(kwargs) на каждый вызов
+            def decorator(func):
+                async def wrapper(*args, **kwargs):
+                    result = await func(*args, **kwargs)
+                    await audit_module.audit_logger.log_user_action(
+                        user_id=kwargs.get("user_id", "system"), event_type=event_type,
+                        description=description, severity=AuditSeverity.INFO, success=True,
+                        details={"function": func.__name__, "args": str(args), "kwargs": str(kwargs)}
+                    )
+                    return result
+                return wrapper
+            return decorator
+        
+        async def noop(session, user_id, amount):
+            return amount
+        
+        decorated = audit_log(AuditEventType.PAYMENT_PROCESSED, "Платеж", capture={"amount": "amount"})(noop)
+        legacy = legacy_audit_log(AuditEventType.PAYMENT_PROCESSED, "Платеж")(noop)
+        session = self.FakeSession()
+        
+        async def per_call(func, calls: int) -> float:
+            start_time = time.perf_counter()
+            for i in range(calls):
+                await func(session, user_id=f"user_{i}", amount=i)
+            return (time.perf_counter() - start_time) / calls
+        
+        bare = await per_call(noop, 20000)
+        audit.sample_rates = {"payment_processed": 0.0}
+        sampled_out = await per_call(decorated, 20000)
+        await audit.flush()
+        assert self._records(tmp_path) == []
+        assert audit.stats["sampled_out"] == 20000
+        
+        audit.sample_rates = {}
+        recorded = await per_call(decorated, 200)
+        eager = await per_call(legacy, 200)
+        await audit.stop()
+        
+        print(f"audit_log decorator overhead per call:")
+        print(f"  Bare coroutine: {bare * 1e6:.2f}us, sampled out: {sampled_out * 1e6:.2f}us")
+        print(f"  Recorded with str(args) (before): {eager * 1e6:.0f}us, with capture spec (after): {recorded * 1e6:.0f}us")
+        
+        assert len(self._records(tmp_path)) == 400
+        assert sampled_out - bare < 20e-6
+        assert recorded < eager / 5
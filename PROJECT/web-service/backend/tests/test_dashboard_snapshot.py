@@ -0,0 +1,187 @@
+import pytest
+import pytest_asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from sqlalchemy import text
+
+import database as database_module
+import database.connection_pool as connection_pool_module
+
+class TestDashboardSnapshot:
+    """Панель администратора из снимка в памяти вместо 13 запросов на каждое открытие"""
+    
+    USERS = 2000
+    TERMINALS = 300
+    TRANSACTIONS = 100000
+    
+    @pytest_asyncio.fixture
+    async def pool(self, db_pool):
+        import random
+        
+        pool = db_pool
+        rng = random.Random(3)
+        now = datetime.utcnow()
+        month_ago = now - timedelta(days=30)
+        await pool.bulk_insert(database_module.User, [
+            {"email": f"user{i}@paygo.ru", "phone": f"+7900{i:07d}", "full_name": f"User {i}",
+             "hashed_password": "x", "is_active": i % 10 != 0, "is_verified": i % 3 == 0}
+            for i in range(self.USERS)
+        ])
+        await pool.bulk_insert(database_module.Terminal, [
+            {"serial_number": f"SN{i:05d}", "name": f"T{i}", "location": "Москва", "address": "ул. Тверская",
+             "terminal_type": "stationary", "model": "PG-1", "manufacturer": "PayGo",
+             "status": "online" if i % 4 else "offline"}
+            for i in range(self.TERMINALS)
+        ])
+        await pool.bulk_insert(database_module.Card, [
+            {"user_id": i % self.USERS + 1, "masked_number": "**** 1234", "bank_name": "Сбербанк",
+             "card_type": "debit", "expires_at": now + timedelta(days=700), "token": f"tok{i}", "is_active": i % 5 != 0}
+            for i in range(self.USERS * 2)
+        ])
+        transactions = []
+        while len(transactions) < self.TRANSACTIONS:
+            created_at = now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+            # Граница окна 30 дней в снимке округляется до часа
+            if abs(created_at - month_ago) < timedelta(hours=1):
+                continue
+            transactions.append({
+                "transaction_id": f"TXN_{len(transactions)}", "user_id": rng.randint(1, self.USERS), "card_id": rng.randint(1, self.USERS * 2),
+                "terminal_id": rng.randint(1, self.TERMINALS), "amount": round(rng.uniform(10, 5000), 2),
+                "status": rng.choices(["completed", "failed", "pending"], weights=[85, 10, 5])[0],
+                "payment_method": "nfc", "created_at": created_at
+            })
+        await pool.bulk_insert(database_module.Transaction, transactions)
+        return pool
+    
+    async def _legacy_dashboard(self, db) -> Dict[str, Any]:
+        """Прежняя реализация get_admin_dashboard: 13 запросов"""
+        from sqlalchemy import func, select
+        User, Terminal, Transaction, Card = (
+            database_module.User, database_module.Terminal, database_module.Transaction, database_module.Card
+        )
+        total_users = await db.scalar(select(func.count(User.id)))
+        active_users = await db.scalar(select(func.count(User.id)).where(User.is_active == True))
+        verified_users = await db.scalar(select(func.count(User.id)).where(User.is_verified == True))
+        total_terminals = await db.scalar(select(func.count(Terminal.id)))
+        online_terminals = await db.scalar(select(func.count(Terminal.id)).where(Terminal.status == "online"))
+        total_transactions = await db.scalar(select(func.count(Transaction.id)))
+        successful = await db.scalar(select(func.count(Transaction.id)).where(Transaction.status == "completed"))
+        total_cards = await db.scalar(select(func.count(Card.id)))
+        active_cards = await db.scalar(select(func.count(Card.id)).where(Card.is_active == True))
+        total_amount = await db.scalar(select(func.sum(Transaction.amount)).where(Transaction.status == "completed")) or 0.0
+        month_ago = datetime.utcnow() - timedelta(days=30)
+        monthly = [Transaction.created_at >= month_ago, Transaction.status == "completed"]
+        monthly_transactions = await db.scalar(select(func.count(Transaction.id)).where(*monthly))
+        monthly_amount = await db.scalar(select(func.sum(Transaction.amount)).where(*monthly)) or 0.0
+        today = [Transaction.created_at >= datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
+                 Transaction.status == "completed"]
+        daily_transactions = await db.scalar(select(func.count(Transaction.id)).where(*today))
+        daily_amount = await db.scalar(select(func.sum(Transaction.amount)).where(*today)) or 0.0
+        return {
+            "users": {"total": total_users, "active": active_users, "verified": verified_users},
+            "terminals": {"total": total_terminals, "online": online_terminals, "offline": total_terminals - online_terminals},
+            "transactions": {"total": total_transactions, "successful": successful,
+                             "success_rate": successful / max(total_transactions, 1) * 100},
+            "cards": {"total": total_cards, "active": active_cards},
+            "financial": {"total_amount": total_amount, "monthly_amount": monthly_amount, "daily_amount": daily_amount,
+                          "monthly_transactions": monthly_transactions, "daily_transactions": daily_transactions,
+                          "average_transaction": total_amount / max(successful, 1)}
+        }
+    
+    def _assert_same(self, snapshot: Dict[str, Any], legacy: Dict[str, Any]):
+        for section, values in legacy.items():
+            for key, value in values.items():
+                assert snapshot[section][key] == pytest.approx(value, abs=0.01), f"{section}.{key}"
+    
+    @pytest.mark.performance
+    @pytest.mark.asyncio
+    async def test_snapshot_matches_queries_and_serves_from_memory(self, pool, monkeypatch):
+        monkeypatch.setattr(connection_pool_module, "db_pool", pool)
+        from dashboard_snapshot import DashboardSnapshot, _dashboard_models, _session
+        
+        # Провайдеры глобального экземпляра: модели database и сессии пула приложения
+        snapshot = DashboardSnapshot(_session, _dashboard_models)
+        
+        start_time = time.perf_counter()
+        for _ in range(5):
+            async with pool.get_session(read_only=True) as db:
+                legacy = await self._legacy_dashboard(db)
+        legacy_time = (time.perf_counter() - start_time) / 5
+        
+        start_time = time.perf_counter()
+        await snapshot.reconcile()
+        reconcile_time = time.perf_counter() - start_time
+        
+        queries_before = pool.query_stats.query_count
+        start_time = time.perf_counter()
+        for _ in range(1000):
+            etag, dashboard = await snapshot.get()
+        snapshot_time = (time.perf_counter() - start_time) / 1000
+        not_modified_etag, not_modified = await snapshot.get(if_none_match=etag)
+        
+        print(f"Admin Dashboard ({self.TRANSACTIONS} transactions):")
+        print(f"  13 queries per request (before): {legacy_time * 1000:.1f}ms")
+        print(f"  Snapshot reconciliation: {reconcile_time * 1000:.1f}ms")
+        print(f"  Snapshot per request (after): {snapshot_time * 1000000:.1f}us")
+        
+        self._assert_same(dashboard, legacy)
+        assert pool.query_stats.query_count == queries_before
+        assert not_modified is None and not_modified_etag == etag
+        assert snapshot_time * 100 < legacy_time
+        
+        # События: новая завершенная транзакция, пользователь и терминал онлайн
+        await pool.bulk_insert(database_module.Transaction, [{
+            "transaction_id": "TXN_NEW", "user_id": 1, "card_id": 1, "terminal_id": 1, "amount": 777.0,
+            "status": "completed", "payment_method": "nfc", "created_at": datetime.utcnow()
+        }])
+        snapshot.transaction_created()
+        snapshot.transaction_completed(777.0, datetime.utcnow())
+        await pool.bulk_insert(database_module.User, [{
+            "email": "new@paygo.ru", "phone": "+79990000000", "full_name": "New",
+            "hashed_password": "x", "is_active": True, "is_verified": False
+        }])
+        snapshot.user_created(True, False)
+        async with pool.get_session() as db:
+            await db.execute(text("UPDATE terminals SET status = 'online' WHERE id = 1"))
+            await db.commit()
+        snapshot.terminal_status_changed("offline", "online")
+        
+        new_etag, dashboard = await snapshot.get(if_none_match=etag)
+        async with pool.get_session(read_only=True) as db:
+            legacy = await self._legacy_dashboard(db)
+        assert new_etag != etag
+        self._assert_same(dashboard, legacy)
+        
+        # Сверка не меняет счетчики, построенные событиями
+        await snapshot.reconcile()
+        _, reconciled = await snapshot.get()
+        self._assert_same(reconciled, legacy)
+    
+    @pytest.mark.asyncio
+    async def test_events_during_reconcile_are_counted_once(self, pool):
+        """Платеж, завершенный во время сверки, учитывается только ее запросами"""
+        from contextlib import asynccontextmanager
+        from dashboard_snapshot import DashboardSnapshot, _dashboard_models
+        
+        @asynccontextmanager
+        async def session_with_concurrent_payment():
+            # Коммит и событие приходят после начала сверки, но до ее запросов
+            await pool.bulk_insert(database_module.Transaction, [{
+                "transaction_id": "TXN_DURING_RECONCILE", "user_id": 1, "card_id": 1, "terminal_id": 1,
+                "amount": 500.0, "status": "completed", "payment_method": "nfc", "created_at": datetime.utcnow()
+            }])
+            snapshot.transaction_created()
+            snapshot.transaction_completed(500.0, datetime.utcnow())
+            async with pool.get_session() as session:
+                yield session
+        
+        snapshot = DashboardSnapshot(session_with_concurrent_payment, _dashboard_models)
+        await snapshot.reconcile()
+        _, dashboard = await snapshot.get()
+        async with pool.get_session() as db:
+            legacy = await self._legacy_dashboard(db)
+        
+        self._assert_same(dashboard, legacy)
+        assert snapshot.stats["events_skipped"] == 2
@@ -0,0 +1,359 @@
+import pytest
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+import database as database_module
+
+class TestEventOutbox:
+    """Outbox событий: запись в транзакции, ретрансляция по порядку, позиции потребителей и отставание"""
+    
+    async def _pool(self, make_db_pool, users: int = 10):
+        """Пул над общим events.db: у каждого воркера свой, как у отдельного процесса"""
+        import logging
+        from sqlalchemy import func, select
+        logging.getLogger("event_outbox").setLevel(logging.CRITICAL)
+        pool = await make_db_pool("events.db", tables=[
+            model.__table__ for model in (database_module.User, database_module.NotificationSettings,
+                                          database_module.OutboxEvent, database_module.EventConsumerOffset,
+                                          database_module.EventPipelineLease)
+        ], pool_size=2)
+        async with pool.get_session() as session:
+            seeded = await session.scalar(select(func.count(database_module.User.id)))
+        if not seeded:
+            await pool.bulk_insert(database_module.User, [
+                {"id": i, "email": f"u{i}@paygo.ru", "phone": f"+7{i:010d}", "full_name": "Тест",
+                 "hashed_password": "x", "role": "user"}
+                for i in range(1, users + 1)
+            ])
+        return pool
+    
+    def _pipeline(self, pool, consumers, **options):
+        from event_outbox import EventPipeline, LocalEventStream, _outbox_models
+        pipeline = EventPipeline(LocalEventStream(), pool.get_session, _outbox_models, poll_interval=0.05, **options)
+        for consumer in consumers:
+            pipeline.register(consumer)
+        return pipeline
+    
+    async def _add_events(self, pool, first: int, count: int, chunk: int = 500):
+        from event_outbox import add_event
+        for start in range(first, first + count, chunk):
+            async with pool.get_session() as session:
+                for n in range(start, min(start + chunk, first + count)):
+                    add_event(session, "payment.completed", {"n": n, "amount": 100.0}, f"TXN_{n}", n % 10 + 1)
+                await session.commit()
+    
+    async def _wait(self, condition, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+    
+    @pytest.mark.asyncio
+    async def test_relay_and_consumer_offsets(self, make_db_pool):
+        """События доходят до всех потребителей по порядку, позиции сохраняются, outbox очищается"""
+        from event_outbox import EventConsumer, add_event
+        pool = await self._pool(make_db_pool)
+        received = {"notifications": [], "audit": []}
+        
+        async def record(name, events):
+            received[name].extend(event.payload["n"] for event in events)
+        
+        consumers = [
+            EventConsumer("notifications", lambda events: record("notifications", events), {"payment.completed"}),
+            EventConsumer("audit", lambda events: record("audit", events), batch_size=250)
+        ]
+        pipeline = self._pipeline(pool, consumers, cleanup_interval=0.2)
+        try:
+            # Откаченная транзакция не оставляет события
+            async with pool.get_session() as session:
+                add_event(session, "payment.completed", {"n": -1}, "TXN_rollback", 1)
+                await session.rollback()
+            
+            await pipeline.start()
+            start_time = time.perf_counter()
+            await self._add_events(pool, 0, 5000)
+            pipeline.notify()
+            await self._wait(lambda: all(
+                consumer["position"] == 5000 for consumer in pipeline.get_stats()["consumers"].values()
+            ))
+            elapsed = time.perf_counter() - start_time
+            
+            stats = pipeline.get_stats()
+            print(f"Event outbox (5,000 events, 2 consumers): {elapsed:.2f}s, "
+                  f"{stats['relay_batches']} relay batches, "
+                  f"latency p99 {stats['consumers']['notifications']['latency_p99_ms']}ms / "
+                  f"{stats['consumers']['audit']['latency_p99_ms']}ms")
+            
+            assert received["notifications"] == received["audit"] == list(range(5000))
+            assert stats["published"] == 5000 and stats["relay_batches"] <= 5000 / 500 * 2
+            assert stats["consumers"]["audit"]["batches"] >= 5000 / 250
+            await self._wait(lambda: pipeline.get_stats()["outbox_deleted"] == 5000)
+            for name in received:
+                assert pipeline.get_stats()["consumers"][name]["lag_events"] == 0
+            async with pool.get_session() as session:
+                offsets = dict((await session.execute(
+                    text("SELECT consumer, position FROM event_consumer_offsets")
+                )).all())
+            assert offsets == {"notifications": 5000, "audit": 5000}
+        finally:
+            await pipeline.stop()
+    
+    @pytest.mark.asyncio
+    async def test_at_least_once_after_restart(self, make_db_pool):
+        """Ошибка обработчика повторяет порцию, после перезапуска доставка продолжается с сохраненной позиции"""
+        from event_outbox import EventConsumer
+        pool = await self._pool(make_db_pool)
+        delivered = []
+        rollups = []
+        state = {"fail": 2, "block": asyncio.Event()}
+        
+        async def audit(events):
+            if events[0].payload["n"] == 1000 and state["fail"]:
+                state["fail"] -= 1
+                raise ConnectionError("аудит недоступен")
+            if events[0].payload["n"] >= 1500:
+                # Первая копия останавливается, не дойдя до конца
+                await state["block"].wait()
+            delivered.extend(event.payload["n"] for event in events)
+        
+        async def rollup(events):
+            rollups.extend(event.payload["n"] for event in events)
+        
+        def consumers():
+            return [EventConsumer("audit", audit, batch_size=100),
+                    EventConsumer("rollups", rollup, durable=False)]
+        
+        await self._add_events(pool, 0, 2000)
+        pipeline = self._pipeline(pool, consumers(), retry_delay=0.01)
+        await pipeline.start()
+        await self._wait(lambda: len(delivered) == 1500)
+        # Отставание считается от опубликованного: ретранслятор мог еще не дойти до конца outbox
+        await self._wait(lambda: pipeline.get_stats()["published_position"] == 2000)
+        stats = pipeline.get_stats()["consumers"]
+        assert stats["audit"]["errors"] == 2 and stats["audit"]["redelivered"] == 200
+        assert stats["audit"]["lag_events"] == 500 and stats["audit"]["lag_seconds"] > 0
+        # Счетчики в памяти строятся из БД: старые события им не нужны
+        assert rollups == []
+        await pipeline.stop()
+        
+        state["block"].set()
+        pipeline = self._pipeline(pool, consumers())
+        try:
+            await pipeline.start()
+            await self._add_events(pool, 2000, 100)
+            pipeline.notify()
+            await self._wait(lambda: len(delivered) == 2100)
+            assert delivered == list(range(2100))
+            await self._wait(lambda: len(rollups) == 100)
+            assert rollups == list(range(2000, 2100))
+        finally:
+            await pipeline.stop()
+    
+    @pytest.mark.asyncio
+    async def test_durable_consumers_run_in_one_worker(self, make_db_pool):
+        """Воркеры с общей БД: постоянный потребитель работает в ведущем, счетчики - в каждом"""
+        from event_outbox import EventConsumer
+        pool = await self._pool(make_db_pool)
+        audit = []
+        rollups = [[], []]
+        
+        def consumers(worker):
+            async def record(events):
+                audit.extend(event.payload["n"] for event in events)
+            
+            async def rollup(events):
+                rollups[worker].extend(event.payload["n"] for event in events)
+            
+            return [EventConsumer("audit", record), EventConsumer("rollups", rollup, durable=False)]
+        
+        async def offset():
+            async with pool.get_session() as session:
+                return (await session.execute(
+                    text("SELECT position FROM event_consumer_offsets WHERE consumer = 'audit'")
+                )).scalar()
+        
+        async def outbox_rows():
+            async with pool.get_session() as session:
+                return (await session.execute(text("SELECT COUNT(*) FROM event_outbox"))).scalar()
+        
+        workers = []
+        for worker in range(2):
+            worker_pool = await self._pool(make_db_pool)
+            workers.append((worker_pool, self._pipeline(worker_pool, consumers(worker), lease=1.0, cleanup_interval=0.2)))
+        try:
+            await asyncio.gather(*(pipeline.start() for _, pipeline in workers))
+            assert [pipeline.leader for _, pipeline in workers].count(True) == 1
+            await self._add_events(pool, 0, 1000)
+            await self._wait(lambda: len(rollups[0]) == len(rollups[1]) == 1000 and len(audit) >= 1000)
+            assert rollups[0] == rollups[1] == list(range(1000))
+            await asyncio.sleep(0.3)
+            assert audit == list(range(1000))
+            assert await offset() == 1000
+            
+            # Ведущий завершился аварийно: аренда не снята
+            leader = next(index for index, (_, pipeline) in enumerate(workers) if pipeline.leader)
+            crashed_pool, crashed = workers.pop(leader)
+            for task in crashed._tasks + crashed._leader_tasks:
+                task.cancel()
+            await asyncio.gather(*crashed._tasks, *crashed._leader_tasks, return_exceptions=True)
+            crashed._tasks, crashed._leader_tasks = [], []
+            await crashed_pool.close()
+            
+            survivor = workers[0][1]
+            await self._add_events(pool, 1000, 200)
+            await self._wait(lambda: survivor.leader and len(audit) == 1200)
+            assert audit == list(range(1200))
+            # Счетчики и позиция аудита выживших обновляются независимо от списка аудита
+            await self._wait(lambda: len(rollups[1 - leader]) == 1200)
+            assert rollups[1 - leader] == list(range(1200))
+            deadline = time.monotonic() + 10
+            while await offset() != 1200 or await outbox_rows():
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.05)
+        finally:
+            for _, pipeline in workers:
+                await pipeline.stop()
+    
+    @pytest.mark.asyncio
+    async def test_cleanup_keeps_rows_for_follower_rollups(self, make_db_pool):
+        """Ведущий не удаляет строки outbox, которые счетчики другого воркера еще не прочитали"""
+        from event_outbox import EventConsumer
+        pool = await self._pool(make_db_pool)
+        audit = []
+        rollups = [[], []]
+        released = asyncio.Event()
+        
+        def consumers(worker):
+            async def record(events):
+                audit.extend(event.payload["n"] for event in events)
+            
+            async def rollup(events):
+                # Счетчики второго воркера застряли на позиции 400
+                if worker == 1 and events[0].payload["n"] >= 400:
+                    await released.wait()
+                rollups[worker].extend(event.payload["n"] for event in events)
+            
+            return [EventConsumer("audit", record), EventConsumer("rollups", rollup, durable=False)]
+        
+        async def outbox_range():
+            async with pool.get_session() as session:
+                return tuple((await session.execute(text("SELECT MIN(id), COUNT(*) FROM event_outbox"))).one())
+        
+        workers = []
+        for worker in range(2):
+            workers.append(self._pipeline(await self._pool(make_db_pool), consumers(worker), lease=1.0, cleanup_interval=0.2))
+        try:
+            # Первый запущенный воркер получает аренду
+            for pipeline in workers:
+                await pipeline.start()
+            assert [pipeline.leader for pipeline in workers] == [True, False]
+            await self._add_events(pool, 0, 1000)
+            await self._wait(lambda: len(audit) == len(rollups[0]) == 1000 and len(rollups[1]) == 400)
+            # Несколько отметок позиции воркеров и очисток ведущего
+            await asyncio.sleep(1.0)
+            assert workers[0].get_stats()["outbox_deleted"] == 400
+            assert await outbox_range() == (401, 600)
+            
+            released.set()
+            await self._wait(lambda: len(rollups[1]) == 1000)
+            assert rollups[1] == list(range(1000))
+            deadline = time.monotonic() + 10
+            while (await outbox_range())[1]:
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.05)
+        finally:
+            released.set()
+            for pipeline in workers:
+                await pipeline.stop()
+    
+    @pytest.mark.asyncio
+    async def test_lease_uses_database_clock(self, make_db_pool, monkeypatch):
+        """Воркер с часами, ушедшими вперед, не считает действующую аренду истекшей"""
+        from datetime import timedelta
+        import event_outbox as event_outbox_module
+        pool = await self._pool(make_db_pool)
+        holder = self._pipeline(pool, [], lease=30.0)
+        other = self._pipeline(pool, [], lease=30.0)
+        assert await holder._acquire()
+        
+        class SkewedDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcnow() + timedelta(hours=1)
+        
+        monkeypatch.setattr(event_outbox_module, "datetime", SkewedDatetime)
+        assert not await other._acquire()
+        assert await holder._acquire()
+        async with pool.get_session() as session:
+            owner = (await session.execute(text("SELECT owner FROM event_pipeline_leases"))).scalar()
+        assert owner == holder.owner
+    
+    @pytest.mark.asyncio
+    async def test_relay_waits_for_sequence_gap(self, make_db_pool):
+        """Пропуск номера (незафиксированная транзакция) задерживает ретрансляцию, откат пропускается по таймауту"""
+        pool = await self._pool(make_db_pool)
+        # Ретранслятор вызывается вручную, без фонового цикла
+        pipeline = self._pipeline(pool, [], gap_timeout=0.3)
+        outbox = database_module.OutboxEvent.__table__
+        
+        async def insert(*ids):
+            async with pool.get_session() as session:
+                await session.execute(outbox.insert(), [
+                    {"id": event_id, "event_type": "payment.completed", "payload": {"n": event_id},
+                     "created_at": datetime.utcnow()} for event_id in ids
+                ])
+                await session.commit()
+        
+        await insert(2, 3)
+        assert await pipeline.relay_once() == 0
+        # Транзакция с номером 1 зафиксирована позже
+        await insert(1)
+        assert await pipeline.relay_once() == 3
+        
+        await insert(6)
+        assert await pipeline.relay_once() == 0
+        await asyncio.sleep(0.35)
+        assert await pipeline.relay_once() == 1
+        assert pipeline.get_stats()["gaps_skipped"] == 2
+        assert [event.id for event in await pipeline.stream.read(0, 10, 0.01)] == [1, 2, 3, 6]
+    
+    @pytest.mark.asyncio
+    async def test_transaction_alerts_respect_settings(self, make_db_pool):
+        """Push о платеже уходит в очередь уведомлений, если у пользователя включены transaction_alerts"""
+        from event_outbox import EventConsumer
+        from payment_events import TransactionAlerts, PAYMENT_COMPLETED, PAYMENT_FAILED
+        from types import SimpleNamespace
+        from payment_events import add_payment_event
+        pool = await self._pool(make_db_pool)
+        async with pool.get_session() as session:
+            await session.execute(database_module.NotificationSettings.__table__.insert(), [
+                {"user_id": 2, "transaction_alerts": False}, {"user_id": 3, "transaction_alerts": True}
+            ])
+            for user_id, status in ((1, "completed"), (2, "completed"), (3, "failed"), (None, "completed")):
+                add_payment_event(session, SimpleNamespace(
+                    transaction_id=f"TXN_{user_id}", status=status, amount=250, currency="RUB",
+                    payment_method="nfc_card", created_at=datetime.utcnow(), bank_response="Отказ банка",
+                    user_id=user_id
+                ), "T-1")
+            await session.commit()
+        
+        enqueued = []
+        
+        class Queue:
+            async def enqueue(self, notification):
+                enqueued.append(notification)
+        
+        alerts = TransactionAlerts(lambda: Queue(), pool.get_session, lambda: database_module.NotificationSettings)
+        pipeline = self._pipeline(pool, [EventConsumer("notifications", alerts, {PAYMENT_COMPLETED, PAYMENT_FAILED})])
+        try:
+            await pipeline.start()
+            await self._wait(lambda: pipeline.get_stats()["consumers"]["notifications"]["position"] == 4)
+            assert [(n.user_id, n.type, n.data["transaction_id"]) for n in enqueued] == [
+                ("1", "transaction_success", "TXN_1"), ("3", "transaction_failed", "TXN_3")
+            ]
+            assert "250.00 RUB" in enqueued[0].message
+        finally:
+            await pipeline.stop()
@@ -0,0 +1,131 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+
+import database as database_module
+
+class TestHeartbeatHistory:
+    """Аптайм терминалов из битовых карт heartbeat по дням"""
+    
+    FLEET_TERMINALS = 10000
+    FLEET_DAYS = 30
+    
+    @pytest_asyncio.fixture
+    async def pool(self, make_db_pool):
+        return await make_db_pool("heartbeats.db", tables=[database_module.TerminalHeartbeatDay.__table__])
+    
+    def _history(self, pool, interval: int = 60):
+        from heartbeat_history import HeartbeatHistory
+        return HeartbeatHistory(pool.get_session, lambda: database_module.TerminalHeartbeatDay, interval=interval)
+    
+    @pytest.mark.asyncio
+    async def test_uptime_and_outages_match_heartbeats(self, pool):
+        """Аптайм, простои и ошибки совпадают с прямым подсчетом по отметкам, в т.ч. после нескольких записей"""
+        import random
+        history = self._history(pool)
+        rng = random.Random(4)
+        origin = datetime(2025, 3, 1)
+        
+        up_slots, error_slots = {1: set(), 2: set()}, {1: set(), 2: set()}
+        for step in range(3):
+            for terminal_id in (1, 2):
+                slot = step * 1500
+                while slot < (step + 1) * 1500:
+                    # Терминал 2 периодически пропадает на 10-60 минут
+                    if terminal_id == 2 and rng.random() < 0.01:
+                        slot += rng.randint(10, 60)
+                        continue
+                    status = "error" if rng.random() < 0.02 else "online"
+                    history.record(terminal_id, origin + timedelta(seconds=slot * 60 + rng.randint(0, 59)), status)
+                    up_slots[terminal_id].add(slot)
+                    if status == "error":
+                        error_slots[terminal_id].add(slot)
+                    slot += 1
+            # Последняя порция остается в памяти и объединяется с базой при чтении
+            if step < 2:
+                assert await history.flush() > 0
+        
+        start = origin + timedelta(hours=5, minutes=30)
+        end = origin + timedelta(days=3)
+        window = range(330, 3 * 1440)
+        for terminal_id in (1, 2):
+            uptime = await history.terminal_uptime(terminal_id, start, end)
+            expected_up = {slot for slot in up_slots[terminal_id] if slot in window}
+            assert uptime["total_slots"] == len(window)
+            assert uptime["up_slots"] == len(expected_up)
+            assert uptime["error_slots"] == len({slot for slot in error_slots[terminal_id] if slot in window})
+            down = [slot for slot in window if slot not in expected_up]
+            assert sum(outage["minutes"] for outage in uptime["outages"]) == len(down)
+            if terminal_id == 2:
+                assert len(uptime["outages"]) > 5
+        
+        fleet = await history.fleet_availability(start, end)
+        assert fleet["terminals"] == 2
+        for terminal_id in (1, 2):
+            expected = len({slot for slot in up_slots[terminal_id] if slot in window}) / len(window) * 100
+            assert fleet["per_terminal"][terminal_id] == pytest.approx(expected)
+        
+        await history.flush()
+        assert history.stats["rows_written"] > 0
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_first_flush_of_day(self, pool):
+        """Два процесса впервые за день пишут разные интервалы одного терминала: биты объединяются"""
+        workers = [self._history(pool), self._history(pool)]
+        origin = datetime(2025, 3, 1)
+        for minute in range(0, 720):
+            workers[minute % 2].record(1, origin + timedelta(minutes=minute))
+        
+        await asyncio.gather(*(worker.flush() for worker in workers))
+        
+        reader = self._history(pool)
+        uptime = await reader.terminal_uptime(1, origin, origin + timedelta(hours=12))
+        assert uptime["up_slots"] == 720
+        from sqlalchemy import select
+        async with pool.get_session() as session:
+            rows = (await session.execute(select(database_module.TerminalHeartbeatDay.up_bits))).all()
+        assert {len(up_bits) for up_bits, in rows} == {180}
+    
+    @pytest.mark.asyncio
+    async def test_fleet_uptime_benchmark(self, pool):
+        """Доступность 10k терминалов за 30 дней (300k строк) меньше чем за секунду"""
+        import numpy as np
+        history = self._history(pool)
+        rng = np.random.default_rng(8)
+        first_day = date(2025, 4, 1)
+        
+        expected = {}
+        batch = []
+        for terminal_id in range(1, self.FLEET_TERMINALS + 1):
+            # Примерно 1-3% интервалов без heartbeat
+            up = rng.random((self.FLEET_DAYS + 1, 1440)) > rng.uniform(0.01, 0.03)
+            packed = np.packbits(up, axis=1)
+            for day_offset in range(self.FLEET_DAYS + 1):
+                batch.append({"terminal_id": terminal_id, "day": first_day + timedelta(days=day_offset),
+                              "up_bits": packed[day_offset].tobytes(), "error_bits": bytes(180)})
+            # Окно начинается в 12:00 первого дня и заканчивается в 12:00 последнего
+            expected[terminal_id] = (up[0, 720:].sum() + up[1:-1].sum() + up[-1, :720].sum()) / (self.FLEET_DAYS * 1440) * 100
+            if len(batch) >= 50000:
+                await pool.bulk_insert(database_module.TerminalHeartbeatDay, batch)
+                batch = []
+        if batch:
+            await pool.bulk_insert(database_module.TerminalHeartbeatDay, batch)
+        
+        start = datetime(2025, 4, 1, 12)
+        times = []
+        for _ in range(3):
+            start_time = time.perf_counter()
+            fleet = await history.fleet_availability(start, start + timedelta(days=self.FLEET_DAYS))
+            times.append(time.perf_counter() - start_time)
+        
+        print(f"Fleet Availability ({self.FLEET_TERMINALS} terminals x {self.FLEET_DAYS} days):")
+        print(f"  Total: {min(times) * 1000:.0f}ms")
+        print(f"  Availability: {fleet['availability_percentage']:.2f}%")
+        
+        assert fleet["terminals"] == self.FLEET_TERMINALS
+        for terminal_id in (1, 777, self.FLEET_TERMINALS):
+            assert fleet["per_terminal"][terminal_id] == pytest.approx(expected[terminal_id])
+        assert fleet["availability_percentage"] == pytest.approx(np.mean(list(expected.values())))
+        assert min(times) < 1.0
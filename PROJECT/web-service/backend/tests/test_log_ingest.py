@@ -0,0 +1,109 @@
+import pytest
+import pytest_asyncio
+import time
+import json
+from typing import List
+
+import database as database_module
+
+class TestTerminalLogIngest:
+    """Пакеты логов терминалов: потоковая распаковка, очередь и запись порциями"""
+    
+    BENCHMARK_LINES = 200000
+    CHUNK_BYTES = 64 * 1024
+    
+    @pytest_asyncio.fixture
+    async def pool(self, make_db_pool):
+        return await make_db_pool("logs.db", tables=[database_module.TerminalLog.__table__])
+    
+    def _lines(self, count: int, invalid_every: int = 0) -> List[bytes]:
+        import random
+        rng = random.Random(4)
+        lines = []
+        for i in range(count):
+            if invalid_every and i % invalid_every == 0:
+                lines.append(b'{"level": "INFO", "message": ')
+                continue
+            lines.append(json.dumps({
+                "timestamp": f"2024-05-01T10:{i // 60000 % 60:02d}:{i // 1000 % 60:02d}Z",
+                "level": rng.choices(["DEBUG", "INFO", "WARNING", "ERROR"], weights=[30, 60, 8, 2])[0],
+                "component": rng.choice(["payment", "hardware", "network"]),
+                "message": f"Операция {i} завершена за {rng.randint(1, 900)} мс",
+                "additional_data": {"sequence": i} if i % 10 == 0 else None
+            }, ensure_ascii=False).encode())
+        return lines
+    
+    async def _stream(self, data: bytes):
+        for offset in range(0, len(data), self.CHUNK_BYTES):
+            yield data[offset:offset + self.CHUNK_BYTES]
+    
+    @pytest.mark.asyncio
+    async def test_gzip_batch_throughput(self, pool):
+        """Склеенные gzip-файлы разбираются потоково и пишутся порциями"""
+        import gzip
+        from sqlalchemy import func, select
+        from log_ingest import LogIngestor
+        
+        lines = self._lines(self.BENCHMARK_LINES, invalid_every=1000)
+        # Два ротированных файла, склеенных в один пакет
+        middle = len(lines) // 2
+        body = gzip.compress(b"\n".join(lines[:middle]) + b"\n") + gzip.compress(b"\n".join(lines[middle:]))
+        invalid = len(range(0, self.BENCHMARK_LINES, 1000))
+        
+        ingestor = LogIngestor(lambda: pool, lambda: database_module.TerminalLog)
+        ingestor.start()
+        start_time = time.perf_counter()
+        result = await ingestor.ingest(7, self._stream(body), "gzip")
+        parse_time = time.perf_counter() - start_time
+        await ingestor.drain()
+        total_time = time.perf_counter() - start_time
+        await ingestor.stop()
+        
+        async with pool.get_session(read_only=True) as db:
+            Log = database_module.TerminalLog
+            stored = await db.scalar(select(func.count(Log.id)).where(Log.terminal_id == 7))
+            errors = await db.scalar(select(func.count(Log.id)).where(Log.level == "ERROR"))
+            sample = (await db.execute(
+                select(Log.created_at, Log.additional_data).where(Log.message.like("Операция 10 %"))
+            )).first()
+        
+        print(f"Terminal Log Ingest ({self.BENCHMARK_LINES:,} lines, {len(body) / 1e6:.1f}MB gzip):")
+        print(f"  Parse and queue: {self.BENCHMARK_LINES / parse_time:,.0f} lines/s")
+        print(f"  End to end: {self.BENCHMARK_LINES / total_time:,.0f} lines/s, {ingestor.stats['copies']} copies")
+        
+        assert result == {"accepted": self.BENCHMARK_LINES - invalid, "rejected": invalid}
+        assert stored == ingestor.stats["lines_written"] == self.BENCHMARK_LINES - invalid
+        assert errors > 0
+        assert sample[0].year == 2024 and sample[1] == {"sequence": 10}
+        assert ingestor.stats["copies"] < self.BENCHMARK_LINES / ingestor.batch_lines
+        assert self.BENCHMARK_LINES / total_time > 20000
+    
+    @pytest.mark.asyncio
+    async def test_full_queue_throttles(self):
+        """Полная очередь - IngestBusy с Retry-After и строкой, с которой досылать"""
+        from log_ingest import LogIngestor, IngestBusy, UnsupportedEncoding
+        
+        # Без писателей очередь не освобождается
+        ingestor = LogIngestor(None, None, batch_lines=100, queue_batches=2, writers=0, put_timeout=0.05)
+        lines = self._lines(500)
+        body = b"\n".join(lines)
+        with pytest.raises(IngestBusy) as busy:
+            await ingestor.ingest(1, self._stream(body))
+        assert busy.value.resume_from == 200
+        assert 1 <= busy.value.retry_after <= 60
+        
+        # Очередь полна до начала пакета - отказ сразу
+        with pytest.raises(IngestBusy) as busy:
+            await ingestor.ingest(1, self._stream(body))
+        assert busy.value.resume_from == 0
+        assert ingestor.stats["throttled"] == 2
+        
+        # Терминал досылает остаток после освобождения очереди
+        while not ingestor._queue.empty():
+            ingestor._queue.get_nowait()
+        ingestor._queued_rows = 0
+        remainder = b"\n".join(lines[200:300])
+        assert await ingestor.ingest(1, self._stream(remainder)) == {"accepted": 100, "rejected": 0}
+        
+        with pytest.raises(UnsupportedEncoding):
+            await ingestor.ingest(1, self._stream(body), "br")
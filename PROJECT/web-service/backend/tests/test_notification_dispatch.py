@@ -0,0 +1,213 @@
+import pytest
+import asyncio
+import time
+
+import database as database_module
+import database.connection_pool as connection_pool_module
+
+class TestNotificationDispatcher:
+    """Массовая рассылка: пачки токенов по провайдерам, ограниченный пул, лимиты и повторы"""
+    
+    class StubProvider:
+        """Локальный провайдер: задержка на вызов, учет параллельных вызовов и доставленных токенов"""
+        
+        def __init__(self, name, max_batch, latency=0.002, rate=100000.0, burst=1000, fail_first=False):
+            self.name = name
+            self.max_batch = max_batch
+            self.latency = latency
+            self.rate = rate
+            self.burst = burst
+            self.fail_first = fail_first
+            self.calls = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.delivered = []
+            self._failed = set()
+        
+        async def send_batch(self, tokens, notification):
+            from notification_dispatch import ProviderError, ProviderResult
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.latency)
+            finally:
+                self.in_flight -= 1
+            if self.fail_first and tokens[0] not in self._failed:
+                self._failed.add(tokens[0])
+                raise ProviderError("503 Service Unavailable")
+            invalid = [token for token in tokens if token.startswith("expired")]
+            self.delivered.extend(token for token in tokens if not token.startswith("expired"))
+            return ProviderResult(invalid=invalid)
+    
+    def _notification(self):
+        from notification_service import Notification, NotificationType
+        return Notification(user_id="campaign", type=NotificationType.SYSTEM_UPDATE,
+                            title="Обновление", message="Новые тарифы")
+    
+    def _dispatcher(self, users: int, workers: int = 16, **provider_options):
+        """Диспетчер с подписками в словаре: fcm у всех, web у каждого третьего"""
+        import logging
+        from notification_dispatch import NotificationDispatcher
+        logging.getLogger("notification_dispatch").setLevel(logging.WARNING)
+        subscriptions = {"fcm": {}, "web": {}}
+        for i in range(users):
+            subscriptions["fcm"][str(i)] = [f"fcm-{i}"]
+            if i % 3 == 0:
+                subscriptions["web"][str(i)] = [f"web-{i}"]
+        
+        async def tokens_provider(user_ids):
+            return [
+                (provider, user_id, token)
+                for provider, users_tokens in subscriptions.items()
+                for user_id in user_ids for token in users_tokens.get(user_id, ())
+            ]
+        
+        async def drop_invalid(provider, tokens):
+            for user_id, token in tokens:
+                subscriptions[provider][user_id].remove(token)
+        
+        fcm = self.StubProvider("fcm", 500, **provider_options)
+        web = self.StubProvider("web", 100, **provider_options)
+        dispatcher = NotificationDispatcher(tokens_provider, [web, fcm], workers=workers, invalid_handler=drop_invalid)
+        return dispatcher, subscriptions, fcm, web
+    
+    @pytest.mark.asyncio
+    async def test_campaign_throughput(self):
+        """Пачки вместо задачи на пользователя: быстрее, параллельность ограничена пулом"""
+        users = 50000
+        notification = self._notification()
+        dispatcher, subscriptions, fcm, web = self._dispatcher(users)
+        
+        # Прежняя рассылка: asyncio.gather по всем пользователям, вызов провайдера на каждый токен
+        calls = {"count": 0, "in_flight": 0, "max_in_flight": 0}
+        
+        async def per_token(token):
+            calls["count"] += 1
+            calls["in_flight"] += 1
+            calls["max_in_flight"] = max(calls["max_in_flight"], calls["in_flight"])
+            await asyncio.sleep(0.002)
+            calls["in_flight"] -= 1
+        
+        async def send_notification(user_id):
+            tokens = subscriptions["fcm"].get(user_id, []) + subscriptions["web"].get(user_id, [])
+            await asyncio.gather(*(per_token(token) for token in tokens))
+            return bool(tokens)
+        
+        start_time = time.perf_counter()
+        results = await asyncio.gather(*(send_notification(str(i)) for i in range(users)))
+        legacy_time = time.perf_counter() - start_time
+        assert sum(results) == users
+        
+        start_time = time.perf_counter()
+        stats = await dispatcher.dispatch((str(i) for i in range(users)), notification)
+        dispatch_time = time.perf_counter() - start_time
+        
+        print(f"Push Campaign ({users:,} users, {users + len(range(0, users, 3)):,} devices):")
+        print(f"  gather per user (before): {legacy_time:.2f}s, {calls['count']:,} provider calls, "
+              f"{calls['max_in_flight']:,} concurrent")
+        print(f"  Batched dispatcher (after): {dispatch_time:.2f}s, {fcm.calls + web.calls} provider calls, "
+              f"{max(fcm.max_in_flight, web.max_in_flight)} concurrent per provider")
+        
+        assert stats["users"] == stats["users_reached"] == users
+        assert sorted(fcm.delivered) == sorted(f"fcm-{i}" for i in range(users))
+        assert len(web.delivered) == len(range(0, users, 3))
+        assert fcm.calls == users // 500 and web.calls == -(-len(range(0, users, 3)) // 100)
+        assert max(fcm.max_in_flight, web.max_in_flight) <= 16
+        assert dispatch_time < legacy_time / 3
+    
+    @pytest.mark.asyncio
+    async def test_rate_limit_and_retries(self):
+        """Вызовы провайдера не чаще лимита, сбои повторяются, недействительные токены удаляются"""
+        from notification_dispatch import TokenBucket
+        
+        dispatcher, subscriptions, fcm, web = self._dispatcher(3000, fail_first=True)
+        fcm.max_batch = 50
+        dispatcher.base_delay = 0.01
+        dispatcher._buckets["fcm"] = TokenBucket(rate=200, burst=5)
+        for i in range(0, 3000, 100):
+            subscriptions["fcm"][str(i)].append(f"expired-{i}")
+        
+        start_time = time.perf_counter()
+        stats = await dispatcher.dispatch([str(i) for i in range(3000)], self._notification())
+        elapsed = time.perf_counter() - start_time
+        
+        batches = -(-(3000 + 30) // 50)
+        assert stats["users_reached"] == 3000 and stats["tokens_failed"] == 0
+        assert stats["tokens_sent"] == 3000 + 1000
+        assert stats["tokens_invalid"] == 30
+        assert stats["retries"] == batches + web.calls // 2
+        # 2 вызова на пачку при 200 вызовах в секунду и запасе 5
+        assert elapsed >= (2 * batches - 5) / 200
+        assert all(len(tokens) == 1 for tokens in subscriptions["fcm"].values())
+    
+    @pytest.mark.asyncio
+    async def test_stream_users_from_database(self, db_pool, monkeypatch):
+        """Подписки рассылки читаются потоковым запросом с учетом настроек push"""
+        import logging
+        from notification_service import PushNotificationService
+        from push_subscriptions import PushSubscriptionStore, _read_session, _session, _subscription_models
+        logging.getLogger("notification_service").setLevel(logging.WARNING)
+        
+        await db_pool.bulk_insert(database_module.User, [
+            {"id": i, "email": f"u{i}@paygo.ru", "phone": f"+7{i:010d}", "full_name": "Тест",
+             "hashed_password": "x", "role": "user", "is_active": i % 15 != 0}
+            for i in range(1, 3001)
+        ])
+        await db_pool.bulk_insert(database_module.NotificationSettings, [
+            {"user_id": i, "push_notifications": i % 10 != 0} for i in range(1, 3001, 2)
+        ])
+        await db_pool.bulk_insert(database_module.PushSubscription, [
+            {"provider": "fcm", "token": f"fcm-{i}", "user_id": i} for i in range(1, 3001)
+        ] + [
+            {"provider": "fcm", "token": f"fcm-tablet-{i}", "user_id": i} for i in range(1, 3001, 7)
+        ])
+        
+        # Провайдеры глобального хранилища подписок поверх db_pool приложения, без Redis
+        monkeypatch.setattr(connection_pool_module, "db_pool", db_pool)
+        store = PushSubscriptionStore(_session, _read_session, _subscription_models)
+        fcm = self.StubProvider("fcm", 500)
+        web = self.StubProvider("web", 100)
+        service = PushNotificationService(providers=[web, fcm], workers=16, store=store)
+        stats = await service.send_campaign(self._notification(), chunk_size=1000)
+        
+        expected = [i for i in range(1, 3001) if i % 15 != 0 and not (i % 2 == 1 and i % 10 == 0)]
+        tablets = [i for i in expected if i % 7 == 1]
+        assert stats["users"] == stats["users_reached"] == len(expected)
+        assert sorted(fcm.delivered) == sorted([f"fcm-{i}" for i in expected] + [f"fcm-tablet-{i}" for i in tablets])
+        assert web.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_reached_users_without_set(self, monkeypatch):
+        """Охваченные пользователи считаются без множества на всю рассылку, в том числе на границе порций"""
+        import notification_dispatch
+        from notification_dispatch import NotificationDispatcher, ReachCounter
+
+        counters = []
+
+        class RecordingCounter(ReachCounter):
+            __slots__ = ()
+
+            def __init__(self):
+                super().__init__()
+                counters.append(self)
+
+        monkeypatch.setattr(notification_dispatch, "ReachCounter", RecordingCounter)
+        users = 20000
+
+        async def token_stream():
+            # Три устройства на пользователя, порции по 7 токенов режут пользователей пополам;
+            # пауза между порциями дает отправить пачки до чтения продолжения
+            tokens = [("fcm", str(i), f"fcm-{i}-{device}") for i in range(users) for device in range(3)]
+            for start in range(0, len(tokens), 7):
+                yield tokens[start:start + 7]
+                if start % 700 == 0:
+                    await asyncio.sleep(0.001)
+
+        fcm = self.StubProvider("fcm", 5, latency=0)
+        dispatcher = NotificationDispatcher(lambda user_ids: [], [fcm], workers=4)
+        stats = await dispatcher.dispatch_tokens(token_stream(), self._notification())
+
+        assert stats["users"] == stats["users_reached"] == users
+        assert stats["tokens_sent"] == 3 * users
+        assert counters[0].peak < 1000 and not counters[0]._open
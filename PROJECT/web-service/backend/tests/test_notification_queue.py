@@ -0,0 +1,232 @@
+import pytest
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import database as database_module
+
+class TestNotificationQueue:
+    """Очередь уведомлений: строгий приоритет, объединение в окне, отложенная отправка"""
+    
+    async def _queue(self, make_db_pool, send, users: int = 10, **options):
+        """Очередь со своим пулом над общим queue.db, как у отдельного процесса"""
+        import logging
+        from sqlalchemy import func, select
+        from notification_queue import NotificationQueue
+        logging.getLogger("notification_queue").setLevel(logging.WARNING)
+        pool = await make_db_pool(
+            "queue.db", tables=[database_module.User.__table__, database_module.NotificationQueueEntry.__table__],
+            pool_size=2
+        )
+        async with pool.get_session() as session:
+            seeded = await session.scalar(select(func.count(database_module.User.id)))
+        if not seeded:
+            await pool.bulk_insert(database_module.User, [
+                {"id": i, "email": f"u{i}@paygo.ru", "phone": f"+7{i:010d}", "full_name": "Тест",
+                 "hashed_password": "x", "role": "user"}
+                for i in range(1, users + 1)
+            ])
+        queue = NotificationQueue(send, pool.get_session, lambda: database_module.NotificationQueueEntry, **options)
+        await queue.start()
+        return pool, queue
+    
+    def _notification(self, user_id, notification_type, priority="normal", message="Платеж 100 ₽"):
+        from notification_service import Notification
+        return Notification(user_id=str(user_id), type=notification_type, priority=priority,
+                            title="PayGo", message=message)
+    
+    async def _wait(self, condition, timeout: float = 20.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+    
+    async def _rows(self, pool):
+        async with pool.get_session() as session:
+            return (await session.execute(text("SELECT COUNT(*) FROM notification_queue"))).scalar()
+    
+    @pytest.mark.asyncio
+    async def test_security_alerts_bypass_marketing_burst(self, make_db_pool):
+        """Оповещения безопасности обгоняют очередь рассылки низкого приоритета"""
+        sent = []
+        
+        async def send(notification):
+            await asyncio.sleep(0.005)
+            sent.append(notification)
+        
+        pool, queue = await self._queue(make_db_pool, send, users=2000, workers=2)
+        try:
+            await asyncio.gather(*(
+                queue.enqueue(self._notification(i, "system_update", "low", "Новые тарифы")) for i in range(1, 2001)
+            ))
+            await asyncio.gather(*(
+                queue.enqueue(self._notification(i, notification_type, "normal", "Вход с нового устройства"))
+                for i in range(1, 21) for notification_type in ("security_alert", "transaction_failed")
+            ))
+            await self._wait(lambda: len(sent) == 2040)
+            
+            stats = queue.get_stats()["classes"]
+            positions = [n for n, notification in enumerate(sent) if notification.type != "system_update"]
+            print(f"Notification queue (2,000 low + 40 alerts, 2 workers):")
+            for name in ("security", "transaction", "low"):
+                print(f"  {name}: sent {stats[name]['sent']}, wait p50 {stats[name]['wait_p50_ms']}ms, "
+                      f"p99 {stats[name]['wait_p99_ms']}ms")
+            
+            assert stats["security"]["sent"] == stats["transaction"]["sent"] == 20
+            assert stats["low"]["sent"] == 2000
+            # FIFO отправил бы оповещения последними
+            assert max(positions) < 2040 - 100
+            assert stats["security"]["wait_p99_ms"] < stats["low"]["wait_p50_ms"]
+            # Одновременные постановки записаны общими транзакциями
+            assert queue.get_stats()["write_batches"] < 2040 / 10
+            await self._wait(lambda: queue.get_stats()["pending_deletes"] == 0)
+            assert await self._rows(pool) == 0
+        finally:
+            await queue.stop()
+    
+    @pytest.mark.asyncio
+    async def test_coalescing_window(self, make_db_pool):
+        """20 платежей за окно - два push: первый сразу, остальные одним уведомлением"""
+        sent = []
+        
+        async def send(notification):
+            sent.append((time.monotonic(), notification))
+        
+        pool, queue = await self._queue(make_db_pool, send, coalesce_window=5.0)
+        try:
+            start_time = time.monotonic()
+            for i in range(20):
+                await asyncio.gather(*(
+                    queue.enqueue(self._notification(user_id, "transaction_success", message=f"Платеж {i + 1}"))
+                    for user_id in (1, 2)
+                ))
+            await asyncio.gather(*(queue.enqueue(self._notification(1, "security_alert", "urgent")) for _ in range(3)))
+            await self._wait(lambda: len(sent) == 2 + 2 + 3)
+            
+            for user_id in ("1", "2"):
+                payments = [(at, n) for at, n in sent if n.user_id == user_id and n.type == "transaction_success"]
+                assert len(payments) == 2
+                assert payments[0][1].message == "Платеж 1" and not payments[0][1].data
+                assert payments[1][1].message == "Платеж 20" and payments[1][1].data == {"coalesced": 19}
+                assert payments[1][0] - start_time >= 5.0
+            assert len([n for _, n in sent if n.type == "security_alert"]) == 3
+            stats = queue.get_stats()
+            assert stats["classes"]["transaction"]["coalesced"] == 2 * 18
+            assert stats["coalescing_windows"] == 0
+        finally:
+            await queue.stop()
+    
+    @pytest.mark.asyncio
+    async def test_deferred_send_survives_restart(self, make_db_pool):
+        """Отложенное уведомление хранится в таблице и уходит в срок после перезапуска, ошибки повторяются"""
+        from notification_queue import TimerWheel
+        sent = []
+        failures = {"left": 2}
+        
+        async def send(notification):
+            if failures["left"]:
+                failures["left"] -= 1
+                raise ConnectionError("FCM недоступен")
+            sent.append((datetime.now(), notification))
+        
+        pool, queue = await self._queue(make_db_pool, send, retry_delay=0.05)
+        send_at = datetime.now() + timedelta(seconds=0.6)
+        await queue.enqueue(self._notification(3, "payment_reminder", "normal", "Счет к оплате"), send_at=send_at)
+        assert queue.get_stats()["scheduled"] == 1
+        await queue.stop()
+        await pool.close()
+        assert sent == []
+        
+        pool, queue = await self._queue(make_db_pool, send, retry_delay=0.05)
+        try:
+            await self._wait(lambda: len(sent) == 1)
+            assert sent[0][0] >= send_at and sent[0][1].message == "Счет к оплате"
+            assert queue.get_stats()["classes"]["normal"]["retried"] == 2
+            await self._wait(lambda: queue.get_stats()["pending_deletes"] == 0)
+            assert await self._rows(pool) == 0
+        finally:
+            await queue.stop()
+        
+        # Колесо: таймеры дальше одного оборота срабатывают в свой тик
+        wheel = TimerWheel(tick=0.01, slots=64, now=0.0)
+        for n in range(10000):
+            wheel.schedule(n * 0.001, n)
+        fired = []
+        for step in range(1, 1001):
+            batch = wheel.advance(step * 0.01)
+            assert all(n * 0.001 <= step * 0.01 + 1e-9 for n in batch)
+            fired.extend(batch)
+        assert sorted(fired) == list(range(10000)) and wheel.size == 0
+
+    @pytest.mark.asyncio
+    async def test_undelivered_notification_is_retried(self, monkeypatch):
+        """Недоставленное на существующие устройства уведомление повторяется, без устройств - снимается"""
+        import notification_service as service_module
+        from notification_queue import DeliveryError, _send_notification
+
+        class Store:
+            async def devices(self, user_id):
+                return {"fcm": frozenset({f"fcm-{user_id}"})} if user_id != "3" else {}
+
+        class Service:
+            store = Store()
+
+            async def send_notification(self, user_id, notification):
+                # Как PushNotificationService: False и при сбое провайдеров, и без устройств
+                return user_id == "1"
+
+        monkeypatch.setattr(service_module, "notification_service", Service())
+        await _send_notification(self._notification(1, "transaction_success"))
+        with pytest.raises(DeliveryError):
+            await _send_notification(self._notification(2, "transaction_success"))
+        await _send_notification(self._notification(3, "transaction_success"))
+
+    @pytest.mark.asyncio
+    async def test_workers_claim_rows_once(self, make_db_pool):
+        """Воркеры с общей таблицей загружают разные строки, строки упавшего воркера забирает другой"""
+        sent = []
+        
+        async def send(notification):
+            sent.append(notification.id)
+        
+        pool, queue = await self._queue(make_db_pool, send, users=200)
+        await queue.stop()
+        # Строки прежней версии без владельца
+        await pool.bulk_insert(database_module.NotificationQueueEntry, [
+            {"id": i, "user_id": i, "type": "payment_reminder", "priority": "normal", "title": "PayGo",
+             "message": "Счет к оплате", "coalesced": 1, "due_at": datetime.now()}
+            for i in range(1, 201)
+        ])
+        await pool.close()
+        
+        started = await asyncio.gather(*(self._queue(make_db_pool, send) for _ in range(2)))
+        try:
+            await self._wait(lambda: len(sent) == 200)
+            await asyncio.sleep(0.3)
+            assert sorted(map(int, sent)) == list(range(1, 201))
+            
+            # Аварийное завершение: исполнители остановлены, аренда не снята
+            crashed = await self._queue(make_db_pool, send, lease=0.2)
+            started.append(crashed)
+            row_id = await crashed[1].enqueue(self._notification(1, "payment_reminder", "normal", "Счет"),
+                                              send_at=datetime.now() + timedelta(seconds=1))
+            for task in crashed[1]._tasks:
+                task.cancel()
+            await asyncio.gather(*crashed[1]._tasks, return_exceptions=True)
+            crashed[1]._tasks = []
+            
+            # Пока аренда действует, строку не забирает никто
+            replacement = await self._queue(make_db_pool, send)
+            started.append(replacement)
+            assert replacement[1].get_stats()["scheduled"] == 0
+            await asyncio.sleep(0.3)
+            await replacement[1]._claim()
+            await self._wait(lambda: len(sent) == 201)
+            assert sent[-1] == row_id
+            await self._wait(lambda: replacement[1].get_stats()["pending_deletes"] == 0)
+            assert await self._rows(replacement[0]) == 0
+        finally:
+            for _, queue in started:
+                await queue.stop()
@@ -0,0 +1,87 @@
+import pytest
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import database as database_module
+from database.partitioning import (
+    TransactionPartitionManager, add_months, partition_name, partition_key_backfill,
+    partitioned_table_definition, transaction_created_window, unique_key_trigger_sql
+)
+
+class TestTransactionPartitioning:
+    """Помесячные секции transactions и отсечение секций в запросах"""
+    
+    def test_partitioned_table_ddl(self):
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.schema import CreateTable
+        
+        table = partitioned_table_definition(database_module.Transaction.__table__)
+        ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+        
+        assert "PARTITION BY RANGE (created_at)" in ddl
+        assert "PRIMARY KEY (id, created_at)" in ddl
+        assert "SERIAL" in ddl
+        assert table.c.created_at.nullable is False
+        
+        # Глобальная уникальность transaction_id - таблица ключей с триггером,
+        # а не (transaction_id, created_at)
+        assert "UNIQUE" not in ddl
+        assert table.info["unique_keys"] == [("transactions_transaction_id_keys", ["transaction_id"])]
+        keys_ddl = str(CreateTable(table.metadata.tables["transactions_transaction_id_keys"]).compile(dialect=postgresql.dialect()))
+        assert "PRIMARY KEY (transaction_id)" in keys_ddl
+        trigger = unique_key_trigger_sql("transactions", ["transaction_id"])
+        assert "INSERT INTO \"transactions_transaction_id_keys\"" in trigger[0]
+        assert "AFTER INSERT OR UPDATE OR DELETE ON \"transactions\"" in trigger[-1]
+        
+        # Строки без created_at получают первую заполненную временную метку строки
+        assert partition_key_backfill(database_module.Transaction.__table__) == 'COALESCE("processed_at", "completed_at", now())'
+    
+    def test_partition_helpers(self):
+        assert add_months(date(2025, 11, 15), 3) == date(2026, 2, 1)
+        assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+        assert partition_name("transactions", date(2025, 1, 1)) == "transactions_y2025m01"
+        
+        created = datetime(2025, 3, 10, 12, 0, 0)
+        timestamp = int((created - datetime(1970, 1, 1)).total_seconds())
+        window = transaction_created_window(f"TXN_T001_{timestamp}_1a2b3c4d")
+        assert window[0] <= created <= window[1]
+        assert window[1] - window[0] == timedelta(days=2)
+        assert transaction_created_window("TXN_001") is None
+    
+    @pytest.mark.performance
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="нужен PostgreSQL (TEST_POSTGRES_URL)")
+    async def test_queries_prune_partitions(self):
+        from sqlalchemy import func, select
+        from sqlalchemy.ext.asyncio import create_async_engine
+        
+        engine = create_async_engine(os.environ["TEST_POSTGRES_URL"])
+        manager = TransactionPartitionManager(lambda: engine, database_module.Transaction.__table__, months_ahead=2)
+        try:
+            await manager.ensure_partitioned_table()
+            # Секции на прошлый год, чтобы было что отсекать
+            async with engine.begin() as conn:
+                await manager._create_partitions(conn, add_months(date.today(), -12), 2)
+            partitions = [partition["name"] for partition in await manager.list_partitions()]
+            
+            Transaction = database_module.Transaction
+            month_ago = datetime.utcnow() - timedelta(days=30)
+            dashboard_scan = await manager.explain_partitions(
+                select(func.count(Transaction.id)).where(Transaction.created_at >= month_ago)
+            )
+            # Поиск по идентификатору с окном created_at, как в routers/transactions.py
+            window = transaction_created_window(f"TXN_T001_{int(time.time())}_1a2b3c4d")
+            lookup_scan = await manager.explain_partitions(
+                select(Transaction).where(Transaction.id == 1, Transaction.created_at.between(*window))
+            )
+            
+            print(f"Partition pruning ({len(partitions)} partitions):")
+            print(f"  Dashboard month count: {dashboard_scan}")
+            print(f"  Lookup by transaction_id: {lookup_scan}")
+            
+            assert len(dashboard_scan) <= 4
+            assert len(lookup_scan) <= 3
+            assert len(lookup_scan) < len(partitions)
+        finally:
+            await engine.dispose()
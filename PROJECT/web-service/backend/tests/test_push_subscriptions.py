@@ -0,0 +1,110 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import time
+
+from sqlalchemy import event
+
+import database as database_module
+
+class TestPushSubscriptionStore:
+    """Подписки push в таблице: множество устройств, кеш чтения, пакетная очистка"""
+    
+    @pytest_asyncio.fixture
+    async def pool(self, make_db_pool):
+        return await make_db_pool(
+            "push.db", tables=[database_module.User.__table__, database_module.PushSubscription.__table__], pool_size=2
+        )
+    
+    async def _store(self, pool, users: int = 100, **options):
+        from push_subscriptions import PushSubscriptionStore, _subscription_models
+        await pool.bulk_insert(database_module.User, [
+            {"id": i, "email": f"u{i}@paygo.ru", "phone": f"+7{i:010d}", "full_name": "Тест",
+             "hashed_password": "x", "role": "user"}
+            for i in range(1, users + 1)
+        ])
+        return PushSubscriptionStore(
+            pool.get_session, lambda: pool.get_session(read_only=True), _subscription_models, **options
+        )
+    
+    @pytest.mark.asyncio
+    async def test_subscription_set_semantics(self, pool):
+        """Повторная подписка не дублирует токен, токен другого пользователя переносится"""
+        store = await self._store(pool)
+        assert await store.subscribe("1", "fcm", "phone")
+        assert not await store.subscribe("1", "fcm", "phone")
+        assert await store.subscribe("1", "web", "browser")
+        assert await store.devices("1") == {"fcm": {"phone"}, "web": {"browser"}}
+        
+        # Телефон перешел ко второму пользователю: кеш первого сброшен
+        assert await store.subscribe("2", "fcm", "phone")
+        assert await store.devices("1") == {"web": {"browser"}}
+        assert await store.devices("2") == {"fcm": {"phone"}}
+        
+        assert not await store.unsubscribe("1", "fcm", "phone")
+        assert await store.unsubscribe("2", "fcm", "phone")
+        assert await store.devices("2") == {}
+        with pytest.raises(ValueError):
+            await store.subscribe("1", "sms", "x")
+        
+        # Параллельные подписки одного токена: одна запись, последний владелец
+        await asyncio.gather(*(store.subscribe(str(i), "fcm", "shared") for i in range(3, 13)))
+        owners = [i for i in range(3, 13) if (await store.devices(str(i))).get("fcm")]
+        assert len(owners) == 1
+    
+    @pytest.mark.asyncio
+    async def test_cached_device_lookup(self, pool):
+        """Устройства пользователя читаются из кеша процесса, а не запросом на каждую отправку"""
+        store = await self._store(pool, users=500)
+        for i in range(1, 501):
+            await store.subscribe(str(i), "fcm", f"fcm-{i}")
+        
+        start_time = time.perf_counter()
+        for i in range(1, 501):
+            await store.devices(str(i))
+        cold = time.perf_counter() - start_time
+        
+        start_time = time.perf_counter()
+        for _ in range(10):
+            for i in range(1, 501):
+                await store.devices(str(i))
+        warm = (time.perf_counter() - start_time) / 10
+        
+        print(f"Device lookup (500 users): database {cold * 1000:.1f}ms, cache {warm * 1000:.2f}ms")
+        stats = store.get_stats()
+        assert stats["loads"] == 500 and stats["local_hits"] == 5000
+        assert warm < cold / 20
+        
+        # Подписка сбрасывает кеш пользователя, LRU ограничивает размер кеша
+        store.cache_size = 100
+        await store.subscribe("1", "web", "browser-1")
+        assert await store.devices("1") == {"fcm": {"fcm-1"}, "web": {"browser-1"}}
+        assert store.get_stats()["cached_users"] == 100
+        assert store.get_stats()["loads"] == 501
+    
+    @pytest.mark.asyncio
+    async def test_batch_invalid_cleanup(self, pool):
+        """Недействительные токены удаляются пачками, рассылка читает токены одним запросом на порцию"""
+        from push_subscriptions import DELETE_CHUNK
+        store = await self._store(pool, users=1200)
+        async with pool.get_session() as session:
+            await session.execute(database_module.PushSubscription.__table__.insert(), [
+                {"provider": "fcm", "token": f"fcm-{i}-{n}", "user_id": i}
+                for i in range(1, 1201) for n in range(2)
+            ])
+            await session.commit()
+        
+        tokens = await store.tokens_for_users([str(i) for i in range(1, 1201)] + ["guest"])
+        assert len(tokens) == 2400 and ("fcm", "7", "fcm-7-1") in tokens
+        await store.devices("7")
+        
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(pool.engine.sync_engine, "before_cursor_execute", listener)
+        removed = await store.remove_invalid("fcm", [(str(i), f"fcm-{i}-0") for i in range(1, 1201)])
+        event.remove(pool.engine.sync_engine, "before_cursor_execute", listener)
+        
+        assert removed == 1200
+        assert len([s for s in statements if s.lstrip().upper().startswith("DELETE")]) == -(-1200 // DELETE_CHUNK)
+        assert await store.devices("7") == {"fcm": {"fcm-7-1"}}
+        assert len(await store.tokens_for_users([str(i) for i in range(1, 1201)])) == 1200
@@ -0,0 +1,167 @@
+import pytest
+import asyncio
+import time
+import json
+from typing import Any, Dict
+
+from fastapi import FastAPI, WebSocket
+
+class ASGIWebSocketClient:
+    """Клиент WebSocket поверх ASGI-интерфейса приложения, без сервера и потоков"""
+    
+    def __init__(self, app, path: str):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.outgoing: asyncio.Queue = asyncio.Queue()
+        scope = {"type": "websocket", "path": path, "raw_path": path.encode(), "root_path": "",
+                 "scheme": "ws", "query_string": b"", "headers": [], "subprotocols": [],
+                 "client": ("127.0.0.1", 0), "server": ("testserver", 80)}
+        self.outgoing.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(app(scope, self.outgoing.get, self.incoming.put))
+    
+    async def accepted(self) -> bool:
+        message = await self.incoming.get()
+        return message["type"] == "websocket.accept"
+    
+    async def receive_json(self, timeout: float = 5.0) -> Dict[str, Any]:
+        message = await asyncio.wait_for(self.incoming.get(), timeout)
+        assert message["type"] == "websocket.send", message
+        return json.loads(message["text"])
+    
+    def pending(self) -> int:
+        return self.incoming.qsize()
+    
+    async def send_json(self, data: Dict[str, Any]):
+        await self.outgoing.put({"type": "websocket.receive", "text": json.dumps(data)})
+    
+    async def ack(self, frame: Dict[str, Any]):
+        await self.send_json({"type": "ack", "scope": frame["scope"], "seq": frame["seq"]})
+    
+    async def disconnect(self):
+        await self.outgoing.put({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+class TestTerminalChannel:
+    """Доставка команд и конфигурации терминалам по WebSocket вместо опроса /config"""
+    
+    IDLE_CONNECTIONS = 10000
+    
+    def _worker(self, backend):
+        """Копия приложения со своим реестром соединений и общим брокером"""
+        from terminal_channel import TerminalChannel
+        channel = TerminalChannel(backend)
+        app = FastAPI()
+        
+        @app.websocket("/terminals/{terminal_id}/channel")
+        async def socket(websocket: WebSocket, terminal_id: str):
+            await channel.serve(websocket, terminal_id)
+        
+        return channel, app
+    
+    @pytest.mark.asyncio
+    async def test_cross_worker_delivery_and_resend(self):
+        """Сообщения доходят через другую копию, неподтвержденные досылаются при переподключении"""
+        from terminal_channel import LocalChannelBackend
+        backend = LocalChannelBackend()
+        channel_a, app_a = self._worker(backend)
+        channel_b, app_b = self._worker(backend)
+        await channel_a.start()
+        await channel_b.start()
+        
+        first = ASGIWebSocketClient(app_a, "/terminals/T1/channel")
+        second = ASGIWebSocketClient(app_b, "/terminals/T2/channel")
+        assert await first.accepted() and await second.accepted()
+        await asyncio.sleep(0)
+        
+        # Команда терминалу T2 отправлена через копию A, соединение - в копии B
+        seq = await channel_a.send("T2", "command", {"command_type": "reboot"})
+        frame = await second.receive_json()
+        assert (frame["type"], frame["seq"], frame["payload"]["command_type"]) == ("command", seq, "reboot")
+        await second.ack(frame)
+        
+        await channel_b.broadcast("maintenance", {"enabled": True})
+        for client in (first, second):
+            frame = await client.receive_json()
+            assert (frame["type"], frame["scope"], frame["payload"]) == ("maintenance", "broadcast", {"enabled": True})
+        await second.ack(frame)
+        
+        # T1 не подтвердил рассылку и пропустил команду, пока был отключен
+        await first.disconnect()
+        await channel_a.send("T1", "config", {"changes": {"language": "en"}, "removed": []})
+        await channel_a.send("T2", "command", {"command_type": "update"})
+        
+        reconnected = ASGIWebSocketClient(app_b, "/terminals/T1/channel")
+        assert await reconnected.accepted()
+        resent = [await reconnected.receive_json(), await reconnected.receive_json()]
+        assert [(frame["type"], frame["scope"]) for frame in resent] == [("config", "terminal"), ("maintenance", "broadcast")]
+        for frame in resent:
+            await reconnected.ack(frame)
+        frame = await second.receive_json()
+        assert frame["payload"]["command_type"] == "update"
+        await asyncio.sleep(0.01)
+        
+        # После подтверждения повторной отправки нет
+        await reconnected.disconnect()
+        again = ASGIWebSocketClient(app_a, "/terminals/T1/channel")
+        assert await again.accepted()
+        await asyncio.sleep(0.01)
+        assert again.pending() == 0
+        # Повторное подключение того же терминала закрывает прежнее соединение
+        duplicate = ASGIWebSocketClient(app_a, "/terminals/T1/channel")
+        assert await duplicate.accepted()
+        assert (await again.incoming.get())["type"] == "websocket.close"
+        assert channel_a.connected == 1
+        
+        await duplicate.disconnect()
+        await second.disconnect()
+        await channel_a.stop()
+        await channel_b.stop()
+    
+    @pytest.mark.asyncio
+    async def test_idle_connections_and_broadcast(self):
+        """10k простаивающих соединений и рассылка режима обслуживания всем одной публикацией"""
+        import gc
+        import tracemalloc
+        from terminal_channel import LocalChannelBackend
+        backend = LocalChannelBackend()
+        channel, app = self._worker(backend)
+        await channel.start()
+        
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start_time = time.perf_counter()
+        clients = []
+        for i in range(self.IDLE_CONNECTIONS):
+            client = ASGIWebSocketClient(app, f"/terminals/T{i:05d}/channel")
+            clients.append(client)
+        assert all(await asyncio.gather(*(client.accepted() for client in clients)))
+        while channel.connected < self.IDLE_CONNECTIONS:
+            await asyncio.sleep(0.01)
+        connect_time = time.perf_counter() - start_time
+        # Память на соединение вместе с клиентской стороной теста
+        per_connection = (tracemalloc.get_traced_memory()[0] - baseline) / self.IDLE_CONNECTIONS
+        tracemalloc.stop()
+        
+        start_time = time.perf_counter()
+        seq = await channel.broadcast("maintenance", {"enabled": True})
+        frames = await asyncio.gather(*(client.receive_json() for client in clients))
+        fan_out_time = time.perf_counter() - start_time
+        
+        for client, frame in zip(clients, frames):
+            await client.ack(frame)
+        await asyncio.sleep(0.1)
+        
+        print(f"Terminal Channel ({self.IDLE_CONNECTIONS} idle connections):")
+        print(f"  Connect: {connect_time:.2f}s, memory: {per_connection / 1024:.1f}KB per connection")
+        print(f"  Broadcast fan-out: {fan_out_time * 1000:.0f}ms")
+        
+        assert all(frame["seq"] == seq and frame["type"] == "maintenance" for frame in frames)
+        assert channel.stats["delivered"] == self.IDLE_CONNECTIONS
+        assert channel.stats["broadcasts"] == 1
+        assert all(acked == seq for acked in backend._broadcast_acks.values())
+        assert fan_out_time < 5.0
+        assert per_connection < 64 * 1024
+        
+        await asyncio.gather(*(client.disconnect() for client in clients))
+        assert channel.connected == 0
+        await channel.stop()
@@ -0,0 +1,133 @@
+import pytest
+import pytest_asyncio
+import time
+import json
+from typing import Any, Dict, List
+
+import database as database_module
+import database.connection_pool as connection_pool_module
+
+class TestTerminalConfigStore:
+    """Версии конфигурации терминалов: 304 и JSON Patch вместо полной конфигурации на каждый опрос"""
+    
+    TERMINALS = 2000
+    @pytest_asyncio.fixture
+    async def pool(self, db_pool, monkeypatch):
+        # Глобальное хранилище пишет через db_pool приложения
+        monkeypatch.setattr(connection_pool_module, "db_pool", db_pool)
+        await db_pool.bulk_insert(database_module.Terminal, [
+            {"serial_number": f"T{i:05d}", "name": f"Терминал {i}", "location": "Москва", "address": "ул. Тверская",
+             "terminal_type": "stationary", "model": "PG-1", "manufacturer": "PayGo",
+             "configuration": {"merchant_id": f"M{i}", "language": "ru"}}
+            for i in range(self.TERMINALS)
+        ])
+        return db_pool
+    
+    def _store(self):
+        from terminal_config import TerminalConfigStore, _config_defaults, _config_models, _session
+        # Провайдеры глобального хранилища: модели database, TerminalConfig и сессии пула приложения
+        return TerminalConfigStore(_session, _config_models, _config_defaults)
+    
+    @staticmethod
+    def _apply_patch(config: Dict[str, Any], patch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        import copy
+        result = copy.deepcopy(config)
+        for operation in patch:
+            *parents, key = [part.replace("~1", "/").replace("~0", "~") for part in operation["path"].split("/")[1:]]
+            target = result
+            for part in parents:
+                target = target[part]
+            if operation["op"] == "remove":
+                del target[key]
+            else:
+                target[key] = operation["value"]
+        return result
+    
+    @pytest.mark.asyncio
+    async def test_versions_etags_and_patches(self, pool):
+        """Версии, ETag, 304, JSON Patch от версии клиента и общий шаблон"""
+        from terminal_config import KEEP_TEMPLATE
+        store = self._store()
+        
+        # Конфигурация до появления версий отдается как версия 0
+        state, patch = await store.poll("T00001")
+        assert patch is None and state.etag == '"0.0"'
+        assert state.config["merchant_id"] == "M1" and state.config["currency"] == "RUB"
+        assert (await store.poll("UNKNOWN"))[0] is None
+        
+        await store.update_template("moscow", {"language": "en", "acquiring_settings": {"bank": "vtb", "mcc": "5411"}})
+        state, patch = await store.update_terminal("T00001", {"merchant_id": "M1"}, template="moscow")
+        assert state.etag == '"1.1"'
+        assert {"op": "replace", "path": "/language", "value": "en"} in patch
+        first = state
+        
+        # Повтор того же содержимого не создает новую версию
+        same, patch = await store.update_terminal("T00001", {"merchant_id": "M1"})
+        assert same.etag == first.etag and patch == []
+        
+        assert (await store.poll("T00001", first.etag))[1] == []
+        await store.update_terminal("T00001", {"merchant_id": "M1", "tax_rate": 0.1}, KEEP_TEMPLATE)
+        await store.update_template("moscow", {"language": "en", "acquiring_settings": {"bank": "alfa", "mcc": "5411"}})
+        state, patch = await store.poll("T00001", first.etag, patch=True)
+        assert state.etag == '"2.2"'
+        assert sorted(operation["path"] for operation in patch) == ["/acquiring_settings/bank", "/tax_rate"]
+        assert self._apply_patch(first.config, patch) == state.config
+        # Без запроса patch или с неизвестной версией - полная конфигурация
+        assert (await store.poll("T00001", first.etag))[1] is None
+        assert (await store.poll("T00001", '"9.9"', patch=True))[1] is None
+        
+        # Шаблон читается один раз на все терминалы
+        for i in range(2, 50):
+            await store.update_terminal(f"T{i:05d}", {"merchant_id": f"M{i}"}, template="moscow")
+        loads = store.stats["version_loads"]
+        for i in range(2, 50):
+            state, _ = await store.poll(f"T{i:05d}")
+            assert state.config["acquiring_settings"]["bank"] == "alfa"
+        assert store.stats["version_loads"] == loads
+        assert state.content_hash == store._states[(state.terminal_id, 1, 2)].content_hash
+    
+    @pytest.mark.asyncio
+    async def test_poll_cost(self, pool):
+        """Опрос с актуальным ETag против выборки полной строки и разбора конфигурации"""
+        from sqlalchemy import select
+        from terminal_config import content_hash
+        store = self._store()
+        settings = {f"param_{i}": f"value_{i}" for i in range(60)}
+        await store.update_template("fleet", {"acquiring_settings": settings})
+        await pool.bulk_insert(database_module.TerminalConfigVersion, [
+            {"owner_type": "terminal", "owner_key": f"T{i:05d}", "version": 1, "template": "fleet",
+             "config": {"merchant_id": f"M{i}"},
+             "content_hash": content_hash({"template": "fleet", "config": {"merchant_id": f"M{i}"}})}
+            for i in range(self.TERMINALS)
+        ])
+        # Полная конфигурация один раз на терминал, шаблон - один раз на всех
+        store._versions.clear()
+        store.stats["version_loads"] = 0
+        etags = {}
+        for i in range(self.TERMINALS):
+            state, _ = await store.poll(f"T{i:05d}")
+            etags[state.terminal_id] = state.etag
+        assert set(etags.values()) == {'"1.1"'}
+        assert store.stats["version_loads"] == self.TERMINALS + 1
+        
+        legacy_bytes = 0
+        start_time = time.perf_counter()
+        for terminal_id in etags:
+            async with pool.get_session() as session:
+                terminal = await session.scalar(
+                    select(database_module.Terminal).where(database_module.Terminal.serial_number == terminal_id)
+                )
+            legacy_bytes += len(json.dumps({**store.defaults, "acquiring_settings": settings, **terminal.configuration}))
+        legacy_time = time.perf_counter() - start_time
+        
+        start_time = time.perf_counter()
+        for terminal_id, etag in etags.items():
+            state, patch = await store.poll(terminal_id, etag)
+            assert patch == []
+        store_time = time.perf_counter() - start_time
+        
+        print(f"Config Polls ({self.TERMINALS} terminals):")
+        print(f"  Full row + body: {legacy_time * 1000:.0f}ms, {legacy_bytes / self.TERMINALS:.0f} bytes per poll")
+        print(f"  ETag 304: {store_time * 1000:.0f}ms, 0 bytes per poll")
+        assert store.stats["not_modified"] == self.TERMINALS
+        assert store.stats["version_loads"] == self.TERMINALS + 1
@@ -0,0 +1,135 @@
+import pytest
+import time
+import statistics
+
+class TestTerminalGeoSearch:
+    """Поиск ближайших терминалов по сетке координат реестра"""
+    
+    CITIES = [(55.7558, 37.6173), (59.9343, 30.3351), (55.0084, 82.9357), (56.8389, 60.6057), (55.7963, 49.1088)]
+    BENCHMARK_TERMINALS = 100000
+    BENCHMARK_QUERIES = 3000
+    
+    def _terminals(self, rng, count: int):
+        """Терминалы в городах и по всей стране: (id, широта, долгота, статус, способы оплаты)"""
+        from terminal_registry import PAYMENT_METHODS
+        terminals = []
+        for i in range(count):
+            if rng.random() < 0.7:
+                latitude, longitude = rng.choice(self.CITIES)
+                latitude, longitude = rng.gauss(latitude, 0.1), rng.gauss(longitude, 0.15)
+            else:
+                latitude, longitude = rng.uniform(43, 70), rng.uniform(28, 150)
+            status = rng.choices(["online", "offline", "maintenance", "error"], weights=[80, 12, 5, 3])[0]
+            methods = [method for method in PAYMENT_METHODS if rng.random() < 0.6]
+            terminals.append((f"T{i:06d}", latitude, longitude, status, methods))
+        return terminals
+    
+    def _queries(self, rng, count: int):
+        queries = []
+        for _ in range(count):
+            if rng.random() < 0.8:
+                latitude, longitude = rng.choice(self.CITIES)
+                queries.append((rng.gauss(latitude, 0.1), rng.gauss(longitude, 0.15)))
+            else:
+                queries.append((rng.uniform(43, 70), rng.uniform(28, 150)))
+        return queries
+    
+    def _brute_force(self, terminals, latitude, longitude, limit=None, radius_km=None, status=None, payment_method=None):
+        from terminal_geo import haversine_km
+        import numpy as np
+        selected = [
+            t for t in terminals
+            if (status is None or t[3] == status) and (payment_method is None or payment_method in t[4])
+        ]
+        distances = haversine_km(latitude, longitude, np.array([t[1] for t in selected]), np.array([t[2] for t in selected]))
+        if radius_km is not None:
+            distances = distances[distances <= radius_km]
+        distances = np.sort(distances)
+        return distances[:limit] if limit is not None else distances
+    
+    def test_matches_brute_force(self):
+        """Ближайшие и в радиусе - те же, что при полном переборе, после изменений и удалений"""
+        import random
+        from terminal_registry import TerminalRegistry
+        
+        rng = random.Random(3)
+        registry = TerminalRegistry()
+        terminals = {t[0]: t for t in self._terminals(rng, 20000)}
+        for terminal_id, latitude, longitude, status, methods in terminals.values():
+            registry.upsert(terminal_id, terminal_id, "", status, latitude=latitude, longitude=longitude,
+                            payment_methods=methods)
+        # Переезд, удаление и терминалы без координат
+        for terminal_id in rng.sample(sorted(terminals), 3000):
+            _, _, _, status, methods = terminals[terminal_id]
+            if rng.random() < 0.3:
+                registry.remove(terminal_id)
+                del terminals[terminal_id]
+            elif rng.random() < 0.2:
+                registry.update_info(terminal_id, terminal_id, "", None, None, methods)
+                del terminals[terminal_id]
+            else:
+                latitude, longitude = rng.uniform(43, 70), rng.uniform(28, 150)
+                registry.update_info(terminal_id, terminal_id, "", latitude, longitude, methods)
+                terminals[terminal_id] = (terminal_id, latitude, longitude, status, methods)
+        rows = list(terminals.values())
+        
+        for latitude, longitude in self._queries(rng, 200):
+            for kwargs in (
+                {"limit": 10},
+                {"limit": 5, "status": "online", "payment_method": "biometric"},
+                {"limit": 20, "radius_km": 3.0},
+                {"limit": None, "radius_km": 15.0, "status": "offline"},
+                {"limit": 3, "status": "error", "payment_method": "nfc"},
+            ):
+                found = registry.nearby(latitude, longitude, **kwargs)
+                expected = self._brute_force(rows, latitude, longitude, **kwargs)
+                assert [t["distance_km"] for t in found] == pytest.approx(expected.tolist(), abs=1e-3)
+                for t in found:
+                    _, _, _, status, methods = terminals[t["terminal_id"]]
+                    assert kwargs.get("status") in (None, status)
+                    assert kwargs.get("payment_method") in (None, *methods)
+    
+    def test_query_latency(self):
+        """p99 поиска среди 100k терминалов меньше миллисекунды"""
+        import random
+        import numpy as np
+        from terminal_registry import TerminalRegistry
+        from terminal_geo import haversine_km
+        
+        rng = random.Random(11)
+        registry = TerminalRegistry()
+        terminals = self._terminals(rng, self.BENCHMARK_TERMINALS)
+        for terminal_id, latitude, longitude, status, methods in terminals:
+            registry.upsert(terminal_id, terminal_id, "", status, latitude=latitude, longitude=longitude,
+                            payment_methods=methods)
+        queries = self._queries(rng, self.BENCHMARK_QUERIES)
+        variants = [
+            {"limit": 10},
+            {"limit": 10, "status": "online", "payment_method": "qr_code"},
+            {"limit": 100, "radius_km": 1.0},
+        ]
+        
+        times = {index: [] for index in range(len(variants))}
+        for latitude, longitude in queries:
+            for index, kwargs in enumerate(variants):
+                start_time = time.perf_counter()
+                registry.nearby(latitude, longitude, **kwargs)
+                times[index].append(time.perf_counter() - start_time)
+        
+        # Полный перебор координат NumPy для сравнения
+        latitudes = np.array([t[1] for t in terminals])
+        longitudes = np.array([t[2] for t in terminals])
+        scan_times = []
+        for latitude, longitude in queries[:200]:
+            start_time = time.perf_counter()
+            distances = haversine_km(latitude, longitude, latitudes, longitudes)
+            np.argpartition(distances, 9)[:10]
+            scan_times.append(time.perf_counter() - start_time)
+        
+        print(f"Terminal Geo Search ({self.BENCHMARK_TERMINALS} terminals, {self.BENCHMARK_QUERIES} queries):")
+        print(f"  Full scan: median {statistics.median(scan_times) * 1000:.2f}ms")
+        for index, kwargs in enumerate(variants):
+            samples = sorted(times[index])
+            p99 = samples[int(len(samples) * 0.99) - 1]
+            print(f"  {kwargs}: median {statistics.median(samples) * 1000:.3f}ms, p99 {p99 * 1000:.3f}ms")
+            assert p99 < 0.001
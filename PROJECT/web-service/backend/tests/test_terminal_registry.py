@@ -0,0 +1,219 @@
+import pytest
+import pytest_asyncio
+import time
+import statistics
+from datetime import datetime, timedelta, timezone
+
+import database as database_module
+import database.connection_pool as connection_pool_module
+
+class TestTerminalRegistry:
+    """Состояние терминалов в памяти вместо запросов к terminals на каждый статус"""
+    
+    TERMINALS = 20000
+    BENCHMARK_TERMINALS = 100000
+    BENCHMARK_HEARTBEATS = 1000000
+    
+    TRANSACTIONS = 60000
+    
+    @pytest_asyncio.fixture
+    async def pool(self, db_pool, monkeypatch):
+        import random
+        
+        # Глобальный реестр читает через db_pool приложения
+        monkeypatch.setattr(connection_pool_module, "db_pool", db_pool)
+        rng = random.Random(5)
+        now = datetime.utcnow()
+        await db_pool.bulk_insert(database_module.Terminal, [
+            {"serial_number": f"T{i:05d}", "name": f"Терминал {i}", "location": "Москва", "address": "ул. Тверская",
+             "terminal_type": "stationary", "model": "PG-1", "manufacturer": "PayGo",
+             "status": rng.choices(["online", "offline", "maintenance", "error"], weights=[80, 12, 5, 3])[0],
+             # Часть терминалов ни разу не присылала heartbeat
+             "last_ping": None if i % 50 == 0 else now - timedelta(seconds=rng.randint(0, 2 * 3600))}
+            for i in range(self.TERMINALS)
+        ])
+        await db_pool.bulk_insert(database_module.Transaction, [
+            {"transaction_id": f"TXN_{i}", "terminal_id": rng.randint(1, self.TERMINALS),
+             "amount": round(rng.uniform(10, 5000), 2), "payment_method": "nfc",
+             "status": rng.choices(["completed", "failed", "pending"], weights=[85, 10, 5])[0]}
+            for i in range(self.TRANSACTIONS)
+        ])
+        return db_pool
+    
+    async def _legacy_status(self, db, now: datetime):
+        """Прежняя реализация: группировка по статусу и все терминалы без heartbeat за час"""
+        from sqlalchemy import func, select
+        Terminal = database_module.Terminal
+        statuses = dict((await db.execute(
+            select(Terminal.status, func.count(Terminal.id)).group_by(Terminal.status)
+        )).all())
+        problematic = (await db.scalars(
+            select(Terminal).where(Terminal.last_ping < now - timedelta(hours=1))
+        )).all()
+        return statuses, problematic
+    
+    @pytest.mark.asyncio
+    async def test_rebuild_matches_database(self, pool):
+        """После загрузки из базы реестр отвечает так же, как запросы"""
+        from sqlalchemy import func, select
+        from terminal_registry import TerminalRegistry, _read_session, _terminal_models
+        
+        # Провайдеры глобального реестра: модели database и сессии пула приложения
+        registry = TerminalRegistry(_read_session, _terminal_models)
+        await registry.rebuild()
+        assert len(registry) == self.TERMINALS
+        
+        now = datetime.utcnow()
+        legacy_times = []
+        for _ in range(20):
+            start_time = time.perf_counter()
+            async with pool.get_session(read_only=True) as db:
+                statuses, problematic = await self._legacy_status(db, now)
+            legacy_times.append(time.perf_counter() - start_time)
+        
+        registry_times = []
+        now_ts = now.replace(tzinfo=timezone.utc).timestamp()
+        for _ in range(20):
+            start_time = time.perf_counter()
+            registry_statuses = registry.status_counts()
+            registry_problematic = registry.problematic(now=now_ts)
+            registry_times.append(time.perf_counter() - start_time)
+        
+        assert {status: count for status, count in registry_statuses.items() if count} == statuses
+        assert {t["terminal_id"] for t in registry_problematic} == {t.serial_number for t in problematic}
+        heartbeats = [t["last_heartbeat"] for t in registry_problematic]
+        assert heartbeats == sorted(heartbeats)
+        
+        Transaction = database_module.Transaction
+        async with pool.get_session(read_only=True) as db:
+            total_transactions, total_amount = (await db.execute(
+                select(func.count(Transaction.id), func.sum(Transaction.amount)).where(Transaction.status == "completed")
+            )).one()
+        summary = registry.summary()
+        assert summary["total_transactions"] == total_transactions
+        assert summary["total_amount"] == pytest.approx(total_amount)
+        
+        legacy_median = statistics.median(legacy_times)
+        registry_median = statistics.median(registry_times)
+        print(f"System Status ({self.TERMINALS} terminals, {len(problematic)} problematic):")
+        print(f"  Database: {legacy_median * 1000:.1f}ms, registry: {registry_median * 1000:.2f}ms")
+        assert registry_median < legacy_median / 5
+    
+    def test_events_match_recomputation(self):
+        """Heartbeat, смена статуса, удаление и транзакции дают тот же результат, что и полный пересчет"""
+        import random
+        from terminal_registry import TerminalRegistry, STATUSES
+        
+        rng = random.Random(9)
+        registry = TerminalRegistry(stale_after=600)
+        state = {}
+        clock = 1.7e9
+        for i in range(2000):
+            terminal_id = f"T{i}"
+            registry.upsert(terminal_id, f"Терминал {i}", "Москва", "offline")
+            state[terminal_id] = ["offline", 0.0, 0, 0.0]
+        next_id = 2000
+        
+        for step in range(50000):
+            clock += rng.uniform(0, 0.1)
+            terminal_id = rng.choice(list(state)) if step % 100 else None
+            action = rng.random()
+            if terminal_id is None:
+                if rng.random() < 0.5:
+                    # Удаление и добавление терминалов (повторное использование слотов)
+                    terminal_id = rng.choice(list(state))
+                    registry.remove(terminal_id)
+                    del state[terminal_id]
+                else:
+                    terminal_id = f"T{next_id}"
+                    next_id += 1
+                    registry.upsert(terminal_id, "Новый", "Казань", "offline")
+                    state[terminal_id] = ["offline", 0.0, 0, 0.0]
+            elif action < 0.7:
+                status = rng.choices(STATUSES, weights=[90, 4, 3, 3])[0]
+                at = datetime.utcfromtimestamp(clock)
+                registry.heartbeat(terminal_id, status, at)
+                state[terminal_id][0:2] = [status, at.replace(tzinfo=timezone.utc).timestamp()]
+            elif action < 0.8:
+                status = rng.choice(STATUSES)
+                registry.set_status(terminal_id, status)
+                state[terminal_id][0] = status
+            else:
+                amount = round(rng.uniform(10, 5000), 2)
+                registry.record_transaction(terminal_id, amount)
+                state[terminal_id][2] += 1
+                state[terminal_id][3] += amount
+            
+            if step % 5000 == 0:
+                expected_stale = {
+                    terminal_id for terminal_id, (_, heartbeat, _, _) in state.items()
+                    if heartbeat and heartbeat < clock - 600
+                }
+                assert {t["terminal_id"] for t in registry.problematic(now=clock)} == expected_stale
+        
+        registry.replace_status("online", "maintenance")
+        for values in state.values():
+            if values[0] == "online":
+                values[0] = "maintenance"
+        
+        counts = {status: 0 for status in STATUSES}
+        for status, _, _, _ in state.values():
+            counts[status] += 1
+        assert registry.status_counts() == counts
+        summary = registry.summary()
+        assert summary["total_terminals"] == len(state)
+        assert summary["total_transactions"] == sum(values[2] for values in state.values())
+        assert summary["total_amount"] == pytest.approx(sum(values[3] for values in state.values()))
+        # Устаревшие записи кучи не накапливаются
+        assert len(registry._heap) <= 4 * len(registry._terminal_ids) + 1024
+    
+    def test_heartbeat_throughput(self):
+        """Поток heartbeat от 100k терминалов и чтение проблемных за O(k)"""
+        import random
+        from terminal_registry import TerminalRegistry
+        
+        rng = random.Random(1)
+        registry = TerminalRegistry()
+        start_ts = 1.7e9
+        for i in range(self.BENCHMARK_TERMINALS):
+            registry.upsert(f"T{i:06d}", f"Терминал {i}", "Москва", "online",
+                            datetime.utcfromtimestamp(start_ts + rng.uniform(0, 60)))
+        terminal_ids = [f"T{i:06d}" for i in range(self.BENCHMARK_TERMINALS)]
+        # Каждый сотый терминал замолкает
+        silent = set(terminal_ids[::100])
+        active = [terminal_id for terminal_id in terminal_ids if terminal_id not in silent]
+        times = [
+            datetime.utcfromtimestamp(start_ts + 60 + i * 7200 / self.BENCHMARK_HEARTBEATS)
+            for i in range(self.BENCHMARK_HEARTBEATS)
+        ]
+        senders = [rng.choice(active) for _ in range(self.BENCHMARK_HEARTBEATS)]
+        
+        start_time = time.perf_counter()
+        for terminal_id, at in zip(senders, times):
+            registry.heartbeat(terminal_id, "online", at)
+        heartbeat_rate = self.BENCHMARK_HEARTBEATS / (time.perf_counter() - start_time)
+        
+        now = start_ts + 60 + 7200
+        registry.problematic(now=now)
+        read_times = []
+        for _ in range(100):
+            start_time = time.perf_counter()
+            problematic = registry.problematic(now=now)
+            summary = registry.summary()
+            read_times.append(time.perf_counter() - start_time)
+        read_times.sort()
+        p99 = read_times[98]
+        
+        print(f"Terminal Registry ({self.BENCHMARK_TERMINALS} terminals):")
+        print(f"  Heartbeats: {heartbeat_rate:,.0f}/s")
+        print(f"  Status read ({len(problematic)} problematic): p99 {p99 * 1000:.2f}ms")
+        
+        expected = {terminal_id for terminal_id in silent}
+        expected.update(
+            terminal_id for terminal_id in active
+            if registry.get(terminal_id)["last_heartbeat"].replace(tzinfo=timezone.utc).timestamp() < now - 3600
+        )
+        assert {t["terminal_id"] for t in problematic} == expected
+        assert summary["online_terminals"] == self.BENCHMARK_TERMINALS
+        assert heartbeat_rate > 200000
+        assert p99 < 0.005
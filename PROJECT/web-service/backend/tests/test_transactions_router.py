@@ -0,0 +1,98 @@
+import pytest
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import select
+
+import database as database_module
+
+# Роутер транзакций на AsyncSession поверх SQLite (aiosqlite)
+class TestTransactionsRouter:
+    """Платеж через HTTP: запрос, подтверждение и событие outbox в одной сессии роутера"""
+
+    def _app(self, db_pool):
+        from database import get_db, get_read_db
+        from routers.transactions import router
+
+        async def override_get_db():
+            async with db_pool.get_session() as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(router, prefix="/api/v1/transactions")
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_read_db] = override_get_db
+        return app
+
+    async def _seed(self, db_pool):
+        async with db_pool.get_session() as session:
+            session.add(database_module.Terminal(
+                serial_number="PG-0001", name="Касса 1", location="Ростов-на-Дону", address="ул. Садовая, 1",
+                terminal_type="standalone", model="PG-100", manufacturer="PayGo", status="online"
+            ))
+            session.add(database_module.User(
+                email="buyer@paygo.ru", phone="+79001234567", full_name="Покупатель", hashed_password="x"
+            ))
+            await session.commit()
+
+    async def _pay(self, client, monkeypatch, result):
+        import routers.transactions as transactions_module
+
+        async def process_payment(transaction, payment_data):
+            return result
+        monkeypatch.setattr(transactions_module, "process_payment", process_payment)
+
+        response = await client.post("/api/v1/transactions/payment-request", json={
+            "terminal_id": "PG-0001", "amount": 150.0, "payment_method": "nfc_card", "user_phone": "+79001234567"
+        })
+        assert response.status_code == 200, response.text
+        transaction_id = response.json()["transaction_id"]
+        assert transaction_id.startswith("TXN_PG-0001_")
+
+        response = await client.post("/api/v1/transactions/payment-confirm", json={
+            "transaction_id": transaction_id, "payment_data": {}, "terminal_signature": "sig"
+        })
+        return transaction_id, response
+
+    async def _stored(self, db_pool, transaction_id):
+        async with db_pool.get_session() as session:
+            transaction = await session.scalar(
+                select(database_module.Transaction).where(database_module.Transaction.transaction_id == transaction_id)
+            )
+            events = (await session.scalars(select(database_module.OutboxEvent))).all()
+        return transaction, events
+
+    @pytest.mark.asyncio
+    async def test_confirmed_payment_writes_event(self, db_pool, monkeypatch):
+        """Успешный платеж: статус и событие payment.completed с серийным номером терминала"""
+        from payment_processor import PaymentResult
+        await self._seed(db_pool)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=self._app(db_pool)), base_url="http://test") as client:
+            transaction_id, response = await self._pay(client, monkeypatch, PaymentResult(
+                success=True, bank_transaction_id="BANK-1", bank_response="{}", card_mask="**** 1234", receipt_number="R-1"
+            ))
+
+        assert response.status_code == 200, response.text
+        assert response.json()["status"] == "completed"
+        transaction, events = await self._stored(db_pool, transaction_id)
+        assert transaction.status == "completed" and transaction.user_id is not None
+        assert [event.event_type for event in events] == ["payment.completed"]
+        assert events[0].payload["terminal_id"] == "PG-0001"
+
+    @pytest.mark.asyncio
+    async def test_failed_commit_is_recorded_after_rollback(self, db_pool, monkeypatch):
+        """COMMIT результата падает: сессия откатывается, FAILED и событие пишутся заново"""
+        from payment_processor import PaymentResult
+        await self._seed(db_pool)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=self._app(db_pool)), base_url="http://test") as client:
+            # Ответ банка не текст: драйвер не сможет записать строку транзакции
+            transaction_id, response = await self._pay(client, monkeypatch, PaymentResult(
+                success=True, bank_transaction_id="BANK-2", bank_response={"raw": object()}, receipt_number="R-2"
+            ))
+
+        assert response.status_code == 500
+        transaction, events = await self._stored(db_pool, transaction_id)
+        assert transaction.status == "failed"
+        assert transaction.bank_transaction_id is None
+        assert [event.event_type for event in events] == ["payment.failed"]